@@ -0,0 +1,185 @@
+# Copyright (c) 2024 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of cgyle.
+#
+# cgyle is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cgyle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cgyle.  If not, see <http://www.gnu.org/licenses/>
+#
+import os
+import shutil
+import logging
+import threading
+from typing import (
+    List, Dict, Tuple, Callable, Optional
+)
+
+from cgyle.metrics import Metrics
+
+Unit = Tuple[str, str, str]
+
+
+class Admission:
+    """
+    Admission control of container tag transfers by free disk space
+
+    Before a tag is transferred, its footprint on disk is estimated
+    by the estimate callback, usually from the sizes of the blobs
+    of its manifests not yet present at the destination. The tag
+    is admitted if each of the given paths keeps at least min_free
+    bytes free after the footprint of the tag and of all admitted
+    transfers still running is taken off. Once a tag is refused,
+    no further tags are admitted such that the run stops cleanly
+    instead of failing tag after tag on a full disk. Refused tags
+    and containers not started yet are deferred to the next run
+    """
+    lock = threading.Lock()
+    min_free = 0
+    paths: List[str] = []
+    estimate: Optional[Callable[[str, str, str], int]] = None
+    reserved: Dict[Unit, int] = {}
+    stopped = ''
+    deferred_tags: List[Unit] = []
+    deferred_containers: List[str] = []
+
+    @staticmethod
+    def setup(
+        paths: List[str], min_free: int,
+        estimate: Optional[Callable[[str, str, str], int]] = None
+    ) -> None:
+        """
+        Enable the admission control for the given paths, paths
+        on the same filesystem are checked once
+        """
+        Admission.reset()
+        devices: List[int] = []
+        with Admission.lock:
+            for path in paths:
+                device = os.stat(Admission.get_existing_path(path)).st_dev
+                if device not in devices:
+                    devices.append(device)
+                    Admission.paths.append(path)
+            Admission.min_free = min_free
+            Admission.estimate = estimate
+
+    @staticmethod
+    def reset() -> None:
+        with Admission.lock:
+            Admission.min_free = 0
+            Admission.paths = []
+            Admission.estimate = None
+            Admission.reserved = {}
+            Admission.stopped = ''
+            Admission.deferred_tags = []
+            Admission.deferred_containers = []
+
+    @staticmethod
+    def is_stopped() -> bool:
+        with Admission.lock:
+            return bool(Admission.stopped)
+
+    @staticmethod
+    def admit(container: str, tag: str, arch: str) -> bool:
+        """
+        Check if the transfer of the container tag fits on disk
+        and reserve its footprint until it is released
+        """
+        if not Admission.paths:
+            return True
+        if Admission.is_stopped():
+            return False
+        size = Admission.estimate(container, tag, arch) \
+            if Admission.estimate else 0
+        with Admission.lock:
+            if Admission.stopped:
+                return False
+            reserved = sum(Admission.reserved.values())
+            for path in Admission.paths:
+                free = shutil.disk_usage(
+                    Admission.get_existing_path(path)
+                ).free
+                Metrics.set('cgyle_disk_free_bytes', free, path=path)
+                if free - reserved - size < Admission.min_free:
+                    Admission.stopped = (
+                        '{}:{} arch:{} needs {}MB, {} has {}MB free of '
+                        'which {}MB are reserved by running transfers '
+                        'and {}MB must stay free'.format(
+                            container, tag, arch, size // 1048576, path,
+                            free // 1048576, reserved // 1048576,
+                            Admission.min_free // 1048576
+                        )
+                    )
+                    logging.warning(
+                        f'Stopped admitting transfers: {Admission.stopped}'
+                    )
+                    return False
+            Admission.reserved[(container, tag, arch)] = size
+        return True
+
+    @staticmethod
+    def release(container: str, tag: str = '', arch: str = '') -> None:
+        """
+        Release the footprint of a finished transfer. Without a
+        tag all transfers of the container are released
+        """
+        with Admission.lock:
+            for unit in list(Admission.reserved):
+                if unit[0] == container and \
+                   (not tag or unit[1:] == (tag, arch)):
+                    del Admission.reserved[unit]
+
+    @staticmethod
+    def defer(container: str, tag: str = '', arch: str = '') -> None:
+        """
+        Record a refused tag or, without a tag, a container
+        which was not started
+        """
+        with Admission.lock:
+            if tag:
+                Admission.deferred_tags.append((container, tag, arch))
+            else:
+                Admission.deferred_containers.append(container)
+
+    @staticmethod
+    def log() -> None:
+        """
+        Report why the admission stopped and the deferred work
+        """
+        with Admission.lock:
+            if not Admission.stopped:
+                return
+            logging.warning(
+                'Run stopped for lack of disk space: {}'.format(
+                    Admission.stopped
+                )
+            )
+            for container, tag, arch in Admission.deferred_tags:
+                logging.info(f'Deferred tag: {container}:{tag} arch:{arch}')
+            for container in Admission.deferred_containers:
+                logging.info(f'Deferred container: {container}')
+            logging.warning(
+                'Deferred {} tags and {} containers to the next run'.format(
+                    len(Admission.deferred_tags),
+                    len(Admission.deferred_containers)
+                )
+            )
+
+    @staticmethod
+    def get_existing_path(path: str) -> str:
+        """
+        Return path or its closest existing parent directory,
+        the destinations are created by the transfers
+        """
+        path = os.path.abspath(path)
+        while not os.path.exists(path) and path != os.path.dirname(path):
+            path = os.path.dirname(path)
+        return path
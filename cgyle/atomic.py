@@ -0,0 +1,69 @@
+# Copyright (c) 2024 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of cgyle.
+#
+# cgyle is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cgyle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cgyle.  If not, see <http://www.gnu.org/licenses/>
+#
+import os
+import json
+from contextlib import suppress
+from tempfile import NamedTemporaryFile
+from typing import (
+    Any, Optional, Type
+)
+
+from cgyle.exceptions import CgyleError
+
+
+class AtomicFile:
+    """
+    Write files that are replaced atomically such that readers,
+    e.g. other cgyle processes or a node_exporter, never see a
+    partially written file
+    """
+    @staticmethod
+    def write(
+        filename: str, content: str, prefix: str,
+        error_class: Type[CgyleError], message: str
+    ) -> None:
+        """
+        Write content to a temporary file with the given prefix
+        next to filename and move it into place. An OSError is
+        raised as error_class with message as description
+        """
+        new_file = None
+        try:
+            with NamedTemporaryFile(
+                'w', dir=os.path.dirname(os.path.abspath(filename)),
+                prefix=prefix, delete=False
+            ) as new_file:
+                new_file.write(content)
+            os.chmod(new_file.name, 0o644)
+            os.replace(new_file.name, filename)
+        except OSError as issue:
+            if new_file:
+                with suppress(OSError):
+                    os.unlink(new_file.name)
+            raise error_class(f'{message}: {issue}')
+
+    @staticmethod
+    def write_json(
+        filename: str, data: Any, prefix: str,
+        error_class: Type[CgyleError], message: str,
+        indent: Optional[int] = 2
+    ) -> None:
+        AtomicFile.write(
+            filename, json.dumps(data, indent=indent), prefix,
+            error_class, message
+        )
@@ -22,16 +22,21 @@ import logging
 import time
 import subprocess
 from typing import (
-    List, Dict
+    List, Dict, Tuple, Optional, Union, Any
 )
 
-from cgyle.credentials import Credentials
+from cgyle.credentials import (
+    Credentials, AuthFile
+)
 from cgyle.response import Response
+from cgyle.metrics import Metrics
+from cgyle.selector import TagSelector
 from cgyle.exceptions import (
     CgyleError,
     CgyleCatalogError,
     CgyleCommandError,
     CgylePodmanError,
+    CgylePolicyError,
     CgyleFilterExpressionError
 )
 
@@ -44,6 +49,7 @@ class Catalog:
         self.archs = Catalog.get_arch_list()
         self.response = Response()
 
+    @Metrics.timed('cgyle_phase_duration_seconds', phase='catalog')
     def get_catalog(self, server: str) -> List[str]:
         """
         Read registry catalog from a v2 registry format
@@ -58,6 +64,7 @@ class Catalog:
                 f'Unexpected catalog response: {catalog_dict}'
             )
 
+    @Metrics.timed('cgyle_phase_duration_seconds', phase='catalog')
     def get_catalog_podman_search(
         self, server: str, tls_verify: bool = True, creds: str = ''
     ) -> List[str]:
@@ -73,9 +80,10 @@ class Catalog:
             f'--tls-verify={format(tls_verify).lower()}',
             '--limit', '2147483647'
         ]
-        if username and password:
+        auth_file = AuthFile.add(server, username, password)
+        if auth_file:
             call_args += [
-                '--creds', f'{username}:{password}'
+                '--authfile', auth_file
             ]
         call_args.append(
             f'{server}:/'
@@ -117,6 +125,7 @@ class Catalog:
             raise CgylePodmanError(catalog_issue)
         return result
 
+    @Metrics.timed('cgyle_phase_duration_seconds', phase='filter')
     def apply_filter(
         self, catalog: List[str], rules: List[str]
     ) -> List[str]:
@@ -137,7 +146,43 @@ class Catalog:
         self, policy_file: str,
         skip_sections: List[str] = [], use_archs: List[str] = []
     ) -> List[str]:
-        result: List[str] = []
+        return [
+            rule for rule, selector in self.get_tag_selectors(
+                policy_file, skip_sections, use_archs
+            )
+        ]
+
+    @Metrics.timed('cgyle_phase_duration_seconds', phase='filter')
+    def get_policy_rules(
+        self, policy_file: str,
+        skip_sections: List[str] = [], use_archs: List[str] = []
+    ) -> List[Tuple[str, Optional[TagSelector], int]]:
+        """
+        Read the policy file and return the expression of each
+        policy path not skipped by section or arch together with
+        the TagSelector of the entry, None if the entry selects
+        all tags, and the priority of the entry.
+
+        A policy entry is either a path or a mapping of a path and
+        the tag selection, see TagSelector.from_policy. The top
+        level key priority is reserved, it holds a mapping of
+        section names to the priority of their entries which can
+        be overwritten by the priority key of an entry:
+
+        .. code:: yaml
+
+            priority:
+              base: 10
+            base:
+            - bci/**
+            - path: suse/sle15/**
+              priority: 20
+            free:
+            - '*'
+
+        Entries without a priority have the priority 0
+        """
+        result: List[Tuple[str, Optional[TagSelector], int]] = []
         skip_archs = []
         if use_archs:
             skip_archs = self.archs
@@ -145,27 +190,125 @@ class Catalog:
         try:
             with open(policy_file) as policy:
                 policy_dict = yaml.safe_load(policy)
+                priorities = policy_dict.pop('priority', None) or {}
+                if not isinstance(priorities, dict):
+                    raise CgylePolicyError(
+                        f'Invalid policy priority {priorities}: the '
+                        'priority key is reserved for a mapping of '
+                        'section names to numbers'
+                    )
                 for category in policy_dict:
                     if category not in skip_sections:
-                        for pattern in policy_dict.get(category):
+                        section_priority = Catalog._get_priority(
+                            priorities.get(category) or 0, category
+                        )
+                        for entry in policy_dict.get(category):
+                            pattern = entry
+                            if isinstance(entry, dict):
+                                pattern = entry.get('path')
+                                if not isinstance(pattern, str):
+                                    raise CgylePolicyError(
+                                        f'Invalid policy entry {entry}: '
+                                        'expected path'
+                                    )
                             if not next(
                                 (arch for arch in skip_archs if arch in pattern), None
                             ):
                                 pattern = re.sub('(?<!\*)\*(?!\*)', '[^/]*', pattern)
                                 pattern = re.sub('\*\*', '.*', pattern)
-                                result.append(f'^{pattern}$')
+                                result.append(
+                                    Catalog._get_rule(
+                                        f'^{pattern}$', entry, section_priority
+                                    )
+                                )
+        except CgylePolicyError:
+            raise
         except Exception as issue:
             raise CgyleError(
                 f'Failed to open {policy_file}: {issue}'
             )
         return result
 
+    def get_tag_selectors(
+        self, policy_file: str,
+        skip_sections: List[str] = [], use_archs: List[str] = []
+    ) -> List[Tuple[str, Optional[TagSelector]]]:
+        """
+        Return the expression of each policy path together with
+        the TagSelector of the entry, see get_policy_rules
+        """
+        return [
+            (rule, selector) for rule, selector, priority in
+            self.get_policy_rules(policy_file, skip_sections, use_archs)
+        ]
+
+    @staticmethod
+    def get_tag_selector(
+        selectors: List[Tuple[str, Optional[TagSelector]]], container: str
+    ) -> Optional[TagSelector]:
+        """
+        Return the TagSelector of the first policy entry matching
+        container, None if that entry selects all tags
+        """
+        for rule, selector in selectors:
+            if re.match(rule, container):
+                return selector
+        return None
+
+    @staticmethod
+    def sort_by_priority(
+        catalog: List[str], priorities: List[Tuple[str, int]]
+    ) -> List[str]:
+        """
+        Return catalog ordered by the priority of the first policy
+        rule matching each entry, highest first. Entries of the
+        same priority keep their order
+        """
+        def get_priority(entry: str) -> int:
+            for rule, priority in priorities:
+                if re.match(rule, entry):
+                    return priority
+            return 0
+        return sorted(catalog, key=get_priority, reverse=True)
+
+    @staticmethod
+    def _get_rule(
+        rule: str, entry: Union[str, dict], section_priority: int
+    ) -> Tuple[str, Optional[TagSelector], int]:
+        if not isinstance(entry, dict):
+            return (rule, None, section_priority)
+        priority = section_priority
+        if 'priority' in entry:
+            priority = Catalog._get_priority(entry['priority'], entry)
+        return (rule, TagSelector.from_policy(entry), priority)
+
+    @staticmethod
+    def _get_priority(priority: Union[int, str], origin: Any) -> int:
+        try:
+            return int(priority)
+        except (TypeError, ValueError):
+            raise CgylePolicyError(
+                f'Invalid priority {priority} of {origin}: expected a number'
+            )
+
     @staticmethod
     def get_arch_list() -> List[str]:
         return [
             'amd64', 'x86_64', 'arm64', 'aarch64', 's390x', 'ppc64el', 'ppc64le'
         ]
 
+    @staticmethod
+    def get_platform_arch(arch: str) -> str:
+        """
+        Map arch name to the architecture name used in the
+        platform section of a multi arch manifest
+        """
+        return {
+            'x86_64': 'amd64',
+            'aarch64': 'arm64',
+            'ppc64el': 'ppc64le'
+        }.get(arch, arch)
+
     @staticmethod
     def get_container_arch_list() -> List[str]:
         return [
@@ -24,13 +24,33 @@ usage: cgyle -h | --help
            [--arch=<arch>...]
            [--registry-creds=<user:pwd>]
            [--proxy-creds=<user:pwd>]
-           [--store-oci=<dir>|--push-oci=<repo> --push-oci-creds=<user:pwd>]
+           [--store-oci=<dir>... [--store-oci-layout [--store-oci-archive]]]
+           [--push-oci=<repo>... --push-oci-creds=<user:pwd>...]
+           [--creds-ttl=<seconds>]
+           [--staging-dir=<dir>]
+           [--staging-max-size=<MB>]
            [--push-ecr-alias=<name>]
            [--tls-verify-proxy=<BOOL>]
            [--tls-verify-registry=<BOOL>]
            [--max-requests=<number>]
+           [--max-retries=<number>]
            [--remove-signatures]
            [--with-attestation]
+           [--sync]
+           [--proxy-delta]
+           [--state-db=<file> [--state-log-lines=<number>]]
+           [--plan=<file>|--plan-file=<file>]
+           [--shard=<i/N>|--shard-dir=<dir>]
+           [--shard-tags]
+           [--claim-ttl=<seconds>]
+           [--metrics-file=<file>]
+           [--metrics-port=<port>]
+           [--report=<file>]
+           [--profile=<dir> [--profile-python=<tool>]]
+           [--status-file=<file> [--status-interval=<seconds>]]
+           [--verify [--verify-report=<file>]]
+           [--gc [--gc-report=<file>]]
+           [--min-free-space=<MB>]
        cgyle --list-archs
 
 options:
@@ -50,7 +70,22 @@ options:
 
     --filter-policy=<policyfile>
         Apply rules provided in the policyfile on the
-        list of containers received from the registry
+        list of containers received from the registry.
+        A rule is either a path or a mapping with a path
+        and a selection of its tags by a glob (tags), a
+        regular expression (tags_regex), exclude globs
+        (exclude), the number of newest tags to keep (keep)
+        ordered by version or created date (order) and the
+        maximum age in days (max_age). The first rule
+        matching a container decides about its tags.
+        Tags are processed newest first by version, with
+        order created by their created date.
+        Containers are processed in the order of the
+        priority of their rule, highest first. The priority
+        of a section is set in a priority mapping of section
+        names to numbers in the policyfile and can be set
+        per rule by a priority key, the default is 0. The
+        section name priority is reserved for this mapping
 
     --skip-policy-section=<name>...
         Skip the provided section name from the policyfile.
@@ -68,17 +103,62 @@ options:
         Login to given proxy registry with the provided credentials
         using podman login
 
-    --store-oci=<dir>
+    --store-oci=<dir>...
         Store each container as oci dir below the given
+        directory. This option can be specified multiple times
+        to store into several directories from one upstream pull
+
+    --store-oci-layout
+        Store all containers into one OCI image layout below
+        the --store-oci directory. The layout shares the blobs
+        of all containers and references each container as
+        container:tag:arch in its index.json. Blobs already
+        present in the layout are not fetched again
+
+    --store-oci-archive
+        In addition to the OCI image layout, export each
+        container as oci archive tarball below the --store-oci
         directory
 
     --push-oci=<repo>
         Push each container to the given repository.
         this will push each container as containerbasename-tagname-arch
-        into the given repository
+        into the given repository. Tags already present with the
+        same manifest digest are skipped. Blobs already pushed to
+        another repository of the destination registry are mounted
+        from there instead of being uploaded again. This option can
+        be specified multiple times to push to several registries
+        from one upstream pull
+
+    --push-oci-creds=<user:pwd>...
+        Contact given push-oci registry with the provided credentials.
+        If specified multiple times, the credentials are used for the
+        push-oci target of the same position. A single credentials
+        value is used for all push-oci targets. Credentials can also
+        be read from a credentials file or from the output of a
+        command in the form exec:<user>:<command>, for example
+        exec:AWS:aws ecr get-login-password
+
+    --creds-ttl=<seconds>
+        Time in seconds credentials read from an exec:<user>:<command>
+        source are used. Afterwards the command is called again and
+        new transfers use the refreshed credentials. Set this below
+        the lifetime of the credentials to refresh them ahead of
+        their expiration [default: 3600]
 
-    --push-oci-creds=<user:pwd>
-        Contact given push-oci registry with the provided credentials
+    --staging-dir=<dir>
+        Local staging directory used if more than one destination
+        is given via the store-oci and push-oci options. Each container
+        tag is fetched once into the staging directory and copied from
+        there to all destinations concurrently
+        [default: /var/tmp/cgyle-staging]
+
+    --staging-max-size=<MB>
+        Size limit of the staging directory. Blobs not in use by a
+        transfer are evicted oldest first before each fetch if the
+        staging directory grows beyond this limit, such that it
+        exceeds the limit at most by the tags in transfer
+        [default: 10240]
 
     --push-ecr-alias=<name>
         Replace first target path element in a container push with
@@ -91,6 +171,151 @@ options:
     --with-attestation
         Do not skip tags ending with .att
 
+    --sync
+        Transfer the new tags of a container with skopeo sync calls
+        of up to 10 tags instead of one skopeo copy call per tag.
+        Used for cache updates and for pushing to a single push-oci
+        target. Cache updates sync into a temporary directory below
+        TMPDIR, /var/tmp by default. Storing via store-oci and
+        transfers to multiple destinations always copy per tag
+
+    --proxy-delta
+        Compute the new tags of each container from the content
+        stored in the local://distribution cache instead of the tag
+        logs of former runs. Tags the cache does not hold or whose
+        manifest digest differs from the one at the registry are
+        transferred. This recovers from lost tag logs or a moved
+        cache. Other proxies answer with the content of their
+        upstream registry and are refused
+
+    --state-db=<file>
+        Keep the failure history of container tags across runs
+        in the given sqlite database. A tag that failed more than
+        once is skipped for a cool-off period which doubles with
+        every further failure. Tags in quarantine are reported at
+        the end of the run
+
+    --state-log-lines=<number>
+        Number of lines of the output of a failed transfer kept
+        with the failure history in the --state-db database
+        [default: 20]
+
+    --plan=<file>
+        Discover the new tags of all containers concurrently and
+        write a JSON work plan to the given file instead of
+        transferring anything. For each tag the plan lists the
+        manifest digest, the size of all blobs and the size of
+        the blobs not yet present in the OCI layout, the push-oci
+        targets or the local distribution cache. The plan also
+        contains the totals of the run
+
+    --plan-file=<file>
+        Process the containers and tags of a plan written by a
+        former --plan run instead of discovering them again
+
+    --shard=<i/N>
+        Process only shard i of N of the cache update. Containers
+        are assigned to shards by a stable hash of their name such
+        that N nodes called with the shards 1/N to N/N process
+        all containers exactly once
+
+    --shard-dir=<dir>
+        Coordinate the cache update with other nodes through claim
+        files in the given directory shared between all nodes.
+        Each container is processed by the node claiming it first.
+        Claims are scoped to the run, the next cache update
+        processes all containers again
+
+    --shard-tags
+        Partition the container tags per arch between the shards
+        instead of the containers. This balances the work better
+        if a few containers carry most of the tags
+
+    --claim-ttl=<seconds>
+        Time in seconds the claims of a run in the --shard-dir
+        directory stay valid if the run did not end properly.
+        Must be longer than the cache update takes
+        [default: 21600]
+
+    --metrics-file=<file>
+        Write the metrics of the run in the Prometheus text format
+        to the given file at the end of the run. Point it into the
+        directory of the node_exporter textfile collector to pick
+        them up
+
+    --metrics-port=<port>
+        Serve the metrics of the running cache update on
+        http://127.0.0.1:<port>/metrics and its live status
+        as JSON on http://127.0.0.1:<port>/status
+
+    --report=<file>
+        Write a JSON report with the duration, the size and the
+        per blob timing of each transferred container tag to the
+        given file at the end of the run. The summary of the report
+        lists the slowest tags and blobs
+
+    --profile=<dir>
+        Profile the run and write the results to the given
+        directory. The wall and CPU time of the catalog, filter,
+        discovery and transfer phases and of each worker are
+        written to summary.json and a timeline of all phases and
+        containers to trace.json in the Chrome trace format, to be
+        opened in chrome://tracing or https://ui.perfetto.dev
+
+    --profile-python=<tool>
+        Profile the Python side of the run in addition. With
+        cprofile the merged statistics of all threads are written
+        to python.pstats, with tracemalloc the top allocation sites
+        are written to tracemalloc.txt
+
+    --status-file=<file>
+        Write the live status of the running cache update as JSON
+        to the given file. The status lists the done and remaining
+        containers and tags, the transferred bytes, the rates, the
+        estimated time to finish and the container and tag each
+        worker is working on. The file is replaced atomically
+
+    --status-interval=<seconds>
+        Time in seconds between two updates of the --status-file
+        [default: 10]
+
+    --verify
+        Audit the content of the local distribution cache and of
+        the --store-oci directories before the cache update. All
+        blobs are hashed in parallel processes and compared with
+        their digest. Corrupt and missing content of each tag and
+        blobs no tag refers to are reported. With --apply the
+        corrupt content is removed and only the affected tags are
+        transferred again. With --plan-file the affected tags are
+        transferred in addition to the planned ones
+
+    --verify-report=<file>
+        Write the results of --verify as JSON to the given file
+
+    --gc
+        Instead of a cache update, remove the content of the local
+        distribution cache and of the --store-oci directories no
+        longer selected by the --filter-policy rules and --filter.
+        The keep and max_age rules apply to the stored tags, their
+        created date is read from the stored image. The sections
+        given by --skip-policy-section are kept.
+        Blobs no selected tag refers to are removed as well.
+        Without --apply the reclaimable content is only reported
+
+    --gc-report=<file>
+        Write the results of --gc as JSON to the given file
+
+    --min-free-space=<MB>
+        Admit a container tag transfer only while the filesystems
+        written by the run keep the given free space in MB. This
+        covers the local distribution cache, the --store-oci and
+        staging directories and the temporary directory of skopeo
+        given by TMPDIR, /var/tmp by default. The footprint of a
+        tag is estimated from the size of the blobs not yet stored.
+        Once a tag does not fit, no further transfers are started,
+        running transfers finish and the deferred tags are reported
+        and transferred by the next run
+
     --tls-verify-proxy=BOOL
         Contact given proxy location without TLS [default: True]
 
@@ -101,6 +326,14 @@ options:
         Maximum number of parallel container requests. Note, all
         container tags are handled in one request [default: 10]
 
+    --max-retries=<number>
+        Maximum number of retries of a transfer failed with a
+        throttling, server or network error. Retries are delayed
+        by a jittered exponential backoff. After repeated failures
+        all transfers from or to the failing registry pause for a
+        while. If set, skopeo itself retries only once per call,
+        with 0 skopeo retries up to five times [default: 3]
+
     --updatecache=<proxy>
         Proxy location to trigger the cache update for. If
         the special value local://distribution:DIR is set, a local
@@ -108,15 +341,57 @@ options:
         its cache is stored below the given directory DIR
 """
 import os
+import re
+import time
 import concurrent.futures
 import logging
-from typing import List
+from typing import (
+    List, Dict, Tuple, Union, Callable, Optional
+)
+from pathlib import Path
 from docopt import docopt
 from contextlib import ExitStack
 
 from cgyle.version import __version__
-from cgyle.proxy import DistributionProxy
+from cgyle.proxy import (
+    DistributionProxy, UpdateOptions
+)
 from cgyle.catalog import Catalog
+from cgyle.selector import TagSelector
+from cgyle.credentials import Credentials
+from cgyle.registry import Registry
+from cgyle.delta import Delta
+from cgyle.verify import Verifier
+from cgyle.garbage import GarbageCollector
+from cgyle.admission import Admission
+from cgyle.push import PushEngine
+from cgyle.retry import RetryPolicy
+from cgyle.state import StateStore
+from cgyle.failures import FailureIndex
+from cgyle.metrics import (
+    Metrics, MetricsServer
+)
+from cgyle.report import TransferReport
+from cgyle.profiler import Profiler
+from cgyle.oci_layout import OCILayout
+from cgyle.shard import (
+    Shard, Coordinator
+)
+from cgyle.exceptions import (
+    CgyleError,
+    CgyleMetricsError,
+    CgyleReportError,
+    CgyleProfileError
+)
+from cgyle.status import (
+    Status, StatusHandler, StatusFile
+)
+from cgyle.plan import (
+    Plan, Planner
+)
+from cgyle.fanout import (
+    FanOut, Destination
+)
 
 logging.basicConfig(
     format='%(levelname)s:%(message)s',
@@ -135,6 +410,7 @@ class Cli:
             options_first=True
         )
         self.max_requests = int(self.arguments['--max-requests'])
+        self.max_retries = int(self.arguments['--max-retries'])
         self.tls_proxy = \
             True if self.arguments['--tls-verify-proxy'] == 'True' else False
         self.tls_registry = \
@@ -150,13 +426,51 @@ class Cli:
         self.policy_skip_sections: List[str] = \
             self.arguments['--skip-policy-section']
         self.from_registry = self.arguments['--from']
-        self.store_oci = self.arguments['--store-oci'] or ''
-        self.push_oci = self.arguments['--push-oci'] or ''
+        self.store_oci_dirs: List[str] = self.arguments['--store-oci']
+        self.store_oci = self.store_oci_dirs[0] if self.store_oci_dirs else ''
+        self.store_oci_layout = bool(self.arguments['--store-oci-layout'])
+        self.store_oci_archive = bool(self.arguments['--store-oci-archive'])
+        self.push_oci_repos: List[str] = self.arguments['--push-oci']
+        self.push_oci = self.push_oci_repos[0] if self.push_oci_repos else ''
         self.ecr_alias = self.arguments['--push-ecr-alias'] or ''
-        self.tls_push_oci_creds = self.arguments['--push-oci-creds'] or ''
+        self.push_oci_creds: List[str] = self.arguments['--push-oci-creds']
+        self.tls_push_oci_creds = self.get_push_oci_creds(0)
+        self.creds_ttl = int(self.arguments['--creds-ttl'])
+        self.staging_dir = self.arguments['--staging-dir']
+        self.staging_max_size = int(self.arguments['--staging-max-size'])
         self.remove_signatures = bool(self.arguments['--remove-signatures'])
         self.with_attestation = bool(self.arguments['--with-attestation'])
-        self.catalog: List[str] = []
+        self.sync = bool(self.arguments['--sync'])
+        self.proxy_delta = bool(self.arguments['--proxy-delta'])
+        self.delta: Optional[Delta] = None
+        self.state_db = self.arguments['--state-db'] or ''
+        self.state_log_lines = int(self.arguments['--state-log-lines'])
+        self.plan_out = self.arguments['--plan'] or ''
+        self.plan_file = self.arguments['--plan-file'] or ''
+        self.plan: Optional[Plan] = None
+        self.shard_tags = bool(self.arguments['--shard-tags'])
+        self.shard_dir = self.arguments['--shard-dir'] or ''
+        self.shard: Optional[Union[Shard, Coordinator]] = None
+        if self.arguments['--shard']:
+            self.shard = Shard.parse(
+                self.arguments['--shard'], self.shard_tags
+            )
+        self.claim_ttl = int(self.arguments['--claim-ttl'])
+        self.metrics_file = self.arguments['--metrics-file'] or ''
+        self.metrics_port = int(self.arguments['--metrics-port'] or 0)
+        self.report_file = self.arguments['--report'] or ''
+        self.profile_dir = self.arguments['--profile'] or ''
+        self.profile_python = self.arguments['--profile-python'] or ''
+        self.status_file = self.arguments['--status-file'] or ''
+        self.status_interval = float(self.arguments['--status-interval'])
+        self.verify = bool(self.arguments['--verify'])
+        self.verify_report = self.arguments['--verify-report'] or ''
+        self.gc = bool(self.arguments['--gc'])
+        self.gc_report = self.arguments['--gc-report'] or ''
+        self.min_free_space = int(self.arguments['--min-free-space'] or 0)
+        self.plan_registries: List[Tuple[str, Registry]] = []
+        self.tag_selectors: List[Tuple[str, Optional[TagSelector]]] = []
+        self.plan_layout: Optional[OCILayout] = None
 
         self.local_distribution_cache = ''
         if self.cache and self.cache.startswith('local://distribution'):
@@ -169,14 +483,63 @@ class Cli:
         if process:
             if self.list_archs:
                 logging.info(Catalog.get_arch_list())
+            elif self.cache and self.gc:
+                self.collect_garbage()
             elif self.cache:
                 self.update_cache()
 
     def update_cache(self) -> None:
+        if not self.profile_dir:
+            self._update_cache()
+            return
+        Profiler.start(self.profile_python)
+        try:
+            self._update_cache()
+        finally:
+            try:
+                Profiler.log(Profiler.stop(self.profile_dir))
+                logging.info(f'Wrote profile to {self.profile_dir}')
+            except CgyleProfileError as issue:
+                logging.error(format(issue))
+
+    def _serve_metrics(self, main: ExitStack) -> None:
+        """
+        Serve metrics and status for the lifetime of main. A port
+        that can't be bound does not stop the run
+        """
+        try:
+            main.enter_context(
+                MetricsServer(self.metrics_port, handler=StatusHandler)
+            )
+        except CgyleMetricsError as issue:
+            logging.error(f'{issue}, continue without endpoint')
+
+    def _update_cache(self) -> None:
         count = 0
-        self.catalog = []
+        run_start = time.monotonic()
+        Metrics.reset()
+        Metrics.set('cgyle_workers', self.max_requests)
+        RetryPolicy.max_retries = self.max_retries
+        Credentials.ttl = self.creds_ttl
+        TransferReport.reset()
+        Admission.reset()
+        OCILayout.reset()
+        Status.start()
+
+        if self.plan_out:
+            self.write_plan()
+            return
+        if not self._read_plan():
+            return
 
         with ExitStack() as main:
+            if self.metrics_port and not self.dryrun:
+                self._serve_metrics(main)
+            if self.status_file and not self.dryrun:
+                main.enter_context(
+                    StatusFile(self.status_file, self.status_interval)
+                )
+            main.callback(Status.finish)
             if self.local_distribution_cache and not self.dryrun:
                 # local instance for cache setup requested
                 local_proxy = DistributionProxy(self.cache)
@@ -188,34 +551,82 @@ class Cli:
                     proxy_creds=self.tls_registry_creds
                 )
 
+            fanout = self._get_fanout()
+            if self.shard_dir and not self.dryrun:
+                self.shard = Coordinator(
+                    self.shard_dir, self.shard_tags, self.claim_ttl
+                )
+                main.callback(self.shard.release)
+            state = None
+            if self.state_db and not self.dryrun:
+                state = StateStore(self.state_db, self.state_log_lines)
+                main.callback(state.close)
+            push_engine = None
+            store_oci = ''
+            push_oci = ''
+            push_oci_creds = ''
+            if fanout:
+                fanout.create()
+            elif not self.dryrun:
+                store_oci = self.store_oci
+                push_oci = self.push_oci
+                push_oci_creds = self.tls_push_oci_creds
+                if push_oci:
+                    push_engine = self._get_push_engine(
+                        push_oci, push_oci_creds
+                    )
+            if not self.dryrun:
+                self._setup_admission(fanout)
             thread_pool = []
             thread_executor = concurrent.futures.ThreadPoolExecutor(
-                max_workers=self.max_requests
+                max_workers=self.max_requests, thread_name_prefix='worker'
             )
             with ExitStack() as stack:
                 # process container fetch requests...
                 if self.dryrun:
                     logging.info(f'Proxy: [{self.cache}]:')
-                for container in self._get_catalog():
+                containers = self._get_catalog()
+                if not self.dryrun:
+                    self._read_delta(containers)
+                options = UpdateOptions(
+                    self.from_registry,
+                    tls_verify=self.tls_proxy,
+                    store_oci=store_oci,
+                    push_oci=push_oci,
+                    push_oci_creds=push_oci_creds,
+                    proxy_creds=self.tls_proxy_creds,
+                    use_archs=self.use_archs,
+                    remove_signatures=self.remove_signatures,
+                    with_attestation=self.with_attestation,
+                    ecr_alias=self.ecr_alias,
+                    oci_layout=self.store_oci_layout,
+                    oci_export=self.store_oci_archive,
+                    push_engine=push_engine,
+                    fanout=fanout,
+                    sync=self.sync,
+                    state=state,
+                    shard=self.shard,
+                    delta=self.delta
+                )
+                for container in containers:
                     count += 1
                     if self.dryrun:
                         logging.info(f'  ({count}) - {container}')
                     else:
                         proxy = DistributionProxy(self.cache, container)
                         stack.push(proxy)
+                        Metrics.inc('cgyle_containers_total', state='planned')
+                        Metrics.inc('cgyle_queue_depth')
                         thread_pool.append(
                             thread_executor.submit(
-                                proxy.update_cache,
-                                self.from_registry,
-                                self.tls_proxy,
-                                self.store_oci,
-                                self.push_oci,
-                                self.tls_push_oci_creds,
-                                self.tls_proxy_creds,
-                                self.use_archs,
-                                self.remove_signatures,
-                                self.with_attestation,
-                                self.ecr_alias
+                                self._run_worker,
+                                proxy,
+                                options,
+                                self.plan.get_tags(container)
+                                if self.plan else None,
+                                Catalog.get_tag_selector(
+                                    self.tag_selectors, container
+                                )
                             )
                         )
 
@@ -226,56 +637,514 @@ class Cli:
                     exception = worker.exception()
                     if exception is not None:
                         logging.error(f'Thread failed with: {exception}')
+                if fanout:
+                    for target, status in fanout.get_status().items():
+                        logging.info(
+                            'Destination {}: done:{} skipped:{} failed:{}'.format(
+                                target, status['done'], status['skipped'],
+                                status['failed']
+                            )
+                        )
+                Admission.log()
+                if state:
+                    for entry in state.get_quarantined():
+                        logging.warning(
+                            'Quarantined until {}: {}:{} arch:{} failures:{} {}'.format(
+                                entry['until'], entry['container'],
+                                entry['tag'], entry['arch'],
+                                entry['failures'], entry['error']
+                            )
+                        )
 
         # All done, collect errors if any. cgyle only keeps the
         # log files of failed caching attempts and wipes the successful
-        # ones because there is no meaningful information in a successful
-        # caching process other than, the container was cached, which
-        # is an information that is still present by reading the log
-        # directory tree. The error information from all failed log
-        # files is now combined into one log file and appended to an
-        # eventually existing log file.
+        # ones. Workers index each failure as it happens, the log files
+        # of the failures of this run are now appended as JSON lines to
+        # the aggregate log file which gets rotated if it grows too big
         if not self.dryrun:
-            log_path = DistributionProxy.get_log_path()
-            log_file_name = f'{log_path}.log'
+            log_file_name = f'{DistributionProxy.get_log_path()}.log'
             try:
-                with open(log_file_name, 'a') as collect_fd:
-                    for topdir, dirs, files in sorted(os.walk(log_path)):
-                        for entry in sorted(dirs + files):
-                            if entry in files:
-                                logfile = os.sep.join([topdir, entry])
-                                if logfile.endswith('.log'):
-                                    if any(container_name in logfile.lstrip(os.sep) for container_name in self.catalog):
-                                        collect_fd.write(f'{logfile}:{os.linesep}')
-                                        with open(logfile) as log_fd:
-                                            collect_fd.write(
-                                                log_fd.read() or 'no log data'
-                                            )
-                                            collect_fd.write(os.linesep)
-            except IOError as issue:
+                with Profiler.span('logs', 'phase'):
+                    failures = FailureIndex.write(log_file_name)
+                if failures:
+                    logging.info(
+                        f'Logged {failures} failed transfers to {log_file_name}'
+                    )
+            except OSError as issue:
                 logging.error(f'Failed to create logfile: {issue}')
+            FailureIndex.reset()
+            self._write_metrics(time.monotonic() - run_start)
+            self._write_report()
+
+    def write_plan(self) -> None:
+        """
+        Discover the new tags of all containers and write their
+        digests and sizes as JSON plan to the --plan file
+        """
+        plan = Plan(self.cache, self.from_registry)
+        planner = Planner(
+            Registry(
+                self.from_registry, self.tls_registry_creds,
+                self.tls_registry
+            ),
+            self._blob_exists
+        )
+        self.plan_registries = [
+            (
+                push_oci,
+                Registry(
+                    push_oci.split(os.sep)[0], self.get_push_oci_creds(index)
+                )
+            ) for index, push_oci in enumerate(self.push_oci_repos)
+        ]
+        self.plan_layout = OCILayout(self.store_oci) \
+            if self.store_oci and self.store_oci_layout else None
+        containers = self._get_catalog()
+        self._read_delta(containers)
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_requests
+        ) as thread_executor:
+            thread_pool = [
+                thread_executor.submit(
+                    self._plan_container, plan, planner, container
+                ) for container in containers
+            ]
+            for worker in concurrent.futures.as_completed(thread_pool):
+                exception = worker.exception()
+                if exception is not None:
+                    logging.error(f'Thread failed with: {exception}')
+        plan.write(self.plan_out)
+        summary = plan.get_summary()
+        logging.info(
+            'Plan {}: containers:{} tags:{} size:{}MB new:{}MB'.format(
+                self.plan_out, summary['containers'], summary['tags'],
+                summary['size'] // (1024 * 1024),
+                summary['new_size'] // (1024 * 1024)
+            )
+        )
+
+    def _read_plan(self) -> bool:
+        """
+        Read the plan of the run from the --plan-file and/or from
+        the tags affected by --verify. The affected tags are merged
+        into a plan read from --plan-file. Returns False if a
+        verification without --plan-file left nothing to transfer
+        """
+        if self.plan_file:
+            self.plan = Plan.read(self.plan_file)
+            if self.plan.from_registry != self.from_registry:
+                logging.warning(
+                    'Plan {} was created for {}, not for {}'.format(
+                        self.plan_file, self.plan.from_registry,
+                        self.from_registry
+                    )
+                )
+        if self.verify:
+            affected = self.verify_cache()
+            if not self.plan:
+                self.plan = affected
+                return bool(affected)
+            if affected:
+                self.plan.merge(affected)
+        return True
+
+    def verify_cache(self) -> Optional[Plan]:
+        """
+        Audit the content of the local distribution cache and of
+        the --store-oci directories. With --apply the corrupt
+        content is removed and a plan transferring only the
+        affected tags is returned
+        """
+        verifier = Verifier()
+        results = []
+        try:
+            if self.local_distribution_cache:
+                results.append(
+                    verifier.verify_distribution(self.local_distribution_cache)
+                )
+            for store_oci in self.store_oci_dirs:
+                if self.store_oci_layout:
+                    results.append(verifier.verify_layout(store_oci))
+                if not self.store_oci_layout or self.store_oci_archive:
+                    results.append(verifier.verify_archives(store_oci))
+            for result in results:
+                Verifier.log(result)
+            if self.verify_report:
+                Verifier.write(results, self.verify_report)
+                logging.info(f'Wrote verification report to {self.verify_report}')
+            if self.dryrun:
+                return None
+            plan = Plan(self.cache, self.from_registry)
+            for result in results:
+                Verifier.repair(result)
+                store_oci = result['root'] \
+                    if result['kind'] != 'distribution' else ''
+                for container, tag, arch in result['affected']:
+                    proxy = DistributionProxy(self.cache, container)
+                    for tag_arch in [arch] if arch else \
+                            self.use_archs or ['all']:
+                        proxy.drop_tags(store_oci, tag_arch, [tag])
+                        plan.add(
+                            container, tag_arch, [
+                                {
+                                    'tag': tag, 'digest': '',
+                                    'size': 0, 'new_size': 0
+                                }
+                            ]
+                        )
+        except CgyleError as issue:
+            logging.error(f'Verification failed: {issue}')
+            return None
+        if not plan.units:
+            return None
+        logging.info(
+            'Transferring {} affected tags again'.format(
+                plan.get_summary()['tags']
+            )
+        )
+        return plan
+
+    def collect_garbage(self) -> None:
+        """
+        Remove the content of the local distribution cache and of
+        the --store-oci directories no longer selected. Without
+        --apply the reclaimable content is only reported
+        """
+        results = []
+        try:
+            if self.policy:
+                # skipped sections are only not updated by this node,
+                # their content is still live
+                self.tag_selectors = Catalog().get_tag_selectors(
+                    self.policy, [], self.use_archs
+                )
+            collector = GarbageCollector(
+                self.select_live, self.max_requests, apply=not self.dryrun
+            )
+            if self.local_distribution_cache:
+                results.append(
+                    collector.collect_distribution(
+                        self.local_distribution_cache
+                    )
+                )
+            for store_oci in self.store_oci_dirs:
+                if self.store_oci_layout:
+                    results.append(collector.collect_layout(store_oci))
+                if not self.store_oci_layout or self.store_oci_archive:
+                    results.append(collector.collect_archives(store_oci))
+        except CgyleError as issue:
+            logging.error(f'Garbage collection failed: {issue}')
+        for result in results:
+            GarbageCollector.log(result)
+            if not self.dryrun:
+                # removed tags are transferred again if selected again
+                store_oci = result['root'] \
+                    if result['kind'] != 'distribution' else ''
+                for container, tag, arch in result['tags']:
+                    proxy = DistributionProxy(self.cache, container)
+                    for tag_arch in [arch] if arch else \
+                            self.use_archs or ['all']:
+                        proxy.drop_tags(store_oci, tag_arch, [tag])
+        if self.gc_report:
+            try:
+                GarbageCollector.write(results, self.gc_report)
+                logging.info(
+                    f'Wrote garbage collection report to {self.gc_report}'
+                )
+            except CgyleError as issue:
+                logging.error(format(issue))
+
+    def select_live(
+        self, container: str, tags: List[str],
+        get_created: Callable[[str], Optional[float]]
+    ) -> List[str]:
+        """
+        Return the tags of the container selected by the policy
+        rules, including their keep and max_age retention, and by
+        the filter of the run
+        """
+        if self.pattern and not re.match(self.pattern, container):
+            return []
+        if not self.policy:
+            return tags
+        rule = next(
+            (
+                (rule, selector) for rule, selector in self.tag_selectors
+                if re.match(rule, container)
+            ), None
+        )
+        if not rule:
+            return []
+        return rule[1].select(tags, get_created) if rule[1] else tags
+
+    def _run_worker(
+        self, proxy: DistributionProxy, options: UpdateOptions,
+        plan_tags: Optional[Dict[str, List[str]]],
+        tag_selector: Optional[TagSelector]
+    ) -> None:
+        """
+        Run the cache update of proxy and account its state and
+        the busy time of the worker in the metrics
+        """
+        Metrics.inc('cgyle_queue_depth', -1)
+        Metrics.inc('cgyle_workers_busy')
+        start = time.monotonic()
+        container_state = 'failed'
+        Status.begin(proxy.container)
+        try:
+            if Admission.is_stopped():
+                # no transfer fits on disk anymore
+                Admission.defer(proxy.container)
+                container_state = 'deferred'
+                return
+            with Profiler.span(proxy.container, 'unit'):
+                proxy.update_cache(options, plan_tags, tag_selector)
+            if proxy.skipped:
+                container_state = 'skipped'
+            elif not proxy.failed_tags:
+                container_state = 'done'
+        finally:
+            Admission.release(proxy.container)
+            Status.end()
+            Metrics.inc('cgyle_workers_busy', -1)
+            Metrics.inc(
+                'cgyle_worker_busy_seconds_total', time.monotonic() - start
+            )
+            Metrics.inc('cgyle_containers_total', state=container_state)
+
+    def _write_metrics(self, duration: float) -> None:
+        Metrics.set('cgyle_run_duration_seconds', duration)
+        Metrics.set('cgyle_run_timestamp_seconds', time.time())
+        if duration:
+            Metrics.set(
+                'cgyle_worker_utilization_ratio',
+                Metrics.get('cgyle_worker_busy_seconds_total') / (
+                    duration * self.max_requests
+                )
+            )
+        if self.metrics_file:
+            try:
+                Metrics.write(self.metrics_file)
+            except CgyleMetricsError as issue:
+                logging.error(format(issue))
+
+    def _write_report(self) -> None:
+        if self.report_file:
+            try:
+                TransferReport.write(self.report_file)
+                logging.info(f'Wrote transfer report to {self.report_file}')
+            except CgyleReportError as issue:
+                logging.error(format(issue))
+
+    def get_push_oci_creds(self, index: int) -> str:
+        """
+        Return credentials for the --push-oci target at index
+        """
+        if not self.push_oci_creds:
+            return ''
+        if len(self.push_oci_creds) == 1:
+            return self.push_oci_creds[0]
+        if index < len(self.push_oci_creds):
+            return self.push_oci_creds[index]
+        return ''
+
+    def _get_push_engine(self, push_oci: str, creds: str) -> PushEngine:
+        return PushEngine(
+            Registry(self.cache, self.tls_proxy_creds, self.tls_proxy),
+            Registry(push_oci.split(os.sep)[0], creds)
+        )
+
+    def _get_fanout(self) -> Optional[FanOut]:
+        if self.dryrun or \
+           len(self.store_oci_dirs) + len(self.push_oci_repos) < 2:
+            return None
+        destinations = [
+            Destination(
+                store_oci, oci_layout=self.store_oci_layout,
+                oci_export=self.store_oci_archive
+            ) for store_oci in self.store_oci_dirs
+        ]
+        for index, push_oci in enumerate(self.push_oci_repos):
+            creds = self.get_push_oci_creds(index)
+            destinations.append(
+                Destination(
+                    push_oci, push=True, creds=creds,
+                    ecr_alias=self.ecr_alias,
+                    push_engine=self._get_push_engine(push_oci, creds)
+                )
+            )
+        return FanOut(
+            self.staging_dir, destinations,
+            self.staging_max_size * 1024 * 1024
+        )
+
+    def _setup_admission(self, fanout: Optional[FanOut]) -> None:
+        """
+        Enable the admission control of transfers by the free space
+        of the filesystems written by the run if --min-free-space
+        is set
+        """
+        if not self.min_free_space:
+            return
+        paths = [DistributionProxy.get_tmp_dir()] + self.store_oci_dirs
+        if self.local_distribution_cache:
+            paths.append(self.local_distribution_cache)
+        if fanout:
+            paths.append(self.staging_dir)
+        self.plan_layout = OCILayout(self.store_oci) \
+            if self.store_oci and self.store_oci_layout else None
+        planner = Planner(
+            Registry(
+                self.from_registry, self.tls_registry_creds,
+                self.tls_registry
+            ),
+            self._blob_exists
+        )
+        Admission.setup(
+            paths, self.min_free_space * 1024 * 1024,
+            lambda container, tag, arch: self._estimate_size(
+                planner, container, tag, arch
+            )
+        )
+
+    def _estimate_size(
+        self, planner: Planner, container: str, tag: str, arch: str
+    ) -> int:
+        """
+        Estimate the bytes the transfer of the container tag adds
+        to the disk from the sizes of its blobs not yet stored. The
+        sizes are taken from the plan if given
+        """
+        entry = self.plan.get_tag(container, arch, tag) if self.plan else None
+        if not entry or not entry['digest']:
+            entry = planner.resolve(container, tag, arch)
+        size = entry['new_size']
+        if self.store_oci and \
+           (not self.store_oci_layout or self.store_oci_archive):
+            # each oci archive carries all blobs of the tag
+            size += entry['size']
+        return size
+
+    def _plan_container(
+        self, plan: Plan, planner: Planner, container: str
+    ) -> None:
+        proxy = DistributionProxy(self.cache, container)
+        for arch in self.use_archs or ['all']:
+            tags = proxy.get_new_tags(
+                self.from_registry, self.store_oci, arch, self.tls_proxy,
+                self.tls_proxy_creds, self.with_attestation,
+                update_tag_log=False,
+                tag_selector=Catalog.get_tag_selector(
+                    self.tag_selectors, container
+                ),
+                delta=self.delta
+            )[1]
+            if tags:
+                plan.add(
+                    container, arch, [
+                        planner.resolve(container, tag, arch) for tag in tags
+                    ]
+                )
+
+    def _read_delta(self, containers: List[str]) -> None:
+        """
+        Read the tags stored in the local distribution cache if
+        --proxy-delta is set. A pull-through proxy reports the
+        upstream content as its own, therefore --proxy-delta is
+        refused for proxies other than local://distribution. If
+        the cache cannot be read, the tag logs are used
+        """
+        if not self.proxy_delta:
+            return
+        if not self.local_distribution_cache:
+            logging.error(
+                '--proxy-delta needs a local://distribution proxy, '
+                f'the content of proxy {self.cache} cannot be told '
+                'apart from its upstream registry'
+            )
+            logging.warning('Falling back to the tag logs of former runs')
+            return
+        delta = Delta(
+            self.local_distribution_cache,
+            Registry(
+                self.from_registry, self.tls_registry_creds,
+                self.tls_registry
+            ),
+            self.max_requests
+        )
+        try:
+            delta.read(containers)
+            self.delta = delta
+        except OSError as issue:
+            logging.error(
+                'Failed to read the content of cache {}: {}'.format(
+                    self.local_distribution_cache, issue
+                )
+            )
+            logging.warning('Falling back to the tag logs of former runs')
+
+    def _blob_exists(self, container: str, digest: str) -> bool:
+        """
+        Check if the given blob is already present at one of the
+        destinations of the cache update
+        """
+        if self.plan_layout and self.plan_layout.has_blob(digest):
+            return True
+        if self.local_distribution_cache:
+            algorithm, _, encoded = digest.partition(':')
+            if Path(
+                self.local_distribution_cache, 'docker', 'registry', 'v2',
+                'blobs', algorithm, encoded[:2], encoded, 'data'
+            ).exists():
+                return True
+        for push_oci, registry in self.plan_registries:
+            target = f'{push_oci}/{container}'
+            if self.ecr_alias:
+                target = os.sep.join(
+                    [push_oci, self.ecr_alias] + list(Path(container).parts[1:])
+                )
+            try:
+                if registry.blob_exists(target.partition(os.sep)[2], digest):
+                    return True
+            except CgyleError as issue:
+                logging.warning(f'Blob lookup at {push_oci} failed: {issue}')
+        return False
 
     def _get_catalog(self) -> List[str]:
         catalog = Catalog()
-        if self.use_podman_search:
-            result = catalog.get_catalog_podman_search(
-                self.from_registry, self.tls_registry,
-                self.tls_registry_creds
-            )
+        rules = catalog.get_policy_rules(
+            self.policy, self.policy_skip_sections, self.use_archs
+        ) if self.policy else []
+        if self.plan:
+            result = self.plan.get_containers()
         else:
-            result = catalog.get_catalog(self.from_registry)
+            if self.use_podman_search:
+                result = catalog.get_catalog_podman_search(
+                    self.from_registry, self.tls_registry,
+                    self.tls_registry_creds
+                )
+            else:
+                result = catalog.get_catalog(self.from_registry)
 
-        if self.policy:
-            result = catalog.apply_filter(
-                result, catalog.translate_policy(
-                    self.policy, self.policy_skip_sections, self.use_archs
+            if self.policy:
+                self.tag_selectors = [
+                    (rule, selector) for rule, selector, priority in rules
+                ]
+                result = catalog.apply_filter(
+                    result, [rule for rule, selector in self.tag_selectors]
                 )
-            )
 
-        if self.pattern:
-            result = catalog.apply_filter(result, [self.pattern])
+            if self.pattern:
+                result = catalog.apply_filter(result, [self.pattern])
 
-        for entry in result:
-            self.catalog.append(entry.lstrip(os.sep))
+        if self.policy:
+            # dispatch containers of higher priority classes first,
+            # workers always pick the next container of the highest
+            # priority still waiting
+            result = Catalog.sort_by_priority(
+                result, [
+                    (rule, priority) for rule, selector, priority in rules
+                ]
+            )
 
         return result
@@ -16,8 +16,22 @@
 # along with cgyle.  If not, see <http://www.gnu.org/licenses/>
 #
 import os
+import json
+import time
 import yaml
-from typing import List
+import shlex
+import atexit
+import base64
+import shutil
+import logging
+import threading
+import subprocess
+from tempfile import (
+    mkdtemp, NamedTemporaryFile
+)
+from typing import (
+    List, Dict, Tuple, Optional
+)
 
 from cgyle.exceptions import CgyleCredentialsError
 
@@ -25,11 +39,42 @@ from cgyle.exceptions import CgyleCredentialsError
 class Credentials:
     """
     Methods to handle credential sources
+
+    Credential files are read once and only read again if
+    the file has changed. Credentials from an exec:<user>:<command>
+    source are taken from the output of the command and are
+    refreshed by running the command again once ttl seconds
+    have passed. All workers of a cgyle process share the
+    loaded credentials
     """
+    lock = threading.Lock()
+    files: Dict[str, Tuple[float, int, List[str]]] = {}
+    commands: Dict[str, Tuple[float, List[str]]] = {}
+
+    # lifetime in seconds of credentials from an exec source
+    ttl = 3600
+
     @staticmethod
     def read(credentials_or_file: str) -> List[str]:
+        if credentials_or_file.startswith('exec:'):
+            return Credentials.get_from_command(credentials_or_file)
         if os.path.isfile(credentials_or_file):
-            return Credentials.get_from_file(credentials_or_file)
+            try:
+                stat = os.stat(credentials_or_file)
+            except OSError as issue:
+                raise CgyleCredentialsError(
+                    f'Failed reading credentials from '
+                    f'{credentials_or_file}: {issue}'
+                )
+            with Credentials.lock:
+                cached = Credentials.files.get(credentials_or_file)
+                if cached and cached[:2] == (stat.st_mtime, stat.st_size):
+                    return list(cached[2])
+                credentials = Credentials.get_from_file(credentials_or_file)
+                Credentials.files[credentials_or_file] = (
+                    stat.st_mtime, stat.st_size, credentials
+                )
+                return list(credentials)
         return Credentials.get_credentials(credentials_or_file)
 
     @staticmethod
@@ -42,6 +87,49 @@ class Credentials:
             )
         return [username, password]
 
+    @staticmethod
+    def get_from_command(source: str) -> List[str]:
+        """
+        Read credentials from the given exec:<user>:<command> source.
+        The command is expected to print the password to stdout,
+        e.g. exec:AWS:aws ecr get-login-password
+        """
+        try:
+            username, command = source.split(':', 2)[1:]
+        except ValueError:
+            raise CgyleCredentialsError(
+                f'Invalid credentials source, expected '
+                f'exec:<user>:<command>, got {source}'
+            )
+        with Credentials.lock:
+            cached = Credentials.commands.get(source)
+            if cached and cached[0] > time.time():
+                return list(cached[1])
+            try:
+                process = subprocess.Popen(
+                    shlex.split(command),
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE
+                )
+                output, error = process.communicate()
+            except Exception as issue:
+                raise CgyleCredentialsError(
+                    f'Failed to run credentials command {command}: {issue}'
+                )
+            password = output.decode().strip() if output else ''
+            if process.returncode != 0 or not password:
+                raise CgyleCredentialsError(
+                    'Failed to read credentials from {}: {}'.format(
+                        command, error.decode().strip() if error else ''
+                    )
+                )
+            if cached:
+                logging.info(f'Refreshed credentials from {command}')
+            credentials = [username, password]
+            Credentials.commands[source] = (
+                time.time() + Credentials.ttl, credentials
+            )
+            return list(credentials)
+
     @staticmethod
     def get_from_file(filename: str) -> List[str]:
         """
@@ -62,3 +150,96 @@ class Credentials:
             raise CgyleCredentialsError(
                 f'Failed reading credentials from {filename}: {issue}'
             )
+
+
+class TokenCache:
+    """
+    Registry bearer tokens shared by all workers of a cgyle
+    process. Tokens are cached per registry, user and scope
+    until they expire
+    """
+    lock = threading.Lock()
+    tokens: Dict[Tuple[str, str, str], Tuple[float, str]] = {}
+
+    # tokens are considered expired this number of seconds
+    # before their real expiration to account for request time
+    expiry_margin = 10
+
+    @staticmethod
+    def get(registry: str, username: str, scope: str) -> Optional[str]:
+        with TokenCache.lock:
+            cached = TokenCache.tokens.get((registry, username, scope))
+            if cached and cached[0] > time.time():
+                return cached[1]
+            return None
+
+    @staticmethod
+    def set(
+        registry: str, username: str, scope: str, token: str,
+        expires_in: int = 60
+    ) -> None:
+        with TokenCache.lock:
+            TokenCache.tokens[(registry, username, scope)] = (
+                time.time() + expires_in - TokenCache.expiry_margin, token
+            )
+
+    @staticmethod
+    def invalidate(registry: str) -> None:
+        with TokenCache.lock:
+            for key in list(TokenCache.tokens):
+                if key[0] == registry:
+                    del TokenCache.tokens[key]
+
+
+class AuthFile:
+    """
+    Shared containers-auth.json file for skopeo and podman
+
+    Instead of passing credentials on the command line, all
+    calls reference one auth file which holds the credentials
+    of all registries used in a cgyle process. The file lives
+    in a private temporary directory removed at exit
+    """
+    lock = threading.Lock()
+    auths: Dict[str, str] = {}
+    path = ''
+
+    @staticmethod
+    def add(server: str, username: str, password: str) -> str:
+        """
+        Register credentials for the registry host of server and
+        return the auth file path. Returns an empty string if no
+        credentials were given
+        """
+        if not username or not password:
+            return ''
+        registry = AuthFile.get_registry(server)
+        auth = base64.b64encode(f'{username}:{password}'.encode()).decode()
+        with AuthFile.lock:
+            if not AuthFile.path:
+                auth_dir = mkdtemp(prefix='cgyle_auth.')
+                atexit.register(shutil.rmtree, auth_dir, True)
+                AuthFile.path = os.sep.join([auth_dir, 'auth.json'])
+            if AuthFile.auths.get(registry) != auth or \
+               not os.path.exists(AuthFile.path):
+                AuthFile.auths[registry] = auth
+                auth_dir = os.path.dirname(AuthFile.path)
+                with NamedTemporaryFile(
+                    'w', dir=auth_dir, prefix='.auth.', delete=False
+                ) as auth_file:
+                    json.dump(
+                        {
+                            'auths': {
+                                name: {'auth': value}
+                                for name, value in AuthFile.auths.items()
+                            }
+                        }, auth_file
+                    )
+                os.replace(auth_file.name, AuthFile.path)
+            return AuthFile.path
+
+    @staticmethod
+    def get_registry(server: str) -> str:
+        return server.replace('http://', '').replace(
+            'https://', ''
+        ).split('/')[0]
@@ -0,0 +1,101 @@
+# Copyright (c) 2024 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of cgyle.
+#
+# cgyle is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cgyle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cgyle.  If not, see <http://www.gnu.org/licenses/>
+#
+import logging
+import concurrent.futures
+from typing import (
+    List, Dict, Set, Tuple
+)
+
+from cgyle.registry import Registry
+from cgyle.verify import Verifier
+from cgyle.metrics import Metrics
+from cgyle.exceptions import CgyleError
+
+
+class Delta:
+    """
+    Tags already stored in a local distribution cache
+
+    A pull-through proxy answers tag lists and manifest requests
+    from the upstream registry, also for content it never cached.
+    Therefore the stored tags and their manifest digests are read
+    from the storage tree of the local distribution cache. A tag
+    is new if the cache does not hold it or if its stored manifest
+    digest differs from the one at the upstream registry. The
+    upstream digests are resolved concurrently. This does not
+    depend on the tag logs of former runs
+    """
+    def __init__(
+        self, data_dir: str, upstream: Registry, max_requests: int = 10
+    ) -> None:
+        self.data_dir = data_dir
+        self.upstream = upstream
+        self.max_requests = max_requests
+        self.tags: Dict[str, Set[str]] = {}
+
+    @Metrics.timed('cgyle_phase_duration_seconds', phase='delta')
+    def read(self, containers: List[str]) -> None:
+        """
+        Read the tags of the given containers stored in the cache
+        and up to date with the upstream registry
+        """
+        selected = set(containers)
+        stored = [
+            (unit, digest) for unit, digest in sorted(
+                Verifier.get_distribution_tags(self.data_dir).items()
+            ) if unit[0] in selected
+        ]
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_requests
+        ) as thread_executor:
+            for ((container, tag), digest), current in zip(
+                stored, thread_executor.map(self._is_current, stored)
+            ):
+                tags = self.tags.setdefault(container, set())
+                if current:
+                    tags.add(tag)
+        logging.info(
+            'Cache {} holds {} of {} containers with {} of {} tags '
+            'up to date'.format(
+                self.data_dir, len(self.tags), len(containers),
+                sum(len(tags) for tags in self.tags.values()), len(stored)
+            )
+        )
+
+    def get_new_tags(self, container: str, tags: List[str]) -> List[str]:
+        """
+        Return the tags of container missing in the cache or
+        differing from the upstream registry
+        """
+        current = self.tags.get(container, set())
+        return [tag for tag in tags if tag not in current]
+
+    def _is_current(self, stored: Tuple[Tuple[str, str], str]) -> bool:
+        """
+        Check if the stored manifest digest of the tag matches
+        the one at the upstream registry
+        """
+        (container, tag), digest = stored
+        try:
+            return bool(digest) and \
+                digest == self.upstream.get_manifest_digest(container, tag)
+        except CgyleError as issue:
+            logging.warning(
+                f'Failed to compare digests of {container}:{tag}: {issue}'
+            )
+            return False
@@ -74,3 +74,73 @@ class CgyleThreadError(CgyleError):
     """
     A thread raised an exception
     """
+
+
+class CgyleOCILayoutError(CgyleError):
+    """
+    Exception raised if the OCI image layout cannot be processed
+    """
+
+
+class CgyleStateError(CgyleError):
+    """
+    Exception raised if the state database cannot be processed
+    """
+
+
+class CgylePlanError(CgyleError):
+    """
+    Exception raised if a plan cannot be read or written
+    """
+
+
+class CgyleShardError(CgyleError):
+    """
+    Exception raised if a shard specification is invalid or
+    the shared claim directory cannot be used
+    """
+
+
+class CgyleMetricsError(CgyleError):
+    """
+    Exception raised if metrics cannot be written or served
+    """
+
+
+class CgyleReportError(CgyleError):
+    """
+    Exception raised if the transfer report cannot be written
+    """
+
+
+class CgyleProfileError(CgyleError):
+    """
+    Exception raised if profiling cannot be started or its
+    results cannot be written
+    """
+
+
+class CgyleStatusError(CgyleError):
+    """
+    Exception raised if the run status cannot be written
+    """
+
+
+class CgylePolicyError(CgyleError):
+    """
+    Exception raised if an entry of the policy file is invalid
+    """
+
+
+class CgyleVerifyError(CgyleError):
+    """
+    Exception raised if the stored content cannot be verified
+    or the verification report cannot be written
+    """
+
+
+class CgyleGarbageCollectionError(CgyleError):
+    """
+    Exception raised if stored content cannot be collected or
+    the garbage collection report cannot be written
+    """
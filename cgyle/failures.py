@@ -0,0 +1,115 @@
+# Copyright (c) 2024 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of cgyle.
+#
+# cgyle is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cgyle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cgyle.  If not, see <http://www.gnu.org/licenses/>
+#
+import os
+import gzip
+import json
+import time
+import shutil
+import threading
+from typing import (
+    List, Dict
+)
+
+from cgyle.retry import RetryPolicy
+
+
+class FailureIndex:
+    """
+    Index of the failed transfers of a cgyle run
+
+    Workers record each failed container tag together with the
+    log file holding the details as it happens. At the end of
+    the run the indexed log files are appended as JSON lines to
+    the aggregate log which is rotated and compressed once it
+    grows beyond max_size bytes, keeping backups rotated files
+    """
+    lock = threading.Lock()
+    failures: List[Dict[str, str]] = []
+
+    max_size = 10 * 1024 * 1024
+    backups = 5
+
+    @staticmethod
+    def record(
+        container: str, tag: str, arch: str, log_name: str, error: str = ''
+    ) -> None:
+        with FailureIndex.lock:
+            FailureIndex.failures.append(
+                {
+                    'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                    'container': container,
+                    'tag': tag,
+                    'arch': arch,
+                    'error': RetryPolicy.classify(error) or 'unknown',
+                    'log': log_name
+                }
+            )
+
+    @staticmethod
+    def get() -> List[Dict[str, str]]:
+        with FailureIndex.lock:
+            return list(FailureIndex.failures)
+
+    @staticmethod
+    def reset() -> None:
+        with FailureIndex.lock:
+            FailureIndex.failures = []
+
+    @staticmethod
+    def write(log_file_name: str) -> int:
+        """
+        Append the recorded failures with the content of their
+        log files to log_file_name and return the number of
+        written entries
+        """
+        failures = FailureIndex.get()
+        if not failures:
+            return 0
+        FailureIndex.rotate(log_file_name)
+        log_data: Dict[str, str] = {}
+        with open(log_file_name, 'a') as collect_fd:
+            for failure in failures:
+                log_name = failure['log']
+                if log_name not in log_data:
+                    try:
+                        with open(log_name, errors='replace') as log_fd:
+                            log_data[log_name] = log_fd.read()
+                    except OSError:
+                        log_data[log_name] = ''
+                entry = dict(failure)
+                entry['output'] = log_data[log_name] or 'no log data'
+                collect_fd.write(json.dumps(entry) + os.linesep)
+        return len(failures)
+
+    @staticmethod
+    def rotate(log_file_name: str) -> None:
+        """
+        Rotate log_file_name to log_file_name.1.gz if it is
+        larger than max_size
+        """
+        if not os.path.exists(log_file_name) or \
+           os.path.getsize(log_file_name) < FailureIndex.max_size:
+            return
+        for index in range(FailureIndex.backups - 1, 0, -1):
+            backup = f'{log_file_name}.{index}.gz'
+            if os.path.exists(backup):
+                os.replace(backup, f'{log_file_name}.{index + 1}.gz')
+        with open(log_file_name, 'rb') as log_fd, \
+             gzip.open(f'{log_file_name}.1.gz', 'wb') as backup_fd:
+            shutil.copyfileobj(log_fd, backup_fd)
+        os.unlink(log_file_name)
@@ -0,0 +1,363 @@
+# Copyright (c) 2024 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of cgyle.
+#
+# cgyle is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cgyle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cgyle.  If not, see <http://www.gnu.org/licenses/>
+#
+import os
+import logging
+import threading
+import subprocess
+import concurrent.futures
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import (
+    List, Dict, Tuple, Optional
+)
+
+from cgyle.credentials import (
+    Credentials, AuthFile
+)
+from cgyle.oci_layout import OCILayout
+from cgyle.push import PushEngine
+from cgyle.retry import RetryPolicy
+from cgyle.exceptions import (
+    CgyleError,
+    CgyleOCILayoutError
+)
+
+
+class Destination:
+    """
+    Target of a fan-out transfer, either an OCI store
+    directory or a registry location to push to
+    """
+    def __init__(
+        self, target: str, push: bool = False, creds: str = '',
+        oci_layout: bool = False, oci_export: bool = False,
+        ecr_alias: str = '', push_engine: Optional[PushEngine] = None
+    ) -> None:
+        self.target = target
+        self.push = push
+        self.creds = creds
+        self.layout = OCILayout(target) if oci_layout and not push else None
+        self.oci_export = oci_export
+        self.ecr_alias = ecr_alias
+        self.push_engine = push_engine
+
+    def create(self) -> None:
+        if not self.push:
+            Path(self.target).mkdir(parents=True, exist_ok=True)
+        if self.layout:
+            self.layout.create()
+
+    def get_archive_name(self, container: str, tag: str, arch: str) -> str:
+        return f'{self.target}/{container}-{tag}-{arch}.oci.tar'
+
+    def get_repository(self, container: str) -> str:
+        if self.ecr_alias:
+            return os.sep.join(
+                [self.target, self.ecr_alias] + list(Path(container).parts[1:])
+            )
+        return f'{self.target}/{container}'
+
+
+class FanOut:
+    """
+    Transfer container tags to multiple destinations from
+    a single upstream pull
+
+    Destinations already holding a tag are skipped, if all of
+    them hold it the tag is not fetched at all. Otherwise each
+    tag is fetched once into a local staging OCI layout.
+    The staging layout shares its blobs between all tags such
+    that blobs are fetched from upstream only once. From the
+    staging layout the tag is copied to all destinations
+    concurrently. Blobs not used by a transfer in progress are
+    evicted oldest first if the staging layout grows beyond
+    max_staging_size bytes, before each fetch and after each
+    transfer. The staging layout therefore exceeds the limit
+    at most by the tags being transferred
+    """
+    def __init__(
+        self, staging_dir: str, destinations: List[Destination],
+        max_staging_size: int
+    ) -> None:
+        self.staging = OCILayout(staging_dir)
+        self.destinations = destinations
+        self.max_staging_size = max_staging_size
+        self.blobs_in_use: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        self.status: Dict[str, Dict[str, int]] = {}
+        for destination in destinations:
+            self.status[destination.target] = {
+                'done': 0, 'skipped': 0, 'failed': 0
+            }
+
+    def create(self) -> None:
+        self.staging.create()
+        for destination in self.destinations:
+            destination.create()
+
+    def transfer(
+        self, call_args: List[str], source: str,
+        container: str, tag: str, arch: str, log_name: str
+    ) -> bool:
+        """
+        Fetch source into staging using the given skopeo copy
+        call_args and copy it from there to all destinations.
+        Returns True if all destinations were successful. On
+        failure the output of all failed steps is written to
+        log_name
+        """
+        ref = OCILayout.get_reference(container, tag, arch)
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(self.destinations)
+        ) as executor:
+            checks = list(
+                executor.map(
+                    lambda destination: self._check(
+                        destination, ref, container, tag, arch
+                    ), self.destinations
+                )
+            )
+        pending: List[Tuple[Destination, List[str]]] = []
+        for destination, (up_to_date, push_blobs) in zip(
+            self.destinations, checks
+        ):
+            if up_to_date:
+                self._set_status(destination, 'skipped')
+            else:
+                pending.append((destination, push_blobs))
+        if not pending:
+            # all destinations hold the tag, nothing to fetch
+            return True
+        blobs, output = self._stage(call_args, source, ref)
+        if not blobs:
+            for destination, push_blobs in pending:
+                self._set_status(destination, 'failed')
+            self._write_log(log_name, [output])
+            return False
+        try:
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=len(pending)
+            ) as executor:
+                results = list(
+                    executor.map(
+                        lambda item: self._transfer_to(
+                            item[0], ref, container, tag, arch, item[1]
+                        ), pending
+                    )
+                )
+        finally:
+            self.staging.remove_reference(ref)
+            self._release(blobs)
+            self.evict()
+        failed_output: List[str] = []
+        for (destination, push_blobs), (status, destination_output) in zip(
+            pending, results
+        ):
+            self._set_status(destination, status)
+            if status == 'failed':
+                failed_output.append(
+                    f'{destination.target}:{os.linesep}{destination_output}'
+                )
+        if failed_output:
+            self._write_log(log_name, failed_output)
+        return not failed_output
+
+    def get_status(self) -> Dict[str, Dict[str, int]]:
+        with self.lock:
+            return {
+                target: dict(status) for target, status in self.status.items()
+            }
+
+    def evict(self) -> None:
+        """
+        Delete oldest staging blobs not in use until the staging
+        layout is below its size limit
+        """
+        with self.lock:
+            blob_dir = os.sep.join([self.staging.blob_dir, 'sha256'])
+            blobs = []
+            total = 0
+            for entry in os.scandir(blob_dir):
+                stat = entry.stat()
+                total += stat.st_size
+                blobs.append((stat.st_mtime, stat.st_size, entry.path))
+            for mtime, size, path in sorted(blobs):
+                if total <= self.max_staging_size:
+                    break
+                if f'sha256:{os.path.basename(path)}' not in self.blobs_in_use:
+                    os.unlink(path)
+                    total -= size
+
+    def _stage(
+        self, call_args: List[str], source: str, ref: str
+    ) -> Tuple[List[str], str]:
+        """
+        Fetch source into the staging layout and mark its blobs
+        in use. If a blob was evicted concurrently, the fetch is
+        repeated once for the missing blobs. Staging blobs not in
+        use are evicted before each fetch. On failure the staged
+        reference is removed again
+        """
+        output = ''
+        try:
+            for attempt in range(2):
+                self.evict()
+                with TemporaryDirectory(
+                    dir=self.staging.root_dir, prefix='.staging.'
+                ) as staging_dir:
+                    returncode, output = RetryPolicy.run(
+                        source.split('/')[2], lambda: self._run(
+                            call_args + self.staging.get_staging_options() + [
+                                source, f'oci:{staging_dir}:{ref}'
+                            ]
+                        )
+                    )
+                    if returncode != 0:
+                        break
+                    self.staging.add_reference(ref, staging_dir)
+                blobs = self._use(self.staging.get_blob_digests(ref))
+                if blobs and all(
+                    self.staging.has_blob(blob) for blob in blobs
+                ):
+                    return (blobs, output)
+                self._release(blobs)
+            else:
+                output = f'{output}{os.linesep}Staged blobs of {ref} incomplete'
+        except CgyleOCILayoutError as issue:
+            output = format(issue)
+        self.staging.remove_reference(ref)
+        return ([], output)
+
+    def _check(
+        self, destination: Destination, ref: str,
+        container: str, tag: str, arch: str
+    ) -> Tuple[bool, List[str]]:
+        """
+        Check if the destination already holds the tag and return
+        the blobs to push to a push destination
+        """
+        if destination.layout:
+            return (destination.layout.has_reference(ref), [])
+        if destination.push and destination.push_engine:
+            repository = destination.get_repository(container)
+            try:
+                return destination.push_engine.prepare(
+                    container, repository.partition(os.sep)[2], tag, arch
+                )
+            except CgyleError as issue:
+                logging.warning(
+                    f'Push preparation failed for {repository}:{tag}: {issue}'
+                )
+        return (False, [])
+
+    def _transfer_to(
+        self, destination: Destination, ref: str,
+        container: str, tag: str, arch: str, blobs: List[str]
+    ) -> Tuple[str, str]:
+        source = f'oci:{self.staging.root_dir}:{ref}'
+        call_args = [
+            'skopeo', 'copy', '--all', '--dest-oci-accept-uncompressed-layers'
+        ]
+        if destination.layout:
+            with TemporaryDirectory(
+                dir=destination.target, prefix='.staging.'
+            ) as staging_dir:
+                returncode, output = self._run(
+                    call_args + destination.layout.get_staging_options() + [
+                        source, f'oci:{staging_dir}:{ref}'
+                    ]
+                )
+                if returncode != 0:
+                    return ('failed', output)
+                try:
+                    destination.layout.add_reference(ref, staging_dir)
+                    if destination.oci_export:
+                        destination.layout.export(
+                            ref, destination.get_archive_name(
+                                container, tag, arch
+                            ), tag
+                        )
+                except CgyleOCILayoutError as issue:
+                    return ('failed', format(issue))
+            return ('done', output)
+        elif destination.push:
+            repository = destination.get_repository(container)
+            destination_repo = repository.partition(os.sep)[2]
+            auth_file = AuthFile.add(
+                destination.target, *Credentials.read(destination.creds)
+            )
+            if auth_file:
+                call_args += ['--dest-authfile', auth_file]
+            returncode, output = RetryPolicy.run(
+                destination.target.split('/')[0], lambda: self._run(
+                    call_args + [
+                        '--retry-times', RetryPolicy.get_retry_times(),
+                        source,
+                        f'docker://{repository}:{tag}'
+                    ]
+                )
+            )
+            if returncode != 0:
+                return ('failed', output)
+            if destination.push_engine and blobs:
+                destination.push_engine.register_push(destination_repo, blobs)
+            return ('done', output)
+        else:
+            archive_name = destination.get_archive_name(container, tag, arch)
+            Path(os.path.dirname(archive_name)).mkdir(
+                parents=True, exist_ok=True
+            )
+            returncode, output = self._run(
+                call_args + [source, f'oci-archive:{archive_name}:{tag}']
+            )
+            return ('failed' if returncode != 0 else 'done', output)
+
+    def _use(self, blobs: List[str]) -> List[str]:
+        with self.lock:
+            for blob in blobs:
+                self.blobs_in_use[blob] = self.blobs_in_use.get(blob, 0) + 1
+                if self.staging.has_blob(blob):
+                    # refresh blob age for the eviction order
+                    os.utime(self.staging.get_blob_path(blob))
+        return blobs
+
+    def _release(self, blobs: List[str]) -> None:
+        with self.lock:
+            for blob in blobs:
+                self.blobs_in_use[blob] -= 1
+                if not self.blobs_in_use[blob]:
+                    del self.blobs_in_use[blob]
+
+    def _set_status(self, destination: Destination, status: str) -> None:
+        with self.lock:
+            self.status[destination.target][status] += 1
+
+    def _run(self, call_args: List[str]) -> Tuple[int, str]:
+        try:
+            skopeo = subprocess.Popen(
+                call_args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+            )
+            output, error = skopeo.communicate()
+        except Exception as issue:
+            return (1, format(issue))
+        return (skopeo.returncode, output.decode() if output else '')
+
+    def _write_log(self, log_name: str, output: List[str]) -> None:
+        Path(os.path.dirname(log_name)).mkdir(parents=True, exist_ok=True)
+        with open(log_name, 'a') as log:
+            log.write(os.linesep.join(output))
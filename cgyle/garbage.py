@@ -0,0 +1,389 @@
+# Copyright (c) 2024 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of cgyle.
+#
+# cgyle is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cgyle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cgyle.  If not, see <http://www.gnu.org/licenses/>
+#
+import os
+import glob
+import json
+import time
+import shutil
+import logging
+import tarfile
+import concurrent.futures
+from typing import (
+    List, Dict, Set, Tuple, Callable, Optional, Any
+)
+
+from cgyle.metrics import Metrics
+from cgyle.verify import Verifier
+from cgyle.selector import TagSelector
+from cgyle.oci_layout import (
+    OCILayout, REF_NAME_ANNOTATION
+)
+from cgyle.atomic import AtomicFile
+from cgyle.exceptions import CgyleGarbageCollectionError
+
+Unit = Tuple[str, str, str]
+
+# select_live(container, tags, get_created) returns the live tags
+SelectLive = Callable[
+    [str, List[str], Callable[[str], Optional[float]]], List[str]
+]
+
+
+class GarbageCollector:
+    """
+    Remove stored content no longer selected by the policy
+
+    select_live returns the tags of a container and arch still
+    selected out of all stored tags, such that retention rules
+    like keep and max_age apply. The creation date of a tag is
+    read from its stored image config if present. Starting from
+    the manifests of the live tags the references of each blob
+    are counted. Tags no longer selected are removed and
+    with them the blobs no live manifest refers to and, in a
+    distribution cache, the revision and layer links no live tag
+    of the repository refers to. Blobs and links written
+    within the grace period are kept as they may belong to a
+    transfer in progress. Without apply nothing is removed and
+    only the reclaimable content is reported
+    """
+    grace = 3600
+
+    def __init__(
+        self, select_live: SelectLive, max_workers: int = 10,
+        apply: bool = False
+    ) -> None:
+        self.select_live = select_live
+        self.max_workers = max_workers
+        self.apply = apply
+
+    @Metrics.timed('cgyle_phase_duration_seconds', phase='gc')
+    def collect_distribution(self, data_dir: str) -> Dict[str, Any]:
+        """
+        Collect the repositories, tags and blobs of a local
+        distribution cache no longer selected
+        """
+        start = time.monotonic()
+        result = GarbageCollector._get_result('distribution', data_dir)
+        blobs = Verifier.get_distribution_blobs(data_dir)
+        references: Dict[str, int] = {}
+        live_containers = set()
+        containers = set()
+        dead_paths: List[str] = []
+        repositories = os.sep.join(
+            [data_dir, 'docker', 'registry', 'v2', 'repositories']
+        )
+        tags = Verifier.get_distribution_tags(data_dir)
+        live = self._get_live(
+            {
+                (container, tag, ''): digest
+                for (container, tag), digest in tags.items()
+            }, blobs
+        )
+        live_digests: Dict[str, Set[str]] = {}
+        for (container, tag), digest in sorted(tags.items()):
+            containers.add(container)
+            if (container, tag, '') in live:
+                live_containers.add(container)
+                live_digests.setdefault(container, set()).update(
+                    self._count(digest, blobs, references)
+                )
+            else:
+                result['tags'].append([container, tag, ''])
+                dead_paths.append(
+                    os.sep.join(
+                        [repositories, container, '_manifests', 'tags', tag]
+                    )
+                )
+        for container in sorted(containers - live_containers):
+            result['repositories'].append(container)
+            dead_paths += [
+                os.sep.join([repositories, container, name])
+                for name in ['_manifests', '_layers', '_uploads']
+            ]
+        for container in sorted(live_containers):
+            dead_paths += self._get_dead_links(
+                os.sep.join([repositories, container]),
+                live_digests[container]
+            )
+        dead_paths += self._get_dead_blobs(
+            blobs, references, result, os.path.dirname
+        )
+        if self.apply:
+            self._remove(dead_paths)
+            for container in result['repositories']:
+                GarbageCollector._remove_empty(
+                    os.sep.join([repositories, container]), repositories
+                )
+        result['seconds'] = round(time.monotonic() - start, 3)
+        return result
+
+    @Metrics.timed('cgyle_phase_duration_seconds', phase='gc')
+    def collect_layout(self, root_dir: str) -> Dict[str, Any]:
+        """
+        Collect the references and blobs of the OCI image layout
+        below root_dir no longer selected
+        """
+        start = time.monotonic()
+        result = GarbageCollector._get_result('oci-layout', root_dir)
+        layout = OCILayout(root_dir)
+        blobs = Verifier.get_layout_blobs(root_dir)
+        references: Dict[str, int] = {}
+        dead_refs: List[str] = []
+        units: Dict[Unit, str] = {}
+        for ref, descriptor in layout.get_references().items():
+            container, tag, arch = ref.rsplit(':', 2)
+            units[(container, tag, arch)] = descriptor.get('digest', '')
+        live = self._get_live(units, blobs)
+        for unit, digest in sorted(units.items()):
+            if unit in live:
+                self._count(digest, blobs, references)
+            else:
+                result['tags'].append(list(unit))
+                dead_refs.append(OCILayout.get_reference(*unit))
+        dead_paths = self._get_dead_blobs(
+            blobs, references, result, lambda path: path
+        )
+        if self.apply:
+            for ref in dead_refs:
+                layout.remove_reference(ref)
+            self._remove(dead_paths)
+        result['seconds'] = round(time.monotonic() - start, 3)
+        return result
+
+    @Metrics.timed('cgyle_phase_duration_seconds', phase='gc')
+    def collect_archives(self, root_dir: str) -> Dict[str, Any]:
+        """
+        Collect the oci-archive tarballs below root_dir no longer
+        selected. Archives whose container tag is unknown are kept
+        """
+        start = time.monotonic()
+        result = GarbageCollector._get_result('oci-archive', root_dir)
+        dead_paths: List[str] = []
+        archives: Dict[str, Unit] = {}
+        for archive_name in sorted(
+            glob.glob(
+                os.sep.join([root_dir, '**', '*.oci.tar']), recursive=True
+            )
+        ):
+            unit = Verifier.get_archive_unit(
+                root_dir, archive_name,
+                GarbageCollector.get_archive_tag(archive_name)
+            )
+            if unit:
+                archives[archive_name] = unit
+            else:
+                logging.warning(f'No container tag found for {archive_name}')
+        # the creation date of archived tags is not read
+        live = self._get_live(
+            {unit: '' for unit in archives.values()}, {}
+        )
+        for archive_name, unit in archives.items():
+            if unit not in live:
+                result['tags'].append(list(unit))
+                result['blobs'] += 1
+                result['bytes'] += os.path.getsize(archive_name)
+                dead_paths.append(archive_name)
+        if self.apply:
+            self._remove(dead_paths)
+        result['seconds'] = round(time.monotonic() - start, 3)
+        return result
+
+    @staticmethod
+    def get_archive_tag(archive_name: str) -> str:
+        """
+        Return the tag an oci-archive tarball was exported with
+        """
+        try:
+            with tarfile.open(archive_name) as archive:
+                index_file = archive.extractfile('index.json')
+                index = json.load(index_file) if index_file else {}
+                for descriptor in index.get('manifests', []):
+                    return descriptor.get('annotations', {}).get(
+                        REF_NAME_ANNOTATION, ''
+                    )
+        except (tarfile.TarError, EOFError, OSError, KeyError, ValueError) as issue:
+            logging.warning(f'Failed to read {archive_name}: {issue}')
+        return ''
+
+    @staticmethod
+    def log(result: Dict[str, Any]) -> None:
+        for container in result['repositories']:
+            logging.info(f'Unused repository: {container}')
+        for container, tag, arch in result['tags']:
+            logging.info(
+                'Unused tag: {}:{}{}'.format(
+                    container, tag, f' arch:{arch}' if arch else ''
+                )
+            )
+        logging.info(
+            'Collected {} {}: repositories:{} tags:{} blobs:{} size:{}MB '
+            'in {:.1f}s'.format(
+                result['kind'], result['root'], len(result['repositories']),
+                len(result['tags']), result['blobs'],
+                result['bytes'] // (1024 * 1024), result['seconds']
+            )
+        )
+
+    @staticmethod
+    def write(results: List[Dict[str, Any]], filename: str) -> None:
+        """
+        Write the garbage collection results as JSON to filename
+        """
+        AtomicFile.write_json(
+            filename, results, '.gc.', CgyleGarbageCollectionError,
+            f'Failed to write garbage collection report {filename}'
+        )
+
+    def _get_live(
+        self, units: Dict[Unit, str], blobs: Dict[str, str]
+    ) -> Set[Unit]:
+        """
+        Return the live units out of the units given with their
+        manifest digest, the tags are selected per container and arch
+        """
+        tags: Dict[Tuple[str, str], List[str]] = {}
+        for container, tag, arch in sorted(units):
+            tags.setdefault((container, arch), []).append(tag)
+        live: Set[Unit] = set()
+        for (container, arch), tag_list in tags.items():
+            for tag in self.select_live(
+                container, tag_list,
+                lambda tag: GarbageCollector.get_created(
+                    units[(container, tag, arch)], blobs
+                )
+            ):
+                live.add((container, tag, arch))
+        return live
+
+    @staticmethod
+    def get_created(digest: str, blobs: Dict[str, str]) -> Optional[float]:
+        """
+        Return the creation time of the stored image of the manifest
+        digest, the first image of an index is used
+        """
+        manifest = Verifier.read_manifest(blobs[digest]) \
+            if digest in blobs else {}
+        if manifest.get('manifests'):
+            child = manifest['manifests'][0].get('digest', '')
+            manifest = Verifier.read_manifest(blobs[child]) \
+                if child in blobs else {}
+        config = manifest.get('config', {}).get('digest', '')
+        if config not in blobs:
+            return None
+        return TagSelector.parse_created(
+            Verifier.read_manifest(blobs[config]).get('created', '')
+        )
+
+    def _count(
+        self, digest: str, blobs: Dict[str, str], references: Dict[str, int]
+    ) -> List[str]:
+        """
+        Count the references of the blobs of the manifest digest
+        and return the digests found
+        """
+        found_digests = Verifier.walk(
+            digest, blobs, set(),
+            lambda digest: Verifier.read_manifest(blobs[digest])
+        )[0]
+        for found in found_digests:
+            references[found] = references.get(found, 0) + 1
+        return found_digests
+
+    @staticmethod
+    def _get_dead_links(repository: str, digests: Set[str]) -> List[str]:
+        """
+        Return the revision and layer link directories of the
+        repository for digests no live tag refers to. Links written
+        within the grace period are kept
+        """
+        dead_paths: List[str] = []
+        oldest = time.time() - GarbageCollector.grace
+        for links in [['_manifests', 'revisions'], ['_layers']]:
+            for path in sorted(
+                glob.glob(os.sep.join([repository, *links, 'sha256', '*']))
+            ):
+                if f'sha256:{os.path.basename(path)}' in digests:
+                    continue
+                link = os.sep.join([path, 'link'])
+                if os.path.exists(link) and os.path.getmtime(link) > oldest:
+                    continue
+                dead_paths.append(path)
+        return dead_paths
+
+    def _get_dead_blobs(
+        self, blobs: Dict[str, str], references: Dict[str, int],
+        result: Dict[str, Any], get_path: Callable[[str], str]
+    ) -> List[str]:
+        """
+        Account the blobs without references outside of the grace
+        period in result and return their paths
+        """
+        dead_paths: List[str] = []
+        oldest = time.time() - GarbageCollector.grace
+        for digest, path in sorted(blobs.items()):
+            if references.get(digest):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if stat.st_mtime > oldest:
+                continue
+            result['blobs'] += 1
+            result['bytes'] += stat.st_size
+            dead_paths.append(get_path(path))
+        return dead_paths
+
+    def _remove(self, paths: List[str]) -> None:
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_workers
+        ) as thread_executor:
+            for path, issue in zip(
+                paths, thread_executor.map(GarbageCollector._remove_path, paths)
+            ):
+                if issue:
+                    raise CgyleGarbageCollectionError(
+                        f'Failed to remove {path}: {issue}'
+                    )
+
+    @staticmethod
+    def _remove_path(path: str) -> str:
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.unlink(path)
+        except OSError as issue:
+            return format(issue)
+        return ''
+
+    @staticmethod
+    def _remove_empty(path: str, top: str) -> None:
+        """
+        Remove path and its parents below top if they are empty
+        """
+        while path != top and os.path.isdir(path) and not os.listdir(path):
+            os.rmdir(path)
+            path = os.path.dirname(path)
+
+    @staticmethod
+    def _get_result(kind: str, root: str) -> Dict[str, Any]:
+        return {
+            'kind': kind, 'root': root, 'seconds': 0.0, 'repositories': [],
+            'tags': [], 'blobs': 0, 'bytes': 0
+        }
@@ -0,0 +1,244 @@
+# Copyright (c) 2024 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of cgyle.
+#
+# cgyle is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cgyle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cgyle.  If not, see <http://www.gnu.org/licenses/>
+#
+import os
+import time
+import logging
+import threading
+import functools
+from contextlib import contextmanager
+from http.server import (
+    BaseHTTPRequestHandler, ThreadingHTTPServer
+)
+from typing import (
+    Dict, Tuple, Callable, Iterator, Type, Any
+)
+
+from cgyle.profiler import Profiler
+from cgyle.atomic import AtomicFile
+from cgyle.exceptions import CgyleMetricsError
+
+# name: (type, help) of all metrics cgyle exports
+METRICS = {
+    'cgyle_run_duration_seconds': (
+        'gauge', 'Duration of the last cache update run'
+    ),
+    'cgyle_run_timestamp_seconds': (
+        'gauge', 'Time the last cache update run finished'
+    ),
+    'cgyle_containers_total': (
+        'counter', 'Containers of the run by state'
+    ),
+    'cgyle_tags_total': (
+        'counter', 'Container tags of the run by state'
+    ),
+    'cgyle_bytes_total': (
+        'counter',
+        'Blob bytes pushed to push-oci targets or deduplicated by '
+        'existing or mounted blobs'
+    ),
+    'cgyle_blobs_total': (
+        'counter', 'Blobs of the copied container tags by state'
+    ),
+    'cgyle_phase_duration_seconds': (
+        'summary', 'Latency of the catalog, filter, delta, discovery, '
+        'verify, gc and transfer phases'
+    ),
+    'cgyle_workers': (
+        'gauge', 'Maximum number of parallel workers'
+    ),
+    'cgyle_workers_busy': (
+        'gauge', 'Number of workers processing a container'
+    ),
+    'cgyle_worker_busy_seconds_total': (
+        'counter', 'Time spent by all workers processing containers'
+    ),
+    'cgyle_worker_utilization_ratio': (
+        'gauge', 'Busy time of the workers relative to the run duration'
+    ),
+    'cgyle_queue_depth': (
+        'gauge', 'Number of containers waiting for a worker'
+    ),
+    'cgyle_disk_free_bytes': (
+        'gauge', 'Free space of the filesystems written by the run '
+        'at the last admission of a transfer'
+    )
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Metrics:
+    """
+    Metrics of a cgyle run shared by all workers
+
+    Values are kept per metric name and label set and are
+    rendered in the Prometheus text exposition format, to be
+    picked up by the node_exporter textfile collector or
+    served on a local /metrics endpoint via MetricsServer
+    """
+    lock = threading.Lock()
+    values: Dict[str, Dict[Labels, float]] = {}
+
+    @staticmethod
+    def inc(name: str, value: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with Metrics.lock:
+            series = Metrics.values.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    @staticmethod
+    def set(name: str, value: float, **labels: str) -> None:
+        with Metrics.lock:
+            Metrics.values.setdefault(name, {})[
+                tuple(sorted(labels.items()))
+            ] = value
+
+    @staticmethod
+    def get(name: str, **labels: str) -> float:
+        with Metrics.lock:
+            return Metrics.values.get(name, {}).get(
+                tuple(sorted(labels.items())), 0
+            )
+
+    @staticmethod
+    def observe(name: str, seconds: float, **labels: str) -> None:
+        Metrics.inc(f'{name}_sum', seconds, **labels)
+        Metrics.inc(f'{name}_count', 1, **labels)
+
+    @staticmethod
+    @contextmanager
+    def timer(name: str, **labels: str) -> Iterator[None]:
+        """
+        Observe the runtime of the block, the block is also
+        recorded as phase span if profiling is active
+        """
+        start = time.monotonic()
+        try:
+            with Profiler.span(labels.get('phase', name), 'phase'):
+                yield
+        finally:
+            Metrics.observe(name, time.monotonic() - start, **labels)
+
+    @staticmethod
+    def timed(name: str, **labels: str) -> Callable:
+        """
+        Decorator observing the runtime of each call of the
+        decorated function
+        """
+        def decorator(function: Callable) -> Callable:
+            @functools.wraps(function)
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                with Metrics.timer(name, **labels):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def reset() -> None:
+        with Metrics.lock:
+            Metrics.values = {}
+
+    @staticmethod
+    def render() -> str:
+        lines = []
+        with Metrics.lock:
+            for name, (metric_type, description) in METRICS.items():
+                series = []
+                for suffix in ['', '_sum', '_count']:
+                    for labels, value in sorted(
+                        Metrics.values.get(f'{name}{suffix}', {}).items()
+                    ):
+                        series.append(
+                            '{}{}{} {}'.format(
+                                name, suffix, Metrics._format_labels(labels),
+                                repr(float(value))
+                            )
+                        )
+                if series:
+                    lines.append(f'# HELP {name} {description}')
+                    lines.append(f'# TYPE {name} {metric_type}')
+                    lines += series
+        return os.linesep.join(lines + [''])
+
+    @staticmethod
+    def write(filename: str) -> None:
+        """
+        Write metrics to filename, the file is replaced atomically
+        as expected by the node_exporter textfile collector
+        """
+        AtomicFile.write(
+            filename, Metrics.render(), '.metrics.', CgyleMetricsError,
+            f'Failed to write metrics to {filename}'
+        )
+
+    @staticmethod
+    def _format_labels(labels: Labels) -> str:
+        if not labels:
+            return ''
+        return '{{{}}}'.format(
+            ','.join(
+                '{}="{}"'.format(
+                    key, value.replace('\\', '\\\\').replace('"', '\\"')
+                ) for key, value in labels
+            )
+        )
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = Metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', format(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logging.debug(f'metrics: {format % args}')
+
+
+class MetricsServer:
+    """
+    Serve the metrics of the running cgyle process on
+    http://address:port/metrics
+    """
+    def __init__(
+        self, port: int, address: str = '127.0.0.1',
+        handler: Type[MetricsHandler] = MetricsHandler
+    ) -> None:
+        try:
+            self.server = ThreadingHTTPServer((address, port), handler)
+        except OSError as issue:
+            raise CgyleMetricsError(
+                f'Failed to serve metrics on {address}:{port}: {issue}'
+            )
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True
+        )
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.server.shutdown()
+        self.server.server_close()
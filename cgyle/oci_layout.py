@@ -0,0 +1,234 @@
+# Copyright (c) 2024 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of cgyle.
+#
+# cgyle is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cgyle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cgyle.  If not, see <http://www.gnu.org/licenses/>
+#
+import os
+import json
+import fcntl
+import threading
+import subprocess
+from pathlib import Path
+from typing import (
+    List, Dict, Optional
+)
+
+from cgyle.atomic import AtomicFile
+from cgyle.exceptions import CgyleOCILayoutError
+
+REF_NAME_ANNOTATION = 'org.opencontainers.image.ref.name'
+
+
+class OCILayout:
+    """
+    Content addressable OCI image layout store
+
+    All containers share one blobs/sha256 directory and one
+    index.json file which holds a reference per container:tag:arch.
+    New content is first copied into a private staging layout which
+    uses the shared blob directory. On success the staged manifest
+    descriptor gets merged into the shared index.json
+    """
+    # index.json is shared between all threads of a cgyle process
+    # and all cgyle processes writing to the same store
+    index_lock = threading.Lock()
+
+    # references of index.json per layout root, read once per run
+    # and updated with each change made by this process. Changes
+    # of other processes are merged when this process writes the
+    # index, until then a reference added by them is missed and
+    # transferred again
+    references: Dict[str, Dict[str, dict]] = {}
+
+    def __init__(self, root_dir: str) -> None:
+        self.root_dir = root_dir
+        self.blob_dir = os.sep.join([root_dir, 'blobs'])
+        self.index_file = os.sep.join([root_dir, 'index.json'])
+
+    def create(self) -> None:
+        """
+        Create the layout structure if not present
+        """
+        Path(self.blob_dir, 'sha256').mkdir(parents=True, exist_ok=True)
+        layout_file = os.sep.join([self.root_dir, 'oci-layout'])
+        if not os.path.exists(layout_file):
+            with open(layout_file, 'w') as layout:
+                json.dump({'imageLayoutVersion': '1.0.0'}, layout)
+        if not os.path.exists(self.index_file):
+            self._write_index({'schemaVersion': 2, 'manifests': []})
+            with OCILayout.index_lock:
+                OCILayout.references.pop(self.root_dir, None)
+
+    @staticmethod
+    def reset() -> None:
+        with OCILayout.index_lock:
+            OCILayout.references = {}
+
+    @staticmethod
+    def get_reference(container: str, tag: str, arch: str) -> str:
+        return f'{container}:{tag}:{arch}'
+
+    def get_blob_path(self, digest: str) -> str:
+        algorithm, encoded = digest.split(':', 1)
+        return os.sep.join([self.blob_dir, algorithm, encoded])
+
+    def has_blob(self, digest: str) -> bool:
+        return os.path.exists(self.get_blob_path(digest))
+
+    def get_references(self) -> Dict[str, dict]:
+        """
+        Return manifest descriptors from index.json by reference name
+        """
+        with OCILayout.index_lock:
+            if self.root_dir not in OCILayout.references:
+                OCILayout.references[self.root_dir] = self._get_references(
+                    self._read_index(self.index_file)
+                )
+            return dict(OCILayout.references[self.root_dir])
+
+    def has_reference(self, ref: str) -> bool:
+        """
+        Check if the reference is registered and its manifest
+        blob exists in the store
+        """
+        descriptor = self.get_references().get(ref)
+        if not descriptor:
+            return False
+        return self.has_blob(descriptor['digest'])
+
+    def get_staging_options(self) -> List[str]:
+        """
+        skopeo copy options to write into a staging layout whose
+        blobs are stored in the shared blob directory. Blobs already
+        present in the shared directory are not fetched again
+        """
+        return [
+            '--dest-shared-blob-dir', self.blob_dir
+        ]
+
+    def add_reference(self, ref: str, staging_dir: str) -> None:
+        """
+        Merge the manifest descriptor of ref from the given staging
+        layout into the shared index.json
+        """
+        staged_descriptor = None
+        for descriptor in self._read_index(
+            os.sep.join([staging_dir, 'index.json'])
+        ).get('manifests', []):
+            if descriptor.get('annotations', {}).get(REF_NAME_ANNOTATION) == ref:
+                staged_descriptor = descriptor
+        if not staged_descriptor:
+            raise CgyleOCILayoutError(
+                f'No reference {ref} found in staging layout {staging_dir}'
+            )
+        self._update_index(ref, staged_descriptor)
+
+    def remove_reference(self, ref: str) -> None:
+        """
+        Remove reference from index.json, blobs are kept
+        """
+        self._update_index(ref)
+
+    def get_blob_digests(self, ref: str) -> List[str]:
+        """
+        Return digests of all manifests, configs and layers
+        referenced by ref
+        """
+        descriptor = self.get_references().get(ref)
+        if not descriptor:
+            return []
+        result: List[str] = []
+        manifests = [descriptor['digest']]
+        while manifests:
+            digest = manifests.pop(0)
+            result.append(digest)
+            manifest = self._read_index(self.get_blob_path(digest))
+            for child in manifest.get('manifests', []):
+                manifests.append(child['digest'])
+            blobs = [manifest['config']] if manifest.get('config') else []
+            for blob in blobs + manifest.get('layers', []):
+                if blob['digest'] not in result:
+                    result.append(blob['digest'])
+        return result
+
+    def export(self, ref: str, archive_name: str, tag: str) -> None:
+        """
+        Export the given reference into an oci-archive tarball
+        """
+        call_args = [
+            'skopeo', 'copy', '--all',
+            f'oci:{self.root_dir}:{ref}',
+            f'oci-archive:{archive_name}:{tag}'
+        ]
+        try:
+            export = subprocess.Popen(
+                call_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            output, error = export.communicate()
+        except Exception as issue:
+            raise CgyleOCILayoutError(
+                f'Failed to export {ref}: {issue}'
+            )
+        if export.returncode != 0:
+            raise CgyleOCILayoutError(
+                f'Failed to export {ref}: {error!r}'
+            )
+
+    def _update_index(
+        self, ref: str, descriptor: Optional[dict] = None
+    ) -> None:
+        """
+        Replace or delete the descriptor of ref in index.json
+        """
+        with OCILayout.index_lock:
+            with open(f'{self.index_file}.lock', 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                index = self._read_index(self.index_file)
+                index['manifests'] = [
+                    entry for entry in index.get('manifests', [])
+                    if entry.get('annotations', {}).get(
+                        REF_NAME_ANNOTATION
+                    ) != ref
+                ] + ([descriptor] if descriptor else [])
+                self._write_index(index)
+                OCILayout.references[self.root_dir] = self._get_references(
+                    index
+                )
+
+    @staticmethod
+    def _get_references(index: dict) -> Dict[str, dict]:
+        result: Dict[str, dict] = {}
+        for descriptor in index.get('manifests', []):
+            ref = descriptor.get('annotations', {}).get(REF_NAME_ANNOTATION)
+            if ref:
+                result[ref] = descriptor
+        return result
+
+    def _read_index(self, index_file: str) -> dict:
+        try:
+            with open(index_file) as index:
+                return json.load(index)
+        except FileNotFoundError:
+            return {}
+        except Exception as issue:
+            raise CgyleOCILayoutError(
+                f'Failed to read {index_file}: {issue}'
+            )
+
+    def _write_index(self, index: dict) -> None:
+        AtomicFile.write_json(
+            self.index_file, index, '.index.', CgyleOCILayoutError,
+            f'Failed to write {self.index_file}', indent=None
+        )
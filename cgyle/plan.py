@@ -0,0 +1,191 @@
+# Copyright (c) 2024 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of cgyle.
+#
+# cgyle is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cgyle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cgyle.  If not, see <http://www.gnu.org/licenses/>
+#
+import json
+import time
+import logging
+import threading
+from typing import (
+    List, Dict, Set, Callable, Optional
+)
+
+from cgyle.registry import Registry
+from cgyle.atomic import AtomicFile
+from cgyle.exceptions import (
+    CgyleError,
+    CgylePlanError
+)
+
+
+class Plan:
+    """
+    Serializable work plan of a cache update
+
+    A plan lists the new tags per container and arch together
+    with their manifest digest, their size and the size of the
+    blobs not yet present at the destination. A plan written
+    by a discovery run can be executed by a later run without
+    discovering the tags again
+    """
+    version = 1
+
+    def __init__(self, proxy: str, from_registry: str) -> None:
+        self.proxy = proxy
+        self.from_registry = from_registry
+        self.units: List[dict] = []
+        self.lock = threading.Lock()
+
+    def add(self, container: str, arch: str, tags: List[dict]) -> None:
+        """
+        Add the tags of container and arch, each tag given as dict
+        with the keys tag, digest, size and new_size
+        """
+        with self.lock:
+            self.units.append(
+                {'container': container, 'arch': arch, 'tags': tags}
+            )
+
+    def merge(self, plan: 'Plan') -> None:
+        """
+        Add the tags of plan which are not yet part of this plan
+        """
+        for unit in plan.units:
+            tags = [
+                tag for tag in unit['tags'] if not self.get_tag(
+                    unit['container'], unit['arch'], tag['tag']
+                )
+            ]
+            if tags:
+                self.add(unit['container'], unit['arch'], tags)
+
+    def get_containers(self) -> List[str]:
+        containers: List[str] = []
+        for unit in self.units:
+            if unit['container'] not in containers:
+                containers.append(unit['container'])
+        return containers
+
+    def get_tags(self, container: str) -> Dict[str, List[str]]:
+        """
+        Return the tag names of container per arch
+        """
+        tags: Dict[str, List[str]] = {}
+        for unit in self.units:
+            if unit['container'] == container:
+                tags.setdefault(unit['arch'], []).extend(
+                    tag['tag'] for tag in unit['tags']
+                )
+        return tags
+
+    def get_tag(self, container: str, arch: str, tag: str) -> Optional[dict]:
+        """
+        Return the digest and sizes of the tag of container and arch
+        """
+        for unit in self.units:
+            if unit['container'] == container and unit['arch'] == arch:
+                for entry in unit['tags']:
+                    if entry['tag'] == tag:
+                        return entry
+        return None
+
+    def get_summary(self) -> Dict[str, int]:
+        tags = [tag for unit in self.units for tag in unit['tags']]
+        return {
+            'containers': len(self.get_containers()),
+            'tags': len(tags),
+            'size': sum(tag['size'] for tag in tags),
+            'new_size': sum(tag['new_size'] for tag in tags)
+        }
+
+    def write(self, filename: str) -> None:
+        plan = {
+            'version': self.version,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'proxy': self.proxy,
+            'from': self.from_registry,
+            'summary': self.get_summary(),
+            'units': sorted(
+                self.units,
+                key=lambda unit: (unit['container'], unit['arch'])
+            )
+        }
+        AtomicFile.write_json(
+            filename, plan, '.plan.', CgylePlanError,
+            f'Failed to write plan {filename}'
+        )
+
+    @staticmethod
+    def read(filename: str) -> 'Plan':
+        try:
+            with open(filename) as plan_file:
+                data = json.load(plan_file)
+            if data.get('version') != Plan.version:
+                raise ValueError(
+                    f'unsupported plan version {data.get("version")}'
+                )
+            plan = Plan(data['proxy'], data['from'])
+            for unit in data['units']:
+                plan.add(unit['container'], unit['arch'], unit['tags'])
+        except (OSError, ValueError, KeyError, TypeError) as issue:
+            raise CgylePlanError(
+                f'Failed to read plan {filename}: {issue}'
+            )
+        return plan
+
+
+class Planner:
+    """
+    Resolve digest and sizes of container tags for a Plan
+
+    Sizes are summed up from the config and layer descriptors
+    of the image manifests. A blob counts into the new size of
+    a tag if blob_exists does not know it and it was not already
+    counted for another tag of the plan
+    """
+    def __init__(
+        self, registry: Registry,
+        blob_exists: Optional[Callable[[str, str], bool]] = None
+    ) -> None:
+        self.registry = registry
+        self.blob_exists = blob_exists
+        self.counted_blobs: Set[str] = set()
+        self.lock = threading.Lock()
+
+    def resolve(self, container: str, tag: str, arch: str) -> dict:
+        try:
+            digest, manifests = self.registry.resolve(container, tag, arch)
+        except CgyleError as issue:
+            logging.warning(
+                f'Failed to resolve {container}:{tag} arch:{arch}: {issue}'
+            )
+            digest, manifests = ('', [])
+        size = 0
+        new_size = 0
+        for manifest in manifests:
+            for blob in Registry.get_blobs(manifest):
+                size += blob.get('size', 0)
+                with self.lock:
+                    counted = blob['digest'] in self.counted_blobs
+                    self.counted_blobs.add(blob['digest'])
+                if counted:
+                    continue
+                if not self.blob_exists or \
+                   not self.blob_exists(container, blob['digest']):
+                    new_size += blob.get('size', 0)
+        return {
+            'tag': tag, 'digest': digest, 'size': size, 'new_size': new_size
+        }
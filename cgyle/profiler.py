@@ -0,0 +1,270 @@
+# Copyright (c) 2024 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of cgyle.
+#
+# cgyle is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cgyle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cgyle.  If not, see <http://www.gnu.org/licenses/>
+#
+import os
+import json
+import time
+import pstats
+import cProfile
+import logging
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from typing import (
+    List, Dict, Optional, Iterator, Any
+)
+
+from cgyle.exceptions import CgyleProfileError
+
+
+class Profiler:
+    """
+    Wall and CPU time profile of a cgyle run
+
+    Phases and units of work are recorded as spans with their
+    wall time and the CPU time of the thread running them. The
+    spans are written as Chrome trace timeline, to be opened in
+    chrome://tracing or https://ui.perfetto.dev, and summed up per
+    phase and per worker thread. Optionally the Python side is
+    profiled with cProfile or tracemalloc. Spans are only recorded
+    between start and stop, otherwise span does nothing
+    """
+    lock = threading.Lock()
+    enabled = False
+    python = ''
+    start_time = 0.0
+    events: List[Dict[str, Any]] = []
+    threads: Dict[int, str] = {}
+    profiles: List[cProfile.Profile] = []
+
+    tools = ['cprofile', 'tracemalloc']
+
+    # number of entries in the slowest units list
+    top = 10
+
+    # number of allocation sites in the tracemalloc statistics
+    top_allocations = 50
+
+    @staticmethod
+    def start(python: str = '') -> None:
+        """
+        Start profiling, python selects an additional profiler
+        for the Python side from Profiler.tools
+        """
+        if python and python not in Profiler.tools:
+            raise CgyleProfileError(
+                'Unknown Python profiler {}, use one of {}'.format(
+                    python, ', '.join(Profiler.tools)
+                )
+            )
+        with Profiler.lock:
+            Profiler.events = []
+            Profiler.threads = {}
+            Profiler.profiles = []
+            Profiler.python = python
+            Profiler.start_time = time.perf_counter()
+            Profiler.enabled = True
+        if python == 'tracemalloc':
+            tracemalloc.start()
+        elif python == 'cprofile':
+            Profiler._enable_python_profile()
+
+    @staticmethod
+    @contextmanager
+    def span(name: str, category: str, **args: Any) -> Iterator[None]:
+        """
+        Record the wall and CPU time of the block as span of the
+        given category. Each span of the unit category is profiled
+        by its own cProfile instance if requested, as cProfile only
+        profiles the thread it was enabled in
+        """
+        if not Profiler.enabled:
+            yield
+            return
+        python_profile = None
+        if category == 'unit' and Profiler.python == 'cprofile':
+            python_profile = Profiler._enable_python_profile()
+        start = time.perf_counter()
+        start_cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            cpu = time.thread_time() - start_cpu
+            if python_profile:
+                python_profile.disable()
+            thread = threading.current_thread()
+            with Profiler.lock:
+                Profiler.threads[thread.ident or 0] = thread.name
+                Profiler.events.append(
+                    {
+                        'name': name,
+                        'cat': category,
+                        'ph': 'X',
+                        'ts': round((start - Profiler.start_time) * 1e6),
+                        'dur': round((end - start) * 1e6),
+                        'pid': os.getpid(),
+                        'tid': thread.ident or 0,
+                        'args': dict(args, cpu=round(cpu, 6))
+                    }
+                )
+
+    @staticmethod
+    def get_summary() -> Dict[str, Any]:
+        """
+        Sum up wall and CPU time in seconds per phase and per
+        worker thread. The idle time of a worker is the part of
+        the run it did not process a unit
+        """
+        with Profiler.lock:
+            events = list(Profiler.events)
+            threads = dict(Profiler.threads)
+        wall = time.perf_counter() - Profiler.start_time
+        phases: Dict[str, Dict[str, float]] = {}
+        workers: Dict[str, Dict[str, float]] = {}
+        for event in events:
+            if event['cat'] == 'phase':
+                totals = phases.setdefault(
+                    event['name'], {'count': 0, 'wall': 0.0, 'cpu': 0.0}
+                )
+            elif event['cat'] == 'unit':
+                totals = workers.setdefault(
+                    threads[event['tid']],
+                    {'count': 0, 'wall': 0.0, 'cpu': 0.0}
+                )
+            else:
+                continue
+            totals['count'] += 1
+            totals['wall'] += event['dur'] / 1e6
+            totals['cpu'] += event['args']['cpu']
+        for totals in workers.values():
+            totals['idle'] = max(wall - totals['wall'], 0.0)
+        process = os.times()
+        return {
+            'wall': round(wall, 6),
+            'cpu': {
+                'user': process.user,
+                'system': process.system,
+                'children_user': process.children_user,
+                'children_system': process.children_system
+            },
+            'phases': Profiler._round(phases),
+            'workers': Profiler._round(workers),
+            'slowest_units': [
+                {
+                    'name': event['name'],
+                    'worker': threads[event['tid']],
+                    'wall': event['dur'] / 1e6,
+                    'cpu': event['args']['cpu']
+                } for event in sorted(
+                    [event for event in events if event['cat'] == 'unit'],
+                    key=lambda event: event['dur'], reverse=True
+                )[:Profiler.top]
+            ]
+        }
+
+    @staticmethod
+    def stop(directory: str) -> Dict[str, Any]:
+        """
+        Stop profiling and write the results into directory:
+
+        * trace.json: Chrome trace timeline of all spans
+        * summary.json: totals per phase and worker
+        * python.pstats: merged cProfile statistics if requested
+        * tracemalloc.txt: top allocation sites if requested
+
+        Returns the summary
+        """
+        summary = Profiler.get_summary()
+        with Profiler.lock:
+            Profiler.enabled = False
+            profiles = list(Profiler.profiles)
+            trace = {
+                'traceEvents': [
+                    {
+                        'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(),
+                        'tid': tid, 'args': {'name': name}
+                    } for tid, name in sorted(Profiler.threads.items())
+                ] + Profiler.events,
+                'displayTimeUnit': 'ms'
+            }
+        snapshot = None
+        if Profiler.python == 'tracemalloc':
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+        for python_profile in profiles:
+            python_profile.disable()
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(os.sep.join([directory, 'trace.json']), 'w') as out:
+                json.dump(trace, out)
+            with open(os.sep.join([directory, 'summary.json']), 'w') as out:
+                json.dump(summary, out, indent=2)
+            if profiles:
+                pstats.Stats(*profiles).dump_stats(
+                    os.sep.join([directory, 'python.pstats'])
+                )
+            if snapshot:
+                with open(
+                    os.sep.join([directory, 'tracemalloc.txt']), 'w'
+                ) as out:
+                    for statistic in snapshot.statistics('lineno')[
+                        :Profiler.top_allocations
+                    ]:
+                        out.write(f'{statistic}{os.linesep}')
+        except OSError as issue:
+            raise CgyleProfileError(
+                f'Failed to write profile to {directory}: {issue}'
+            )
+        return summary
+
+    @staticmethod
+    def log(summary: Dict[str, Any]) -> None:
+        for name, totals in summary['phases'].items():
+            logging.info(
+                'Profile phase {}: count:{} wall:{}s cpu:{}s'.format(
+                    name, totals['count'], totals['wall'], totals['cpu']
+                )
+            )
+        for name, totals in summary['workers'].items():
+            logging.info(
+                'Profile worker {}: units:{} busy:{}s idle:{}s cpu:{}s'.format(
+                    name, totals['count'], totals['wall'],
+                    totals['idle'], totals['cpu']
+                )
+            )
+
+    @staticmethod
+    def _enable_python_profile() -> Optional[cProfile.Profile]:
+        python_profile = cProfile.Profile()
+        try:
+            python_profile.enable()
+        except ValueError:
+            # another profiler is already active in this thread
+            return None
+        with Profiler.lock:
+            Profiler.profiles.append(python_profile)
+        return python_profile
+
+    @staticmethod
+    def _round(
+        totals: Dict[str, Dict[str, float]]
+    ) -> Dict[str, Dict[str, float]]:
+        return {
+            name: {key: round(value, 6) for key, value in values.items()}
+            for name, values in totals.items()
+        }
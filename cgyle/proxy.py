@@ -16,21 +16,123 @@
 # along with cgyle.  If not, see <http://www.gnu.org/licenses/>
 #
 import os
+import re
 import yaml
 import json
 import time
 import psutil
 from pathlib import Path
 from textwrap import dedent
-from tempfile import NamedTemporaryFile
+from tempfile import (
+    NamedTemporaryFile, TemporaryDirectory
+)
 import logging
 import subprocess
-from cgyle.credentials import Credentials
+from collections import deque
+from contextlib import (
+    ExitStack, suppress
+)
+from cgyle.credentials import (
+    Credentials, AuthFile
+)
 from cgyle.catalog import Catalog
-from cgyle.exceptions import CgyleCommandError
+from cgyle.oci_layout import OCILayout
+from cgyle.push import PushEngine
+from cgyle.fanout import FanOut
+from cgyle.retry import RetryPolicy
+from cgyle.state import StateStore
+from cgyle.failures import FailureIndex
+from cgyle.metrics import Metrics
+from cgyle.status import Status
+from cgyle.selector import TagSelector
+from cgyle.delta import Delta
+from cgyle.admission import Admission
+from cgyle.report import (
+    TransferStats, TransferReport
+)
+from cgyle.shard import (
+    Shard, Coordinator
+)
+from cgyle.exceptions import (
+    CgyleError,
+    CgyleCommandError,
+    CgyleOCILayoutError
+)
 from json import JSONDecodeError
 from subprocess import SubprocessError
-from typing import List
+from typing import (
+    List, Dict, Optional, Tuple, Union, Iterable, Deque
+)
+
+
+class UpdateOptions:
+    """
+    Settings of a cache update run shared by all containers
+
+    With store_oci and oci_layout set, all containers are stored
+    into one OCI image layout below store_oci which shares the
+    blobs between all containers. With oci_export set, an
+    oci-archive tarball is exported from the layout in addition.
+
+    With push_oci and a push_engine, the destination is checked
+    for the tag and its blobs prior pushing. Tags already up to
+    date are skipped and missing blobs known in other repositories
+    of the destination registry are mounted from there.
+
+    With a fanout, each tag is fetched once and copied to all
+    destinations of the fanout. store_oci and push_oci are not
+    used in this case
+
+    With sync set, all new tags of the container are transferred
+    by one skopeo sync call instead of one skopeo copy call per
+    tag. This applies to pushes via push_oci and to cache updates
+    without store_oci. Storing into store_oci and the fanout
+    always use one skopeo copy call per tag
+
+    With a state store, the result of each transfer is recorded
+    and tags in quarantine after repeated failures are skipped
+
+    With a shard, only the work units owned by the shard are
+    processed. Depending on the shard a work unit is either the
+    container or a container tag of an arch
+
+    With a delta only the tags not yet stored in the cache
+    are transferred, see Delta
+    """
+    def __init__(
+        self, from_registry: str, tls_verify: bool = True,
+        store_oci: str = '', push_oci: str = '', push_oci_creds: str = '',
+        proxy_creds: str = '', use_archs: List[str] = [],
+        remove_signatures: bool = False,
+        with_attestation: bool = False,
+        ecr_alias: str = '',
+        oci_layout: bool = False,
+        oci_export: bool = False,
+        push_engine: Optional[PushEngine] = None,
+        fanout: Optional[FanOut] = None,
+        sync: bool = False,
+        state: Optional[StateStore] = None,
+        shard: Optional[Union[Shard, Coordinator]] = None,
+        delta: Optional[Delta] = None
+    ) -> None:
+        self.from_registry = from_registry
+        self.tls_verify = tls_verify
+        self.store_oci = store_oci
+        self.push_oci = push_oci
+        self.push_oci_creds = push_oci_creds
+        self.proxy_creds = proxy_creds
+        self.use_archs = use_archs
+        self.remove_signatures = remove_signatures
+        self.with_attestation = with_attestation
+        self.ecr_alias = ecr_alias
+        self.oci_layout = oci_layout
+        self.oci_export = oci_export
+        self.push_engine = push_engine
+        self.fanout = fanout
+        self.sync = sync
+        self.state = state
+        self.shard = shard
+        self.delta = delta
 
 
 class DistributionProxy:
@@ -38,6 +140,12 @@ class DistributionProxy:
     Access methods for the distribution registry
     configured as proxy
     """
+    # number of output lines of a transfer kept in memory
+    # and written to its log file if the transfer failed
+    max_log_lines = 1000
+    # number of tags transferred by one skopeo sync call
+    max_sync_tags = 10
+
     def __init__(self, server: str, container: str = '') -> None:
         self.log_path = DistributionProxy.get_log_path()
         self.server = server.replace('http://', '')
@@ -45,6 +153,8 @@ class DistributionProxy:
         self.container = container
         self.registry_name = ''
         self.shutdown = False
+        self.skipped = False
+        self.failed_tags = 0
         self.pid = 0
 
     def __enter__(self):
@@ -54,12 +164,25 @@ class DistributionProxy:
     def get_log_path():
         return '/var/log/cgyle'
 
+    @staticmethod
+    def get_tmp_dir() -> str:
+        """
+        Return the directory skopeo keeps temporary image data in
+        """
+        return os.environ.get('TMPDIR') or '/var/tmp'
+
     def get_tags(
         self, tls_verify: bool = True, proxy_creds: str = '',
         arch: str = '', tag_log_name: str = '',
-        with_attestation: bool = False
+        with_attestation: bool = False,
+        tag_selector: Optional[TagSelector] = None
     ) -> List[str]:
+        """
+        Return the tags of the container newest first, with a
+        tag_selector only the tags selected by the policy are returned
+        """
         username, password = Credentials.read(proxy_creds)
+        auth_file = AuthFile.add(self.server, username, password)
         call_args = [
             'skopeo'
         ]
@@ -69,8 +192,8 @@ class DistributionProxy:
                 '--override-arch', arch
             ]
         call_args.append('inspect')
-        if username and password:
-            call_args += ['--creds', f'{username}:{password}']
+        if auth_file:
+            call_args += ['--authfile', auth_file]
         call_args += [
             f'--tls-verify={format(tls_verify).lower()}',
             f'docker://{self.server}/{self.container}'
@@ -87,8 +210,8 @@ class DistributionProxy:
                     '--no-trunc', '--format', '{{.Tag}}',
                     f'{self.server}/{self.container}'
                 ]
-                if username and password:
-                    call_args += ['--creds', f'{username}:{password}']
+                if auth_file:
+                    call_args += ['--authfile', auth_file]
                 output, error, returncode = self._call_skopeo(
                     call_args
                 )
@@ -118,6 +241,16 @@ class DistributionProxy:
                 result_tag_list.append(tag)
             elif not tag.endswith('.sig') and not tag.endswith('.att'):
                 result_tag_list.append(tag)
+        # process the newest tags first such that an interrupted
+        # run has fetched the tags most likely in use
+        if tag_selector:
+            result_tag_list = tag_selector.select(
+                result_tag_list, lambda tag: self.get_created(
+                    tag, tls_verify, auth_file, arch
+                )
+            )
+        else:
+            result_tag_list = TagSelector.order_newest(result_tag_list)
         if tag_log_name:
             with open(tag_log_name, 'w') as taglog:
                 for tag in result_tag_list:
@@ -125,133 +258,297 @@ class DistributionProxy:
                         taglog.write(f'{tag}{os.linesep}')
         return result_tag_list
 
+    def get_created(
+        self, tag: str, tls_verify: bool = True, auth_file: str = '',
+        arch: str = ''
+    ) -> Optional[float]:
+        """
+        Return the creation time of the container tag in seconds
+        since the epoch, None if it cannot be inspected
+        """
+        call_args = ['skopeo']
+        if arch:
+            call_args += ['--override-arch', arch]
+        call_args.append('inspect')
+        if auth_file:
+            call_args += ['--authfile', auth_file]
+        call_args += [
+            f'--tls-verify={format(tls_verify).lower()}',
+            f'docker://{self.server}/{self.container}:{tag}'
+        ]
+        try:
+            output, error, returncode = self._call_skopeo(call_args)
+            if returncode == 0:
+                return TagSelector.parse_created(
+                    json.loads(output).get('Created', '')
+                )
+            logging.warning(
+                'Failed to inspect {}:{}: {}'.format(
+                    self.container, tag, error.decode().strip()
+                )
+            )
+        except (SubprocessError, JSONDecodeError) as issue:
+            logging.warning(
+                f'Failed to inspect {self.container}:{tag}: {issue}'
+            )
+        return None
+
+    def drop_tags(self, store_oci: str, arch: str, tags: List[str]) -> None:
+        """
+        Remove tags from the tag log such that the next run
+        transfers them again
+        """
+        tag_log_name = self.get_tag_log_name(store_oci, arch)
+        for tagname in tags:
+            self._drop_tag(tag_log_name, tagname)
+
+    def get_tag_log_name(self, store_oci: str, arch: str) -> str:
+        return '{}/{}-{}.tags'.format(
+            store_oci or self.log_path, self.container, arch
+        )
+
+    @Metrics.timed('cgyle_phase_duration_seconds', phase='discovery')
+    def get_new_tags(
+        self, from_registry: str, store_oci: str, arch: str,
+        tls_verify: bool = True, proxy_creds: str = '',
+        with_attestation: bool = False, update_tag_log: bool = True,
+        tag_selector: Optional[TagSelector] = None,
+        delta: Optional[Delta] = None
+    ) -> Tuple[str, List[str]]:
+        """
+        Return the tag log name and the tags of the container in
+        from_registry not yet handled by a previous run. With
+        update_tag_log the tag log is rewritten with the current
+        list of tags. With a tag_selector only the tags selected
+        by the policy are taken into account. With a delta the
+        tags not yet stored in the cache are returned instead
+        of the tags missing in the tag log
+        """
+        tag_log_name = self.get_tag_log_name(store_oci, arch)
+        prior_tag_list = []
+        if os.path.exists(tag_log_name):
+            with open(tag_log_name) as taglog:
+                prior_tag_list = [tag.rstrip() for tag in taglog]
+        if update_tag_log:
+            Path(os.path.dirname(tag_log_name)).mkdir(
+                parents=True, exist_ok=True
+            )
+        tag_list = DistributionProxy(
+            from_registry, self.container
+        ).get_tags(
+            tls_verify, proxy_creds, arch,
+            tag_log_name if update_tag_log else '', with_attestation,
+            tag_selector
+        )
+        if delta:
+            return (tag_log_name, delta.get_new_tags(self.container, tag_list))
+        return (
+            tag_log_name,
+            [tag for tag in tag_list if tag not in prior_tag_list]
+        )
+
     def update_cache(
-        self, from_registry: str, tls_verify: bool = True,
-        store_oci: str = '', push_oci: str = '', push_oci_creds: str = '',
-        proxy_creds: str = '', use_archs: List[str] = [],
-        remove_signatures: bool = False,
-        with_attestation: bool = False,
-        ecr_alias: str = ''
+        self, options: UpdateOptions,
+        plan_tags: Optional[Dict[str, List[str]]] = None,
+        tag_selector: Optional[TagSelector] = None
     ) -> None:
         """
-        Trigger a cache update of the container
+        Trigger a cache update of the container with the settings
+        of the run given in options, see UpdateOptions
+
+        With plan_tags, the tags per arch are taken from a plan
+        instead of being discovered from the from_registry
+
+        With a tag_selector only the tags selected by the policy
+        entry of the container are transferred
+
+        Each tag is transferred only if the Admission control admits
+        it, refused tags are deferred to the next run
         """
-        username, password = Credentials.read(proxy_creds)
-        push_username, push_password = Credentials.read(push_oci_creds)
+        shard = options.shard
+        if shard and not shard.tags and not shard.owns(self.container):
+            self.skipped = True
+            return
+        shard_tags = bool(shard and shard.tags)
         server = self.server
         Path(self.log_path).mkdir(parents=True, exist_ok=True)
-        if store_oci:
-            Path(store_oci).mkdir(parents=True, exist_ok=True)
+        layout = self._create_store(options.store_oci, options.oci_layout)
 
-        if not use_archs:
-            use_archs.append('all')
+        if plan_tags is not None:
+            use_archs = list(plan_tags)
+        else:
+            use_archs = options.use_archs or ['all']
 
         try:
             for arch in use_archs:
                 count = 0
                 if self.shutdown:
                     break
-                if store_oci:
-                    tag_log_name = '{}/{}-{}.tags'.format(
-                        store_oci, self.container, arch
+                if plan_tags is not None:
+                    tag_log_name = self.get_tag_log_name(
+                        options.store_oci, arch
                     )
+                    tag_list = plan_tags.get(arch, [])
                 else:
-                    tag_log_name = '{}/{}-{}.tags'.format(
-                        self.log_path, self.container, arch
+                    # with tags partitioned between the shards only
+                    # the owned tags are added to the tag log
+                    tag_log_name, tag_list = self.get_new_tags(
+                        options.from_registry, options.store_oci, arch,
+                        options.tls_verify, options.proxy_creds,
+                        options.with_attestation,
+                        update_tag_log=not shard_tags,
+                        tag_selector=tag_selector, delta=options.delta
                     )
-                Path(os.path.dirname(tag_log_name)).mkdir(
-                    parents=True, exist_ok=True
-                )
-                prior_tag_list = []
-                if os.path.exists(tag_log_name):
-                    with open(tag_log_name) as taglog:
-                        prior_tag_list = [tag.rstrip() for tag in taglog]
-                tag_list = DistributionProxy(
-                    from_registry, self.container
-                ).get_tags(
-                    tls_verify, proxy_creds, arch, tag_log_name,
-                    with_attestation
-                )
-                tag_list = \
-                    [tag for tag in tag_list if tag not in prior_tag_list]
+                tag_list = self._get_shard_tags(shard, tag_list, arch)
+                if plan_tags is not None or shard_tags:
+                    self._add_tags(tag_log_name, tag_list)
+                Metrics.inc('cgyle_tags_total', len(tag_list), state='planned')
+                if options.state:
+                    tag_list = self._skip_quarantined(
+                        options.state, tag_list, arch, tag_log_name
+                    )
+                if options.sync and tag_list and \
+                   not options.store_oci and not options.fanout:
+                    self._sync_tags(
+                        tag_list, arch, tag_log_name, options.tls_verify,
+                        options.remove_signatures, options.proxy_creds,
+                        options.push_oci, options.push_oci_creds,
+                        options.ecr_alias, options.push_engine, options.state
+                    )
+                    continue
                 for tagname in tag_list:
                     count += 1
-                    if store_oci:
-                        archive_name = '{}/{}-{}-{}.oci.tar'.format(
-                            store_oci, self.container, tagname, arch
+                    ref = OCILayout.get_reference(
+                        self.container, tagname, arch
+                    )
+                    if layout and layout.has_reference(ref):
+                        logging.info(
+                            '[{}]: Skipping ({}/{} tags, arch:{}): {} present in {}'.format(
+                                self.pid, count, len(tag_list), arch,
+                                ref, options.store_oci
+                            )
                         )
-                        log_name = '{}/{}-{}-{}.log'.format(
-                            store_oci, self.container, tagname, arch
+                        Metrics.inc('cgyle_tags_total', state='skipped')
+                        continue
+                    archive_name, log_name = self._get_target(
+                        options.store_oci, options.push_oci, options.ecr_alias,
+                        tagname, arch
+                    )
+                    push_blobs: List[str] = []
+                    blob_sizes: Dict[str, int] = {}
+                    destination_repo = archive_name.partition(os.sep)[2]
+                    if options.push_oci and options.push_engine:
+                        up_to_date, push_blobs = self._prepare_push(
+                            options.push_engine, destination_repo,
+                            tagname, arch
                         )
-                    elif push_oci:
-                        archive_name = '{}/{}'.format(
-                            push_oci, self.container
+                        blob_sizes = options.push_engine.get_blob_sizes(
+                            push_blobs
                         )
-                        if ecr_alias:
-                            archive_name = os.sep.join(
-                                [push_oci, ecr_alias] + list(Path(self.container).parts[1:])
+                        if up_to_date:
+                            logging.info(
+                                '[{}]: Skipping ({}/{} tags, arch:{}): {}:{} up to date in {}'.format(
+                                    self.pid, count, len(tag_list), arch,
+                                    self.container, tagname, options.push_oci
+                                )
+                            )
+                            Metrics.inc('cgyle_tags_total', state='skipped')
+                            continue
+                    if not Admission.admit(self.container, tagname, arch):
+                        self._defer_tag(tag_log_name, tagname, arch)
+                        continue
+                    call_args = self._get_copy_call_args(
+                        arch, options.tls_verify, options.remove_signatures,
+                        options.proxy_creds, options.push_oci,
+                        options.push_oci_creds
+                    )
+                    if options.fanout:
+                        logging.info(
+                            '[{}]: Fetching ({}/{} tags, arch:{}): {}:{}@{} for {} destinations'.format(
+                                self.pid, count, len(tag_list), arch,
+                                self.container, tagname, server,
+                                len(options.fanout.destinations)
                             )
-                        log_name = '{}/{}-{}-{}.log'.format(
-                            self.log_path, self.container, tagname, arch
                         )
-                    else:
-                        archive_name = '/dev/null'
-                        log_name = '{}/{}-{}-{}.log'.format(
-                            self.log_path, self.container, tagname, arch
+                        Status.update(
+                            tagname, f'{count}/{len(tag_list)} tags, arch:{arch}'
                         )
-                    Path(os.path.dirname(log_name)).mkdir(
-                        parents=True, exist_ok=True
-                    )
-                    if arch == 'all':
-                        call_args = [
-                            'skopeo', 'copy', '--all'
-                        ]
-                    else:
-                        call_args = [
-                            'skopeo', '--override-arch', arch, 'copy'
-                        ]
-                    call_args += [
-                        '--dest-oci-accept-uncompressed-layers',
-                        '--retry-times', '5',
-                        '--image-parallel-copies', '5',
-                        f'--src-tls-verify={format(tls_verify).lower()}'
-                    ]
-                    if remove_signatures:
-                        call_args += [
-                            '--remove-signatures'
-                        ]
-                    if username and password:
-                        call_args += [
-                            '--src-creds', f'{username}:{password}'
-                        ]
-                    if push_username and push_password:
-                        call_args += [
-                            '--dest-creds', f'{push_username}:{push_password}'
-                        ]
+                        with Metrics.timer(
+                            'cgyle_phase_duration_seconds', phase='transfer'
+                        ):
+                            failed = not options.fanout.transfer(
+                                call_args,
+                                f'docker://{server}/{self.container}:{tagname}',
+                                self.container, tagname, arch, log_name
+                            )
+                        if failed:
+                            logging.error(
+                                '[{}]: [E] - for details see: {}'.format(
+                                    self.pid, log_name
+                                )
+                            )
+                            self._drop_tag(tag_log_name, tagname)
+                        self._record_result(
+                            options.state, tagname, arch, failed,
+                            self._read_log(log_name, 0) if failed else '',
+                            log_name
+                        )
+                        logging.info(f'[{self.pid}]: [Done]')
+                        continue
+                    staging = None
+                    if layout:
+                        staging = TemporaryDirectory(
+                            dir=options.store_oci, prefix='.staging.'
+                        )
+                        call_args += layout.get_staging_options()
                     call_args += [
                         f'docker://{server}/{self.container}:{tagname}'
                     ]
-                    if push_oci:
+                    if options.push_oci:
                         call_args += [
                             f'docker://{archive_name}:{tagname}'
                         ]
+                    elif staging:
+                        call_args += [
+                            f'oci:{staging.name}:{ref}'
+                        ]
                     else:
                         call_args += [
                             f'oci-archive:{archive_name}:{tagname}'
                         ]
-                    with open(log_name, 'a') as clog:
-                        skopeo = subprocess.Popen(
-                            call_args, stdout=clog, stderr=clog
+                    with ExitStack() as cleanup:
+                        if staging:
+                            cleanup.callback(staging.cleanup)
+                        capture: Deque[str] = deque(maxlen=self.max_log_lines)
+                        stats = TransferStats(
+                            self.container, tagname, arch, blob_sizes
                         )
-                        self.pid = skopeo.pid
-                        logging.info(
-                            '[{}]: Fetching ({}/{} tags, arch:{}): {}:{}@{}'.format(
-                                self.pid, count, len(tag_list), arch,
-                                self.container, tagname, server
-                            )
+                        returncode, output = RetryPolicy.run(
+                            server, lambda: self._fetch(
+                                call_args, capture, tagname,
+                                f'{count}/{len(tag_list)} tags, arch:{arch}',
+                                stats
+                            ), options.push_oci.split('/')[0]
+                        )
+                        failed = returncode != 0
+                        if not failed and layout and staging:
+                            try:
+                                layout.add_reference(ref, staging.name)
+                                if options.oci_export:
+                                    layout.export(
+                                        ref, archive_name, tagname
+                                    )
+                            except CgyleOCILayoutError as issue:
+                                capture.append(f'{issue}{os.linesep}')
+                                output = format(issue)
+                                failed = True
+                        TransferReport.add(stats.finish(failed))
+                        self._record_result(
+                            options.state, tagname, arch, failed, output,
+                            log_name
                         )
-                        skopeo.communicate()
-                        if skopeo.returncode != 0:
+                        if failed:
+                            self._write_log(log_name, capture)
                             logging.error(
                                 '[{}]: [E] - for details see: {}'.format(
                                     self.pid, log_name
@@ -261,16 +558,15 @@ class DistributionProxy:
                             # Rewrite the tag list and drop this tag from the list
                             # such that it gets taken into account for the next
                             # run of cgyle
-                            current_tag_list = []
-                            if os.path.exists(tag_log_name):
-                                with open(tag_log_name) as taglog:
-                                    current_tag_list = [tag.rstrip() for tag in taglog]
-                                with open(tag_log_name, 'w') as taglog:
-                                    for tag in current_tag_list:
-                                        if tag != tagname:
-                                            taglog.write(f'{tag}{os.linesep}')
+                            self._drop_tag(tag_log_name, tagname)
                         else:
-                            os.unlink(log_name)
+                            if options.push_engine and push_blobs:
+                                options.push_engine.register_push(
+                                    destination_repo, push_blobs
+                                )
+                            # drop the log of a former failure if any
+                            with suppress(FileNotFoundError):
+                                os.unlink(log_name)
                         logging.info(f'[{self.pid}]: [Done]')
         except (SubprocessError, IOError) as issue:
             raise CgyleCommandError(
@@ -279,6 +575,530 @@ class DistributionProxy:
                 )
             )
 
+    def _create_store(
+        self, store_oci: str, oci_layout: bool
+    ) -> Optional[OCILayout]:
+        """
+        Create the store_oci directory and return the OCI image
+        layout below it if requested
+        """
+        if not store_oci:
+            return None
+        Path(store_oci).mkdir(parents=True, exist_ok=True)
+        if not oci_layout:
+            return None
+        layout = OCILayout(store_oci)
+        layout.create()
+        return layout
+
+    def _skip_quarantined(
+        self, state: StateStore, tag_list: List[str], arch: str,
+        tag_log_name: str
+    ) -> List[str]:
+        """
+        Return the tags of tag_list not in quarantine. Tags in
+        quarantine are dropped from the tag log such that they
+        are retried once their cool-off expired
+        """
+        result_tag_list = []
+        for tagname in tag_list:
+            if state.is_quarantined(self.container, tagname, arch):
+                logging.info(
+                    '[{}]: Skipping (arch:{}): {}:{} in quarantine'.format(
+                        self.pid, arch, self.container, tagname
+                    )
+                )
+                self._drop_tag(tag_log_name, tagname)
+                Metrics.inc('cgyle_tags_total', state='skipped')
+            else:
+                result_tag_list.append(tagname)
+        return result_tag_list
+
+    def _get_shard_tags(
+        self, shard: Optional[Union[Shard, Coordinator]],
+        tag_list: List[str], arch: str
+    ) -> List[str]:
+        """
+        Return the tags owned by shard if the shard partitions
+        the container tags
+        """
+        if not shard or not shard.tags:
+            return tag_list
+        return [
+            tagname for tagname in tag_list
+            if shard.owns(f'{self.container}:{tagname}:{arch}')
+        ]
+
+    def _record_result(
+        self, state: Optional[StateStore], tagname: str, arch: str,
+        failed: bool, error: str = '', log_name: str = ''
+    ) -> None:
+        """
+        Record the result of a transfer in the failure index of
+        the run and in the state store if given
+        """
+        Metrics.inc('cgyle_tags_total', state='failed' if failed else 'done')
+        Admission.release(self.container, tagname, arch)
+        if failed:
+            self.failed_tags += 1
+            FailureIndex.record(
+                self.container, tagname, arch, log_name, error
+            )
+        if not state:
+            return
+        if not failed:
+            state.record_success(self.container, tagname, arch)
+            return
+        cooloff = state.record_failure(self.container, tagname, arch, error)
+        if cooloff:
+            logging.warning(
+                '[{}]: {}:{} failed repeatedly, quarantined for {}h'.format(
+                    self.pid, self.container, tagname, cooloff // 3600
+                )
+            )
+
+    def _defer_tag(self, tag_log_name: str, tagname: str, arch: str) -> None:
+        """
+        Defer a tag refused by the admission control to the next run
+        """
+        logging.info(
+            '[{}]: Deferring (arch:{}): {}:{} for lack of disk space'.format(
+                self.pid, arch, self.container, tagname
+            )
+        )
+        self._drop_tag(tag_log_name, tagname)
+        Admission.defer(self.container, tagname, arch)
+        Metrics.inc('cgyle_tags_total', state='deferred')
+
+    @Metrics.timed('cgyle_phase_duration_seconds', phase='transfer')
+    def _fetch(
+        self, call_args: List[str], capture: Deque[str],
+        tagname: str, progress: str, stats: TransferStats
+    ) -> Tuple[int, str]:
+        """
+        Run one skopeo copy attempt, add its output to the capture
+        ring buffer and the transfer stats and return its returncode
+        and output
+        """
+        attempt: Deque[str] = deque(maxlen=capture.maxlen)
+        stats.begin()
+        Status.update(tagname, progress)
+        skopeo = subprocess.Popen(
+            call_args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+        )
+        self.pid = skopeo.pid
+        logging.info(
+            '[{}]: Fetching ({}): {}:{}@{}'.format(
+                self.pid, progress, self.container, tagname, self.server
+            )
+        )
+        for line in skopeo.stdout or []:
+            text = line.decode(errors='replace')
+            attempt.append(text)
+            stats.feed(text)
+        skopeo.wait()
+        capture.extend(attempt)
+        if skopeo.returncode == 0:
+            return (0, '')
+        return (skopeo.returncode, ''.join(attempt))
+
+    @staticmethod
+    def _write_log(log_name: str, output: Iterable[str]) -> None:
+        Path(os.path.dirname(log_name)).mkdir(parents=True, exist_ok=True)
+        with open(log_name, 'a') as log:
+            log.write(''.join(output))
+
+    @staticmethod
+    def _read_log(log_name: str, offset: int) -> str:
+        try:
+            with open(log_name, errors='replace') as log:
+                log.seek(offset)
+                return log.read()
+        except OSError:
+            return ''
+
+    def _get_target(
+        self, store_oci: str, push_oci: str, ecr_alias: str,
+        tagname: str, arch: str
+    ) -> List[str]:
+        """
+        Return copy target name and log file name for the given tag
+        """
+        if store_oci:
+            archive_name = '{}/{}-{}-{}.oci.tar'.format(
+                store_oci, self.container, tagname, arch
+            )
+            log_name = '{}/{}-{}-{}.log'.format(
+                store_oci, self.container, tagname, arch
+            )
+        elif push_oci:
+            archive_name = '{}/{}'.format(
+                push_oci, self.container
+            )
+            if ecr_alias:
+                archive_name = os.sep.join(
+                    [push_oci, ecr_alias] + list(Path(self.container).parts[1:])
+                )
+            log_name = '{}/{}-{}-{}.log'.format(
+                self.log_path, self.container, tagname, arch
+            )
+        else:
+            archive_name = '/dev/null'
+            log_name = '{}/{}-{}-{}.log'.format(
+                self.log_path, self.container, tagname, arch
+            )
+        return [archive_name, log_name]
+
+    def _prepare_push(
+        self, push_engine: PushEngine, destination_repo: str,
+        tagname: str, arch: str
+    ) -> Tuple[bool, List[str]]:
+        try:
+            return push_engine.prepare(
+                self.container, destination_repo, tagname, arch
+            )
+        except CgyleError as issue:
+            logging.warning(
+                '[{}]: Push preparation failed for {}:{}: {}'.format(
+                    self.pid, self.container, tagname, issue
+                )
+            )
+            return (False, [])
+
+    def _get_copy_call_args(
+        self, arch: str, tls_verify: bool, remove_signatures: bool,
+        proxy_creds: str, push_oci: str, push_oci_creds: str
+    ) -> List[str]:
+        if arch == 'all':
+            call_args = [
+                'skopeo', 'copy', '--all'
+            ]
+        else:
+            call_args = [
+                'skopeo', '--override-arch', arch, 'copy'
+            ]
+        call_args += [
+            '--dest-oci-accept-uncompressed-layers',
+            '--retry-times', RetryPolicy.get_retry_times(),
+            '--image-parallel-copies', '5',
+            f'--src-tls-verify={format(tls_verify).lower()}'
+        ]
+        if remove_signatures:
+            call_args += [
+                '--remove-signatures'
+            ]
+        return call_args + self._get_auth_options(
+            proxy_creds, push_oci, push_oci_creds
+        )
+
+    def _get_sync_call_args(
+        self, arch: str, tls_verify: bool, remove_signatures: bool,
+        proxy_creds: str, push_oci: str, push_oci_creds: str
+    ) -> List[str]:
+        call_args = ['skopeo']
+        if arch != 'all':
+            call_args += [
+                '--override-arch', arch
+            ]
+        call_args += [
+            'sync', '--src', 'yaml', '--dest',
+            'docker' if push_oci else 'dir',
+            '--keep-going',
+            '--retry-times', RetryPolicy.get_retry_times(),
+            f'--src-tls-verify={format(tls_verify).lower()}'
+        ]
+        if arch == 'all':
+            call_args += [
+                '--all'
+            ]
+        if remove_signatures:
+            call_args += [
+                '--remove-signatures'
+            ]
+        return call_args + self._get_auth_options(
+            proxy_creds, push_oci, push_oci_creds
+        )
+
+    def _get_auth_options(
+        self, proxy_creds: str, push_oci: str, push_oci_creds: str
+    ) -> List[str]:
+        """
+        Credentials are read for each transfer such that
+        refreshed credentials are used by new transfers
+        """
+        auth_options: List[str] = []
+        src_auth_file = AuthFile.add(
+            self.server, *Credentials.read(proxy_creds)
+        )
+        dest_auth_file = AuthFile.add(
+            push_oci, *Credentials.read(push_oci_creds)
+        ) if push_oci else ''
+        if src_auth_file:
+            auth_options += [
+                '--src-authfile', src_auth_file
+            ]
+        if dest_auth_file:
+            auth_options += [
+                '--dest-authfile', dest_auth_file
+            ]
+        return auth_options
+
+    def _sync_tags(
+        self, tag_list: List[str], arch: str, tag_log_name: str,
+        tls_verify: bool, remove_signatures: bool, proxy_creds: str,
+        push_oci: str, push_oci_creds: str, ecr_alias: str,
+        push_engine: Optional[PushEngine], state: Optional[StateStore]
+    ) -> None:
+        """
+        Transfer the tags of tag_list with skopeo sync calls of up
+        to max_sync_tags tags and map the sync result back to the
+        individual tags. Each batch is run via RetryPolicy, a retry
+        syncs only the tags failed so far. The tags are accounted in
+        the TransferReport and the Status like copied tags and a
+        failed tag records only the error lines of its own. Without
+        push_oci each batch is synced into a temporary directory
+        below get_tmp_dir which is deleted afterwards, just to fill
+        the proxy cache
+        """
+        archive_name, log_name = self._get_target(
+            '', push_oci, ecr_alias, 'sync', arch
+        )
+        destination_repo = archive_name.partition(os.sep)[2]
+        push_blobs: Dict[str, List[str]] = {}
+        sync_tags: List[str] = []
+        for tagname in tag_list:
+            if push_oci and push_engine:
+                up_to_date, push_blobs[tagname] = self._prepare_push(
+                    push_engine, destination_repo, tagname, arch
+                )
+                if up_to_date:
+                    logging.info(
+                        '[{}]: Skipping (arch:{}): {}:{} up to date in {}'.format(
+                            self.pid, arch, self.container, tagname, push_oci
+                        )
+                    )
+                    Metrics.inc('cgyle_tags_total', state='skipped')
+                    continue
+            if not Admission.admit(self.container, tagname, arch):
+                self._defer_tag(tag_log_name, tagname, arch)
+                continue
+            sync_tags.append(tagname)
+        if not sync_tags:
+            return
+        call_args = self._get_sync_call_args(
+            arch, tls_verify, remove_signatures,
+            proxy_creds, push_oci, push_oci_creds
+        )
+        source = f'docker://{self.server}/{self.container}'
+        batch_size = self.max_sync_tags
+        for offset in range(0, len(sync_tags), batch_size):
+            batch = sync_tags[offset:offset + batch_size]
+            stats = {
+                tagname: TransferStats(
+                    self.container, tagname, arch,
+                    push_engine.get_blob_sizes(push_blobs[tagname])
+                    if push_engine and push_blobs.get(tagname) else {}
+                ) for tagname in batch
+            }
+            pending = batch
+            failed_tags: List[str] = []
+
+            def sync() -> Tuple[int, str]:
+                nonlocal pending, failed_tags
+                if failed_tags:
+                    # a retry only syncs the tags failed so far
+                    pending = failed_tags
+                returncode, output_text = self._sync_batch(
+                    call_args, pending, arch, tls_verify,
+                    push_oci, archive_name, stats
+                )
+                failed_tags = self.get_failed_sync_tags(
+                    output_text, returncode, source, pending
+                )
+                return (returncode, output_text)
+
+            returncode, output_text = RetryPolicy.run(
+                self.server, sync, push_oci.split('/')[0]
+            )
+            errors = self.get_sync_errors(output_text, source, failed_tags)
+            for tagname in batch:
+                failed = tagname in failed_tags
+                TransferReport.add(stats[tagname].finish(failed))
+                self._record_result(
+                    state, tagname, arch, failed,
+                    errors.get(tagname, ''), log_name
+                )
+                if failed:
+                    logging.error(
+                        '[{}]: [E] {}:{} - for details see: {}'.format(
+                            self.pid, self.container, tagname, log_name
+                        )
+                    )
+                    self._drop_tag(tag_log_name, tagname)
+                elif push_engine and push_blobs.get(tagname):
+                    push_engine.register_push(
+                        destination_repo, push_blobs[tagname]
+                    )
+            if failed_tags:
+                self._write_log(log_name, [output_text])
+            logging.info(
+                '[{}]: [Done] synced:{} failed:{}'.format(
+                    self.pid, len(batch) - len(failed_tags),
+                    len(failed_tags)
+                )
+            )
+
+    def _sync_batch(
+        self, call_args: List[str], batch: List[str], arch: str,
+        tls_verify: bool, push_oci: str, archive_name: str,
+        stats: Dict[str, TransferStats]
+    ) -> Tuple[int, str]:
+        """
+        Run one skopeo sync call for the tags of batch and return
+        its returncode and output. skopeo sync copies the tags one
+        after the other, the output following the start of a tag
+        is fed to the transfer stats of the tag
+        """
+        source = f'docker://{self.server}/{self.container}'
+        with ExitStack() as cleanup:
+            source_spec = cleanup.enter_context(
+                NamedTemporaryFile(
+                    'w', prefix='cgyle_sync', suffix='.yaml'
+                )
+            )
+            yaml.safe_dump(
+                {
+                    self.server: {
+                        'images': {self.container: batch},
+                        'tls-verify': tls_verify
+                    }
+                }, source_spec
+            )
+            source_spec.flush()
+            if push_oci:
+                # skopeo sync appends the basename of the container
+                # to the destination
+                destination = os.path.dirname(archive_name)
+            else:
+                destination = cleanup.enter_context(
+                    TemporaryDirectory(
+                        dir=self.get_tmp_dir(),
+                        prefix='.sync.'
+                    )
+                )
+            skopeo = subprocess.Popen(
+                call_args + [source_spec.name, destination],
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+            )
+            self.pid = skopeo.pid
+            logging.info(
+                '[{}]: Syncing ({} tags, arch:{}): {}@{}'.format(
+                    self.pid, len(batch), arch, self.container,
+                    self.server
+                )
+            )
+            output: List[str] = []
+            current: Optional[TransferStats] = None
+            with Metrics.timer(
+                'cgyle_phase_duration_seconds', phase='transfer'
+            ):
+                for line in skopeo.stdout or []:
+                    text = line.decode(errors='replace')
+                    output.append(text)
+                    match = re.search(
+                        r'Copying image ref (\d+)/\d+.*from="?{}:([^"\s]+)'
+                        .format(re.escape(source)), text
+                    )
+                    if match and match.group(2) in stats:
+                        if current:
+                            current.end()
+                        current = stats[match.group(2)]
+                        current.begin()
+                        Status.update(
+                            current.tag, '{}/{} synced tags, arch:{}'.format(
+                                match.group(1), len(batch), arch
+                            )
+                        )
+                    elif current:
+                        current.feed(text)
+                skopeo.wait()
+        return (skopeo.returncode, ''.join(output))
+
+    @staticmethod
+    def get_sync_errors(
+        output: str, source: str, tags: List[str]
+    ) -> Dict[str, str]:
+        """
+        Return the error lines of the skopeo sync output per tag
+        of tags. A tag gets the error lines naming it, a tag not
+        named by any error line, e.g. because skopeo stopped before
+        the tag was copied, gets the error lines naming no tag
+        """
+        named: Dict[str, List[str]] = {}
+        unnamed: List[str] = []
+        for line in output.splitlines(keepends=True):
+            if not re.search(r'\blevel=(error|fatal)\b', line):
+                continue
+            line_tags = re.findall(
+                r'{}:([^"\\\s]+)'.format(re.escape(source)), line
+            )
+            for tag in line_tags:
+                named.setdefault(tag, []).append(line)
+            if not line_tags:
+                unnamed.append(line)
+        return {
+            tag: ''.join(named.get(tag, unnamed)) for tag in tags
+        }
+
+    @staticmethod
+    def get_failed_sync_tags(
+        output: str, returncode: int, source: str, tags: List[str]
+    ) -> List[str]:
+        """
+        Return the tags which were not synced from the skopeo sync
+        output. A tag failed if skopeo reported an error for it or
+        if skopeo stopped before the tag was copied
+        """
+        if returncode == 0:
+            return []
+        copied = set(
+            re.findall(
+                r'from="?{}:([^"\s]+)'.format(re.escape(source)), output
+            )
+        )
+        failed = set()
+        for line in output.splitlines():
+            if re.search(r'\blevel=(error|fatal)\b', line):
+                failed.update(
+                    re.findall(
+                        r'{}:([^"\\\s]+)'.format(re.escape(source)), line
+                    )
+                )
+        return [
+            tag for tag in tags if tag in failed or tag not in copied
+        ]
+
+    def _add_tags(self, tag_log_name: str, tag_list: List[str]) -> None:
+        Path(os.path.dirname(tag_log_name)).mkdir(parents=True, exist_ok=True)
+        current_tag_list = []
+        if os.path.exists(tag_log_name):
+            with open(tag_log_name) as taglog:
+                current_tag_list = [tag.rstrip() for tag in taglog]
+        with open(tag_log_name, 'a') as taglog:
+            for tag in tag_list:
+                if tag != 'latest' and tag not in current_tag_list:
+                    taglog.write(f'{tag}{os.linesep}')
+
+    def _drop_tag(self, tag_log_name: str, tagname: str) -> None:
+        current_tag_list = []
+        if os.path.exists(tag_log_name):
+            with open(tag_log_name) as taglog:
+                current_tag_list = [tag.rstrip() for tag in taglog]
+            with open(tag_log_name, 'w') as taglog:
+                for tag in current_tag_list:
+                    if tag != tagname:
+                        taglog.write(f'{tag}{os.linesep}')
+
     def get_pid(self) -> str:
         return format(self.pid)
 
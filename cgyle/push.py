@@ -0,0 +1,121 @@
+# Copyright (c) 2024 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of cgyle.
+#
+# cgyle is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cgyle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cgyle.  If not, see <http://www.gnu.org/licenses/>
+#
+import logging
+import threading
+from typing import (
+    List, Dict, Set, Tuple
+)
+
+from cgyle.registry import Registry
+from cgyle.metrics import Metrics
+
+
+class PushEngine:
+    """
+    Prepare container pushes to a destination registry
+
+    The destination is checked for the manifest and blobs of
+    a container tag before it gets pushed. Blobs missing in the
+    destination repository but known in another repository of
+    the destination registry are mounted from there instead of
+    being uploaded again. One instance is shared by all workers
+    of a cgyle run to share the knowledge about blob locations
+    """
+    def __init__(self, source: Registry, destination: Registry) -> None:
+        self.source = source
+        self.destination = destination
+        self.blob_repos: Dict[str, Set[str]] = {}
+        self.blob_sizes: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def prepare(
+        self, source_repo: str, destination_repo: str, tag: str, arch: str
+    ) -> Tuple[bool, List[str]]:
+        """
+        Check and prepare the destination for the given tag
+
+        Returns a tuple of a flag which is True if the destination
+        is already up to date and the list of blob digests of the tag
+        """
+        digest, manifests = self.source.resolve(source_repo, tag, arch)
+        if digest and digest == self.destination.get_manifest_digest(
+            destination_repo, tag
+        ):
+            return (True, [])
+        blobs: List[str] = []
+        for manifest in manifests:
+            for blob in Registry.get_blobs(manifest):
+                if blob['digest'] not in blobs:
+                    blobs.append(blob['digest'])
+                    with self.lock:
+                        self.blob_sizes[blob['digest']] = blob.get('size', 0)
+        for blob_digest in blobs:
+            if self.destination.blob_exists(destination_repo, blob_digest):
+                self.register(destination_repo, [blob_digest])
+                self._count_deduplicated(blob_digest)
+                continue
+            for from_repo in self.get_locations(blob_digest):
+                if from_repo != destination_repo and \
+                   self.destination.mount_blob(
+                       destination_repo, blob_digest, from_repo
+                   ):
+                    logging.info(
+                        f'Mounted {blob_digest} from {from_repo} '
+                        f'into {destination_repo}'
+                    )
+                    self.register(destination_repo, [blob_digest])
+                    self._count_deduplicated(blob_digest)
+                    break
+        return (False, blobs)
+
+    def register(self, repo: str, blobs: List[str]) -> None:
+        """
+        Remember the given blobs to be present in repo
+        """
+        with self.lock:
+            for blob_digest in blobs:
+                self.blob_repos.setdefault(blob_digest, set()).add(repo)
+
+    def get_locations(self, blob_digest: str) -> List[str]:
+        with self.lock:
+            return sorted(self.blob_repos.get(blob_digest, set()))
+
+    def get_blob_sizes(self, blobs: List[str]) -> Dict[str, int]:
+        with self.lock:
+            return {
+                blob_digest: self.blob_sizes.get(blob_digest, 0)
+                for blob_digest in blobs
+            }
+
+    def register_push(self, repo: str, blobs: List[str]) -> None:
+        """
+        Remember the blobs of a successful push to repo and count
+        the bytes of the blobs uploaded by the push
+        """
+        with self.lock:
+            size = sum(
+                self.blob_sizes.get(blob_digest, 0) for blob_digest in blobs
+                if repo not in self.blob_repos.get(blob_digest, set())
+            )
+        Metrics.inc('cgyle_bytes_total', size, kind='transferred')
+        self.register(repo, blobs)
+
+    def _count_deduplicated(self, blob_digest: str) -> None:
+        with self.lock:
+            size = self.blob_sizes.get(blob_digest, 0)
+        Metrics.inc('cgyle_bytes_total', size, kind='deduplicated')
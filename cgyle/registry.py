@@ -0,0 +1,300 @@
+# Copyright (c) 2024 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of cgyle.
+#
+# cgyle is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cgyle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cgyle.  If not, see <http://www.gnu.org/licenses/>
+#
+import re
+import json
+import time
+import base64
+import logging
+import requests
+import requests.packages.urllib3
+from typing import (
+    List, Dict, Tuple
+)
+
+from cgyle.catalog import Catalog
+from cgyle.credentials import (
+    Credentials, TokenCache
+)
+from cgyle.retry import (
+    RetryPolicy, CircuitBreaker
+)
+from cgyle.exceptions import CgyleRequestError
+
+MANIFEST_MEDIA_TYPES = [
+    'application/vnd.oci.image.index.v1+json',
+    'application/vnd.oci.image.manifest.v1+json',
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.docker.distribution.manifest.v2+json'
+]
+
+
+class Registry:
+    """
+    Native access to the v2 registry API
+
+    Handles the Basic and Bearer token authentication
+    challenges a registry responds with. Bearer tokens are
+    shared between all instances through the TokenCache.
+    The credentials are read from the given creds source on
+    each authorization such that refreshed credentials are
+    picked up
+    """
+    def __init__(
+        self, server: str, creds: str = '', tls_verify: bool = True
+    ) -> None:
+        requests.packages.urllib3.disable_warnings()
+        scheme = 'http' if server.startswith('http://') else 'https'
+        self.server = server.replace('http://', '').replace('https://', '')
+        self.url = f'{scheme}://{self.server}'
+        self.creds = creds
+        self.credentials: List[str] = []
+        self.tls_verify = tls_verify
+        self.basic_auth = False
+
+    def request(
+        self, method: str, path: str, scopes: List[str],
+        headers: Dict[str, str] = {}, **kwargs
+    ) -> requests.Response:
+        """
+        Send request to the registry and answer an authentication
+        challenge for the given scopes if requested
+        """
+        request_headers = dict(headers)
+        authorization = self._get_authorization(scopes)
+        if authorization:
+            request_headers['Authorization'] = authorization
+        response = self._send(method, path, request_headers, **kwargs)
+        challenge = response.headers.get('WWW-Authenticate', '')
+        if response.status_code == 401 and challenge:
+            request_headers['Authorization'] = self._authorize(
+                challenge, scopes
+            )
+            response = self._send(method, path, request_headers, **kwargs)
+        return response
+
+    def blob_exists(self, repo: str, digest: str) -> bool:
+        response = self.request(
+            'HEAD', f'/v2/{repo}/blobs/{digest}', [f'repository:{repo}:pull']
+        )
+        return response.status_code == 200
+
+    def mount_blob(self, repo: str, digest: str, from_repo: str) -> bool:
+        """
+        Mount blob from another repository of the same registry.
+        If the registry does not mount the blob, it starts an upload
+        session instead which gets cancelled
+        """
+        response = self.request(
+            'POST', f'/v2/{repo}/blobs/uploads/?mount={digest}&from={from_repo}',
+            [f'repository:{repo}:pull,push', f'repository:{from_repo}:pull']
+        )
+        if response.status_code == 201:
+            return True
+        location = response.headers.get('Location', '')
+        if response.status_code == 202 and location:
+            self.request(
+                'DELETE', location.replace(self.url, ''),
+                [f'repository:{repo}:pull,push']
+            )
+        return False
+
+    def get_manifest_digest(self, repo: str, reference: str) -> str:
+        """
+        Return digest of the manifest or an empty string if
+        the manifest does not exist
+        """
+        response = self.request(
+            'HEAD', f'/v2/{repo}/manifests/{reference}',
+            [f'repository:{repo}:pull'],
+            {'Accept': ', '.join(MANIFEST_MEDIA_TYPES)}
+        )
+        if response.status_code != 200:
+            return ''
+        return response.headers.get('Docker-Content-Digest', '')
+
+    def get_manifest(self, repo: str, reference: str) -> Tuple[dict, str]:
+        """
+        Return manifest and its digest
+        """
+        response = self.request(
+            'GET', f'/v2/{repo}/manifests/{reference}',
+            [f'repository:{repo}:pull'],
+            {'Accept': ', '.join(MANIFEST_MEDIA_TYPES)}
+        )
+        if response.status_code != 200:
+            raise CgyleRequestError(
+                f'Failed to get manifest {repo}:{reference}: '
+                f'HTTP {response.status_code}'
+            )
+        try:
+            manifest = json.loads(response.content)
+        except Exception as issue:
+            raise CgyleRequestError(
+                f'Invalid manifest {repo}:{reference}: {issue}'
+            )
+        return (
+            manifest,
+            response.headers.get('Docker-Content-Digest', '') or reference
+        )
+
+    def resolve(
+        self, repo: str, tag: str, arch: str
+    ) -> Tuple[str, List[dict]]:
+        """
+        Resolve the manifest digest of a tag as it will be present
+        in a copy destination and the image manifests that gets copied.
+        For a multi arch source and a selected arch, only the
+        manifest of that arch is copied
+        """
+        manifest, digest = self.get_manifest(repo, tag)
+        if not Registry.is_index(manifest):
+            return (digest, [manifest])
+        manifests: List[dict] = []
+        platform_arch = Catalog.get_platform_arch(arch)
+        for descriptor in manifest['manifests']:
+            if arch == 'all' or descriptor.get(
+                'platform', {}
+            ).get('architecture') == platform_arch:
+                manifests.append(
+                    self.get_manifest(
+                        repo, descriptor['digest']
+                    )[0]
+                )
+                if arch != 'all':
+                    return (descriptor['digest'], manifests)
+        if arch != 'all':
+            return ('', [])
+        return (digest, manifests)
+
+    @staticmethod
+    def is_index(manifest: dict) -> bool:
+        return 'manifests' in manifest
+
+    @staticmethod
+    def get_blobs(manifest: dict) -> List[dict]:
+        """
+        Return config and layer descriptors of an image manifest
+        """
+        blobs = [manifest['config']] if manifest.get('config') else []
+        return blobs + manifest.get('layers', [])
+
+    def _send(
+        self, method: str, path: str, headers: Dict[str, str], **kwargs
+    ) -> requests.Response:
+        """
+        Send request and retry it on throttling, server and
+        network errors according to the RetryPolicy
+        """
+        breaker = CircuitBreaker.get(self.server)
+        attempt = 0
+        while True:
+            breaker.wait()
+            retry_after = 0.0
+            try:
+                response = requests.request(
+                    method, f'{self.url}{path}', headers=headers,
+                    verify=self.tls_verify, timeout=60, **kwargs
+                )
+                error_class = RetryPolicy.classify(
+                    status_code=response.status_code
+                )
+            except Exception as issue:
+                response = None
+                error_class = 'network'
+                error = issue
+            if response is not None and \
+               not RetryPolicy.is_retryable(error_class):
+                breaker.record_success()
+                return response
+            if response is not None:
+                retry_after = RetryPolicy.get_retry_after(
+                    response.headers.get('Retry-After', '')
+                )
+            breaker.record_failure(retry_after)
+            if attempt >= RetryPolicy.max_retries:
+                if response is not None:
+                    return response
+                raise CgyleRequestError(
+                    f'Failed to handle request: {error}'
+                )
+            delay = RetryPolicy.get_delay(attempt, retry_after)
+            attempt += 1
+            logging.warning(
+                '{} error from {}, retry {}/{} in {:.1f}s'.format(
+                    error_class, self.server, attempt,
+                    RetryPolicy.max_retries, delay
+                )
+            )
+            time.sleep(delay)
+
+    def _get_credentials(self) -> List[str]:
+        credentials = Credentials.read(self.creds)
+        if credentials != self.credentials:
+            if self.credentials:
+                # credentials got refreshed, tokens of the
+                # previous credentials are no longer used
+                TokenCache.invalidate(self.server)
+            self.credentials = credentials
+        return credentials
+
+    def _get_authorization(self, scopes: List[str]) -> str:
+        username, password = self._get_credentials()
+        if self.basic_auth:
+            return 'Basic {}'.format(
+                base64.b64encode(f'{username}:{password}'.encode()).decode()
+            )
+        token = TokenCache.get(self.server, username, ' '.join(scopes))
+        return f'Bearer {token}' if token else ''
+
+    def _authorize(self, challenge: str, scopes: List[str]) -> str:
+        auth_type, _, params = challenge.partition(' ')
+        if auth_type.lower() == 'basic':
+            self.basic_auth = True
+            return self._get_authorization(scopes)
+        username, password = self._get_credentials()
+        settings = dict(re.findall(r'(\w+)="([^"]*)"', params))
+        if auth_type.lower() != 'bearer' or 'realm' not in settings:
+            raise CgyleRequestError(
+                f'Unsupported authentication challenge: {challenge}'
+            )
+        try:
+            response = requests.get(
+                settings['realm'],
+                params={
+                    'service': settings.get('service', ''),
+                    'scope': scopes
+                },
+                auth=(username, password)
+                if username and password else None,
+                verify=self.tls_verify, timeout=60
+            )
+            token_data = json.loads(response.content)
+        except Exception as issue:
+            raise CgyleRequestError(
+                f'Failed to get token from {settings["realm"]}: {issue}'
+            )
+        token = token_data.get('token') or token_data.get('access_token')
+        if not token:
+            raise CgyleRequestError(
+                f'No token received from {settings["realm"]}'
+            )
+        TokenCache.set(
+            self.server, username, ' '.join(scopes), token,
+            int(token_data.get('expires_in') or 60)
+        )
+        return f'Bearer {token}'
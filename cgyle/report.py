@@ -0,0 +1,244 @@
+# Copyright (c) 2024 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of cgyle.
+#
+# cgyle is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cgyle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cgyle.  If not, see <http://www.gnu.org/licenses/>
+#
+import re
+import time
+import threading
+from typing import (
+    List, Dict, Any
+)
+
+from cgyle.metrics import Metrics
+from cgyle.atomic import AtomicFile
+from cgyle.exceptions import CgyleReportError
+
+COPY_LINE = re.compile(
+    r'^Copying (blob|config) (?:sha256:)?([0-9a-f]{12,64})(.*)$'
+)
+SIZE = re.compile(r'([\d.]+)\s*([KMGT]?i?B)\b')
+UNITS = {
+    'B': 1,
+    'KB': 1000, 'MB': 1000 ** 2, 'GB': 1000 ** 3, 'TB': 1000 ** 4,
+    'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3, 'TiB': 1024 ** 4
+}
+
+
+class TransferStats:
+    """
+    Timing and size of the blobs of one container tag transfer
+
+    The output of skopeo copy is fed line by line while skopeo
+    runs. A blob starts with its "Copying blob" line and ends
+    with a "done" line or, as skopeo does not report the end of
+    a blob without a terminal, at the latest when the manifest
+    gets written. Blob sizes are taken from the progress line
+    if present or from blob_sizes, a map of known blob digests
+    to their size
+    """
+    def __init__(
+        self, container: str, tag: str, arch: str,
+        blob_sizes: Dict[str, int] = {}
+    ) -> None:
+        self.container = container
+        self.tag = tag
+        self.arch = arch
+        self.blob_sizes = blob_sizes
+        self.attempts = 0
+        self.start_time = 0.0
+        self.end_time = 0.0
+        self.blobs: Dict[str, Dict[str, Any]] = {}
+
+    def begin(self) -> None:
+        """
+        Start a transfer attempt, blobs of a former attempt
+        are forgotten
+        """
+        self.attempts += 1
+        if not self.start_time:
+            self.start_time = time.monotonic()
+        self.end_time = 0.0
+        self.blobs = {}
+
+    def end(self) -> None:
+        """
+        End the transfer attempt before the transfer is finished,
+        e.g. when skopeo sync moves on to the next tag
+        """
+        self.end_time = time.monotonic()
+        self._end_blobs(self.end_time)
+
+    def feed(self, line: str) -> None:
+        now = time.monotonic()
+        if line.startswith('Writing manifest'):
+            self._end_blobs(now)
+            return
+        match = COPY_LINE.match(line.strip())
+        if not match:
+            return
+        kind, digest, status = match.groups()
+        blob = self.blobs.setdefault(
+            digest, {
+                'digest': digest, 'kind': kind, 'state': 'copying',
+                'start': now, 'end': 0.0, 'bytes': self._get_size(digest)
+            }
+        )
+        if 'skipped' in status:
+            blob['state'] = 'skipped'
+            blob['end'] = now
+        elif 'done' in status:
+            blob['state'] = 'copied'
+            blob['end'] = now
+            sizes = SIZE.findall(status)
+            if sizes:
+                value, unit = sizes[-1]
+                blob['bytes'] = int(float(value) * UNITS[unit])
+
+    def finish(self, failed: bool) -> Dict[str, Any]:
+        """
+        Finish the transfer and return its report entry
+        """
+        now = self.end_time or time.monotonic()
+        self._end_blobs(now)
+        blobs = []
+        for blob in self.blobs.values():
+            Metrics.inc('cgyle_blobs_total', state=blob['state'])
+            blobs.append(
+                {
+                    'digest': blob['digest'],
+                    'kind': blob['kind'],
+                    'state': blob['state'],
+                    'duration': round(blob['end'] - blob['start'], 3),
+                    'bytes': blob['bytes']
+                }
+            )
+        return {
+            'container': self.container,
+            'tag': self.tag,
+            'arch': self.arch,
+            'failed': failed,
+            'attempts': self.attempts,
+            'duration': round(now - self.start_time, 3)
+            if self.start_time else 0.0,
+            'bytes': sum(
+                blob['bytes'] for blob in blobs if blob['state'] == 'copied'
+            ),
+            'blobs': blobs
+        }
+
+    def _end_blobs(self, now: float) -> None:
+        for blob in self.blobs.values():
+            if blob['state'] == 'copying':
+                blob['state'] = 'copied'
+                blob['end'] = now
+
+    def _get_size(self, digest: str) -> int:
+        size = self.blob_sizes.get(f'sha256:{digest}')
+        if size is not None:
+            return size
+        # without a terminal skopeo shows the digest in full,
+        # with a terminal it shows an abbreviated digest
+        for blob_digest, size in self.blob_sizes.items():
+            if blob_digest.startswith(f'sha256:{digest}'):
+                return size
+        return 0
+
+
+class TransferReport:
+    """
+    Per run report of all container tag transfers
+
+    Entries are added by the workers from TransferStats. The
+    report written at the end of the run lists all transfers
+    and a summary with the transfers and blobs that took the
+    longest time
+    """
+    lock = threading.Lock()
+    entries: List[Dict[str, Any]] = []
+    transferred = 0
+
+    # number of entries in the slowest tags and blobs lists
+    top = 10
+
+    @staticmethod
+    def add(entry: Dict[str, Any]) -> None:
+        with TransferReport.lock:
+            TransferReport.entries.append(entry)
+            TransferReport.transferred += entry['bytes']
+
+    @staticmethod
+    def get() -> List[Dict[str, Any]]:
+        with TransferReport.lock:
+            return list(TransferReport.entries)
+
+    @staticmethod
+    def get_bytes() -> int:
+        """
+        Return the bytes of all transfers added so far
+        """
+        with TransferReport.lock:
+            return TransferReport.transferred
+
+    @staticmethod
+    def reset() -> None:
+        with TransferReport.lock:
+            TransferReport.entries = []
+            TransferReport.transferred = 0
+
+    @staticmethod
+    def get_summary() -> Dict[str, Any]:
+        entries = TransferReport.get()
+        blobs = [
+            dict(blob, container=entry['container'], tag=entry['tag'])
+            for entry in entries for blob in entry['blobs']
+        ]
+        return {
+            'tags': len(entries),
+            'failed': len([entry for entry in entries if entry['failed']]),
+            'duration': round(sum(entry['duration'] for entry in entries), 3),
+            'bytes': sum(entry['bytes'] for entry in entries),
+            'blobs_copied': len(
+                [blob for blob in blobs if blob['state'] == 'copied']
+            ),
+            'blobs_skipped': len(
+                [blob for blob in blobs if blob['state'] == 'skipped']
+            ),
+            'slowest_tags': [
+                {
+                    key: entry[key] for key in [
+                        'container', 'tag', 'arch', 'duration', 'bytes'
+                    ]
+                } for entry in sorted(
+                    entries, key=lambda entry: entry['duration'], reverse=True
+                )[:TransferReport.top]
+            ],
+            'slowest_blobs': sorted(
+                [blob for blob in blobs if blob['state'] == 'copied'],
+                key=lambda blob: blob['duration'], reverse=True
+            )[:TransferReport.top]
+        }
+
+    @staticmethod
+    def write(filename: str) -> None:
+        report = {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'summary': TransferReport.get_summary(),
+            'transfers': TransferReport.get()
+        }
+        AtomicFile.write_json(
+            filename, report, '.report.', CgyleReportError,
+            f'Failed to write report {filename}'
+        )
@@ -0,0 +1,256 @@
+# Copyright (c) 2024 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of cgyle.
+#
+# cgyle is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cgyle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cgyle.  If not, see <http://www.gnu.org/licenses/>
+#
+import re
+import time
+import random
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from typing import (
+    Dict, List, Tuple, Callable
+)
+
+# error classes in order of precedence if the output of
+# a failed transfer matches more than one class
+ERROR_PATTERNS = [
+    ('disk', [
+        'no space left on device', 'disk quota exceeded',
+        'read-only file system'
+    ]),
+    ('auth', [
+        'unauthorized', 'authentication required', 'denied', 'forbidden'
+    ]),
+    ('not_found', [
+        'manifest unknown', 'name unknown', 'not found', 'no such image'
+    ]),
+    ('throttle', [
+        'toomanyrequests', 'too many requests'
+    ]),
+    ('server', [
+        'internal server error', 'bad gateway', 'service unavailable',
+        'gateway timeout'
+    ]),
+    ('network', [
+        'connection refused', 'connection reset', 'i/o timeout',
+        'no such host', 'tls handshake timeout', 'network is unreachable',
+        'unexpected eof', 'broken pipe', 'timeout'
+    ])
+]
+
+RETRYABLE_ERRORS = ['throttle', 'server', 'network']
+
+
+class RetryPolicy:
+    """
+    Classify transfer errors and retry transient ones
+
+    Errors are classified from the output of a failed skopeo
+    call or from a HTTP status code. Throttling, server and
+    network errors are retried up to max_retries times with a
+    jittered exponential backoff. A Retry-After value sent by
+    the registry is used as lower bound of the delay
+    """
+    max_retries = 3
+    skopeo_retries = 5
+    base_delay = 2.0
+    max_delay = 300.0
+
+    @staticmethod
+    def classify(output: str = '', status_code: int = 0) -> str:
+        """
+        Return the error class for the given output and/or
+        HTTP status code or an empty string if neither
+        indicates an error
+        """
+        match = re.search(r'http status:? (\d{3})', output, re.IGNORECASE)
+        if not status_code and match:
+            status_code = int(match.group(1))
+        if status_code in (401, 403):
+            return 'auth'
+        if status_code == 404:
+            return 'not_found'
+        if status_code == 429:
+            return 'throttle'
+        if status_code >= 500:
+            return 'server'
+        output = output.lower()
+        for error_class, patterns in ERROR_PATTERNS:
+            if any(pattern in output for pattern in patterns):
+                return error_class
+        return 'unknown' if output or status_code >= 400 else ''
+
+    @staticmethod
+    def is_retryable(error_class: str) -> bool:
+        return error_class in RETRYABLE_ERRORS
+
+    @staticmethod
+    def get_delay(attempt: int, retry_after: float = 0) -> float:
+        """
+        Return the delay in seconds before the given retry attempt,
+        starting with 0 for the first retry
+        """
+        delay = min(RetryPolicy.max_delay, RetryPolicy.base_delay * 2 ** attempt)
+        return max(retry_after, random.uniform(delay / 2, delay))
+
+    @staticmethod
+    def get_retry_after(value: str) -> float:
+        """
+        Return the seconds from a Retry-After header value which is
+        either a number of seconds or a HTTP date. Returns 0 if the
+        value is empty or invalid
+        """
+        if not value:
+            return 0
+        if value.strip().isdigit():
+            return float(value)
+        try:
+            return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return 0
+
+    @staticmethod
+    def get_retry_times() -> str:
+        """
+        Return the --retry-times value for skopeo calls run via
+        run(). Retries are done here, skopeo only covers short
+        interruptions such that the attempts do not multiply
+        """
+        return '1' if RetryPolicy.max_retries else format(
+            RetryPolicy.skopeo_retries
+        )
+
+    @staticmethod
+    def get_failing_host(output: str, hosts: List[str]) -> str:
+        """
+        Return the host of hosts that is mentioned last in the
+        output of a failed call, which is the host the final error
+        message refers to. Defaults to the first host
+        """
+        return max(hosts, key=lambda host: output.rfind(host))
+
+    @staticmethod
+    def run(
+        host: str, call: Callable[[], Tuple[int, str]], destination: str = ''
+    ) -> Tuple[int, str]:
+        """
+        Run call, which returns a tuple of returncode and output,
+        until it succeeds, fails with an error that is not retryable
+        or max_retries is reached. The circuit breakers of host and
+        of an optional destination host are consulted prior each
+        attempt. A transient failure is recorded for the host the
+        error refers to
+        """
+        hosts = [host, destination] if destination else [host]
+        breakers = [CircuitBreaker.get(name) for name in hosts]
+        attempt = 0
+        while True:
+            for breaker in breakers:
+                breaker.wait()
+            returncode, output = call()
+            error_class = RetryPolicy.classify(output) if returncode else ''
+            if not RetryPolicy.is_retryable(error_class):
+                # the hosts responded, an error is specific to the request
+                for breaker in breakers:
+                    breaker.record_success()
+                return (returncode, output)
+            failing_host = RetryPolicy.get_failing_host(output, hosts)
+            CircuitBreaker.get(failing_host).record_failure()
+            if attempt >= RetryPolicy.max_retries:
+                return (returncode, output)
+            delay = RetryPolicy.get_delay(attempt)
+            attempt += 1
+            logging.warning(
+                '{} error from {}, retry {}/{} in {:.1f}s'.format(
+                    error_class, failing_host, attempt,
+                    RetryPolicy.max_retries, delay
+                )
+            )
+            time.sleep(delay)
+
+
+class CircuitBreaker:
+    """
+    Per host circuit breaker shared by all workers
+
+    After failure_threshold consecutive transient failures the
+    circuit opens and all requests to the host pause until the
+    open period is over. Then one request probes the host while
+    the others keep waiting. A successful probe closes the
+    circuit, a failed probe opens it again for twice as long
+    up to max_reset_timeout
+    """
+    lock = threading.Lock()
+    breakers: Dict[str, 'CircuitBreaker'] = {}
+
+    failure_threshold = 5
+    reset_timeout = 30.0
+    max_reset_timeout = 600.0
+
+    def __init__(self, host: str) -> None:
+        self.host = host
+        self.failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+        self.condition = threading.Condition()
+
+    @staticmethod
+    def get(host: str) -> 'CircuitBreaker':
+        with CircuitBreaker.lock:
+            if host not in CircuitBreaker.breakers:
+                CircuitBreaker.breakers[host] = CircuitBreaker(host)
+            return CircuitBreaker.breakers[host]
+
+    def wait(self) -> None:
+        """
+        Block while the circuit is open
+        """
+        with self.condition:
+            while self.open_until:
+                delay = self.open_until - time.time()
+                if delay <= 0:
+                    # let this request probe the host, all others
+                    # wait until the probe reports or times out
+                    self.open_until = time.time() + self.reset_timeout
+                    return
+                self.condition.wait(delay)
+
+    def record_success(self) -> None:
+        with self.condition:
+            if self.open_until:
+                logging.info(f'Circuit for {self.host} closed')
+            self.failures = 0
+            self.trips = 0
+            self.open_until = 0.0
+            self.condition.notify_all()
+
+    def record_failure(self, retry_after: float = 0) -> None:
+        with self.condition:
+            self.failures += 1
+            if self.failures < self.failure_threshold and not self.open_until:
+                return
+            self.trips += 1
+            timeout = max(
+                retry_after, min(
+                    self.max_reset_timeout,
+                    self.reset_timeout * 2 ** (self.trips - 1)
+                )
+            )
+            self.open_until = time.time() + timeout
+            logging.warning(
+                f'Circuit for {self.host} open, pausing for {timeout:.0f}s'
+            )
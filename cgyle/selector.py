@@ -0,0 +1,202 @@
+# Copyright (c) 2024 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of cgyle.
+#
+# cgyle is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cgyle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cgyle.  If not, see <http://www.gnu.org/licenses/>
+#
+import re
+import time
+import fnmatch
+from datetime import datetime
+from typing import (
+    List, Dict, Tuple, Callable, Optional, Union
+)
+
+from cgyle.exceptions import CgylePolicyError
+
+# keys of a policy entry selecting tags in addition to its path
+SELECTOR_KEYS = ['tags', 'tags_regex', 'exclude', 'keep', 'order', 'max_age']
+
+
+class TagSelector:
+    """
+    Select the tags of a repository according to a policy entry
+
+    Tags are selected by a glob or a regular expression and can
+    be excluded by globs. Of the selected tags only the newest
+    keep tags are used, ordered by version or by the date the
+    tag was created. With max_age, tags created more than max_age
+    days ago are dropped. Tags with an unknown creation date are
+    considered to be the oldest but are never dropped for their
+    age. The latest tag is not counted against keep
+    """
+    orders = ['version', 'created']
+
+    def __init__(
+        self, tags: str = '', tags_regex: str = '', exclude: List[str] = [],
+        keep: int = 0, order: str = 'version', max_age: int = 0
+    ) -> None:
+        if order not in TagSelector.orders:
+            raise CgylePolicyError(
+                'Invalid tag order {}, use one of {}'.format(
+                    order, ', '.join(TagSelector.orders)
+                )
+            )
+        if keep < 0 or max_age < 0:
+            raise CgylePolicyError('keep and max_age must not be negative')
+        try:
+            self.tags_regex = re.compile(tags_regex) if tags_regex else None
+        except re.error as issue:
+            raise CgylePolicyError(
+                f'Invalid tag expression [{tags_regex}]: {issue}'
+            )
+        self.tags = tags
+        self.exclude = exclude
+        self.keep = keep
+        self.order = order
+        self.max_age = max_age
+
+    @staticmethod
+    def from_policy(entry: dict) -> Optional['TagSelector']:
+        """
+        Create a TagSelector from a policy entry of the form:
+
+        .. code:: yaml
+
+            - path: suse/sle15/**
+              tags: '15.*'
+              exclude: ['*-beta*']
+              keep: 3
+              order: version
+              max_age: 90
+
+        Returns None if the entry does not select tags
+        """
+        unknown = set(entry) - set(SELECTOR_KEYS + ['path', 'priority'])
+        if unknown or not isinstance(entry.get('path'), str):
+            raise CgylePolicyError(
+                'Invalid policy entry {}: expected path and any of {}'.format(
+                    entry, ', '.join(SELECTOR_KEYS)
+                )
+            )
+        if not set(entry).intersection(SELECTOR_KEYS):
+            return None
+        exclude = entry.get('exclude') or []
+        try:
+            return TagSelector(
+                tags=format(entry.get('tags') or ''),
+                tags_regex=format(entry.get('tags_regex') or ''),
+                exclude=[exclude] if isinstance(exclude, str)
+                else [format(pattern) for pattern in exclude],
+                keep=int(entry.get('keep') or 0),
+                order=entry.get('order') or 'version',
+                max_age=int(entry.get('max_age') or 0)
+            )
+        except (TypeError, ValueError) as issue:
+            raise CgylePolicyError(f'Invalid policy entry {entry}: {issue}')
+
+    def needs_created(self) -> bool:
+        """
+        Return True if select needs the creation date of the tags
+        """
+        return self.order == 'created' or bool(self.max_age)
+
+    def match(self, tag: str) -> bool:
+        if self.tags and not fnmatch.fnmatchcase(tag, self.tags):
+            return False
+        if self.tags_regex and not self.tags_regex.match(tag):
+            return False
+        return not any(
+            fnmatch.fnmatchcase(tag, pattern) for pattern in self.exclude
+        )
+
+    def select(
+        self, tags: List[str],
+        get_created: Optional[Callable[[str], Optional[float]]] = None
+    ) -> List[str]:
+        """
+        Return the selected tags newest first, get_created returns
+        the creation time of a tag in seconds since the epoch or
+        None if it is unknown
+        """
+        selected = [tag for tag in tags if self.match(tag)]
+        created: Dict[str, Optional[float]] = {}
+        if self.needs_created() and get_created:
+            created = {
+                tag: get_created(tag) for tag in selected if tag != 'latest'
+            }
+        if self.max_age and created:
+            oldest = time.time() - self.max_age * 86400
+            selected = [
+                tag for tag in selected
+                if (created.get(tag) or oldest) >= oldest
+            ]
+        selected = TagSelector.order_newest(
+            selected, created if self.order == 'created' else {}
+        )
+        if self.keep:
+            newest = [tag for tag in selected if tag != 'latest'][:self.keep]
+            selected = [
+                tag for tag in selected if tag in newest or tag == 'latest'
+            ]
+        return selected
+
+    @staticmethod
+    def order_newest(
+        tags: List[str], created: Dict[str, Optional[float]] = {}
+    ) -> List[str]:
+        """
+        Return tags ordered newest first, by their creation time
+        if given and by version otherwise. The latest tag goes
+        first, tags with an unknown creation time go last
+        """
+        return sorted(
+            tags, key=lambda tag: (
+                tag == 'latest', created.get(tag) or 0.0,
+                TagSelector.get_version_key(tag)
+            ), reverse=True
+        )
+
+    @staticmethod
+    def get_version_key(tag: str) -> Tuple[Tuple[int, Union[int, str]], ...]:
+        """
+        Key ordering tags by version, numeric parts of a tag are
+        compared as numbers such that 15.10 is newer than 15.9
+        """
+        return tuple(
+            (1, int(part)) if part.isdigit() else (0, part)
+            for part in re.split(r'(\d+)', tag) if part
+        )
+
+    @staticmethod
+    def parse_created(created: str) -> Optional[float]:
+        """
+        Parse the RFC 3339 creation date of an image as reported
+        by skopeo inspect into seconds since the epoch
+        """
+        match = re.match(
+            r'^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(\.\d+)?(Z|[+-]\d\d:\d\d)$',
+            created or ''
+        )
+        if not match:
+            return None
+        seconds, fraction, zone = match.groups()
+        # fromisoformat of older Python versions only accepts
+        # microseconds, skopeo reports nanoseconds
+        return datetime.fromisoformat(
+            '{}.{}{}'.format(
+                seconds, (fraction or '.')[1:7].ljust(6, '0'),
+                '+00:00' if zone == 'Z' else zone
+            )
+        ).timestamp()
@@ -0,0 +1,183 @@
+# Copyright (c) 2024 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of cgyle.
+#
+# cgyle is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cgyle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cgyle.  If not, see <http://www.gnu.org/licenses/>
+#
+import os
+import time
+import socket
+import hashlib
+from pathlib import Path
+from contextlib import suppress
+
+from cgyle.exceptions import CgyleShardError
+
+
+class Shard:
+    """
+    Static partition of the work units of a cache update
+
+    A work unit is either a container or, with tags set, a
+    container tag of an arch. The unit belongs to shard i of N
+    if the stable hash of its key modulo N equals i - 1. All
+    nodes compute the same partition without talking to each
+    other
+    """
+    def __init__(self, index: int, count: int, tags: bool = False) -> None:
+        if count < 1 or not 1 <= index <= count:
+            raise CgyleShardError(f'Invalid shard {index}/{count}')
+        self.index = index
+        self.count = count
+        self.tags = tags
+
+    @staticmethod
+    def parse(value: str, tags: bool = False) -> 'Shard':
+        """
+        Create Shard from a specification in the form i/N
+        """
+        index, slash, count = value.partition('/')
+        if not slash or not index.isdigit() or not count.isdigit():
+            raise CgyleShardError(
+                f'Invalid shard {value!r}, expected i/N'
+            )
+        return Shard(int(index), int(count), tags)
+
+    @staticmethod
+    def get_hash(key: str) -> int:
+        return int(hashlib.sha256(key.encode()).hexdigest()[:16], 16)
+
+    def owns(self, key: str) -> bool:
+        return Shard.get_hash(key) % self.count == self.index - 1
+
+
+class Coordinator:
+    """
+    Dynamic partition of the work units of a cache update
+
+    Nodes sharing claim_dir, e.g via NFS, claim a work unit by
+    exclusively creating its claim file. The first node wins, all
+    others skip the unit.
+
+    Claims are scoped to the runs of the nodes. Each run registers
+    itself in the runs directory below claim_dir and deregisters
+    via release when it ends. A claim is live while the run that
+    took it is registered, and for all runs started before the
+    claim was taken. Any other claim is taken over, such that a
+    later run, e.g. the next cycle or a rerun on the same node,
+    processes the unit again. The registration of a run that did
+    not end properly expires after claim_ttl seconds, which must
+    be longer than a cache update takes
+    """
+    def __init__(
+        self, claim_dir: str, tags: bool = False, claim_ttl: int = 6 * 3600
+    ) -> None:
+        self.claim_dir = claim_dir
+        self.tags = tags
+        self.claim_ttl = claim_ttl
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self.run_dir = os.sep.join([claim_dir, 'runs'])
+        self.run_file = os.sep.join([self.run_dir, self.owner])
+        try:
+            Path(self.run_dir).mkdir(parents=True, exist_ok=True)
+            with open(self.run_file, 'w'):
+                pass
+            self.run_start = os.stat(self.run_file).st_mtime_ns
+        except OSError as issue:
+            raise CgyleShardError(
+                f'Failed to register run in {claim_dir}: {issue}'
+            )
+
+    def owns(self, key: str) -> bool:
+        """
+        Claim the work unit of key, returns True if this node
+        holds the claim
+        """
+        claim_file = os.sep.join(
+            [self.claim_dir, hashlib.sha256(key.encode()).hexdigest()]
+        )
+        if self._create(claim_file, key):
+            return True
+        try:
+            mtime = os.stat(claim_file).st_mtime_ns
+            if self._is_live(claim_file, mtime):
+                return False
+            return self._take_over(claim_file, mtime, key)
+        except OSError:
+            return False
+
+    def release(self) -> None:
+        """
+        Deregister the run, its claims are taken over by later runs
+        """
+        with suppress(OSError):
+            os.unlink(self.run_file)
+
+    def _is_live(self, claim_file: str, mtime: int) -> bool:
+        if mtime >= self.run_start:
+            # claimed while this run is active
+            return True
+        with open(claim_file) as claim:
+            owner = claim.read().partition(' ')[0]
+        if not owner or os.sep in owner:
+            return False
+        try:
+            run_mtime = os.path.getmtime(os.sep.join([self.run_dir, owner]))
+        except FileNotFoundError:
+            return False
+        return run_mtime > time.time() - self.claim_ttl
+
+    def _take_over(self, claim_file: str, mtime: int, key: str) -> bool:
+        """
+        Take over the stale claim file of the given mtime. The
+        marker named by the observed mtime is created exclusively
+        such that only one node takes over this claim. The moved
+        claim is checked again, a claim created meanwhile by
+        another node is put back
+        """
+        marker = f'{claim_file}.{mtime}.takeover'
+        if not self._create(marker, key):
+            return False
+        moved = f'{claim_file}.{self.owner}'
+        try:
+            os.rename(claim_file, moved)
+            if os.stat(moved).st_mtime_ns != mtime:
+                with suppress(FileExistsError):
+                    os.link(moved, claim_file)
+                return False
+            return self._create(claim_file, key)
+        finally:
+            with suppress(OSError):
+                os.unlink(moved)
+            with suppress(OSError):
+                os.unlink(marker)
+
+    def _create(self, claim_file: str, key: str) -> bool:
+        """
+        Create the claim file exclusively, it is linked into place
+        such that other nodes never see a claim without its owner
+        """
+        claim_new = f'{claim_file}.{self.owner}.new'
+        try:
+            with open(claim_new, 'w') as claim:
+                claim.write(f'{self.owner} {key}{os.linesep}')
+            os.link(claim_new, claim_file)
+        except FileExistsError:
+            return False
+        except OSError as issue:
+            raise CgyleShardError(f'Failed to claim {key}: {issue}')
+        finally:
+            with suppress(OSError):
+                os.unlink(claim_new)
+        return True
@@ -0,0 +1,145 @@
+# Copyright (c) 2024 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of cgyle.
+#
+# cgyle is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cgyle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cgyle.  If not, see <http://www.gnu.org/licenses/>
+#
+import os
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from typing import (
+    List, Dict
+)
+
+from cgyle.exceptions import CgyleStateError
+
+
+class StateStore:
+    """
+    Persistent failure history of container tags across runs
+
+    Each failed transfer of a container tag and arch is recorded
+    in a sqlite database. A tag failing more than once is put
+    into quarantine for a cool-off period which starts with
+    base_cooloff seconds and doubles with every further failure
+    up to max_cooloff seconds. A successful transfer clears the
+    history of the tag
+    """
+    base_cooloff = 6 * 3600
+    max_cooloff = 7 * 24 * 3600
+
+    # limit for the size in characters of the error output kept
+    # per tag, max_error_lines limits its number of lines
+    max_error_size = 64 * 1024
+
+    def __init__(self, db_file: str, max_error_lines: int = 20) -> None:
+        self.db_file = db_file
+        self.max_error_lines = max_error_lines
+        self.lock = threading.Lock()
+        try:
+            Path(os.path.dirname(os.path.abspath(db_file))).mkdir(
+                parents=True, exist_ok=True
+            )
+            self.db = sqlite3.connect(db_file, check_same_thread=False)
+            with self.db:
+                self.db.execute(
+                    'CREATE TABLE IF NOT EXISTS failures ('
+                    'container TEXT, tag TEXT, arch TEXT, '
+                    'failures INTEGER, last_failure REAL, '
+                    'next_attempt REAL, error TEXT, '
+                    'PRIMARY KEY (container, tag, arch))'
+                )
+        except (OSError, sqlite3.Error) as issue:
+            raise CgyleStateError(
+                f'Failed to open state database {db_file}: {issue}'
+            )
+
+    def is_quarantined(self, container: str, tag: str, arch: str) -> bool:
+        with self.lock:
+            row = self.db.execute(
+                'SELECT next_attempt FROM failures '
+                'WHERE container=? AND tag=? AND arch=?',
+                (container, tag, arch)
+            ).fetchone()
+        return bool(row) and row[0] > time.time()
+
+    def record_failure(
+        self, container: str, tag: str, arch: str, error: str = ''
+    ) -> int:
+        """
+        Record a failed transfer and return the cool-off period
+        in seconds until the tag is tried again
+        """
+        now = time.time()
+        with self.lock, self.db:
+            row = self.db.execute(
+                'SELECT failures FROM failures '
+                'WHERE container=? AND tag=? AND arch=?',
+                (container, tag, arch)
+            ).fetchone()
+            failures = row[0] + 1 if row else 1
+            cooloff = 0
+            if failures > 1:
+                cooloff = min(
+                    self.max_cooloff, self.base_cooloff * 2 ** (failures - 2)
+                )
+            self.db.execute(
+                'INSERT OR REPLACE INTO failures VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (
+                    container, tag, arch, failures, now, now + cooloff,
+                    ''.join(
+                        error.splitlines(True)[-self.max_error_lines:]
+                    )[-self.max_error_size:]
+                )
+            )
+        return cooloff
+
+    def record_success(self, container: str, tag: str, arch: str) -> None:
+        with self.lock, self.db:
+            self.db.execute(
+                'DELETE FROM failures WHERE container=? AND tag=? AND arch=?',
+                (container, tag, arch)
+            )
+
+    def get_quarantined(self) -> List[Dict[str, str]]:
+        """
+        Return the tags currently in quarantine, longest
+        quarantine first
+        """
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT container, tag, arch, failures, next_attempt, error '
+                'FROM failures WHERE next_attempt > ? '
+                'ORDER BY next_attempt DESC, container, tag, arch',
+                (time.time(),)
+            ).fetchall()
+        return [
+            {
+                'container': container,
+                'tag': tag,
+                'arch': arch,
+                'failures': format(failures),
+                'until': time.strftime(
+                    '%Y-%m-%d %H:%M:%S', time.localtime(next_attempt)
+                ),
+                'error': error.strip().splitlines()[-1] if error.strip()
+                else ''
+            } for container, tag, arch, failures, next_attempt, error in rows
+        ]
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,200 @@
+# Copyright (c) 2024 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of cgyle.
+#
+# cgyle is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cgyle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cgyle.  If not, see <http://www.gnu.org/licenses/>
+#
+import json
+import time
+import logging
+import threading
+from typing import (
+    Dict, Optional, Any
+)
+
+from cgyle.metrics import (
+    Metrics, MetricsHandler
+)
+from cgyle.report import TransferReport
+from cgyle.atomic import AtomicFile
+from cgyle.exceptions import CgyleStatusError
+
+
+class Status:
+    """
+    Live status of a running cgyle run
+
+    Workers only announce the container and tag they are working
+    on. Container and tag counts are taken from the run Metrics
+    and the transferred bytes from the TransferReport at the time
+    a snapshot is requested, such that keeping the status up to
+    date costs nothing beyond the bookkeeping done anyway
+    """
+    lock = threading.Lock()
+    start_time = 0.0
+    finished = False
+    workers: Dict[str, Dict[str, Any]] = {}
+
+    @staticmethod
+    def start() -> None:
+        with Status.lock:
+            Status.start_time = time.time()
+            Status.finished = False
+            Status.workers = {}
+
+    @staticmethod
+    def finish() -> None:
+        with Status.lock:
+            Status.finished = True
+            Status.workers = {}
+
+    @staticmethod
+    def begin(container: str) -> None:
+        """
+        Announce the calling worker to process container
+        """
+        with Status.lock:
+            Status.workers[threading.current_thread().name] = {
+                'container': container,
+                'tag': '',
+                'progress': '',
+                'since': time.time()
+            }
+
+    @staticmethod
+    def update(tag: str, progress: str) -> None:
+        """
+        Announce the calling worker to transfer tag of its
+        container, progress describes the position of the tag
+        """
+        with Status.lock:
+            worker = Status.workers.get(threading.current_thread().name)
+            if worker:
+                worker['tag'] = tag
+                worker['progress'] = progress
+
+    @staticmethod
+    def end() -> None:
+        with Status.lock:
+            Status.workers.pop(threading.current_thread().name, None)
+
+    @staticmethod
+    def get() -> Dict[str, Any]:
+        now = time.time()
+        with Status.lock:
+            elapsed = now - Status.start_time if Status.start_time else 0.0
+            finished = Status.finished
+            workers = {
+                name: dict(
+                    worker, busy=round(now - worker['since'], 3)
+                ) for name, worker in sorted(Status.workers.items())
+            }
+        containers = {
+            state: int(Metrics.get('cgyle_containers_total', state=state))
+            for state in ['planned', 'done', 'failed', 'skipped', 'deferred']
+        }
+        processed = sum(
+            containers[state]
+            for state in ['done', 'failed', 'skipped', 'deferred']
+        )
+        containers['remaining'] = max(containers['planned'] - processed, 0)
+        tags = {
+            state: int(Metrics.get('cgyle_tags_total', state=state))
+            for state in ['done', 'failed', 'skipped', 'deferred']
+        }
+        transferred = TransferReport.get_bytes()
+        eta: Optional[float] = None
+        if finished:
+            eta = 0.0
+        elif processed and elapsed:
+            eta = round(elapsed / processed * containers['remaining'], 3)
+        minutes = elapsed / 60
+        return {
+            'state': 'finished' if finished else 'running',
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'elapsed': round(elapsed, 3),
+            'eta': eta,
+            'containers': containers,
+            'tags': tags,
+            'bytes': transferred,
+            'rates': {
+                'containers_per_minute': round(processed / minutes, 3)
+                if minutes else 0.0,
+                'tags_per_minute': round(sum(tags.values()) / minutes, 3)
+                if minutes else 0.0,
+                'bytes_per_second': round(transferred / elapsed, 3)
+                if elapsed else 0.0
+            },
+            'queue_depth': int(Metrics.get('cgyle_queue_depth')),
+            'workers': workers
+        }
+
+    @staticmethod
+    def write(filename: str) -> None:
+        """
+        Write the status as JSON to filename, the file is
+        replaced atomically such that readers never see a
+        partially written status
+        """
+        AtomicFile.write_json(
+            filename, Status.get(), '.status.', CgyleStatusError,
+            f'Failed to write status {filename}'
+        )
+
+
+class StatusHandler(MetricsHandler):
+    """
+    Serve the run status on /status in addition to /metrics
+    """
+    def do_GET(self) -> None:
+        if self.path != '/status':
+            super().do_GET()
+            return
+        body = json.dumps(Status.get(), indent=2).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', format(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StatusFile:
+    """
+    Rewrite the status file every interval seconds while the
+    context is active and a last time when it is left
+    """
+    def __init__(self, filename: str, interval: float) -> None:
+        self.filename = filename
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.thread.join()
+        self._write()
+
+    def _run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self._write()
+
+    def _write(self) -> None:
+        try:
+            Status.write(self.filename)
+        except CgyleStatusError as issue:
+            logging.error(format(issue))
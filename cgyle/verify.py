@@ -0,0 +1,436 @@
+# Copyright (c) 2024 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of cgyle.
+#
+# cgyle is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cgyle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cgyle.  If not, see <http://www.gnu.org/licenses/>
+#
+import os
+import re
+import glob
+import json
+import time
+import hashlib
+import logging
+import tarfile
+import concurrent.futures
+from typing import (
+    List, Dict, Set, Tuple, Callable, Container, Optional, Any
+)
+
+from cgyle.metrics import Metrics
+from cgyle.oci_layout import OCILayout
+from cgyle.atomic import AtomicFile
+from cgyle.exceptions import (
+    CgyleError,
+    CgyleVerifyError
+)
+
+BLOB_NAME = re.compile(r'^[0-9a-f]{64}$')
+
+
+class Verifier:
+    """
+    Integrity audit of the content stored by cgyle
+
+    Verifies the blob tree of a local distribution cache, an OCI
+    image layout or the oci-archive tarballs below a store-oci
+    directory. Each blob is hashed in a process pool and compared
+    against the digest it is stored under. The manifests of all
+    tags are walked to find the tags whose content is corrupt or
+    missing. Blobs not referenced by any tag are reported as
+    orphaned. Child manifests of an index are only checked if
+    present, as a single arch copy does not store the others
+    """
+    # large layers are hashed in chunks of this size
+    buffer_size = 4 * 1024 * 1024
+
+    def __init__(self, processes: int = 0) -> None:
+        self.processes = processes or os.cpu_count() or 1
+
+    @Metrics.timed('cgyle_phase_duration_seconds', phase='verify')
+    def verify_distribution(self, data_dir: str) -> Dict[str, Any]:
+        """
+        Verify the storage tree of a local distribution cache
+        """
+        tags: Dict[Tuple[str, str, str], str] = {
+            (container, tag, ''): digest for (container, tag), digest
+            in Verifier.get_distribution_tags(data_dir).items()
+        }
+        return self._verify(
+            'distribution', data_dir,
+            Verifier.get_distribution_blobs(data_dir), tags
+        )
+
+    @Metrics.timed('cgyle_phase_duration_seconds', phase='verify')
+    def verify_layout(self, root_dir: str) -> Dict[str, Any]:
+        """
+        Verify the OCI image layout below root_dir
+        """
+        tags: Dict[Tuple[str, str, str], str] = {}
+        for ref, descriptor in OCILayout(root_dir).get_references().items():
+            container, tag, arch = ref.rsplit(':', 2)
+            tags[(container, tag, arch)] = descriptor.get('digest', '')
+        return self._verify(
+            'oci-layout', root_dir, Verifier.get_layout_blobs(root_dir), tags
+        )
+
+    @staticmethod
+    def get_distribution_blobs(data_dir: str) -> Dict[str, str]:
+        """
+        Return the data file of each blob of a distribution cache
+        """
+        return {
+            'sha256:{}'.format(os.path.basename(os.path.dirname(path))): path
+            for path in glob.glob(
+                os.sep.join(
+                    [
+                        data_dir, 'docker', 'registry', 'v2', 'blobs',
+                        'sha256', '*', '*', 'data'
+                    ]
+                )
+            )
+        }
+
+    @staticmethod
+    def get_distribution_tags(data_dir: str) -> Dict[Tuple[str, str], str]:
+        """
+        Return the manifest digest of each container tag of a
+        distribution cache, empty if the tag link is empty
+        """
+        repositories = os.sep.join(
+            [data_dir, 'docker', 'registry', 'v2', 'repositories']
+        )
+        tags: Dict[Tuple[str, str], str] = {}
+        for link in glob.glob(
+            os.sep.join(
+                [repositories, '**', '_manifests', 'tags', '*', 'current', 'link']
+            ), recursive=True
+        ):
+            tag_dir = os.path.dirname(os.path.dirname(link))
+            container = os.path.relpath(
+                os.path.dirname(os.path.dirname(os.path.dirname(tag_dir))),
+                repositories
+            )
+            with open(link) as link_file:
+                tags[(container, os.path.basename(tag_dir))] = \
+                    link_file.read().strip()
+        return tags
+
+    @staticmethod
+    def get_layout_blobs(root_dir: str) -> Dict[str, str]:
+        """
+        Return the file of each blob of an OCI image layout
+        """
+        blob_dir = os.sep.join([OCILayout(root_dir).blob_dir, 'sha256'])
+        return {
+            f'sha256:{name}': os.sep.join([blob_dir, name])
+            for name in (
+                os.listdir(blob_dir) if os.path.isdir(blob_dir) else []
+            ) if BLOB_NAME.match(name)
+        }
+
+    @Metrics.timed('cgyle_phase_duration_seconds', phase='verify')
+    def verify_archives(self, root_dir: str) -> Dict[str, Any]:
+        """
+        Verify the oci-archive tarballs below root_dir. Content
+        is only reported per archive, orphans are not tracked
+        """
+        start = time.monotonic()
+        archives = sorted(
+            glob.glob(
+                os.sep.join([root_dir, '**', '*.oci.tar']), recursive=True
+            )
+        )
+        result = Verifier._get_result('oci-archive', root_dir)
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.processes
+        ) as executor:
+            for archive, state in zip(
+                archives, executor.map(Verifier.verify_archive, archives)
+            ):
+                result['blobs'] += state['blobs']
+                result['bytes'] += state['bytes']
+                result['missing'] += state['missing']
+                if not state['error'] and not state['corrupt'] and \
+                   not state['missing']:
+                    continue
+                if state['error']:
+                    logging.warning(f'Failed to read {archive}: {state["error"]}')
+                result['corrupt'].append(archive)
+                unit = Verifier.get_archive_unit(
+                    root_dir, archive, state['tag']
+                )
+                if unit:
+                    result['affected'].append(list(unit))
+                else:
+                    logging.warning(
+                        f'No container tag found for {archive}'
+                    )
+        result['seconds'] = round(time.monotonic() - start, 3)
+        return result
+
+    @staticmethod
+    def verify_archive(archive_name: str) -> Dict[str, Any]:
+        """
+        Hash the blobs of an oci-archive tarball and walk its
+        manifests. Runs in a worker process
+        """
+        state: Dict[str, Any] = {
+            'tag': '', 'blobs': 0, 'bytes': 0, 'corrupt': [],
+            'missing': [], 'error': ''
+        }
+        try:
+            with tarfile.open(archive_name) as archive:
+                members = {}
+                for member in archive.getmembers():
+                    path = member.name.lstrip('./')
+                    if path.startswith('blobs/sha256/') and member.isfile():
+                        digest = 'sha256:{}'.format(os.path.basename(path))
+                        members[digest] = member
+                        hashed, size = Verifier.hash_stream(
+                            archive.extractfile(member)
+                        )
+                        state['blobs'] += 1
+                        state['bytes'] += size
+                        if hashed != digest:
+                            state['corrupt'].append(digest)
+                    elif path == 'index.json':
+                        members[path] = member
+
+                def read_manifest(digest: str) -> dict:
+                    return Verifier._load_manifest(
+                        archive.extractfile(members[digest])
+                    )
+                index = read_manifest('index.json') \
+                    if 'index.json' in members else {}
+                for descriptor in index.get('manifests', []):
+                    state['tag'] = descriptor.get('annotations', {}).get(
+                        'org.opencontainers.image.ref.name', ''
+                    )
+                    state['missing'] += Verifier.walk(
+                        descriptor.get('digest', ''), members,
+                        set(state['corrupt']), read_manifest
+                    )[1]
+                if not index.get('manifests'):
+                    state['error'] = 'no image in archive'
+        except (tarfile.TarError, EOFError, OSError) as issue:
+            state['error'] = format(issue)
+        return state
+
+    @staticmethod
+    def walk(
+        digest: str, present: Container[str], corrupt: Set[str],
+        read_manifest: Callable[[str], dict]
+    ) -> Tuple[List[str], List[str]]:
+        """
+        Return the present and the missing digests referenced by
+        the manifest digest. Missing child manifests of an index
+        are not reported
+        """
+        found: List[str] = []
+        missing: List[str] = []
+        pending = [(digest, True, True)]
+        while pending:
+            current, required, is_manifest = pending.pop(0)
+            if current in found or current in missing:
+                continue
+            if current not in present:
+                if required:
+                    missing.append(current)
+                continue
+            found.append(current)
+            if not is_manifest or current in corrupt:
+                continue
+            manifest = read_manifest(current)
+            for child in manifest.get('manifests', []):
+                pending.append((child.get('digest', ''), False, True))
+            blobs = [manifest['config']] if manifest.get('config') else []
+            for blob in blobs + manifest.get('layers', []):
+                pending.append((blob.get('digest', ''), True, False))
+        return (found, missing)
+
+    @staticmethod
+    def hash_file(path: str) -> Tuple[str, int]:
+        """
+        Return the sha256 digest and the size of the file, the
+        digest is empty if the file cannot be read. Runs in a
+        worker process
+        """
+        try:
+            with open(path, 'rb', buffering=0) as blob:
+                return Verifier.hash_stream(blob)
+        except OSError as issue:
+            logging.warning(f'Failed to read {path}: {issue}')
+            return ('', 0)
+
+    @staticmethod
+    def hash_stream(stream: Any) -> Tuple[str, int]:
+        digest = hashlib.sha256()
+        size = 0
+        buffer = bytearray(Verifier.buffer_size)
+        view = memoryview(buffer)
+        while True:
+            count = stream.readinto(buffer)
+            if not count:
+                break
+            digest.update(view[:count])
+            size += count
+        return (f'sha256:{digest.hexdigest()}', size)
+
+    @staticmethod
+    def get_archive_unit(
+        root_dir: str, archive_name: str, tag: str
+    ) -> Optional[Tuple[str, str, str]]:
+        """
+        Return container, tag and arch of an archive stored as
+        container-tag-arch.oci.tar below root_dir. If the tag
+        could not be read from the archive, it is looked up in
+        the tag logs below root_dir
+        """
+        name = os.path.relpath(archive_name, root_dir)[:-len('.oci.tar')]
+        name, _, arch = name.rpartition('-')
+        if tag:
+            if name.endswith(f'-{tag}'):
+                return (name[:-len(tag) - 1], tag, arch)
+            return None
+        position = name.find('-', len(os.path.dirname(name)))
+        while position > 0:
+            container, tag = name[:position], name[position + 1:]
+            tag_log_name = f'{root_dir}/{container}-{arch}.tags'
+            if os.path.exists(tag_log_name):
+                with open(tag_log_name) as taglog:
+                    if tag in [line.rstrip() for line in taglog]:
+                        return (container, tag, arch)
+            position = name.find('-', position + 1)
+        return None
+
+    @staticmethod
+    def repair(result: Dict[str, Any]) -> None:
+        """
+        Remove the corrupt content of a verification result such
+        that it gets transferred again. For an OCI image layout
+        the references of the affected tags are removed as well
+        """
+        try:
+            for path in result['corrupt']:
+                if os.path.exists(path):
+                    os.unlink(path)
+            if result['kind'] != 'distribution' and os.path.exists(
+                os.sep.join([result['root'], 'index.json'])
+            ):
+                layout = OCILayout(result['root'])
+                for container, tag, arch in result['affected']:
+                    layout.remove_reference(
+                        OCILayout.get_reference(container, tag, arch)
+                    )
+        except (OSError, CgyleError) as issue:
+            raise CgyleVerifyError(
+                f'Failed to repair {result["root"]}: {issue}'
+            )
+
+    @staticmethod
+    def log(result: Dict[str, Any]) -> None:
+        for path in result['corrupt']:
+            logging.warning(f'Corrupt: {path}')
+        for digest in result['missing']:
+            logging.warning(f'Missing: {digest}')
+        for container, tag, arch in result['affected']:
+            logging.warning(
+                'Affected: {}:{}{}'.format(
+                    container, tag, f' arch:{arch}' if arch else ''
+                )
+            )
+        logging.info(
+            'Verified {} {}: blobs:{} size:{}MB corrupt:{} missing:{} '
+            'orphaned:{} affected tags:{} in {:.1f}s'.format(
+                result['kind'], result['root'], result['blobs'],
+                result['bytes'] // (1024 * 1024), len(result['corrupt']),
+                len(result['missing']), len(result['orphaned']),
+                len(result['affected']), result['seconds']
+            )
+        )
+
+    @staticmethod
+    def write(results: List[Dict[str, Any]], filename: str) -> None:
+        """
+        Write the verification results as JSON to filename
+        """
+        AtomicFile.write_json(
+            filename, results, '.verify.', CgyleVerifyError,
+            f'Failed to write verification report {filename}'
+        )
+
+    def _verify(
+        self, kind: str, root: str, blobs: Dict[str, str],
+        tags: Dict[Tuple[str, str, str], str]
+    ) -> Dict[str, Any]:
+        start = time.monotonic()
+        result = Verifier._get_result(kind, root)
+        digests = sorted(blobs)
+        corrupt: Set[str] = set()
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.processes
+        ) as executor:
+            for digest, (hashed, size) in zip(
+                digests, executor.map(
+                    Verifier.hash_file, [blobs[digest] for digest in digests],
+                    chunksize=16
+                )
+            ):
+                result['bytes'] += size
+                if hashed != digest:
+                    corrupt.add(digest)
+        referenced: Set[str] = set()
+        missing: Set[str] = set()
+        for (container, tag, arch), digest in sorted(tags.items()):
+            found, absent = Verifier.walk(
+                digest, blobs, corrupt,
+                lambda digest: Verifier.read_manifest(blobs[digest])
+            ) if digest else ([], [f'{container}:{tag}'])
+            referenced.update(found)
+            missing.update(absent)
+            if absent or corrupt.intersection(found):
+                result['affected'].append([container, tag, arch])
+        result['blobs'] = len(blobs)
+        result['corrupt'] = sorted(blobs[digest] for digest in corrupt)
+        result['missing'] = sorted(missing)
+        result['orphaned'] = sorted(
+            blobs[digest] for digest in set(blobs) - referenced
+        )
+        result['seconds'] = round(time.monotonic() - start, 3)
+        return result
+
+    @staticmethod
+    def _get_result(kind: str, root: str) -> Dict[str, Any]:
+        return {
+            'kind': kind, 'root': root, 'blobs': 0, 'bytes': 0,
+            'seconds': 0.0, 'corrupt': [], 'missing': [], 'orphaned': [],
+            'affected': []
+        }
+
+    @staticmethod
+    def read_manifest(path: str) -> dict:
+        try:
+            with open(path, 'rb') as manifest:
+                return Verifier._load_manifest(manifest)
+        except OSError:
+            return {}
+
+    @staticmethod
+    def _load_manifest(stream: Any) -> dict:
+        try:
+            manifest = json.loads(stream.read())
+            return manifest if isinstance(manifest, dict) else {}
+        except ValueError:
+            return {}
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# Copyright (c) 2024 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of cgyle.
+#
+# cgyle is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cgyle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cgyle.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+usage: catalog_bench.py -h | --help
+       catalog_bench.py [--patterns=<number>...] [--entries=<number>...]
+           [--arch=<arch>...]
+           [--repeat=<number>]
+           [--verify-entries=<number>]
+           [--seed=<number>]
+           [--output=<file>]
+
+Micro benchmark of Catalog.translate_policy and Catalog.apply_filter.
+Synthetic policies with * and ** globs and arch scoped paths are
+translated, compiled and matched against synthetic catalogs for
+each combination of the given pattern and entry counts. The best
+time of the repeated runs and the peak memory of each step are
+reported. The result of apply_filter is checked against an
+independent glob matcher on a sample of each catalog
+
+options:
+    --patterns=<number>...
+        Number of policy patterns [default: 100 1000]
+
+    --entries=<number>...
+        Number of catalog entries [default: 1000 10000]
+
+    --arch=<arch>...
+        Arch selection passed to translate_policy, patterns scoped
+        to other archs are skipped
+
+    --repeat=<number>
+        Number of timed runs per step, the best is reported
+        [default: 3]
+
+    --verify-entries=<number>
+        Size of the catalog sample checked against the reference
+        glob matcher, 0 disables the check [default: 2000]
+
+    --seed=<number>
+        Seed of the synthetic data [default: 42]
+
+    --output=<file>
+        Write the results as JSON to file in addition
+"""
+import os
+import re
+import sys
+import json
+import time
+import yaml
+import random
+import functools
+import tracemalloc
+from tempfile import TemporaryDirectory
+from typing import (
+    List, Dict, Set, Tuple, Callable, Any
+)
+from docopt import docopt
+
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)
+    )))
+)
+
+from cgyle.catalog import Catalog  # noqa: E402
+
+NAMESPACES = [
+    'bci', 'suse', 'foo', 'opensuse', 'rancher', 'sles', 'containers',
+    'neuvector', 'cloud', 'trento'
+]
+NAMES = [
+    'base', 'minimal', 'micro', 'busybox', 'python', 'golang', 'nodejs',
+    'ruby', 'php', 'openjdk', 'nginx', 'postgres', 'mariadb', 'git'
+]
+ARCHS = ['x86_64', 'aarch64', 's390x', 'ppc64le']
+
+
+def create_catalog(entries: int, rng: random.Random) -> List[str]:
+    catalog: Set[str] = set()
+    while len(catalog) < entries:
+        namespace = rng.choice(NAMESPACES)
+        name = '{}-{}'.format(rng.choice(NAMES), rng.randrange(entries))
+        depth = rng.randrange(4)
+        if depth == 0:
+            catalog.add(f'{namespace}/{name}')
+        elif depth == 1:
+            catalog.add(f'{namespace}/images/{name}')
+        elif depth == 2:
+            catalog.add(
+                '{}/{}/{}/{}'.format(
+                    namespace, rng.choice(NAMES), rng.choice(ARCHS), name
+                )
+            )
+        else:
+            catalog.add(
+                '{}/{}/{}/bar/{}/tag-{}'.format(
+                    namespace, rng.choice(NAMES), rng.choice(ARCHS),
+                    name, rng.randrange(10)
+                )
+            )
+    return sorted(catalog)
+
+
+def create_policy(patterns: int, rng: random.Random) -> Dict[str, List[str]]:
+    templates: List[Callable[[], str]] = [
+        lambda: '{}/{}-{}'.format(
+            rng.choice(NAMESPACES), rng.choice(NAMES), rng.randrange(patterns)
+        ),
+        lambda: '{}/{}-*'.format(rng.choice(NAMESPACES), rng.choice(NAMES)),
+        lambda: '{}/images/{}*'.format(
+            rng.choice(NAMESPACES), rng.choice(NAMES)
+        ),
+        lambda: '{}/{}/**'.format(rng.choice(NAMESPACES), rng.choice(NAMES)),
+        lambda: '{}/*/{}/bar/**'.format(
+            rng.choice(NAMESPACES), rng.choice(ARCHS)
+        ),
+        lambda: '{}/*/{}/{}-{}'.format(
+            rng.choice(NAMESPACES), rng.choice(ARCHS), rng.choice(NAMES),
+            rng.randrange(patterns)
+        )
+    ]
+    policy: Dict[str, List[str]] = {'free': [], 'restricted': []}
+    for count in range(patterns):
+        policy['free' if count % 2 else 'restricted'].append(
+            rng.choice(templates)()
+        )
+    return policy
+
+
+def glob_match(pattern: str, name: str) -> bool:
+    """
+    Reference matcher of the policy glob semantics: * matches
+    anything but a slash and ** matches anything
+    """
+    @functools.lru_cache(maxsize=None)
+    def match(position: int, offset: int) -> bool:
+        if position == len(pattern):
+            return offset == len(name)
+        if pattern.startswith('**', position):
+            return any(
+                match(position + 2, rest)
+                for rest in range(offset, len(name) + 1)
+            )
+        if pattern[position] == '*':
+            rest = offset
+            while True:
+                if match(position + 1, rest):
+                    return True
+                if rest == len(name) or name[rest] == '/':
+                    return False
+                rest += 1
+        return offset < len(name) and name[offset] == pattern[position] \
+            and match(position + 1, offset + 1)
+    return match(0, 0)
+
+
+def reference_filter(
+    catalog: List[str], policy: Dict[str, List[str]], use_archs: List[str]
+) -> List[str]:
+    skip_archs = [
+        arch for arch in Catalog.get_arch_list() if arch not in use_archs
+    ] if use_archs else []
+    globs = [
+        pattern for patterns in policy.values() for pattern in patterns
+        if not any(arch in pattern for arch in skip_archs)
+    ]
+    return sorted(
+        entry for entry in catalog
+        if any(glob_match(pattern, entry) for pattern in globs)
+    )
+
+
+def measure(function: Callable[[], Any], repeat: int) -> Tuple[Any, float, int]:
+    """
+    Return the result, the best time in seconds of repeat runs
+    and the peak memory in bytes of function
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        re.purge()
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    re.purge()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return (result, best, peak)
+
+
+def run_case(
+    patterns: int, entries: int, use_archs: List[str], repeat: int,
+    verify_entries: int, seed: int, work_dir: str
+) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    policy = create_policy(patterns, rng)
+    catalog = create_catalog(entries, rng)
+    policy_file = os.sep.join([work_dir, f'policy-{patterns}.yml'])
+    with open(policy_file, 'w') as policy_out:
+        yaml.safe_dump(policy, policy_out)
+    catalog_api = Catalog()
+    rules, translate_time, translate_peak = measure(
+        lambda: catalog_api.translate_policy(policy_file, [], use_archs),
+        repeat
+    )
+    _, compile_time, compile_peak = measure(
+        lambda: [re.compile(rule) for rule in rules], repeat
+    )
+    result, filter_time, filter_peak = measure(
+        lambda: catalog_api.apply_filter(catalog, rules), repeat
+    )
+    case: Dict[str, Any] = {
+        'patterns': patterns,
+        'rules': len(rules),
+        'entries': entries,
+        'matches': len(result),
+        'translate': {'seconds': translate_time, 'peak_bytes': translate_peak},
+        'compile': {'seconds': compile_time, 'peak_bytes': compile_peak},
+        'filter': {
+            'seconds': filter_time, 'peak_bytes': filter_peak,
+            'entries_per_second': round(entries / filter_time)
+            if filter_time else 0
+        },
+        'verified': None
+    }
+    if verify_entries:
+        sample = sorted(rng.sample(catalog, min(verify_entries, entries)))
+        expected = reference_filter(sample, policy, use_archs)
+        actual = catalog_api.apply_filter(sample, rules)
+        case['verified'] = actual == expected
+        if actual != expected:
+            case['mismatches'] = sorted(
+                set(actual).symmetric_difference(expected)
+            )[:10]
+    return case
+
+
+def main() -> int:
+    arguments = docopt(__doc__)
+    cases = []
+    with TemporaryDirectory(prefix='cgyle-bench.') as work_dir:
+        for patterns in arguments['--patterns']:
+            for entries in arguments['--entries']:
+                case = run_case(
+                    int(patterns), int(entries), arguments['--arch'],
+                    int(arguments['--repeat']),
+                    int(arguments['--verify-entries']),
+                    int(arguments['--seed']), work_dir
+                )
+                cases.append(case)
+                print(
+                    'patterns:{} entries:{} matches:{} translate:{:.4f}s '
+                    'compile:{:.4f}s filter:{:.4f}s peak:{}KB verified:{}'.format(
+                        case['patterns'], case['entries'], case['matches'],
+                        case['translate']['seconds'],
+                        case['compile']['seconds'],
+                        case['filter']['seconds'],
+                        max(
+                            case[step]['peak_bytes']
+                            for step in ['translate', 'compile', 'filter']
+                        ) // 1024,
+                        case['verified']
+                    )
+                )
+    if arguments['--output']:
+        with open(arguments['--output'], 'w') as result_file:
+            json.dump(cases, result_file, indent=2)
+    if any(case['verified'] is False for case in cases):
+        sys.stderr.write('apply_filter differs from the reference matcher\n')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
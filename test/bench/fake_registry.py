@@ -0,0 +1,274 @@
+# Copyright (c) 2024 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of cgyle.
+#
+# cgyle is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cgyle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cgyle.  If not, see <http://www.gnu.org/licenses/>
+#
+import re
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+from http.server import (
+    BaseHTTPRequestHandler, ThreadingHTTPServer
+)
+from typing import (
+    List, Dict, Tuple, Optional, Any
+)
+
+MANIFEST_TYPE = 'application/vnd.oci.image.manifest.v1+json'
+CONFIG_TYPE = 'application/vnd.oci.image.config.v1+json'
+LAYER_TYPE = 'application/vnd.oci.image.layer.v1.tar+gzip'
+
+MANIFEST_PATH = re.compile(r'^/v2/(.+)/(manifests|blobs)/([^/]+)$')
+TAGS_PATH = re.compile(r'^/v2/(.+)/tags/list$')
+
+
+class FakeRegistry:
+    """
+    Local stand-in for a v2 registry with a synthetic catalog
+
+    The registry serves containers bench/container-<n>, each with
+    tags 1.<n> and latest. Every tag consists of a config blob, a
+    base layer shared by all containers and further layers of its
+    own. Blob content is generated from the blob name, such that
+    digests are real but nothing needs to be stored on disk.
+    Each request is delayed by latency seconds, blobs are sent
+    at bandwidth bytes per second per connection (0 means
+    unlimited) and a share of error_rate requests fails with a
+    503 Service Unavailable error
+    """
+    def __init__(
+        self, containers: int = 20, tags: int = 5, layers: int = 3,
+        blob_size: int = 64 * 1024, latency: float = 0.0,
+        bandwidth: int = 0, error_rate: float = 0.0, seed: int = 42
+    ) -> None:
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.blobs: Dict[str, Tuple[str, int]] = {}
+        self.manifests: Dict[Tuple[str, str], bytes] = {}
+        self.tags: Dict[str, List[str]] = {}
+        base = self._add_blob('base', blob_size)
+        for container_count in range(containers):
+            name = f'bench/container-{container_count:04d}'
+            self.tags[name] = []
+            for tag_count in range(tags):
+                tag = f'1.{tag_count}'
+                self.tags[name].append(tag)
+                self.manifests[(name, tag)] = self._create_manifest(
+                    f'{name}:{tag}', [base] + [
+                        self._add_blob(f'{name}:{tag}:{layer}', blob_size)
+                        for layer in range(1, layers)
+                    ]
+                )
+            if tags:
+                self.tags[name].append('latest')
+                self.manifests[(name, 'latest')] = \
+                    self.manifests[(name, self.tags[name][-2])]
+        self.server = ThreadingHTTPServer(
+            ('127.0.0.1', 0), self._get_handler()
+        )
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True
+        )
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_address(self) -> str:
+        return '{}:{}'.format(*self.server.server_address)
+
+    def get_tag_count(self) -> int:
+        return sum(len(tags) for tags in self.tags.values())
+
+    def get_blob(self, digest: str) -> Optional[bytes]:
+        if digest not in self.blobs:
+            return None
+        name, size = self.blobs[digest]
+        return self._get_content(name, size)
+
+    def get_manifest(self, name: str, reference: str) -> Optional[bytes]:
+        if reference.startswith('sha256:'):
+            for (repo, tag), manifest in self.manifests.items():
+                if repo == name and \
+                   reference == FakeRegistry.get_digest(manifest):
+                    return manifest
+            return None
+        return self.manifests.get((name, reference))
+
+    def fail(self) -> bool:
+        """
+        Account a request and return True if it should fail
+        """
+        with self.lock:
+            self.requests += 1
+            failed = self.random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        return failed
+
+    @staticmethod
+    def get_digest(content: bytes) -> str:
+        return f'sha256:{hashlib.sha256(content).hexdigest()}'
+
+    def _add_blob(self, name: str, size: int) -> Dict[str, Any]:
+        digest = FakeRegistry.get_digest(self._get_content(name, size))
+        self.blobs[digest] = (name, size)
+        return {'mediaType': LAYER_TYPE, 'digest': digest, 'size': size}
+
+    def _create_manifest(
+        self, name: str, layers: List[Dict[str, Any]]
+    ) -> bytes:
+        config = json.dumps(
+            {
+                'architecture': 'amd64', 'os': 'linux',
+                'config': {'Labels': {'name': name}},
+                'rootfs': {
+                    'type': 'layers',
+                    'diff_ids': [layer['digest'] for layer in layers]
+                }
+            }
+        ).encode()
+        config_digest = FakeRegistry.get_digest(config)
+        self.blobs[config_digest] = (f'config:{config.decode()}', 0)
+        return json.dumps(
+            {
+                'schemaVersion': 2,
+                'mediaType': MANIFEST_TYPE,
+                'config': {
+                    'mediaType': CONFIG_TYPE,
+                    'digest': config_digest,
+                    'size': len(config)
+                },
+                'layers': layers
+            }
+        ).encode()
+
+    @staticmethod
+    def _get_content(name: str, size: int) -> bytes:
+        if name.startswith('config:'):
+            return name[len('config:'):].encode()
+        pattern = hashlib.sha256(name.encode()).digest()
+        return (pattern * (size // len(pattern) + 1))[:size]
+
+    def _get_handler(self) -> type:
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_HEAD(self) -> None:
+                self._handle(send_body=False)
+
+            def do_GET(self) -> None:
+                self._handle(send_body=True)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                logging.debug(f'fake registry: {format % args}')
+
+            def _handle(self, send_body: bool) -> None:
+                if registry.latency:
+                    time.sleep(registry.latency)
+                if registry.fail():
+                    self._send_json(
+                        503, {
+                            'errors': [
+                                {
+                                    'code': 'UNAVAILABLE',
+                                    'message': 'service unavailable'
+                                }
+                            ]
+                        }
+                    )
+                    return
+                path = self.path.partition('?')[0]
+                if path in ['/v2', '/v2/']:
+                    self._send_json(200, {})
+                elif path == '/v2/_catalog':
+                    self._send_json(
+                        200, {'repositories': sorted(registry.tags)}
+                    )
+                elif TAGS_PATH.match(path):
+                    name = TAGS_PATH.match(path).group(1)  # type: ignore
+                    if name in registry.tags:
+                        self._send_json(
+                            200, {'name': name, 'tags': registry.tags[name]}
+                        )
+                    else:
+                        self._send_unknown('NAME_UNKNOWN')
+                elif MANIFEST_PATH.match(path):
+                    name, kind, reference = MANIFEST_PATH.match(
+                        path
+                    ).groups()  # type: ignore
+                    if kind == 'manifests':
+                        content = registry.get_manifest(name, reference)
+                        content_type = MANIFEST_TYPE
+                    else:
+                        content = registry.get_blob(reference)
+                        content_type = 'application/octet-stream'
+                    if content is None:
+                        self._send_unknown(
+                            'MANIFEST_UNKNOWN' if kind == 'manifests'
+                            else 'BLOB_UNKNOWN'
+                        )
+                        return
+                    self.send_response(200)
+                    self.send_header('Content-Type', content_type)
+                    self.send_header('Content-Length', format(len(content)))
+                    self.send_header(
+                        'Docker-Content-Digest',
+                        FakeRegistry.get_digest(content)
+                    )
+                    self.end_headers()
+                    if send_body:
+                        self._send_body(content)
+                else:
+                    self._send_unknown('UNSUPPORTED')
+
+            def _send_body(self, content: bytes) -> None:
+                chunk_size = 16 * 1024
+                for offset in range(0, len(content), chunk_size):
+                    chunk = content[offset:offset + chunk_size]
+                    self.wfile.write(chunk)
+                    if registry.bandwidth:
+                        time.sleep(len(chunk) / registry.bandwidth)
+
+            def _send_unknown(self, code: str) -> None:
+                self._send_json(
+                    404, {'errors': [{'code': code, 'message': 'unknown'}]}
+                )
+
+            def _send_json(self, status: int, data: dict) -> None:
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', format(len(body)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+
+        return Handler
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# Copyright (c) 2024 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of cgyle.
+#
+# cgyle is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cgyle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cgyle.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+usage: run.py -h | --help
+       run.py [--containers=<number>] [--tags=<number>] [--layers=<number>]
+           [--blob-size=<bytes>]
+           [--latency=<seconds>]
+           [--bandwidth=<bytes>]
+           [--error-rate=<ratio>]
+           [--startup=<seconds>]
+           [--max-requests=<number>]
+           [--max-retries=<number>]
+           [--retry-delay=<seconds>]
+           [--output=<file>]
+           [--baseline=<file> [--max-regression=<percent>]]
+           [--keep=<dir>]
+
+Offline benchmark of a cgyle cache update. A local fake registry
+with a synthetic catalog serves as source and proxy, fake skopeo
+and podman commands from test/bench/bin transfer the tags from it.
+Cli.update_cache runs end to end and the throughput, the tail
+latency of the tag transfers and the CPU and memory use are
+printed as JSON
+
+options:
+    --containers=<number>
+        Number of containers in the catalog [default: 20]
+
+    --tags=<number>
+        Number of tags per container, a latest tag is added
+        [default: 5]
+
+    --layers=<number>
+        Number of layers per tag, the first layer is shared by
+        all containers [default: 3]
+
+    --blob-size=<bytes>
+        Size of each layer [default: 65536]
+
+    --latency=<seconds>
+        Delay of each registry request [default: 0.005]
+
+    --bandwidth=<bytes>
+        Bytes per second and connection, 0 means unlimited
+        [default: 0]
+
+    --error-rate=<ratio>
+        Share of registry requests failing with a 503 error
+        [default: 0]
+
+    --startup=<seconds>
+        Startup delay of each fake skopeo and podman call
+        [default: 0.02]
+
+    --max-requests=<number>
+        Number of cgyle workers [default: 10]
+
+    --max-retries=<number>
+        Retries of failed transfers [default: 3]
+
+    --retry-delay=<seconds>
+        Base delay of the retry backoff [default: 0.1]
+
+    --output=<file>
+        Write the result to file in addition
+
+    --baseline=<file>
+        Result of a former run to compare with. The benchmark
+        fails if the throughput dropped by more than the allowed
+        regression
+
+    --max-regression=<percent>
+        Allowed throughput regression against the baseline
+        [default: 10]
+
+    --keep=<dir>
+        Keep the store, logs, report and profile of the run in
+        the given directory instead of a temporary one
+"""
+import os
+import sys
+import json
+import time
+import logging
+import resource
+from tempfile import TemporaryDirectory
+from contextlib import ExitStack
+from unittest.mock import patch
+from typing import (
+    List, Dict, Any
+)
+from docopt import docopt
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(
+    1, os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)
+    )))
+)
+
+from fake_registry import FakeRegistry  # noqa: E402
+from cgyle.cli import Cli  # noqa: E402
+from cgyle.proxy import DistributionProxy  # noqa: E402
+from cgyle.retry import RetryPolicy  # noqa: E402
+from cgyle.metrics import Metrics  # noqa: E402
+from cgyle.report import TransferReport  # noqa: E402
+
+
+def get_percentile(values: List[float], percentile: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(
+        len(values) - 1, max(0, int(round(percentile / 100 * len(values))) - 1)
+    )
+    return round(values[index], 3)
+
+
+def run(arguments: Dict[str, Any], work_dir: str) -> Dict[str, Any]:
+    bin_dir = os.sep.join([os.path.dirname(os.path.abspath(__file__)), 'bin'])
+    os.environ['PATH'] = os.pathsep.join([bin_dir, os.environ['PATH']])
+    os.environ['CGYLE_BENCH_STARTUP'] = arguments['--startup']
+    RetryPolicy.base_delay = float(arguments['--retry-delay'])
+    registry = FakeRegistry(
+        containers=int(arguments['--containers']),
+        tags=int(arguments['--tags']),
+        layers=int(arguments['--layers']),
+        blob_size=int(arguments['--blob-size']),
+        latency=float(arguments['--latency']),
+        bandwidth=int(arguments['--bandwidth']),
+        error_rate=float(arguments['--error-rate'])
+    )
+    with ExitStack() as stack:
+        stack.enter_context(registry)
+        # keep the failure logs of the run in the work dir
+        stack.enter_context(
+            patch.object(
+                DistributionProxy, 'get_log_path',
+                return_value=os.sep.join([work_dir, 'log'])
+            )
+        )
+        address = f'http://{registry.get_address()}'
+        sys.argv = [
+            'cgyle', '--updatecache', address, '--from', address, '--apply',
+            '--store-oci', os.sep.join([work_dir, 'store']),
+            '--tls-verify-proxy', 'false',
+            '--max-requests', arguments['--max-requests'],
+            '--max-retries', arguments['--max-retries'],
+            '--report', os.sep.join([work_dir, 'report.json']),
+            '--profile', os.sep.join([work_dir, 'profile'])
+        ]
+        logging.getLogger().setLevel(logging.WARNING)
+        cli = Cli(process=False)
+        start = time.monotonic()
+        cli.update_cache()
+        wall = time.monotonic() - start
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    durations = [entry['duration'] for entry in TransferReport.get()]
+    done = int(Metrics.get('cgyle_tags_total', state='done'))
+    return {
+        'parameters': {
+            key.lstrip('-'): value for key, value in arguments.items()
+            if key not in [
+                '-h', '--help', '--output', '--baseline', '--max-regression',
+                '--keep'
+            ]
+        },
+        'wall': round(wall, 3),
+        'containers': int(
+            Metrics.get('cgyle_containers_total', state='done')
+        ),
+        'tags': {
+            'expected': registry.get_tag_count(),
+            'done': done,
+            'failed': int(Metrics.get('cgyle_tags_total', state='failed'))
+        },
+        'units_per_second': round(done / wall, 3) if wall else 0.0,
+        'latency': {
+            'p50': get_percentile(durations, 50),
+            'p90': get_percentile(durations, 90),
+            'p99': get_percentile(durations, 99),
+            'max': get_percentile(durations, 100)
+        },
+        'registry': {
+            'requests': registry.requests, 'errors': registry.errors
+        },
+        'cpu': {
+            'cgyle': round(own.ru_utime + own.ru_stime, 3),
+            'tools': round(children.ru_utime + children.ru_stime, 3)
+        },
+        'max_rss_kb': {
+            'cgyle': own.ru_maxrss, 'tools': children.ru_maxrss
+        }
+    }
+
+
+def main() -> int:
+    arguments = docopt(__doc__)
+    with ExitStack() as stack:
+        work_dir = arguments['--keep'] or stack.enter_context(
+            TemporaryDirectory(prefix='cgyle-bench.')
+        )
+        result = run(arguments, work_dir)
+    output = json.dumps(result, indent=2)
+    print(output)
+    if arguments['--output']:
+        with open(arguments['--output'], 'w') as result_file:
+            result_file.write(output)
+    if result['tags']['done'] + result['tags']['failed'] != \
+       result['tags']['expected']:
+        sys.stderr.write('Not all tags were processed\n')
+        return 1
+    if arguments['--baseline']:
+        with open(arguments['--baseline']) as baseline_file:
+            baseline = json.load(baseline_file)
+        allowed = float(arguments['--max-regression'])
+        regression = 100 - 100 * result['units_per_second'] / \
+            baseline['units_per_second']
+        if regression > allowed:
+            sys.stderr.write(
+                'Throughput regression of {:.1f}% exceeds {}%: {} -> {} '
+                'units per second\n'.format(
+                    regression, allowed, baseline['units_per_second'],
+                    result['units_per_second']
+                )
+            )
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,175 @@
+# Copyright (c) 2024 SUSE Software Solutions Germany GmbH.  All rights reserved.
+#
+# This file is part of cgyle.
+#
+# cgyle is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cgyle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cgyle.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+Fake skopeo and podman commands talking to a FakeRegistry
+
+Only the calls cgyle issues are implemented. Registries are
+always contacted via plain http. Blobs are really downloaded
+from the registry, such that the latency and bandwidth of the
+registry apply to each transfer. The environment variable
+CGYLE_BENCH_STARTUP adds a startup delay in seconds to each
+call, to account for the startup of the real binaries
+"""
+import os
+import sys
+import json
+import time
+import urllib.request
+from urllib.error import (
+    HTTPError, URLError
+)
+from typing import (
+    List, Dict, Tuple
+)
+
+MANIFEST_ACCEPT = ', '.join(
+    [
+        'application/vnd.oci.image.manifest.v1+json',
+        'application/vnd.oci.image.index.v1+json',
+        'application/vnd.docker.distribution.manifest.v2+json',
+        'application/vnd.docker.distribution.manifest.list.v2+json'
+    ]
+)
+
+
+class ShimError(Exception):
+    pass
+
+
+def skopeo(args: List[str]) -> int:
+    _startup()
+    images = [
+        arg for arg in args
+        if arg.startswith(('docker://', 'oci:', 'oci-archive:'))
+    ]
+    try:
+        if 'inspect' in args:
+            return _skopeo_inspect(images[0])
+        if 'copy' in args:
+            return _skopeo_copy(images[0], images[1])
+        raise ShimError(f'unsupported skopeo call: {args}')
+    except (ShimError, IndexError) as issue:
+        sys.stderr.write(f'Error: {issue}{os.linesep}')
+        return 1
+
+
+def podman(args: List[str]) -> int:
+    _startup()
+    try:
+        if args[:1] != ['search']:
+            raise ShimError(f'unsupported podman call: {args}')
+        server, _, name = args[-1].partition('/')
+        if '--list-tags' in args:
+            for tag in _get_json(server, f'/v2/{name}/tags/list')['tags']:
+                sys.stdout.write(f'{tag}{os.linesep}')
+        else:
+            server = server.rstrip(':')
+            for name in _get_json(server, '/v2/_catalog')['repositories']:
+                sys.stdout.write(f'{server}/{name}{os.linesep}')
+    except ShimError as issue:
+        sys.stderr.write(f'Error: {issue}{os.linesep}')
+        return 125
+    return 0
+
+
+def _skopeo_inspect(image: str) -> int:
+    server, name, reference = _parse_docker(image)
+    manifest, digest = _get_manifest(server, name, reference)
+    config = _get_json(server, f'/v2/{name}/blobs/{manifest["config"]["digest"]}')
+    tags = _get_json(server, f'/v2/{name}/tags/list')['tags']
+    sys.stdout.write(
+        json.dumps(
+            {
+                'Name': f'{server}/{name}',
+                'Digest': digest,
+                'RepoTags': tags,
+                'Architecture': config.get('architecture'),
+                'Os': config.get('os'),
+                'Layers': [layer['digest'] for layer in manifest['layers']]
+            }, indent=4
+        )
+    )
+    return 0
+
+
+def _skopeo_copy(source: str, destination: str) -> int:
+    server, name, reference = _parse_docker(source)
+    sys.stdout.write(f'Getting image source signatures{os.linesep}')
+    manifest, digest = _get_manifest(server, name, reference)
+    for layer in manifest['layers']:
+        sys.stdout.write(f'Copying blob {layer["digest"]}{os.linesep}')
+        sys.stdout.flush()
+        _get(server, f'/v2/{name}/blobs/{layer["digest"]}')
+    config_digest = manifest['config']['digest']
+    sys.stdout.write(f'Copying config {config_digest}{os.linesep}')
+    _get(server, f'/v2/{name}/blobs/{config_digest}')
+    sys.stdout.write(f'Writing manifest to image destination{os.linesep}')
+    transport, _, target = destination.partition(':')
+    if transport in ['oci', 'oci-archive']:
+        target = target.rpartition(':')[0] or target
+        if transport == 'oci':
+            os.makedirs(target, exist_ok=True)
+            target = os.sep.join([target, 'manifest.json'])
+        with open(target, 'w') as archive:
+            json.dump(manifest, archive)
+    return 0
+
+
+def _parse_docker(image: str) -> Tuple[str, str, str]:
+    location = image[len('docker://'):]
+    server, _, repository = location.partition('/')
+    name, _, reference = repository.partition('@')
+    if not reference:
+        name, _, reference = repository.rpartition(':') \
+            if ':' in repository else (repository, '', 'latest')
+    return (server, name, reference)
+
+
+def _get_manifest(server: str, name: str, reference: str) -> Tuple[Dict, str]:
+    content, headers = _get(
+        server, f'/v2/{name}/manifests/{reference}',
+        {'Accept': MANIFEST_ACCEPT}
+    )
+    return (json.loads(content), headers.get('Docker-Content-Digest', ''))
+
+
+def _get_json(server: str, path: str) -> Dict:
+    return json.loads(_get(server, path)[0])
+
+
+def _get(
+    server: str, path: str, headers: Dict[str, str] = {}
+) -> Tuple[bytes, Dict[str, str]]:
+    request = urllib.request.Request(f'http://{server}{path}', headers=headers)
+    try:
+        with urllib.request.urlopen(request) as response:
+            return (response.read(), dict(response.headers))
+    except HTTPError as issue:
+        raise ShimError(
+            'reading {}: received unexpected HTTP status: {} {}'.format(
+                path, issue.code, issue.reason
+            )
+        )
+    except URLError as issue:
+        raise ShimError(f'pinging container registry {server}: {issue.reason}')
+
+
+def _startup() -> None:
+    startup = float(os.environ.get('CGYLE_BENCH_STARTUP') or 0)
+    if startup:
+        time.sleep(startup)
@@ -0,0 +1,111 @@
+import logging
+from collections import namedtuple
+from unittest.mock import (
+    patch, Mock
+)
+from pytest import fixture
+
+from cgyle.admission import Admission
+from cgyle.metrics import Metrics
+
+usage = namedtuple('usage', ['total', 'used', 'free'])
+
+MB = 1024 * 1024
+
+
+class TestAdmission:
+    @fixture(autouse=True)
+    def inject_fixtures(self, caplog, tmp_path):
+        self._caplog = caplog
+        self.tmp_path = tmp_path
+        Admission.setup(
+            [format(tmp_path), format(tmp_path / 'store' / 'new')],
+            100 * MB, self.estimate
+        )
+
+    def setup(self):
+        Metrics.reset()
+        self.estimate = Mock(return_value=10 * MB)
+
+    def setup_method(self, cls):
+        self.setup()
+
+    def teardown_method(self, cls):
+        Admission.reset()
+
+    def test_setup(self):
+        # both paths are on the same filesystem
+        assert Admission.paths == [format(self.tmp_path)]
+        assert Admission.min_free == 100 * MB
+
+    def test_admit_disabled(self):
+        Admission.reset()
+        assert Admission.admit('suse/base', '1.0', 'x86_64')
+        Admission.setup([format(self.tmp_path)], 1)
+        with patch('shutil.disk_usage') as mock_disk_usage:
+            mock_disk_usage.return_value = usage(0, 0, 1)
+            assert Admission.admit('suse/base', '1.0', 'x86_64')
+
+    @patch('shutil.disk_usage')
+    def test_admit(self, mock_disk_usage):
+        mock_disk_usage.return_value = usage(0, 0, 125 * MB)
+        assert Admission.admit('suse/base', '1.0', 'x86_64')
+        assert Admission.admit('suse/base', '1.1', 'x86_64')
+        assert Metrics.get(
+            'cgyle_disk_free_bytes', path=format(self.tmp_path)
+        ) == 125 * MB
+        self.estimate.assert_called_with('suse/base', '1.1', 'x86_64')
+        assert Admission.reserved == {
+            ('suse/base', '1.0', 'x86_64'): 10 * MB,
+            ('suse/base', '1.1', 'x86_64'): 10 * MB
+        }
+        Admission.release('suse/base', '1.0', 'x86_64')
+        assert list(Admission.reserved) == [('suse/base', '1.1', 'x86_64')]
+        assert Admission.admit('suse/base', '1.2', 'x86_64')
+        with self._caplog.at_level(logging.WARNING):
+            assert not Admission.admit('bci/base', '2.0', 'aarch64')
+        assert 'Stopped admitting transfers: bci/base:2.0 arch:aarch64 ' \
+            f'needs 10MB, {self.tmp_path} has 125MB free of which 20MB ' \
+            'are reserved by running transfers and 100MB must stay free' in \
+            self._caplog.text
+        assert Admission.is_stopped()
+
+        # once stopped nothing is admitted anymore
+        mock_disk_usage.return_value = usage(0, 0, 1000 * MB)
+        self.estimate.reset_mock()
+        assert not Admission.admit('bci/base', '1.0', 'aarch64')
+        assert not self.estimate.called
+
+        Admission.release('suse/base')
+        assert Admission.reserved == {}
+
+    @patch('shutil.disk_usage')
+    def test_admit_stopped_concurrently(self, mock_disk_usage):
+        def estimate(container, tag, arch):
+            Admission.stopped = 'full'
+            return 0
+        Admission.estimate = estimate
+        assert not Admission.admit('suse/base', '1.0', 'x86_64')
+        assert not mock_disk_usage.called
+
+    def test_log(self):
+        with self._caplog.at_level(logging.INFO):
+            Admission.log()
+        assert not self._caplog.text
+        Admission.stopped = 'suse/base:1.0 arch:x86_64 needs 10MB'
+        Admission.defer('suse/base', '1.0', 'x86_64')
+        Admission.defer('bci/base')
+        with self._caplog.at_level(logging.INFO):
+            Admission.log()
+        assert 'Run stopped for lack of disk space: suse/base:1.0 ' \
+            'arch:x86_64 needs 10MB' in self._caplog.text
+        assert 'Deferred tag: suse/base:1.0 arch:x86_64' in self._caplog.text
+        assert 'Deferred container: bci/base' in self._caplog.text
+        assert 'Deferred 1 tags and 1 containers to the next run' in \
+            self._caplog.text
+
+    def test_get_existing_path(self):
+        assert Admission.get_existing_path(
+            format(self.tmp_path / 'a' / 'b')
+        ) == format(self.tmp_path)
+        assert Admission.get_existing_path('/does/not/exist') == '/'
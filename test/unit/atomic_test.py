@@ -0,0 +1,54 @@
+import os
+import json
+from unittest.mock import patch
+from pytest import (
+    raises, fixture
+)
+from cgyle.atomic import AtomicFile
+from cgyle.exceptions import CgyleReportError
+
+
+class TestAtomicFile:
+    @fixture(autouse=True)
+    def inject_fixtures(self, tmp_path):
+        self.tmp = format(tmp_path)
+
+    def test_write(self):
+        filename = f'{self.tmp}/metrics.prom'
+        AtomicFile.write(
+            filename, 'metric 1.0', '.metrics.', CgyleReportError, 'issue'
+        )
+        with open(filename) as new_file:
+            assert new_file.read() == 'metric 1.0'
+        assert os.stat(filename).st_mode & 0o777 == 0o644
+        assert os.listdir(self.tmp) == ['metrics.prom']
+
+    def test_write_json(self):
+        filename = f'{self.tmp}/report.json'
+        AtomicFile.write_json(
+            filename, {'a': 1}, '.report.', CgyleReportError, 'issue'
+        )
+        with open(filename) as new_file:
+            assert new_file.read() == '{\n  "a": 1\n}'
+        AtomicFile.write_json(
+            filename, {'a': 1}, '.report.', CgyleReportError, 'issue', None
+        )
+        with open(filename) as new_file:
+            assert json.load(new_file) == {'a': 1}
+
+    @patch('os.replace')
+    def test_write_raises(self, mock_replace):
+        mock_replace.side_effect = OSError('replace failed')
+        with raises(CgyleReportError) as issue:
+            AtomicFile.write(
+                f'{self.tmp}/report.json', '{}', '.report.',
+                CgyleReportError, 'Failed to write report'
+            )
+        assert format(issue.value) == 'Failed to write report: replace failed'
+        # the temporary file is cleaned up
+        assert os.listdir(self.tmp) == []
+        with raises(CgyleReportError):
+            AtomicFile.write(
+                f'{self.tmp}/missing/report.json', '{}', '.report.',
+                CgyleReportError, 'Failed to write report'
+            )
@@ -3,12 +3,14 @@ from unittest.mock import (
 )
 from pytest import raises
 from cgyle.catalog import Catalog
+from cgyle.credentials import AuthFile
 from cgyle.exceptions import (
     CgyleError,
     CgyleCatalogError,
     CgylePodmanError,
     CgyleCommandError,
-    CgyleFilterExpressionError
+    CgyleFilterExpressionError,
+    CgylePolicyError
 )
 
 
@@ -65,7 +67,7 @@ class TestCatalog:
         mock_Popen.assert_called_once_with(
             [
                 'podman', 'search', '--tls-verify=true',
-                '--limit', '2147483647', '--creds', 'user:pwd',
+                '--limit', '2147483647', '--authfile', AuthFile.path,
                 'registry.opensuse.org:/'
             ], stdout=-1, stderr=-1
         )
@@ -130,8 +132,74 @@ class TestCatalog:
             '^foo/s390x/bar$'
         ]
 
+    def test_get_tag_selectors(self):
+        selectors = self.catalog.get_tag_selectors('../data/policy.tags')
+        assert [rule for rule, selector in selectors] == [
+            '^suse/sle15/.*$',
+            '^bci/.*$',
+            '^opensuse/[^/]*$'
+        ]
+        assert selectors[0][1].tags == '15.*'
+        assert selectors[0][1].exclude == ['*-beta*']
+        assert selectors[0][1].keep == 3
+        assert selectors[1][1] is None
+        assert selectors[2][1].order == 'created'
+        assert selectors[2][1].max_age == 90
+        assert Catalog.get_tag_selector(
+            selectors, 'suse/sle15/base'
+        ) is selectors[0][1]
+        assert Catalog.get_tag_selector(selectors, 'bci/base') is None
+        assert Catalog.get_tag_selector(selectors, 'other/base') is None
+
+    def test_get_policy_rules(self):
+        rules = self.catalog.get_policy_rules('../data/policy.priority')
+        assert [(rule, priority) for rule, selector, priority in rules] == [
+            ('^bci/.*$', 10),
+            ('^suse/sle15/.*$', 20),
+            ('^[^/]*$', 0)
+        ]
+        # a priority alone does not select tags
+        assert rules[1][1] is None
+        assert self.catalog.get_policy_rules(
+            '../data/policy.priority', ['base']
+        ) == [('^[^/]*$', None, 0)]
+
+    def test_get_policy_rules_invalid(self):
+        with patch('yaml.safe_load') as mock_safe_load:
+            with patch('builtins.open', create=True):
+                mock_safe_load.return_value = {'priority': ['base']}
+                with raises(CgylePolicyError):
+                    self.catalog.get_policy_rules('policy')
+                mock_safe_load.return_value = {
+                    'priority': {'base': 'high'}, 'base': ['bci/**']
+                }
+                with raises(CgylePolicyError):
+                    self.catalog.get_policy_rules('policy')
+                mock_safe_load.return_value = {
+                    'base': [{'path': 'bci/**', 'priority': None}]
+                }
+                with raises(CgylePolicyError):
+                    self.catalog.get_policy_rules('policy')
+                mock_safe_load.return_value = {'base': [{'keep': 1}]}
+                with raises(CgylePolicyError):
+                    self.catalog.get_policy_rules('policy')
+
+    def test_sort_by_priority(self):
+        assert Catalog.sort_by_priority(
+            ['a/x', 'b/x', 'c', 'a/y'], [('^a/.*$', 5), ('^c$', 10)]
+        ) == ['c', 'a/x', 'a/y', 'b/x']
+
+    def test_get_tag_selectors_invalid_entry(self):
+        with raises(CgylePolicyError):
+            self.catalog.get_tag_selectors('../data/policy.invalid')
+
     def test_translate_policy_open_failed(self):
         with patch('builtins.open', create=True) as mock_open:
             mock_open.side_effect = Exception
             with raises(CgyleError):
                 self.catalog.translate_policy('bogus', use_archs=['x86_64'])
+
+    def test_get_platform_arch(self):
+        assert Catalog.get_platform_arch('x86_64') == 'amd64'
+        assert Catalog.get_platform_arch('aarch64') == 'arm64'
+        assert Catalog.get_platform_arch('s390x') == 's390x'
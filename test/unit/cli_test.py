@@ -1,9 +1,24 @@
-import io
+import os
 import logging
 import sys
 from cgyle.cli import Cli
+from cgyle.failures import FailureIndex
+from cgyle.status import StatusHandler
+from cgyle.metrics import Metrics
+from cgyle.selector import TagSelector
+from cgyle.admission import Admission
+from cgyle.proxy import UpdateOptions
+from cgyle.plan import (
+    Plan, Planner
+)
+from cgyle.exceptions import (
+    CgyleRequestError,
+    CgyleVerifyError,
+    CgyleGarbageCollectionError,
+    CgyleMetricsError
+)
 from unittest.mock import (
-    patch, Mock, call, MagicMock
+    patch, Mock, call
 )
 from pytest import fixture
 
@@ -18,6 +33,8 @@ class TestCli:
         self._caplog = caplog
 
     def setup(self):
+        FailureIndex.reset()
+        Admission.reset()
         sys.argv = argv_cgyle_tests
         self.cli = Cli(process=False)
 
@@ -40,8 +57,9 @@ class TestCli:
         catalog = Mock()
         catalog.get_catalog.return_value = ['some-container']
         catalog.apply_filter.return_value = ['some-container']
-        catalog.translate_policy.return_value = []
+        catalog.get_policy_rules.return_value = [('^some-.*$', None, 0)]
         mock_Catalog.return_value = catalog
+        mock_Catalog.sort_by_priority.return_value = ['some-container']
         self.cli.use_podman_search = False
         self.cli.dryrun = True
         self.cli.pattern = '.*'
@@ -49,12 +67,25 @@ class TestCli:
         with patch('builtins.open', create=True):
             self.cli.update_cache()
         assert catalog.apply_filter.call_args_list == [
-            call(['some-container'], []),
+            call(['some-container'], ['^some-.*$']),
             call(['some-container'], ['.*'])
         ]
-        catalog.translate_policy.assert_called_once_with(
+        catalog.get_policy_rules.assert_called_once_with(
             '../data/policy', [], []
         )
+        mock_Catalog.sort_by_priority.assert_called_once_with(
+            ['some-container'], [('^some-.*$', 0)]
+        )
+
+    def test_get_catalog_by_priority(self):
+        self.cli.plan = Mock()
+        self.cli.plan.get_containers.return_value = [
+            'bci/base', 'other', 'suse/sle15/base', 'bci/python'
+        ]
+        self.cli.policy = '../data/policy.priority'
+        assert self.cli._get_catalog() == [
+            'suse/sle15/base', 'bci/base', 'bci/python', 'other'
+        ]
 
     @patch.object(Cli, '_get_catalog')
     def test_update_cache_dry_run(self, mock_get_catalog):
@@ -91,11 +122,43 @@ class TestCli:
                 remote='registry.opensuse.org',
                 proxy_creds=''
             )
-            proxy.update_cache.assert_called_once_with(
-                'registry.opensuse.org', False, '', '', '', '', [],
-                False, False, ''
+            options = proxy.update_cache.call_args[0][0]
+            proxy.update_cache.assert_called_once_with(options, None, None)
+            assert vars(options) == vars(
+                UpdateOptions('registry.opensuse.org', tls_verify=False)
             )
 
+    @patch.object(Cli, '_get_catalog')
+    @patch('cgyle.cli.StateStore')
+    @patch('cgyle.cli.DistributionProxy')
+    def test_update_cache_state(
+        self, mock_DistributionProxy, mock_StateStore, mock_get_catalog
+    ):
+        proxy = Mock()
+        mock_DistributionProxy.return_value = proxy
+        mock_get_catalog.return_value = ['some-container']
+        state = mock_StateStore.return_value
+        state.get_quarantined.return_value = [
+            {
+                'container': 'some-container', 'tag': '1', 'arch': 'all',
+                'failures': '2', 'until': '2024-01-01 12:00:00',
+                'error': 'manifest unknown'
+            }
+        ]
+        self.cli.dryrun = False
+        self.cli.local_distribution_cache = None
+        self.cli.state_db = 'state.db'
+        with self._caplog.at_level(logging.WARNING):
+            with patch('builtins.open', create=True):
+                self.cli.update_cache()
+        mock_StateStore.assert_called_once_with('state.db', 20)
+        assert proxy.update_cache.call_args[0][0].state == state
+        assert (
+            'Quarantined until 2024-01-01 12:00:00: some-container:1 '
+            'arch:all failures:2 manifest unknown'
+        ) in self._caplog.text
+        state.close.assert_called_once_with()
+
     @patch.object(Cli, '_get_catalog')
     @patch('concurrent.futures.as_completed')
     @patch('cgyle.cli.DistributionProxy')
@@ -116,45 +179,37 @@ class TestCli:
 
     @patch('cgyle.cli.Catalog')
     @patch('cgyle.cli.DistributionProxy')
-    @patch('os.walk')
+    @patch('cgyle.cli.FailureIndex')
     def test_update_cache_collected_log(
-        self, mock_os_walk, mock_DistributionProxy, mock_Catalog
+        self, mock_FailureIndex, mock_DistributionProxy, mock_Catalog
     ):
         catalog = Mock()
         catalog.get_catalog.return_value = ['some/container/foo/bar']
         mock_Catalog.return_value = catalog
-
         mock_DistributionProxy.get_log_path.return_value = '/var/log/cgyle'
-
-        mock_os_walk.return_value = [
-            ('/var/log/cgyle/some/container/foo', [], ['bar.log', 'system.log']),
-            ('/var/log/cgyle/some/outside/catalog', [], ['some.log'])
-        ]
+        mock_FailureIndex.write.return_value = 2
         self.cli.dryrun = False
         self.cli.use_podman_search = False
         self.cli.local_distribution_cache = None
-
-        with patch('builtins.open', create=True) as mock_open:
-            mock_open.return_value = MagicMock(spec=io.IOBase)
+        with self._caplog.at_level(logging.INFO):
             self.cli.update_cache()
-            assert mock_open.call_args_list == [
-                call('/var/log/cgyle.log', 'a'),
-                call('/var/log/cgyle/some/container/foo/bar.log')
-            ]
-            mock_os_walk.assert_called_once_with('/var/log/cgyle')
+        mock_FailureIndex.write.assert_called_once_with('/var/log/cgyle.log')
+        mock_FailureIndex.reset.assert_called_once_with()
+        assert 'Logged 2 failed transfers to /var/log/cgyle.log' in \
+            self._caplog.text
 
     @patch('cgyle.cli.Catalog')
     @patch('cgyle.cli.DistributionProxy')
+    @patch('cgyle.cli.FailureIndex')
     def test_update_cache_collected_log_IO_error(
-        self, mock_DistributionProxy, mock_Catalog
+        self, mock_FailureIndex, mock_DistributionProxy, mock_Catalog
     ):
         mock_DistributionProxy.get_log_path.return_value = '/var/log/cgyle'
+        mock_FailureIndex.write.side_effect = IOError('issue')
         self.cli.dryrun = False
-        with patch('builtins.open', create=True) as mock_open:
-            mock_open.side_effect = IOError('issue')
-            with self._caplog.at_level(logging.ERROR):
-                self.cli.update_cache()
-            assert 'Failed to create logfile' in self._caplog.text
+        with self._caplog.at_level(logging.ERROR):
+            self.cli.update_cache()
+        assert 'Failed to create logfile' in self._caplog.text
 
     @patch('cgyle.cli.Catalog')
     def test_get_catalog_request(self, mock_Catalog):
@@ -179,3 +234,615 @@ class TestCli:
         catalog.get_catalog_podman_search.assert_called_once_with(
             'registry.opensuse.org', True, ''
         )
+
+    @patch('cgyle.cli.Registry')
+    @patch('cgyle.cli.PushEngine')
+    def test_get_push_engine(self, mock_PushEngine, mock_Registry):
+        self.cli.tls_proxy_creds = 'user:pass'
+        assert self.cli._get_push_engine(
+            'some.ecr/base', 'AWS:secret'
+        ) == mock_PushEngine.return_value
+        assert mock_Registry.call_args_list == [
+            call('local://distribution:some', 'user:pass', True),
+            call('some.ecr', 'AWS:secret')
+        ]
+
+    @patch.object(Cli, '_get_catalog')
+    @patch('cgyle.cli.DistributionProxy')
+    @patch.object(Cli, '_get_push_engine')
+    def test_update_cache_push(
+        self, mock_get_push_engine, mock_DistributionProxy, mock_get_catalog
+    ):
+        proxy = Mock()
+        mock_DistributionProxy.return_value = proxy
+        mock_get_catalog.return_value = ['some-container']
+        self.cli.dryrun = False
+        self.cli.local_distribution_cache = None
+        self.cli.push_oci = 'some.ecr'
+        self.cli.tls_push_oci_creds = 'AWS:secret'
+        with patch('builtins.open', create=True):
+            self.cli.update_cache()
+        mock_get_push_engine.assert_called_once_with('some.ecr', 'AWS:secret')
+        options = proxy.update_cache.call_args[0][0]
+        proxy.update_cache.assert_called_once_with(options, None, None)
+        assert vars(options) == vars(
+            UpdateOptions(
+                'registry.opensuse.org', push_oci='some.ecr',
+                push_oci_creds='AWS:secret',
+                push_engine=mock_get_push_engine.return_value
+            )
+        )
+
+    @patch.object(Cli, '_get_catalog')
+    @patch('cgyle.cli.DistributionProxy')
+    @patch('cgyle.cli.FanOut')
+    @patch('cgyle.cli.Destination')
+    @patch.object(Cli, '_get_push_engine')
+    def test_update_cache_fanout(
+        self, mock_get_push_engine, mock_Destination, mock_FanOut,
+        mock_DistributionProxy, mock_get_catalog
+    ):
+        proxy = Mock()
+        mock_DistributionProxy.return_value = proxy
+        mock_get_catalog.return_value = ['some-container']
+        fanout = Mock()
+        fanout.get_status.return_value = {
+            'some.ecr': {'done': 1, 'skipped': 2, 'failed': 3}
+        }
+        mock_FanOut.return_value = fanout
+        self.cli.dryrun = False
+        self.cli.local_distribution_cache = None
+        self.cli.store_oci_dirs = ['some_dir']
+        self.cli.push_oci_repos = ['some.ecr', 'other.ecr']
+        self.cli.push_oci_creds = ['AWS:one', 'AWS:two']
+        with self._caplog.at_level(logging.INFO):
+            with patch('builtins.open', create=True):
+                self.cli.update_cache()
+        assert mock_Destination.call_args_list == [
+            call('some_dir', oci_layout=False, oci_export=False),
+            call(
+                'some.ecr', push=True, creds='AWS:one', ecr_alias='',
+                push_engine=mock_get_push_engine.return_value
+            ),
+            call(
+                'other.ecr', push=True, creds='AWS:two', ecr_alias='',
+                push_engine=mock_get_push_engine.return_value
+            )
+        ]
+        mock_FanOut.assert_called_once_with(
+            '/var/tmp/cgyle-staging', [mock_Destination.return_value] * 3,
+            10240 * 1024 * 1024
+        )
+        fanout.create.assert_called_once_with()
+        options = proxy.update_cache.call_args[0][0]
+        proxy.update_cache.assert_called_once_with(options, None, None)
+        assert vars(options) == vars(
+            UpdateOptions('registry.opensuse.org', fanout=fanout)
+        )
+        assert 'Destination some.ecr: done:1 skipped:2 failed:3' in \
+            self._caplog.text
+
+    def test_get_push_oci_creds(self):
+        assert self.cli.get_push_oci_creds(0) == ''
+        self.cli.push_oci_creds = ['AWS:one']
+        assert self.cli.get_push_oci_creds(1) == 'AWS:one'
+        self.cli.push_oci_creds = ['AWS:one', 'AWS:two']
+        assert self.cli.get_push_oci_creds(1) == 'AWS:two'
+        assert self.cli.get_push_oci_creds(2) == ''
+
+    @patch.object(Cli, '_get_catalog')
+    @patch('cgyle.cli.Plan')
+    @patch('cgyle.cli.DistributionProxy')
+    def test_update_cache_plan_file(
+        self, mock_DistributionProxy, mock_Plan, mock_get_catalog
+    ):
+        proxy = Mock()
+        mock_DistributionProxy.return_value = proxy
+        mock_get_catalog.return_value = ['some-container']
+        plan = mock_Plan.read.return_value
+        plan.from_registry = 'registry.suse.com'
+        plan.get_tags.return_value = {'x86_64': ['1.0']}
+        self.cli.dryrun = False
+        self.cli.local_distribution_cache = None
+        self.cli.plan_file = 'plan.json'
+        with self._caplog.at_level(logging.WARNING):
+            with patch('builtins.open', create=True):
+                self.cli.update_cache()
+        assert 'Plan plan.json was created for registry.suse.com' in \
+            self._caplog.text
+        mock_Plan.read.assert_called_once_with('plan.json')
+        plan.get_tags.assert_called_once_with('some-container')
+        assert proxy.update_cache.call_args[0][1] == {'x86_64': ['1.0']}
+
+    def test_get_catalog_from_plan(self):
+        self.cli.plan = Mock()
+        self.cli.plan.get_containers.return_value = ['some-container']
+        assert self.cli._get_catalog() == ['some-container']
+
+    @patch.object(Cli, '_get_catalog')
+    @patch('cgyle.cli.Registry')
+    @patch('cgyle.cli.Planner')
+    @patch('cgyle.cli.DistributionProxy')
+    def test_update_cache_write_plan(
+        self, mock_DistributionProxy, mock_Planner, mock_Registry,
+        mock_get_catalog, tmp_path
+    ):
+        proxy = Mock()
+        proxy.get_new_tags.return_value = ('tags', ['1.0'])
+        mock_DistributionProxy.return_value = proxy
+        mock_get_catalog.return_value = ['some-container', 'failing']
+        planner = mock_Planner.return_value
+        planner.resolve.side_effect = [
+            {'tag': '1.0', 'digest': 'sha256:a', 'size': 2097152,
+             'new_size': 1048576},
+            Exception('resolve failed')
+        ]
+        self.cli.plan_out = f'{tmp_path}/plan.json'
+        self.cli.push_oci_repos = ['some.ecr/base']
+        self.cli.store_oci = 'oci'
+        self.cli.store_oci_layout = True
+        self.cli.max_requests = 1
+        with self._caplog.at_level(logging.INFO):
+            self.cli.update_cache()
+        assert 'Thread failed with: resolve failed' in self._caplog.text
+        assert 'containers:1 tags:1 size:2MB new:1MB' in self._caplog.text
+        mock_Planner.assert_called_once_with(
+            mock_Registry.return_value, self.cli._blob_exists
+        )
+        assert mock_Registry.call_args_list == [
+            call('registry.opensuse.org', '', True),
+            call('some.ecr', '')
+        ]
+        assert proxy.get_new_tags.call_args_list[0] == call(
+            'registry.opensuse.org', 'oci', 'all', True, '', False,
+            update_tag_log=False, tag_selector=None, delta=None
+        )
+        assert self.cli.plan_layout.root_dir == 'oci'
+        proxy.update_cache.assert_not_called()
+        with open(f'{tmp_path}/plan.json') as plan_file:
+            assert '"digest": "sha256:a"' in plan_file.read()
+
+    @patch('cgyle.cli.Delta')
+    @patch('cgyle.cli.Registry')
+    def test_read_delta(self, mock_Registry, mock_Delta):
+        self.cli._read_delta(['some-container'])
+        mock_Delta.assert_not_called()
+        self.cli.proxy_delta = True
+        self.cli.local_distribution_cache = ''
+        self.cli.cache = 'localhost:5000'
+        with self._caplog.at_level(logging.WARNING):
+            self.cli._read_delta(['some-container'])
+        assert '--proxy-delta needs a local://distribution proxy' in \
+            self._caplog.text
+        mock_Delta.assert_not_called()
+        self.cli.local_distribution_cache = 'some'
+        self.cli._read_delta(['some-container'])
+        mock_Registry.assert_called_once_with(
+            'registry.opensuse.org', '', True
+        )
+        mock_Delta.assert_called_once_with(
+            'some', mock_Registry.return_value, 10
+        )
+        mock_Delta.return_value.read.assert_called_once_with(
+            ['some-container']
+        )
+        assert self.cli.delta == mock_Delta.return_value
+        self.cli.delta = None
+        mock_Delta.return_value.read.side_effect = OSError('denied')
+        with self._caplog.at_level(logging.WARNING):
+            self.cli._read_delta(['some-container'])
+        assert 'Failed to read the content of cache some: denied' in \
+            self._caplog.text
+        assert self.cli.delta is None
+
+    @patch('cgyle.cli.DistributionProxy')
+    @patch('cgyle.cli.Verifier')
+    def test_verify_cache(self, mock_Verifier, mock_DistributionProxy, tmp_path):
+        verifier = mock_Verifier.return_value
+        distribution = {
+            'kind': 'distribution', 'root': 'some',
+            'affected': [['suse/base', '1.0', '']]
+        }
+        layout = {
+            'kind': 'oci-layout', 'root': 'oci',
+            'affected': [['suse/base', '2.0', 'x86_64']]
+        }
+        verifier.verify_distribution.return_value = distribution
+        verifier.verify_layout.return_value = layout
+        verifier.verify_archives.return_value = {
+            'kind': 'oci-archive', 'root': 'oci', 'affected': []
+        }
+        self.cli.store_oci_dirs = ['oci']
+        self.cli.store_oci_layout = True
+        self.cli.verify_report = f'{tmp_path}/verify.json'
+        assert self.cli.verify_cache() is None
+        assert mock_Verifier.log.call_count == 2
+        mock_Verifier.write.assert_called_once_with(
+            [distribution, layout], f'{tmp_path}/verify.json'
+        )
+        assert not mock_Verifier.repair.called
+
+        self.cli.dryrun = False
+        self.cli.store_oci_archive = True
+        self.cli.use_archs = ['x86_64', 'aarch64']
+        with self._caplog.at_level(logging.INFO):
+            plan = self.cli.verify_cache()
+        assert 'Transferring 3 affected tags again' in self._caplog.text
+        assert plan.get_containers() == ['suse/base']
+        assert plan.get_tags('suse/base') == {
+            'x86_64': ['1.0', '2.0'], 'aarch64': ['1.0']
+        }
+        assert mock_Verifier.repair.call_count == 3
+        proxy = mock_DistributionProxy.return_value
+        assert proxy.drop_tags.call_args_list == [
+            call('', 'x86_64', ['1.0']),
+            call('', 'aarch64', ['1.0']),
+            call('oci', 'x86_64', ['2.0'])
+        ]
+
+        self.cli.local_distribution_cache = ''
+        layout['affected'] = []
+        assert self.cli.verify_cache() is None
+
+        mock_Verifier.repair.side_effect = CgyleVerifyError('busy')
+        with self._caplog.at_level(logging.ERROR):
+            assert self.cli.verify_cache() is None
+        assert 'Verification failed: busy' in self._caplog.text
+
+    @patch.object(Cli, 'verify_cache')
+    @patch.object(Cli, '_get_catalog')
+    def test_update_cache_verify(self, mock_get_catalog, mock_verify_cache):
+        mock_verify_cache.return_value = None
+        self.cli.verify = True
+        self.cli.update_cache()
+        mock_verify_cache.assert_called_once_with()
+        assert not mock_get_catalog.called
+
+    @patch.object(Cli, 'verify_cache')
+    @patch('cgyle.cli.Plan')
+    def test_read_plan_verify_with_plan_file(
+        self, mock_Plan, mock_verify_cache
+    ):
+        plan = mock_Plan.read.return_value
+        plan.from_registry = 'registry.opensuse.org'
+        self.cli.plan_file = 'plan.json'
+        self.cli.verify = True
+        mock_verify_cache.return_value = None
+        assert self.cli._read_plan()
+        assert not plan.merge.called
+        affected = Mock()
+        mock_verify_cache.return_value = affected
+        assert self.cli._read_plan()
+        assert self.cli.plan == plan
+        plan.merge.assert_called_once_with(affected)
+
+    @patch.object(Cli, 'collect_garbage')
+    def test_process_gc(self, mock_collect_garbage):
+        sys.argv = argv_cgyle_tests + ['--gc']
+        Cli()
+        mock_collect_garbage.assert_called_once_with()
+
+    @patch('cgyle.cli.DistributionProxy')
+    @patch('cgyle.cli.GarbageCollector')
+    @patch('cgyle.cli.Catalog')
+    def test_collect_garbage(
+        self, mock_Catalog, mock_GarbageCollector, mock_DistributionProxy,
+        tmp_path
+    ):
+        collector = mock_GarbageCollector.return_value
+        distribution = {
+            'kind': 'distribution', 'root': 'some',
+            'tags': [['suse/base', 'old', '']]
+        }
+        layout = {
+            'kind': 'oci-layout', 'root': 'oci',
+            'tags': [['suse/base', '2.0', 'x86_64']]
+        }
+        collector.collect_distribution.return_value = distribution
+        collector.collect_layout.return_value = layout
+        collector.collect_archives.return_value = {
+            'kind': 'oci-archive', 'root': 'oci', 'tags': []
+        }
+        mock_Catalog.return_value.get_tag_selectors.return_value = []
+        self.cli.policy = '../data/policy'
+        self.cli.policy_skip_sections = ['free']
+        self.cli.store_oci_dirs = ['oci']
+        self.cli.store_oci_layout = True
+        self.cli.gc_report = f'{tmp_path}/gc.json'
+        with self._caplog.at_level(logging.INFO):
+            self.cli.collect_garbage()
+        # the skipped sections stay live
+        mock_Catalog.return_value.get_tag_selectors.assert_called_with(
+            '../data/policy', [], []
+        )
+        assert f'Wrote garbage collection report to {tmp_path}/gc.json' in \
+            self._caplog.text
+        mock_GarbageCollector.assert_called_once_with(
+            self.cli.select_live, 10, apply=False
+        )
+        collector.collect_distribution.assert_called_once_with('some')
+        assert mock_GarbageCollector.log.call_count == 2
+        mock_GarbageCollector.write.assert_called_once_with(
+            [distribution, layout], f'{tmp_path}/gc.json'
+        )
+        assert not mock_DistributionProxy.called
+
+        self.cli.dryrun = False
+        self.cli.store_oci_archive = True
+        self.cli.use_archs = ['x86_64', 'aarch64']
+        self.cli.collect_garbage()
+        proxy = mock_DistributionProxy.return_value
+        assert proxy.drop_tags.call_args_list == [
+            call('', 'x86_64', ['old']),
+            call('', 'aarch64', ['old']),
+            call('oci', 'x86_64', ['2.0'])
+        ]
+
+        collector.collect_layout.side_effect = CgyleGarbageCollectionError(
+            'busy'
+        )
+        mock_GarbageCollector.write.side_effect = \
+            CgyleGarbageCollectionError('read-only')
+        with self._caplog.at_level(logging.ERROR):
+            self.cli.collect_garbage()
+        assert 'Garbage collection failed: busy' in self._caplog.text
+        assert 'read-only' in self._caplog.text
+
+    def test_select_live(self):
+        get_created = Mock(return_value=None)
+        selector = TagSelector(exclude=['beta'], keep=1)
+        self.cli.policy = '../data/policy'
+        self.cli.tag_selectors = [('^suse/.*$', selector), ('^bci/.*$', None)]
+        self.cli.pattern = '.*base'
+        assert self.cli.select_live(
+            'suse/base', ['1.0', '1.1', 'beta'], get_created
+        ) == ['1.1']
+        assert self.cli.select_live(
+            'bci/base', ['beta', '1.0'], get_created
+        ) == ['beta', '1.0']
+        assert self.cli.select_live('other/base', ['1.0'], get_created) == []
+        assert self.cli.select_live('suse/micro', ['1.0'], get_created) == []
+        self.cli.policy = ''
+        assert self.cli.select_live(
+            'other/base', ['1.0'], get_created
+        ) == ['1.0']
+
+    def test_blob_exists(self, tmp_path):
+        registry = Mock()
+        registry.blob_exists.side_effect = [
+            CgyleRequestError('timeout'), False, True
+        ]
+        self.cli.plan_layout = Mock()
+        self.cli.plan_layout.has_blob.return_value = True
+        assert self.cli._blob_exists('suse/sle15', 'sha256:abc')
+
+        self.cli.plan_layout = None
+        self.cli.local_distribution_cache = format(tmp_path)
+        blob_dir = tmp_path / 'docker/registry/v2/blobs/sha256/ab/abc'
+        blob_dir.mkdir(parents=True)
+        (blob_dir / 'data').write_text('data')
+        assert self.cli._blob_exists('suse/sle15', 'sha256:abc')
+
+        self.cli.plan_registries = [
+            ('some.ecr/base', registry), ('other.ecr/base', registry)
+        ]
+        with self._caplog.at_level(logging.WARNING):
+            assert not self.cli._blob_exists('suse/sle15', 'sha256:def')
+        assert 'Blob lookup at some.ecr/base failed: timeout' in \
+            self._caplog.text
+        self.cli.ecr_alias = 'alias'
+        assert self.cli._blob_exists('suse/sle15', 'sha256:def')
+        assert registry.blob_exists.call_args_list == [
+            call('base/suse/sle15', 'sha256:def'),
+            call('base/suse/sle15', 'sha256:def'),
+            call('base/alias/sle15', 'sha256:def')
+        ]
+
+    def test_shard(self):
+        sys.argv = argv_cgyle_tests + ['--shard', '2/3', '--shard-tags']
+        cli = Cli(process=False)
+        assert cli.shard.index == 2
+        assert cli.shard.count == 3
+        assert cli.shard.tags
+
+    @patch.object(Cli, '_get_catalog')
+    @patch('cgyle.cli.Coordinator')
+    @patch('cgyle.cli.DistributionProxy')
+    def test_update_cache_shard_dir(
+        self, mock_DistributionProxy, mock_Coordinator, mock_get_catalog
+    ):
+        proxy = Mock()
+        mock_DistributionProxy.return_value = proxy
+        mock_get_catalog.return_value = ['some-container']
+        self.cli.dryrun = False
+        self.cli.local_distribution_cache = None
+        self.cli.shard_dir = '/shared/claims'
+        with patch('builtins.open', create=True):
+            self.cli.update_cache()
+        mock_Coordinator.assert_called_once_with(
+            '/shared/claims', False, 21600
+        )
+        assert proxy.update_cache.call_args[0][0].shard == \
+            mock_Coordinator.return_value
+        mock_Coordinator.return_value.release.assert_called_once_with()
+
+    @patch.object(Cli, '_get_catalog')
+    @patch('cgyle.cli.MetricsServer')
+    @patch('cgyle.cli.DistributionProxy')
+    def test_update_cache_metrics(
+        self, mock_DistributionProxy, mock_MetricsServer, mock_get_catalog,
+        tmp_path
+    ):
+        proxies = [
+            Mock(skipped=False, failed_tags=0),
+            Mock(skipped=False, failed_tags=2),
+            Mock(skipped=True, failed_tags=0)
+        ]
+        proxies[1].update_cache.side_effect = Exception('issue')
+        mock_DistributionProxy.side_effect = proxies
+        mock_get_catalog.return_value = ['a', 'b', 'c']
+        self.cli.dryrun = False
+        self.cli.local_distribution_cache = None
+        self.cli.metrics_port = 9100
+        self.cli.metrics_file = f'{tmp_path}/cgyle.prom'
+        self.cli.max_requests = 1
+        self.cli.update_cache()
+        mock_MetricsServer.assert_called_once_with(
+            9100, handler=StatusHandler
+        )
+        with open(self.cli.metrics_file) as metrics_file:
+            metrics = metrics_file.read()
+        assert 'cgyle_containers_total{state="planned"} 3.0' in metrics
+        assert 'cgyle_containers_total{state="done"} 1.0' in metrics
+        assert 'cgyle_containers_total{state="failed"} 1.0' in metrics
+        assert 'cgyle_containers_total{state="skipped"} 1.0' in metrics
+        assert 'cgyle_queue_depth 0.0' in metrics
+        assert 'cgyle_workers_busy 0.0' in metrics
+        assert 'cgyle_worker_utilization_ratio' in metrics
+
+    @patch.object(Cli, '_get_catalog')
+    @patch('cgyle.cli.MetricsServer')
+    @patch('cgyle.cli.DistributionProxy')
+    def test_update_cache_metrics_port_busy(
+        self, mock_DistributionProxy, mock_MetricsServer, mock_get_catalog
+    ):
+        proxy = Mock(skipped=False, failed_tags=0)
+        mock_DistributionProxy.return_value = proxy
+        mock_MetricsServer.side_effect = CgyleMetricsError('port busy')
+        mock_get_catalog.return_value = ['a']
+        self.cli.dryrun = False
+        self.cli.local_distribution_cache = None
+        self.cli.metrics_port = 9100
+        with self._caplog.at_level(logging.ERROR):
+            self.cli.update_cache()
+        assert 'port busy, continue without endpoint' in self._caplog.text
+        assert proxy.update_cache.called
+
+    @patch('shutil.disk_usage')
+    @patch.object(Planner, 'resolve')
+    @patch.object(Cli, '_get_catalog')
+    @patch('cgyle.cli.DistributionProxy')
+    def test_update_cache_admission(
+        self, mock_DistributionProxy, mock_get_catalog, mock_resolve,
+        mock_disk_usage, tmp_path
+    ):
+        def update_cache(*args):
+            assert not Admission.admit('a', '1.0', 'all')
+
+        proxies = [
+            Mock(skipped=False, failed_tags=0, container='a'),
+            Mock(skipped=False, failed_tags=0, container='b')
+        ]
+        proxies[0].update_cache.side_effect = update_cache
+        mock_DistributionProxy.side_effect = proxies
+        mock_get_catalog.return_value = ['a', 'b']
+        mock_resolve.return_value = {
+            'tag': '1.0', 'digest': 'sha256:a', 'size': 30 * 1048576,
+            'new_size': 20 * 1048576
+        }
+        mock_disk_usage.return_value = Mock(free=100 * 1048576)
+        self.cli.dryrun = False
+        self.cli.local_distribution_cache = None
+        self.cli.store_oci_dirs = [format(tmp_path)]
+        self.cli.store_oci = format(tmp_path)
+        self.cli.store_oci_layout = True
+        self.cli.min_free_space = 90
+        self.cli.max_requests = 1
+        with self._caplog.at_level(logging.INFO):
+            self.cli.update_cache()
+        assert 'Stopped admitting transfers: a:1.0 arch:all needs 20MB' in \
+            self._caplog.text
+        assert 'Deferred container: b' in self._caplog.text
+        assert not proxies[1].update_cache.called
+        assert Metrics.get('cgyle_containers_total', state='deferred') == 1
+        mock_resolve.assert_called_once_with('a', '1.0', 'all')
+        assert self.cli.plan_layout.root_dir == format(tmp_path)
+        Admission.reset()
+
+    def test_setup_admission(self, tmp_path):
+        self.cli.dryrun = False
+        with patch.dict(os.environ, {'TMPDIR': format(tmp_path)}), \
+             patch('cgyle.cli.Admission') as mock_Admission:
+            self.cli._setup_admission(None)
+            assert not mock_Admission.setup.called
+            self.cli.min_free_space = 1
+            self.cli.store_oci_dirs = ['oci']
+            self.cli._setup_admission(Mock())
+        assert mock_Admission.setup.call_args[0][:2] == (
+            [format(tmp_path), 'oci', 'some', '/var/tmp/cgyle-staging'],
+            1048576
+        )
+        assert self.cli.plan_layout is None
+
+    @patch.object(Planner, 'resolve')
+    def test_estimate_size(self, mock_resolve):
+        planner = Planner(Mock())
+        mock_resolve.return_value = {
+            'tag': '2.0', 'digest': 'sha256:b', 'size': 30, 'new_size': 20
+        }
+        self.cli.plan = Plan('proxy', 'registry')
+        self.cli.plan.add(
+            'suse/base', 'x86_64', [
+                {'tag': '1.0', 'digest': 'sha256:a', 'size': 5, 'new_size': 3},
+                {'tag': '1.1', 'digest': '', 'size': 0, 'new_size': 0}
+            ]
+        )
+        assert self.cli._estimate_size(
+            planner, 'suse/base', '1.0', 'x86_64'
+        ) == 3
+        assert self.cli._estimate_size(
+            planner, 'suse/base', '1.1', 'x86_64'
+        ) == 20
+        self.cli.plan = None
+        self.cli.store_oci = 'oci'
+        assert self.cli._estimate_size(
+            planner, 'suse/base', '2.0', 'x86_64'
+        ) == 50
+        self.cli.store_oci_layout = True
+        assert self.cli._estimate_size(
+            planner, 'suse/base', '2.0', 'x86_64'
+        ) == 20
+
+    @patch.object(Cli, '_get_catalog')
+    @patch('cgyle.cli.DistributionProxy')
+    def test_update_cache_profile_and_status(
+        self, mock_DistributionProxy, mock_get_catalog, tmp_path
+    ):
+        mock_DistributionProxy.return_value = Mock(
+            container='some-container', skipped=False, failed_tags=0
+        )
+        mock_get_catalog.return_value = ['some-container']
+        self.cli.dryrun = False
+        self.cli.local_distribution_cache = None
+        self.cli.profile_dir = f'{tmp_path}/profile'
+        self.cli.status_file = f'{tmp_path}/status.json'
+        with self._caplog.at_level(logging.INFO):
+            self.cli.update_cache()
+        assert 'Profile worker worker_0: units:1' in self._caplog.text
+        assert os.path.isfile(f'{tmp_path}/profile/trace.json')
+        with open(self.cli.status_file) as status_file:
+            assert '"state": "finished"' in status_file.read()
+        self.cli.status_file = ''
+
+        # the profile cannot be written
+        self.cli.profile_dir = f'{tmp_path}/profile/trace.json'
+        with self._caplog.at_level(logging.ERROR):
+            self.cli.update_cache()
+        assert 'Failed to write profile' in self._caplog.text
+
+    def test_write_report(self, tmp_path):
+        self.cli.report_file = f'{tmp_path}/report.json'
+        with self._caplog.at_level(logging.INFO):
+            self.cli._write_report()
+        assert os.path.isfile(self.cli.report_file)
+        assert 'Wrote transfer report' in self._caplog.text
+        self.cli.report_file = f'{tmp_path}/missing/report.json'
+        with self._caplog.at_level(logging.ERROR):
+            self.cli._write_report()
+        assert 'Failed to write report' in self._caplog.text
+
+    def test_write_metrics_failed(self, tmp_path):
+        self.cli.metrics_file = f'{tmp_path}/missing/cgyle.prom'
+        with self._caplog.at_level(logging.ERROR):
+            self.cli._write_metrics(0)
+        assert 'Failed to write metrics' in self._caplog.text
@@ -1,6 +1,10 @@
+import os
+import json
 from unittest.mock import patch
 from pytest import raises
-from cgyle.credentials import Credentials
+from cgyle.credentials import (
+    Credentials, TokenCache, AuthFile
+)
 from cgyle.exceptions import CgyleCredentialsError
 
 
@@ -26,3 +30,104 @@ class TestCredentials:
         mock_os_path_isfile.return_value = True
         with raises(CgyleCredentialsError):
             Credentials.read('not_a_file')
+
+    def test_get_credentials_from_file_invalid_content(self, tmp_path):
+        creds = tmp_path / 'creds'
+        creds.write_text('bogus')
+        with raises(CgyleCredentialsError):
+            Credentials.read(format(creds))
+
+    def test_get_credentials_from_file_cached(self, tmp_path):
+        creds = tmp_path / 'creds'
+        creds.write_text('scc:\n  username: user\n  password: pass\n')
+        assert Credentials.read(format(creds)) == ['user', 'pass']
+        with patch.object(Credentials, 'get_from_file') as mock_get_from_file:
+            assert Credentials.read(format(creds)) == ['user', 'pass']
+            assert not mock_get_from_file.called
+        creds.write_text('scc:\n  username: other\n  password: secret\n')
+        os.utime(creds, (0, 0))
+        assert Credentials.read(format(creds)) == ['other', 'secret']
+
+
+class TestCredentialsCommand:
+    def setup(self):
+        Credentials.commands = {}
+
+    def setup_method(self, cls):
+        self.setup()
+
+    @patch('time.time')
+    def test_get_credentials_from_command(self, mock_time, tmp_path):
+        mock_time.return_value = 1000
+        counter = tmp_path / 'counter'
+        command = tmp_path / 'get-password'
+        command.write_text(
+            f'#!/bin/sh\necho x >> {counter}\n'
+            f'echo secret$(wc -l < {counter})\n'
+        )
+        command.chmod(0o755)
+        source = f'exec:AWS:{command} --some arg'
+        assert Credentials.read(source) == ['AWS', 'secret1']
+        # cached until the ttl has passed
+        assert Credentials.read(source) == ['AWS', 'secret1']
+        mock_time.return_value = 1000 + Credentials.ttl
+        assert Credentials.read(source) == ['AWS', 'secret2']
+
+    def test_get_credentials_from_command_raises(self, tmp_path):
+        with raises(CgyleCredentialsError):
+            Credentials.read('exec:AWS')
+        with raises(CgyleCredentialsError):
+            Credentials.read(f'exec:AWS:{tmp_path}/does-not-exist')
+        with raises(CgyleCredentialsError):
+            Credentials.read('exec:AWS:false')
+        with raises(CgyleCredentialsError):
+            Credentials.read('exec:AWS:true')
+
+
+class TestTokenCache:
+    def setup(self):
+        TokenCache.tokens = {}
+
+    def setup_method(self, cls):
+        self.setup()
+
+    @patch('time.time')
+    def test_get_set(self, mock_time):
+        mock_time.return_value = 1000
+        assert TokenCache.get('server', 'user', 'scope') is None
+        TokenCache.set('server', 'user', 'scope', 'abc', 60)
+        assert TokenCache.get('server', 'user', 'scope') == 'abc'
+        assert TokenCache.get('server', 'other', 'scope') is None
+        mock_time.return_value = 1050
+        assert TokenCache.get('server', 'user', 'scope') is None
+
+    def test_invalidate(self):
+        TokenCache.set('server', 'user', 'scope', 'abc', 60)
+        TokenCache.set('other', 'user', 'scope', 'abc', 60)
+        TokenCache.invalidate('server')
+        assert TokenCache.get('server', 'user', 'scope') is None
+        assert TokenCache.get('other', 'user', 'scope') == 'abc'
+
+
+class TestAuthFile:
+    def test_add(self):
+        assert AuthFile.add('server', '', '') == ''
+        auth_file = AuthFile.add('https://server/path', 'user', 'pass')
+        assert auth_file == AuthFile.path
+        with open(auth_file) as auth:
+            assert json.load(auth)['auths']['server'] == {
+                'auth': 'dXNlcjpwYXNz'
+            }
+        assert AuthFile.add('some.ecr', 'AWS', 'secret') == auth_file
+        with open(auth_file) as auth:
+            auths = json.load(auth)['auths']
+            assert auths['server'] == {'auth': 'dXNlcjpwYXNz'}
+            assert auths['some.ecr'] == {'auth': 'QVdTOnNlY3JldA=='}
+        os.unlink(auth_file)
+        assert AuthFile.add('server', 'user', 'pass') == auth_file
+        assert os.path.exists(auth_file)
+
+    def test_get_registry(self):
+        assert AuthFile.get_registry('http://localhost:5000/a') == \
+            'localhost:5000'
+        assert AuthFile.get_registry('some.ecr') == 'some.ecr'
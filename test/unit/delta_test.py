@@ -0,0 +1,56 @@
+import logging
+from unittest.mock import Mock
+from pytest import fixture
+from cgyle.delta import Delta
+from cgyle.exceptions import CgyleRequestError
+
+
+class TestDelta:
+    @fixture(autouse=True)
+    def inject_fixtures(self, caplog, tmp_path):
+        self._caplog = caplog
+        self.tmp_path = tmp_path
+
+    def setup(self):
+        self.upstream = Mock()
+
+    def setup_method(self, cls):
+        self.setup()
+
+    def add_tag(self, container, tag, digest):
+        link_dir = self.tmp_path / 'docker' / 'registry' / 'v2' / \
+            'repositories' / container / '_manifests' / 'tags' / tag / \
+            'current'
+        link_dir.mkdir(parents=True)
+        (link_dir / 'link').write_text(digest)
+
+    def test_read(self):
+        self.add_tag('a', '1.0', 'sha256:x')
+        self.add_tag('a', '1.1', 'sha256:y')
+        self.add_tag('a', 'latest', '')
+        self.add_tag('b/c', '1.0', 'sha256:z')
+        self.add_tag('other', '1.0', 'sha256:x')
+        digests = {
+            ('a', '1.0'): 'sha256:x', ('a', '1.1'): 'sha256:x',
+            ('b/c', '1.0'): CgyleRequestError('503')
+        }
+
+        def get_manifest_digest(container, tag):
+            digest = digests[(container, tag)]
+            if isinstance(digest, Exception):
+                raise digest
+            return digest
+
+        self.upstream.get_manifest_digest.side_effect = get_manifest_digest
+        delta = Delta(format(self.tmp_path), self.upstream, 2)
+        with self._caplog.at_level(logging.INFO):
+            delta.read(['a', 'b/c', 'd'])
+        assert delta.tags == {'a': {'1.0'}, 'b/c': set()}
+        assert f'Cache {self.tmp_path} holds 2 of 3 containers with 1 of ' \
+            '4 tags up to date' in self._caplog.text
+        assert 'Failed to compare digests of b/c:1.0: 503' in \
+            self._caplog.text
+        assert delta.get_new_tags(
+            'a', ['latest', '1.2', '1.1', '1.0']
+        ) == ['latest', '1.2', '1.1']
+        assert delta.get_new_tags('d', ['1.0']) == ['1.0']
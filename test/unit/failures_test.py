@@ -0,0 +1,65 @@
+import os
+import gzip
+import json
+from unittest.mock import patch
+from pytest import fixture
+from cgyle.failures import FailureIndex
+
+
+class TestFailureIndex:
+    @fixture(autouse=True)
+    def inject_fixtures(self, tmp_path):
+        self.tmp = format(tmp_path)
+        self.log_file_name = f'{self.tmp}/cgyle.log'
+        FailureIndex.reset()
+
+    def test_record(self):
+        FailureIndex.record(
+            'suse/sle15', '1.0', 'x86_64', 'sle15-1.0-x86_64.log',
+            'writing blob: no space left on device'
+        )
+        FailureIndex.record('suse/sle15', '1.1', 'x86_64', 'log')
+        failures = FailureIndex.get()
+        assert failures[0]['container'] == 'suse/sle15'
+        assert failures[0]['tag'] == '1.0'
+        assert failures[0]['arch'] == 'x86_64'
+        assert failures[0]['error'] == 'disk'
+        assert failures[0]['log'] == 'sle15-1.0-x86_64.log'
+        assert failures[1]['error'] == 'unknown'
+        FailureIndex.reset()
+        assert FailureIndex.get() == []
+
+    def test_write(self):
+        assert FailureIndex.write(self.log_file_name) == 0
+        assert not os.path.exists(self.log_file_name)
+        log_name = f'{self.tmp}/sle15-sync-all.log'
+        with open(log_name, 'w') as log:
+            log.write('manifest unknown')
+        FailureIndex.record('suse/sle15', '1.0', 'all', log_name)
+        FailureIndex.record('suse/sle15', '1.1', 'all', log_name)
+        FailureIndex.record('suse/bci', '2', 'all', f'{self.tmp}/missing.log')
+        assert FailureIndex.write(self.log_file_name) == 3
+        with open(self.log_file_name) as log:
+            entries = [json.loads(line) for line in log]
+        assert [entry['tag'] for entry in entries] == ['1.0', '1.1', '2']
+        assert entries[1]['output'] == 'manifest unknown'
+        assert entries[2]['output'] == 'no log data'
+
+    @patch.object(FailureIndex, 'max_size', 10)
+    @patch.object(FailureIndex, 'backups', 2)
+    def test_rotate(self):
+        FailureIndex.rotate(self.log_file_name)
+        for generation in ['first', 'second', 'third']:
+            with open(self.log_file_name, 'w') as log:
+                log.write(f'{generation} generation of the log')
+            FailureIndex.rotate(self.log_file_name)
+            assert not os.path.exists(self.log_file_name)
+        with gzip.open(f'{self.log_file_name}.1.gz', 'rt') as backup:
+            assert backup.read() == 'third generation of the log'
+        with gzip.open(f'{self.log_file_name}.2.gz', 'rt') as backup:
+            assert backup.read() == 'second generation of the log'
+        assert not os.path.exists(f'{self.log_file_name}.3.gz')
+        with open(self.log_file_name, 'w') as log:
+            log.write('small')
+        FailureIndex.rotate(self.log_file_name)
+        assert os.path.exists(self.log_file_name)
@@ -0,0 +1,273 @@
+import os
+import json
+import logging
+from unittest.mock import (
+    patch, Mock
+)
+from pytest import fixture
+from cgyle.fanout import (
+    FanOut, Destination
+)
+from cgyle.oci_layout import OCILayout
+from cgyle.credentials import AuthFile
+from cgyle.exceptions import (
+    CgyleRequestError, CgyleOCILayoutError
+)
+
+
+class FakeSkopeo:
+    """
+    Simulates skopeo copy into oci layouts
+    """
+    def __init__(self, fail_for='', skip_blobs=[]):
+        self.calls = []
+        self.fail_for = fail_for
+        self.skip_blobs = skip_blobs
+
+    def __call__(self, call_args, stdout=None, stderr=None):
+        self.calls.append(call_args)
+        target = call_args[-1]
+        skopeo = Mock(returncode=0)
+        skopeo.communicate.return_value = (f'copy {target}'.encode(), None)
+        if self.fail_for and self.fail_for in target:
+            skopeo.returncode = 1
+            return skopeo
+        if target.startswith('oci:'):
+            layout_dir, ref = target[4:].split(':', 1)
+            blob_dir = call_args[call_args.index('--dest-shared-blob-dir') + 1]
+            blobs = {
+                'm': {
+                    'config': {'digest': 'sha256:c'},
+                    'layers': [{'digest': 'sha256:l'}]
+                },
+                'c': {},
+                'l': {}
+            }
+            for name, content in blobs.items():
+                if name not in self.skip_blobs:
+                    with open(os.sep.join([blob_dir, 'sha256', name]), 'w') as blob:
+                        json.dump(content, blob)
+            with open(os.sep.join([layout_dir, 'index.json']), 'w') as index:
+                json.dump(
+                    {
+                        'schemaVersion': 2,
+                        'manifests': [
+                            {
+                                'digest': 'sha256:m',
+                                'annotations': {
+                                    'org.opencontainers.image.ref.name': ref
+                                }
+                            }
+                        ]
+                    }, index
+                )
+        return skopeo
+
+
+class TestFanOut:
+    @fixture(autouse=True)
+    def inject_fixtures(self, tmp_path, caplog):
+        self._caplog = caplog
+        self.tmp = format(tmp_path)
+        self.push_engine = Mock()
+        self.push_engine.prepare.return_value = (False, ['sha256:c'])
+        self.layout_dest = Destination(
+            f'{self.tmp}/layout', oci_layout=True, oci_export=True
+        )
+        self.archive_dest = Destination(f'{self.tmp}/archive')
+        self.push_dest = Destination(
+            'some.ecr', push=True, creds='AWS:secret',
+            ecr_alias='alias', push_engine=self.push_engine
+        )
+        self.fanout = FanOut(
+            f'{self.tmp}/staging',
+            [self.layout_dest, self.archive_dest, self.push_dest],
+            1024
+        )
+        self.fanout.create()
+        self.log_name = f'{self.tmp}/log/container-1-all.log'
+
+    def test_destination(self):
+        assert self.archive_dest.get_archive_name('suse/a', '1', 'all') == \
+            f'{self.tmp}/archive/suse/a-1-all.oci.tar'
+        assert self.push_dest.get_repository('suse/a/b') == 'some.ecr/alias/a/b'
+        assert Destination('some.ecr', push=True).get_repository('suse/a') == \
+            'some.ecr/suse/a'
+
+    @patch.object(OCILayout, 'export')
+    @patch('cgyle.fanout.subprocess.Popen')
+    def test_transfer(self, mock_Popen, mock_export):
+        skopeo = FakeSkopeo()
+        mock_Popen.side_effect = skopeo
+        assert self.fanout.transfer(
+            ['skopeo', 'copy', '--all'], 'docker://server/suse/a:1',
+            'suse/a', '1', 'all', self.log_name
+        )
+        staging = f'{self.tmp}/staging'
+        # fetched once from upstream into staging
+        assert skopeo.calls[0][:3] == ['skopeo', 'copy', '--all']
+        assert skopeo.calls[0][-2] == 'docker://server/suse/a:1'
+        assert skopeo.calls[0][-1].startswith(f'oci:{staging}/.staging.')
+        # copied from staging to all destinations
+        sources = [call_args[-2] for call_args in skopeo.calls[1:]]
+        assert sources == [f'oci:{staging}:suse/a:1:all'] * 3
+        targets = sorted(call_args[-1] for call_args in skopeo.calls[1:])
+        assert targets[0] == 'docker://some.ecr/alias/a:1'
+        assert targets[1] == \
+            f'oci-archive:{self.tmp}/archive/suse/a-1-all.oci.tar:1'
+        assert targets[2].startswith(f'oci:{self.tmp}/layout/.staging.')
+        push_call = [
+            call_args for call_args in skopeo.calls
+            if call_args[-1].startswith('docker://')
+        ][0]
+        assert push_call[4:6] == ['--dest-authfile', AuthFile.path]
+        assert OCILayout(f'{self.tmp}/layout').has_reference('suse/a:1:all')
+        mock_export.assert_called_once_with(
+            'suse/a:1:all', f'{self.tmp}/layout/suse/a-1-all.oci.tar', '1'
+        )
+        self.push_engine.prepare.assert_called_once_with(
+            'suse/a', 'alias/a', '1', 'all'
+        )
+        self.push_engine.register_push.assert_called_once_with(
+            'alias/a', ['sha256:c']
+        )
+        # reference is released from staging, blobs are kept
+        assert self.fanout.staging.get_references() == {}
+        assert self.fanout.staging.has_blob('sha256:l')
+        assert self.fanout.blobs_in_use == {}
+        assert self.fanout.get_status() == {
+            f'{self.tmp}/layout': {'done': 1, 'skipped': 0, 'failed': 0},
+            f'{self.tmp}/archive': {'done': 1, 'skipped': 0, 'failed': 0},
+            'some.ecr': {'done': 1, 'skipped': 0, 'failed': 0}
+        }
+        assert not os.path.exists(self.log_name)
+
+        # second transfer skips up to date destinations
+        self.push_engine.prepare.return_value = (True, [])
+        assert self.fanout.transfer(
+            ['skopeo', 'copy', '--all'], 'docker://server/suse/a:1',
+            'suse/a', '1', 'all', self.log_name
+        )
+        assert self.fanout.get_status()[f'{self.tmp}/layout']['skipped'] == 1
+        assert self.fanout.get_status()['some.ecr']['skipped'] == 1
+        # the archive destination was refreshed from a new staging pull
+        assert len(skopeo.calls) == 6
+        assert skopeo.calls[4][-1].startswith(f'oci:{staging}/.staging.')
+        assert skopeo.calls[5][-1].startswith('oci-archive:')
+
+    @patch('cgyle.fanout.subprocess.Popen')
+    def test_transfer_up_to_date(self, mock_Popen):
+        skopeo = FakeSkopeo()
+        mock_Popen.side_effect = skopeo
+        self.push_engine.prepare.return_value = (True, [])
+        fanout = FanOut(
+            f'{self.tmp}/staging', [self.layout_dest, self.push_dest], 1024
+        )
+        fanout.create()
+        with patch.object(OCILayout, 'has_reference', return_value=True):
+            assert fanout.transfer(
+                ['skopeo', 'copy', '--all'], 'docker://server/suse/a:1',
+                'suse/a', '1', 'all', self.log_name
+            )
+        # nothing is fetched if all destinations hold the tag
+        assert skopeo.calls == []
+        assert fanout.get_status() == {
+            f'{self.tmp}/layout': {'done': 0, 'skipped': 1, 'failed': 0},
+            'some.ecr': {'done': 0, 'skipped': 1, 'failed': 0}
+        }
+
+    @patch('cgyle.fanout.subprocess.Popen')
+    def test_transfer_staging_failed(self, mock_Popen):
+        mock_Popen.side_effect = FakeSkopeo(fail_for='.staging.')
+        with open(f'{self.tmp}/staging/blobs/sha256/old', 'w') as blob:
+            blob.write('x' * 2048)
+        assert not self.fanout.transfer(
+            ['skopeo', 'copy', '--all'], 'docker://server/suse/a:1',
+            'suse/a', '1', 'all', self.log_name
+        )
+        assert self.fanout.get_status()['some.ecr']['failed'] == 1
+        assert os.path.exists(self.log_name)
+        # staging blobs beyond the limit are evicted before the fetch
+        assert os.listdir(f'{self.tmp}/staging/blobs/sha256') == []
+
+    @patch.object(OCILayout, 'add_reference')
+    @patch('cgyle.fanout.subprocess.Popen')
+    def test_transfer_staging_add_reference_failed(
+        self, mock_Popen, mock_add_reference
+    ):
+        mock_Popen.side_effect = FakeSkopeo()
+        mock_add_reference.side_effect = CgyleOCILayoutError('index busy')
+        assert not self.fanout.transfer(
+            ['skopeo', 'copy', '--all'], 'docker://server/suse/a:1',
+            'suse/a', '1', 'all', self.log_name
+        )
+        with open(self.log_name) as log:
+            assert log.read() == 'index busy'
+
+    @patch('cgyle.fanout.subprocess.Popen')
+    def test_transfer_staging_incomplete(self, mock_Popen):
+        mock_Popen.side_effect = FakeSkopeo(skip_blobs=['l'])
+        assert not self.fanout.transfer(
+            ['skopeo', 'copy', '--all'], 'docker://server/suse/a:1',
+            'suse/a', '1', 'all', self.log_name
+        )
+        with open(self.log_name) as log:
+            assert 'Staged blobs of suse/a:1:all incomplete' in log.read()
+        assert self.fanout.blobs_in_use == {}
+        # the incomplete staged reference is removed
+        assert self.fanout.staging.get_references() == {}
+
+    @patch('cgyle.fanout.subprocess.Popen')
+    def test_transfer_destination_failed(self, mock_Popen):
+        mock_Popen.side_effect = FakeSkopeo(fail_for='docker://some.ecr')
+        self.push_engine.prepare.side_effect = CgyleRequestError('issue')
+        with self._caplog.at_level(logging.WARNING):
+            assert not self.fanout.transfer(
+                ['skopeo', 'copy', '--all'], 'docker://server/suse/a:1',
+                'suse/a', '1', 'all', self.log_name
+            )
+        assert 'Push preparation failed for some.ecr/alias/a:1' in \
+            self._caplog.text
+        assert self.fanout.get_status()['some.ecr'] == {
+            'done': 0, 'skipped': 0, 'failed': 1
+        }
+        assert self.fanout.get_status()[f'{self.tmp}/archive']['done'] == 1
+        with open(self.log_name) as log:
+            assert log.read().startswith('some.ecr:')
+
+    @patch.object(OCILayout, 'export')
+    @patch('cgyle.fanout.subprocess.Popen')
+    def test_transfer_layout_failed(self, mock_Popen, mock_export):
+        mock_export.side_effect = CgyleOCILayoutError('export failed')
+        mock_Popen.side_effect = FakeSkopeo()
+        assert not self.fanout.transfer(
+            ['skopeo', 'copy', '--all'], 'docker://server/suse/a:1',
+            'suse/a', '1', 'all', self.log_name
+        )
+        mock_Popen.side_effect = FakeSkopeo(fail_for=f'{self.tmp}/layout')
+        assert not self.fanout.transfer(
+            ['skopeo', 'copy', '--all'], 'docker://server/suse/a:2',
+            'suse/a', '2', 'all', self.log_name
+        )
+        assert self.fanout.get_status()[f'{self.tmp}/layout']['failed'] == 2
+
+    @patch('cgyle.fanout.subprocess.Popen')
+    def test_evict(self, mock_Popen):
+        mock_Popen.side_effect = FakeSkopeo()
+        self.fanout.max_staging_size = 0
+        assert self.fanout.transfer(
+            ['skopeo', 'copy', '--all'], 'docker://server/suse/a:1',
+            'suse/a', '1', 'all', self.log_name
+        )
+        assert os.listdir(f'{self.tmp}/staging/blobs/sha256') == []
+        # blobs in use are kept
+        self.fanout._use(['sha256:c'])
+        with open(f'{self.tmp}/staging/blobs/sha256/c', 'w'):
+            pass
+        self.fanout.evict()
+        assert os.listdir(f'{self.tmp}/staging/blobs/sha256') == ['c']
+
+    @patch('cgyle.fanout.subprocess.Popen')
+    def test_run_raises(self, mock_Popen):
+        mock_Popen.side_effect = Exception('no skopeo')
+        assert self.fanout._run(['skopeo']) == (1, 'no skopeo')
@@ -0,0 +1,309 @@
+import io
+import os
+import json
+import hashlib
+import logging
+import tarfile
+from unittest.mock import (
+    patch, Mock
+)
+from pytest import (
+    fixture, raises
+)
+from cgyle.garbage import GarbageCollector
+from cgyle.selector import TagSelector
+from cgyle.verify import Verifier
+from cgyle.exceptions import CgyleGarbageCollectionError
+
+
+def digest_of(content):
+    return 'sha256:{}'.format(hashlib.sha256(content).hexdigest())
+
+
+def manifest_of(config, layers):
+    return json.dumps(
+        {
+            'config': {'digest': config},
+            'layers': [{'digest': layer} for layer in layers]
+        }
+    ).encode()
+
+
+class TestGarbageCollector:
+    @fixture(autouse=True)
+    def inject_fixtures(self, caplog, tmp_path):
+        self._caplog = caplog
+        self.tmp_path = tmp_path
+
+    def setup(self):
+        self.select_live = Mock(
+            side_effect=lambda container, tags, get_created: [
+                tag for tag in tags
+                if container.startswith('suse/') and tag != 'old'
+            ]
+        )
+        self.collector = GarbageCollector(self.select_live, 2, apply=True)
+        GarbageCollector.grace = 0
+
+    def setup_method(self, cls):
+        self.setup()
+
+    def teardown_method(self, cls):
+        GarbageCollector.grace = 3600
+
+    def add_distribution_blob(self, root, content):
+        digest = digest_of(content)
+        blob_dir = root / 'blobs' / 'sha256' / digest[7:9] / digest[7:]
+        blob_dir.mkdir(parents=True)
+        (blob_dir / 'data').write_bytes(content)
+        return digest
+
+    def add_distribution_tag(self, root, container, tag, digest):
+        link_dir = root / 'repositories' / container / '_manifests' / \
+            'tags' / tag / 'current'
+        link_dir.mkdir(parents=True)
+        (link_dir / 'link').write_text(digest)
+
+    def add_distribution_link(self, root, container, links, digest):
+        link_dir = root / 'repositories' / container / links / 'sha256' / \
+            digest[7:]
+        link_dir.mkdir(parents=True)
+        (link_dir / 'link').write_text(digest)
+        return link_dir
+
+    def test_collect_distribution(self):
+        root = self.tmp_path / 'docker' / 'registry' / 'v2'
+        shared = self.add_distribution_blob(root, b'shared')
+        dead = self.add_distribution_blob(root, b'dead')
+        live = self.add_distribution_blob(root, manifest_of(shared, []))
+        old = self.add_distribution_blob(root, manifest_of(shared, [dead]))
+        self.add_distribution_tag(root, 'suse/base', '1.0', live)
+        self.add_distribution_tag(root, 'suse/base', 'old', old)
+        self.add_distribution_tag(root, 'bci/base/x', '1.0', old)
+        (root / 'repositories' / 'bci' / 'base' / 'x' / '_layers').mkdir()
+        links = {
+            digest: self.add_distribution_link(
+                root, 'suse/base', kind, digest
+            ) for kind, digest in [
+                ('_manifests/revisions', live), ('_manifests/revisions', old),
+                ('_layers', shared), ('_layers', dead)
+            ]
+        }
+        self.collector.apply = False
+        result = self.collector.collect_distribution(format(self.tmp_path))
+        assert result['repositories'] == ['bci/base/x']
+        assert result['tags'] == [
+            ['bci/base/x', '1.0', ''], ['suse/base', 'old', '']
+        ]
+        assert result['blobs'] == 2
+        assert result['bytes'] == len(b'dead') + len(manifest_of(shared, [dead]))
+        assert (root / 'repositories' / 'bci').exists()
+
+        self.collector.apply = True
+        self.collector.collect_distribution(format(self.tmp_path))
+        assert not (root / 'repositories' / 'bci').exists()
+        assert not (
+            root / 'repositories/suse/base/_manifests/tags/old'
+        ).exists()
+        assert (root / 'repositories/suse/base/_manifests/tags/1.0').exists()
+        # the links only the removed tag referred to are removed
+        assert links[live].exists()
+        assert links[shared].exists()
+        assert not links[old].exists()
+        assert not links[dead].exists()
+        assert not (root / 'blobs' / 'sha256' / dead[7:9] / dead[7:]).exists()
+        assert (root / 'blobs' / 'sha256' / shared[7:9] / shared[7:]).exists()
+
+    def test_collect_distribution_keep(self):
+        root = self.tmp_path / 'docker' / 'registry' / 'v2'
+        for tag in ['1.0', '1.1', '2.0']:
+            layer = self.add_distribution_blob(root, tag.encode())
+            self.add_distribution_tag(
+                root, 'suse/base', tag,
+                self.add_distribution_blob(root, manifest_of(layer, []))
+            )
+        selector = TagSelector(keep=1)
+        self.collector.select_live = \
+            lambda container, tags, get_created: selector.select(
+                tags, get_created
+            )
+        result = self.collector.collect_distribution(format(self.tmp_path))
+        assert result['tags'] == [
+            ['suse/base', '1.0', ''], ['suse/base', '1.1', '']
+        ]
+        assert result['blobs'] == 4
+        assert os.listdir(
+            root / 'repositories/suse/base/_manifests/tags'
+        ) == ['2.0']
+
+    def test_collect_distribution_max_age(self):
+        root = self.tmp_path / 'docker' / 'registry' / 'v2'
+        for tag, created in [
+            ('1.0', '2020-01-01T00:00:00Z'), ('2.0', '2999-01-01T00:00:00Z')
+        ]:
+            config = self.add_distribution_blob(
+                root, json.dumps({'created': created}).encode()
+            )
+            manifest = self.add_distribution_blob(
+                root, manifest_of(config, [])
+            )
+            index = self.add_distribution_blob(
+                root, json.dumps({'manifests': [{'digest': manifest}]}).encode()
+            )
+            self.add_distribution_tag(root, 'suse/base', tag, index)
+        self.collector.apply = False
+        selector = TagSelector(max_age=30)
+        self.collector.select_live = \
+            lambda container, tags, get_created: selector.select(
+                tags, get_created
+            )
+        result = self.collector.collect_distribution(format(self.tmp_path))
+        assert result['tags'] == [['suse/base', '1.0', '']]
+
+    def test_get_created(self):
+        blobs = {'sha256:m': 'manifest', 'sha256:i': 'index'}
+        assert GarbageCollector.get_created('sha256:x', blobs) is None
+        with patch.object(Verifier, 'read_manifest') as mock_read_manifest:
+            mock_read_manifest.side_effect = [
+                {'manifests': [{'digest': 'sha256:gone'}]}
+            ]
+            assert GarbageCollector.get_created('sha256:i', blobs) is None
+            mock_read_manifest.side_effect = [
+                {'config': {'digest': 'sha256:gone'}}
+            ]
+            assert GarbageCollector.get_created('sha256:m', blobs) is None
+
+    def test_collect_distribution_grace(self):
+        GarbageCollector.grace = 3600
+        root = self.tmp_path / 'docker' / 'registry' / 'v2'
+        self.add_distribution_blob(root, b'new')
+        self.add_distribution_tag(root, 'suse/base', '1.0', digest_of(b'gone'))
+        link_dir = self.add_distribution_link(
+            root, 'suse/base', '_layers', digest_of(b'new')
+        )
+        result = self.collector.collect_distribution(format(self.tmp_path))
+        assert result['blobs'] == 0
+        assert link_dir.exists()
+
+    def test_collect_layout(self):
+        blob_dir = self.tmp_path / 'blobs' / 'sha256'
+        blob_dir.mkdir(parents=True)
+
+        def add_blob(content):
+            digest = digest_of(content)
+            (blob_dir / digest[7:]).write_bytes(content)
+            return digest
+        shared = add_blob(b'shared')
+        dead = add_blob(b'dead')
+        live = add_blob(manifest_of(shared, []))
+        old = add_blob(manifest_of(shared, [dead]))
+        (self.tmp_path / 'index.json').write_text(
+            json.dumps(
+                {
+                    'manifests': [
+                        {
+                            'digest': digest, 'annotations': {
+                                'org.opencontainers.image.ref.name': ref
+                            }
+                        } for digest, ref in [
+                            (live, 'suse/base:1.0:x86_64'),
+                            (old, 'suse/base:old:x86_64'),
+                            (old, 'bci/base:1.0:x86_64')
+                        ]
+                    ]
+                }
+            )
+        )
+        result = self.collector.collect_layout(format(self.tmp_path))
+        assert result['tags'] == [
+            ['bci/base', '1.0', 'x86_64'], ['suse/base', 'old', 'x86_64']
+        ]
+        assert result['blobs'] == 2
+        with open(self.tmp_path / 'index.json') as index:
+            assert [
+                descriptor['digest'] for descriptor in json.load(index)[
+                    'manifests'
+                ]
+            ] == [live]
+        assert sorted(os.listdir(blob_dir)) == sorted(
+            [shared[7:], live[7:]]
+        )
+
+    def create_archive(self, name, tag):
+        archive_name = self.tmp_path / name
+        archive_name.parent.mkdir(parents=True, exist_ok=True)
+        with tarfile.open(archive_name, 'w') as archive:
+            index = json.dumps(
+                {
+                    'manifests': [
+                        {
+                            'digest': 'sha256:a', 'annotations': {
+                                'org.opencontainers.image.ref.name': tag
+                            }
+                        }
+                    ]
+                } if tag else {}
+            ).encode()
+            info = tarfile.TarInfo('index.json')
+            info.size = len(index)
+            archive.addfile(info, io.BytesIO(index))
+        return archive_name
+
+    def test_collect_archives(self):
+        live = self.create_archive('suse/base-1.0-x86_64.oci.tar', '1.0')
+        dead = self.create_archive('bci/base-1.0-x86_64.oci.tar', '1.0')
+        unknown = self.create_archive('bci/base-x-x86_64.oci.tar', '')
+        with self._caplog.at_level(logging.WARNING):
+            result = self.collector.collect_archives(format(self.tmp_path))
+        assert result['tags'] == [['bci/base', '1.0', 'x86_64']]
+        assert result['blobs'] == 1
+        assert live.exists()
+        assert unknown.exists()
+        assert not dead.exists()
+        assert f'No container tag found for {unknown}' in self._caplog.text
+
+    def test_get_archive_tag(self):
+        (self.tmp_path / 'bogus.oci.tar').write_bytes(b'bogus')
+        with self._caplog.at_level(logging.WARNING):
+            assert GarbageCollector.get_archive_tag(
+                format(self.tmp_path / 'bogus.oci.tar')
+            ) == ''
+        assert 'Failed to read' in self._caplog.text
+
+    def test_remove_raises(self):
+        (self.tmp_path / 'blob').write_bytes(b'blob')
+        with patch('os.unlink') as mock_unlink:
+            mock_unlink.side_effect = OSError('busy')
+            with raises(CgyleGarbageCollectionError):
+                self.collector._remove([format(self.tmp_path / 'blob')])
+
+    def test_get_dead_blobs_vanished(self):
+        result = GarbageCollector._get_result('oci-layout', 'oci')
+        assert self.collector._get_dead_blobs(
+            {'sha256:a': format(self.tmp_path / 'gone')}, {}, result,
+            lambda path: path
+        ) == []
+
+    def test_log(self):
+        result = GarbageCollector._get_result('distribution', 'some')
+        result['repositories'] = ['bci/base']
+        result['tags'] = [['bci/base', '1.0', ''], ['c', 't', 'x86_64']]
+        result['blobs'] = 2
+        result['bytes'] = 3 * 1024 * 1024
+        with self._caplog.at_level(logging.INFO):
+            GarbageCollector.log(result)
+        assert 'Unused repository: bci/base' in self._caplog.text
+        assert 'Unused tag: bci/base:1.0\n' in self._caplog.text
+        assert 'Unused tag: c:t arch:x86_64' in self._caplog.text
+        assert 'Collected distribution some: repositories:1 tags:2 ' \
+            'blobs:2 size:3MB' in self._caplog.text
+
+    def test_write(self):
+        report = self.tmp_path / 'gc.json'
+        GarbageCollector.write([{'kind': 'oci-layout'}], format(report))
+        with open(report) as report_file:
+            assert json.load(report_file) == [{'kind': 'oci-layout'}]
+        with raises(CgyleGarbageCollectionError):
+            GarbageCollector.write(
+                [], format(self.tmp_path / 'gone' / 'gc.json')
+            )
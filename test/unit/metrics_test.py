@@ -0,0 +1,109 @@
+import os
+import logging
+import urllib.request
+from urllib.error import HTTPError
+from unittest.mock import patch
+from pytest import (
+    raises, fixture
+)
+from cgyle.metrics import (
+    Metrics, MetricsServer
+)
+from cgyle.exceptions import CgyleMetricsError
+
+
+class TestMetrics:
+    @fixture(autouse=True)
+    def inject_fixtures(self, tmp_path):
+        self.tmp = format(tmp_path)
+        Metrics.reset()
+
+    def test_inc_set_get(self):
+        Metrics.inc('cgyle_tags_total', state='done')
+        Metrics.inc('cgyle_tags_total', 2, state='done')
+        Metrics.set('cgyle_workers', 10)
+        Metrics.set('cgyle_workers', 5)
+        assert Metrics.get('cgyle_tags_total', state='done') == 3
+        assert Metrics.get('cgyle_tags_total', state='failed') == 0
+        assert Metrics.get('cgyle_workers') == 5
+
+    @patch('time.monotonic')
+    def test_timer_and_timed(self, mock_monotonic):
+        mock_monotonic.side_effect = [10, 12.5, 20, 21]
+
+        @Metrics.timed('cgyle_phase_duration_seconds', phase='catalog')
+        def get_catalog(server):
+            return [server]
+
+        with Metrics.timer('cgyle_phase_duration_seconds', phase='catalog'):
+            pass
+        assert get_catalog('server') == ['server']
+        assert get_catalog.__name__ == 'get_catalog'
+        assert Metrics.get(
+            'cgyle_phase_duration_seconds_sum', phase='catalog'
+        ) == 3.5
+        assert Metrics.get(
+            'cgyle_phase_duration_seconds_count', phase='catalog'
+        ) == 2
+
+    def test_render(self):
+        assert Metrics.render() == ''
+        Metrics.inc('cgyle_tags_total', state='done')
+        Metrics.inc('cgyle_tags_total', state='failed')
+        Metrics.set('cgyle_run_duration_seconds', 42)
+        Metrics.observe(
+            'cgyle_phase_duration_seconds', 0.5, phase='a "quoted" phase'
+        )
+        assert Metrics.render() == os.linesep.join(
+            [
+                '# HELP cgyle_run_duration_seconds '
+                'Duration of the last cache update run',
+                '# TYPE cgyle_run_duration_seconds gauge',
+                'cgyle_run_duration_seconds 42.0',
+                '# HELP cgyle_tags_total Container tags of the run by state',
+                '# TYPE cgyle_tags_total counter',
+                'cgyle_tags_total{state="done"} 1.0',
+                'cgyle_tags_total{state="failed"} 1.0',
+                '# HELP cgyle_phase_duration_seconds Latency of the '
+                'catalog, filter, delta, discovery, verify, gc and transfer phases',
+                '# TYPE cgyle_phase_duration_seconds summary',
+                'cgyle_phase_duration_seconds_sum'
+                '{phase="a \\"quoted\\" phase"} 0.5',
+                'cgyle_phase_duration_seconds_count'
+                '{phase="a \\"quoted\\" phase"} 1.0',
+                ''
+            ]
+        )
+
+    def test_write(self):
+        Metrics.set('cgyle_workers', 10)
+        metrics_file = f'{self.tmp}/cgyle.prom'
+        Metrics.write(metrics_file)
+        with open(metrics_file) as metrics:
+            assert 'cgyle_workers 10.0' in metrics.read()
+        with raises(CgyleMetricsError):
+            Metrics.write(f'{self.tmp}/missing/cgyle.prom')
+
+
+class TestMetricsServer:
+    @fixture(autouse=True)
+    def inject_fixtures(self, caplog):
+        self._caplog = caplog
+        Metrics.reset()
+
+    def test_serve(self):
+        Metrics.set('cgyle_queue_depth', 3)
+        with MetricsServer(0) as server:
+            url = 'http://127.0.0.1:{}'.format(server.server.server_port)
+            with self._caplog.at_level(logging.DEBUG):
+                with urllib.request.urlopen(f'{url}/metrics') as response:
+                    assert response.status == 200
+                    assert 'cgyle_queue_depth 3.0' in response.read().decode()
+            assert 'metrics: "GET /metrics HTTP/1.1" 200' in self._caplog.text
+            with raises(HTTPError):
+                urllib.request.urlopen(f'{url}/other')
+
+    def test_init_raises(self):
+        with MetricsServer(0) as server:
+            with raises(CgyleMetricsError):
+                MetricsServer(server.server.server_port)
@@ -0,0 +1,166 @@
+import os
+import json
+from unittest.mock import (
+    patch, Mock
+)
+from pytest import (
+    raises, fixture
+)
+from cgyle.oci_layout import OCILayout
+from cgyle.exceptions import CgyleOCILayoutError
+
+
+class TestOCILayout:
+    @fixture(autouse=True)
+    def inject_fixtures(self, tmp_path):
+        self._tmp_path = tmp_path
+        self.root_dir = format(tmp_path / 'store')
+        self.layout = OCILayout(self.root_dir)
+        self.layout.create()
+
+    def _stage(self, ref, digest):
+        staging_dir = self._tmp_path / 'staging'
+        staging_dir.mkdir(exist_ok=True)
+        with open(staging_dir / 'index.json', 'w') as index:
+            json.dump(
+                {
+                    'schemaVersion': 2,
+                    'manifests': [
+                        {
+                            'mediaType': 'application/vnd.oci.image.manifest.v1+json',
+                            'digest': digest,
+                            'size': 42,
+                            'annotations': {
+                                'org.opencontainers.image.ref.name': ref
+                            }
+                        }
+                    ]
+                }, index
+            )
+        return format(staging_dir)
+
+    def test_create(self):
+        with open(os.sep.join([self.root_dir, 'oci-layout'])) as layout:
+            assert json.load(layout) == {'imageLayoutVersion': '1.0.0'}
+        with open(os.sep.join([self.root_dir, 'index.json'])) as index:
+            assert json.load(index) == {'schemaVersion': 2, 'manifests': []}
+        assert os.path.isdir(os.sep.join([self.root_dir, 'blobs', 'sha256']))
+        # create on an existing layout keeps its content
+        self.layout.add_reference(
+            'a:1:all', self._stage('a:1:all', 'sha256:aaa')
+        )
+        self.layout.create()
+        assert list(self.layout.get_references()) == ['a:1:all']
+
+    def test_get_reference(self):
+        assert OCILayout.get_reference('suse/sle15', '15.5', 'x86_64') == \
+            'suse/sle15:15.5:x86_64'
+
+    def test_get_staging_options(self):
+        assert self.layout.get_staging_options() == [
+            '--dest-shared-blob-dir', f'{self.root_dir}/blobs'
+        ]
+
+    def test_add_reference_and_has_reference(self):
+        self.layout.add_reference(
+            'a:1:all', self._stage('a:1:all', 'sha256:aaa')
+        )
+        self.layout.add_reference(
+            'b:1:all', self._stage('b:1:all', 'sha256:bbb')
+        )
+        # replace existing reference
+        self.layout.add_reference(
+            'a:1:all', self._stage('a:1:all', 'sha256:ccc')
+        )
+        references = self.layout.get_references()
+        assert sorted(references) == ['a:1:all', 'b:1:all']
+        assert references['a:1:all']['digest'] == 'sha256:ccc'
+        # manifest blob is not present
+        assert not self.layout.has_reference('a:1:all')
+        with open(self.layout.get_blob_path('sha256:ccc'), 'w'):
+            pass
+        assert self.layout.has_reference('a:1:all')
+        assert self.layout.has_blob('sha256:ccc')
+        assert not self.layout.has_reference('c:1:all')
+
+    def test_remove_reference_and_get_blob_digests(self):
+        blobs = {
+            'sha256:index': {'manifests': [{'digest': 'sha256:m'}]},
+            'sha256:m': {
+                'config': {'digest': 'sha256:c'},
+                'layers': [{'digest': 'sha256:l'}, {'digest': 'sha256:c'}]
+            }
+        }
+        for digest, content in blobs.items():
+            with open(self.layout.get_blob_path(digest), 'w') as blob:
+                json.dump(content, blob)
+        self.layout.add_reference(
+            'a:1:all', self._stage('a:1:all', 'sha256:index')
+        )
+        assert self.layout.get_blob_digests('a:1:all') == [
+            'sha256:index', 'sha256:m', 'sha256:c', 'sha256:l'
+        ]
+        self.layout.remove_reference('a:1:all')
+        assert self.layout.get_references() == {}
+        assert self.layout.get_blob_digests('a:1:all') == []
+        assert self.layout.has_blob('sha256:m')
+
+    def test_add_reference_raises(self):
+        with raises(CgyleOCILayoutError):
+            self.layout.add_reference(
+                'a:1:all', self._stage('b:1:all', 'sha256:aaa')
+            )
+
+    def test_get_references_cached(self):
+        self.layout.add_reference(
+            'a:1:all', self._stage('a:1:all', 'sha256:aaa')
+        )
+        # index.json is read once, changes of this process update it
+        with patch.object(OCILayout, '_read_index') as mock_read_index:
+            assert list(self.layout.get_references()) == ['a:1:all']
+            assert list(
+                OCILayout(self.root_dir).get_references()
+            ) == ['a:1:all']
+            assert not mock_read_index.called
+        # a change of another process is seen in the next run
+        with open(os.sep.join([self.root_dir, 'index.json']), 'w') as index:
+            json.dump({'schemaVersion': 2, 'manifests': []}, index)
+        assert list(self.layout.get_references()) == ['a:1:all']
+        OCILayout.reset()
+        assert self.layout.get_references() == {}
+
+    def test_get_references_no_index(self):
+        assert OCILayout(format(self._tmp_path)).get_references() == {}
+
+    def test_get_references_raises(self):
+        with open(os.sep.join([self.root_dir, 'index.json']), 'w') as index:
+            index.write('{')
+        with raises(CgyleOCILayoutError):
+            self.layout.get_references()
+
+    @patch('cgyle.oci_layout.subprocess.Popen')
+    def test_export(self, mock_Popen):
+        skopeo = Mock()
+        skopeo.returncode = 0
+        skopeo.communicate.return_value = (b'', b'')
+        mock_Popen.return_value = skopeo
+        self.layout.export('a:1:all', 'archive.oci.tar', '1')
+        mock_Popen.assert_called_once_with(
+            [
+                'skopeo', 'copy', '--all',
+                f'oci:{self.root_dir}:a:1:all',
+                'oci-archive:archive.oci.tar:1'
+            ], stdout=-1, stderr=-1
+        )
+
+    @patch('cgyle.oci_layout.subprocess.Popen')
+    def test_export_raises(self, mock_Popen):
+        skopeo = Mock()
+        skopeo.returncode = 1
+        skopeo.communicate.return_value = (b'', b'error')
+        mock_Popen.return_value = skopeo
+        with raises(CgyleOCILayoutError):
+            self.layout.export('a:1:all', 'archive.oci.tar', '1')
+        mock_Popen.side_effect = Exception
+        with raises(CgyleOCILayoutError):
+            self.layout.export('a:1:all', 'archive.oci.tar', '1')
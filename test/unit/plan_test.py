@@ -0,0 +1,173 @@
+import json
+import logging
+from unittest.mock import (
+    patch, Mock
+)
+from pytest import (
+    raises, fixture
+)
+from cgyle.plan import (
+    Plan, Planner
+)
+from cgyle.exceptions import (
+    CgylePlanError, CgyleRequestError
+)
+
+
+class TestPlan:
+    @fixture(autouse=True)
+    def inject_fixtures(self, tmp_path):
+        self._tmp_path = tmp_path
+
+    def setup(self):
+        self.plan = Plan('localhost:5000', 'registry.suse.com')
+        self.plan.add(
+            'suse/sle15', 'x86_64', [
+                {'tag': '1.0', 'digest': 'sha256:a', 'size': 30,
+                 'new_size': 10}
+            ]
+        )
+        self.plan.add(
+            'bci/python', 'all', [
+                {'tag': '3.11', 'digest': 'sha256:b', 'size': 5,
+                 'new_size': 5}
+            ]
+        )
+        self.plan.add(
+            'suse/sle15', 'aarch64', [
+                {'tag': '1.0', 'digest': 'sha256:c', 'size': 20,
+                 'new_size': 0},
+                {'tag': '1.1', 'digest': 'sha256:d', 'size': 20,
+                 'new_size': 20}
+            ]
+        )
+
+    def setup_method(self, cls):
+        self.setup()
+
+    def test_get_containers(self):
+        assert self.plan.get_containers() == ['suse/sle15', 'bci/python']
+
+    def test_get_tags(self):
+        assert self.plan.get_tags('suse/sle15') == {
+            'x86_64': ['1.0'], 'aarch64': ['1.0', '1.1']
+        }
+        assert self.plan.get_tags('unknown') == {}
+
+    def test_get_tag(self):
+        assert self.plan.get_tag('suse/sle15', 'aarch64', '1.1') == {
+            'tag': '1.1', 'digest': 'sha256:d', 'size': 20, 'new_size': 20
+        }
+        assert self.plan.get_tag('suse/sle15', 'aarch64', '2.0') is None
+        assert self.plan.get_tag('bci/python', 'x86_64', '3.11') is None
+
+    def test_merge(self):
+        plan = Plan('localhost:5000', 'registry.suse.com')
+        plan.add(
+            'suse/sle15', 'aarch64', [
+                {'tag': '1.1', 'digest': '', 'size': 0, 'new_size': 0},
+                {'tag': '1.2', 'digest': '', 'size': 0, 'new_size': 0}
+            ]
+        )
+        plan.add(
+            'bci/python', 'all', [
+                {'tag': '3.11', 'digest': '', 'size': 0, 'new_size': 0}
+            ]
+        )
+        self.plan.merge(plan)
+        assert self.plan.get_tags('suse/sle15') == {
+            'x86_64': ['1.0'], 'aarch64': ['1.0', '1.1', '1.2']
+        }
+        assert self.plan.get_tags('bci/python') == {'all': ['3.11']}
+
+    def test_get_summary(self):
+        assert self.plan.get_summary() == {
+            'containers': 2, 'tags': 4, 'size': 75, 'new_size': 35
+        }
+
+    def test_write_and_read(self):
+        plan_file = f'{self._tmp_path}/plan.json'
+        self.plan.write(plan_file)
+        with open(plan_file) as plan_fd:
+            data = json.load(plan_fd)
+        assert data['summary']['new_size'] == 35
+        assert [unit['container'] for unit in data['units']] == [
+            'bci/python', 'suse/sle15', 'suse/sle15'
+        ]
+        plan = Plan.read(plan_file)
+        assert plan.proxy == 'localhost:5000'
+        assert plan.from_registry == 'registry.suse.com'
+        assert plan.get_tags('suse/sle15') == self.plan.get_tags('suse/sle15')
+
+    def test_write_raises(self):
+        with raises(CgylePlanError):
+            self.plan.write(f'{self._tmp_path}/missing/plan.json')
+
+    def test_read_raises(self):
+        with raises(CgylePlanError):
+            Plan.read(f'{self._tmp_path}/missing.json')
+        plan_file = self._tmp_path / 'plan.json'
+        plan_file.write_text('{"version": 0}')
+        with raises(CgylePlanError) as issue:
+            Plan.read(format(plan_file))
+        assert 'unsupported plan version 0' in format(issue.value)
+        plan_file.write_text('{"version": 1}')
+        with raises(CgylePlanError):
+            Plan.read(format(plan_file))
+
+
+class TestPlanner:
+    @fixture(autouse=True)
+    def inject_fixtures(self, caplog):
+        self._caplog = caplog
+
+    def setup(self):
+        self.registry = Mock()
+        self.blob_exists = Mock(return_value=False)
+        self.planner = Planner(self.registry, self.blob_exists)
+
+    def setup_method(self, cls):
+        self.setup()
+
+    def test_resolve(self):
+        self.registry.resolve.return_value = (
+            'sha256:m', [
+                {
+                    'config': {'digest': 'sha256:c', 'size': 1},
+                    'layers': [
+                        {'digest': 'sha256:l1', 'size': 10},
+                        {'digest': 'sha256:l2', 'size': 100}
+                    ]
+                }
+            ]
+        )
+        self.blob_exists.side_effect = lambda container, digest: \
+            digest == 'sha256:l2'
+        assert self.planner.resolve('suse/sle15', '1.0', 'x86_64') == {
+            'tag': '1.0', 'digest': 'sha256:m', 'size': 111, 'new_size': 11
+        }
+        self.registry.resolve.assert_called_once_with(
+            'suse/sle15', '1.0', 'x86_64'
+        )
+        # blobs are counted once per plan
+        assert self.planner.resolve('suse/sle15', '1.1', 'x86_64') == {
+            'tag': '1.1', 'digest': 'sha256:m', 'size': 111, 'new_size': 0
+        }
+
+    def test_resolve_without_blob_check(self):
+        planner = Planner(self.registry)
+        self.registry.resolve.return_value = (
+            'sha256:m', [{'layers': [{'digest': 'sha256:l1', 'size': 10}]}]
+        )
+        assert planner.resolve('suse/sle15', '1.0', 'all')['new_size'] == 10
+
+    @patch('cgyle.plan.Registry.get_blobs')
+    def test_resolve_failed(self, mock_get_blobs):
+        self.registry.resolve.side_effect = CgyleRequestError('timeout')
+        with self._caplog.at_level(logging.WARNING):
+            assert self.planner.resolve('suse/sle15', '1.0', 'all') == {
+                'tag': '1.0', 'digest': '', 'size': 0, 'new_size': 0
+            }
+        assert 'Failed to resolve suse/sle15:1.0 arch:all: timeout' in \
+            self._caplog.text
+        assert not mock_get_blobs.called
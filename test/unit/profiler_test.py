@@ -0,0 +1,140 @@
+import os
+import json
+import pstats
+import logging
+import threading
+from unittest.mock import patch
+from pytest import (
+    raises, fixture
+)
+from cgyle.profiler import Profiler
+from cgyle.metrics import Metrics
+from cgyle.exceptions import CgyleProfileError
+
+
+def work():
+    return sum(range(1000))
+
+
+class TestProfiler:
+    @fixture(autouse=True)
+    def inject_fixtures(self, tmp_path, caplog):
+        self.tmp = format(tmp_path)
+        self._caplog = caplog
+        Profiler.events = []
+        yield
+        Profiler.enabled = False
+
+    def test_span_disabled(self):
+        with Profiler.span('catalog', 'phase'):
+            pass
+        assert Profiler.events == []
+
+    def test_start_raises(self):
+        with raises(CgyleProfileError):
+            Profiler.start('perf')
+
+    def test_profile(self):
+        Profiler.start()
+        with Metrics.timer('cgyle_phase_duration_seconds', phase='catalog'):
+            work()
+
+        def worker(name):
+            with Profiler.span(name, 'unit'):
+                with Profiler.span('transfer', 'phase'):
+                    work()
+
+        thread = threading.Thread(
+            target=worker, args=['container'], name='worker_0'
+        )
+        thread.start()
+        thread.join()
+        with Profiler.span('other', 'misc', tag='latest'):
+            pass
+        summary = Profiler.stop(self.tmp)
+        assert sorted(summary['phases']) == ['catalog', 'transfer']
+        assert summary['phases']['catalog']['count'] == 1
+        assert summary['workers']['worker_0']['count'] == 1
+        assert summary['workers']['worker_0']['idle'] >= 0
+        assert summary['slowest_units'][0]['name'] == 'container'
+        assert summary['slowest_units'][0]['worker'] == 'worker_0'
+        assert 'children_user' in summary['cpu']
+        with open(os.sep.join([self.tmp, 'trace.json'])) as trace_file:
+            trace = json.load(trace_file)
+        events = trace['traceEvents']
+        assert {
+            event['args']['name'] for event in events if event['ph'] == 'M'
+        } == {'worker_0', threading.current_thread().name}
+        spans = [event for event in events if event['ph'] == 'X']
+        assert [span['name'] for span in spans] == [
+            'catalog', 'transfer', 'container', 'other'
+        ]
+        assert spans[3]['args']['tag'] == 'latest'
+        with open(os.sep.join([self.tmp, 'summary.json'])) as summary_file:
+            assert json.load(summary_file) == summary
+        assert not os.path.exists(os.sep.join([self.tmp, 'python.pstats']))
+
+        # spans are no longer recorded after stop
+        with Profiler.span('catalog', 'phase'):
+            pass
+        assert len(Profiler.events) == 4
+
+    def test_profile_cprofile(self):
+        Profiler.start('cprofile')
+
+        def worker():
+            with Profiler.span('container', 'unit'):
+                work()
+
+        work()
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        Profiler.stop(self.tmp)
+        stats = pstats.Stats(os.sep.join([self.tmp, 'python.pstats']))
+        assert [
+            function for function in stats.stats if function[2] == 'work'
+        ]
+        assert len(Profiler.profiles) == 2
+
+    @patch('cgyle.profiler.cProfile.Profile')
+    def test_profile_cprofile_busy(self, mock_Profile):
+        mock_Profile.return_value.enable.side_effect = ValueError
+        Profiler.start('cprofile')
+        with Profiler.span('container', 'unit'):
+            pass
+        assert Profiler.profiles == []
+
+    def test_profile_tracemalloc(self):
+        Profiler.start('tracemalloc')
+        data = [format(count) for count in range(1000)]
+        Profiler.stop(self.tmp)
+        assert data
+        with open(os.sep.join([self.tmp, 'tracemalloc.txt'])) as out:
+            assert 'profiler_test.py' in out.read()
+
+    def test_stop_raises(self):
+        Profiler.start()
+        with open(os.sep.join([self.tmp, 'file']), 'w'):
+            pass
+        with raises(CgyleProfileError):
+            Profiler.stop(os.sep.join([self.tmp, 'file']))
+
+    def test_log(self):
+        with self._caplog.at_level(logging.INFO):
+            Profiler.log(
+                {
+                    'phases': {
+                        'catalog': {'count': 1, 'wall': 2.0, 'cpu': 0.5}
+                    },
+                    'workers': {
+                        'worker_0': {
+                            'count': 3, 'wall': 8.0, 'idle': 2.0, 'cpu': 1.0
+                        }
+                    }
+                }
+            )
+        assert 'Profile phase catalog: count:1 wall:2.0s cpu:0.5s' in \
+            self._caplog.text
+        assert 'Profile worker worker_0: units:3 busy:8.0s idle:2.0s' in \
+            self._caplog.text
@@ -1,16 +1,25 @@
 import io
+import logging
 from unittest.mock import (
     patch, Mock, MagicMock, call
 )
 from pytest import (
     raises, fixture
 )
-from cgyle.proxy import DistributionProxy
+from cgyle.proxy import (
+    DistributionProxy, UpdateOptions
+)
+from cgyle.selector import TagSelector
+from cgyle.credentials import AuthFile
+from cgyle.metrics import Metrics
+from cgyle.report import TransferReport
 from subprocess import SubprocessError
 from cgyle.exceptions import (
-    CgyleCommandError, CgyleCredentialsError
+    CgyleCommandError, CgyleCredentialsError, CgyleOCILayoutError,
+    CgyleRequestError
 )
 from json import JSONDecodeError
+from collections import deque
 
 
 class TestDistributionProxy:
@@ -36,11 +45,15 @@ class TestDistributionProxy:
         mock_DistributionProxy.return_value = proxy
         mock_Popen.side_effect = SubprocessError
         with raises(CgyleCommandError):
-            self.proxy.update_cache(from_registry='some_registry')
+            self.proxy.update_cache(
+                UpdateOptions(from_registry='some_registry')
+            )
         with raises(CgyleCredentialsError):
             self.proxy.update_cache(
-                from_registry='some_registry', store_oci='some_dir',
-                proxy_creds='bogus_creds'
+                UpdateOptions(
+                    from_registry='some_registry', store_oci='some_dir',
+                    proxy_creds='bogus_creds'
+                )
             )
 
     @patch('cgyle.proxy.subprocess.Popen')
@@ -56,31 +69,33 @@ class TestDistributionProxy:
         proxy = Mock()
         proxy.get_tags.return_value = ['latest']
         mock_DistributionProxy.return_value = proxy
-        skopeo = Mock()
+        skopeo = Mock(stdout=[])
         skopeo.returncode = 0
-        skopeo.communicate.return_value = ('stdout', 'stderr')
+        skopeo.stdout = [b'stdout']
         mock_Popen.return_value = skopeo
         with patch('builtins.open', create=True) as mock_open:
             mock_open.return_value = MagicMock(spec=io.IOBase)
             file_handle = mock_open.return_value.__enter__.return_value
             file_handle.readline.return_value = ['tagname']
             self.proxy.update_cache(
-                from_registry='some_registry', store_oci='some_dir',
-                proxy_creds='user:pass'
+                UpdateOptions(
+                    from_registry='some_registry', store_oci='some_dir',
+                    proxy_creds='user:pass'
+                )
             )
             mock_Popen.assert_called_once_with(
                 [
                     'skopeo', 'copy', '--all',
                     '--dest-oci-accept-uncompressed-layers',
-                    '--retry-times', '5',
+                    '--retry-times', '1',
                     '--image-parallel-copies', '5',
                     '--src-tls-verify=true',
-                    '--src-creds', 'user:pass',
+                    '--src-authfile', AuthFile.path,
                     'docker://server/container:latest',
                     'oci-archive:some_dir/container-latest-all.oci.tar:latest'
-                ], stdout=file_handle, stderr=file_handle
+                ], stdout=-1, stderr=-2
             )
-            assert skopeo.communicate.called
+            assert skopeo.wait.called
 
     @patch('cgyle.proxy.subprocess.Popen')
     @patch('os.unlink')
@@ -92,32 +107,214 @@ class TestDistributionProxy:
         proxy = Mock()
         proxy.get_tags.return_value = ['latest']
         mock_DistributionProxy.return_value = proxy
-        skopeo = Mock()
+        skopeo = Mock(stdout=[])
         skopeo.returncode = 0
-        skopeo.communicate.return_value = ('stdout', 'stderr')
+        skopeo.stdout = [b'stdout']
         mock_Popen.return_value = skopeo
         with patch('builtins.open', create=True) as mock_open:
             mock_open.return_value = MagicMock(spec=io.IOBase)
-            file_handle = mock_open.return_value.__enter__.return_value
             self.proxy.update_cache(
-                from_registry='some_registry',
-                store_oci='some_dir',
-                proxy_creds='user:pass',
-                use_archs=['x86_64']
+                UpdateOptions(
+                    from_registry='some_registry',
+                    store_oci='some_dir',
+                    proxy_creds='user:pass',
+                    use_archs=['x86_64']
+                )
             )
             mock_Popen.assert_called_once_with(
                 [
                     'skopeo', '--override-arch', 'x86_64',
                     'copy', '--dest-oci-accept-uncompressed-layers',
-                    '--retry-times', '5',
+                    '--retry-times', '1',
                     '--image-parallel-copies', '5',
                     '--src-tls-verify=true',
-                    '--src-creds', 'user:pass',
+                    '--src-authfile', AuthFile.path,
                     'docker://server/container:latest',
                     'oci-archive:some_dir/container-latest-x86_64.oci.tar:latest'
-                ], stdout=file_handle, stderr=file_handle
+                ], stdout=-1, stderr=-2
             )
-            assert skopeo.communicate.called
+            assert skopeo.wait.called
+
+    @patch('cgyle.proxy.subprocess.Popen')
+    @patch('os.unlink')
+    @patch('cgyle.proxy.Path')
+    @patch('cgyle.proxy.DistributionProxy')
+    @patch.object(DistributionProxy, '_add_tags')
+    def test_update_cache_plan_tags(
+        self, mock_add_tags, mock_DistributionProxy, mock_Path,
+        mock_os_unlink, mock_Popen
+    ):
+        skopeo = Mock(stdout=[])
+        skopeo.returncode = 0
+        mock_Popen.return_value = skopeo
+        with patch('builtins.open', create=True) as mock_open:
+            mock_open.return_value = MagicMock(spec=io.IOBase)
+            self.proxy.update_cache(
+                UpdateOptions(
+                    from_registry='some_registry',
+                    store_oci='some_dir',
+                    use_archs=['x86_64']
+                ),
+                plan_tags={'aarch64': ['1.0']}
+            )
+        assert not mock_DistributionProxy.called
+        mock_add_tags.assert_called_once_with(
+            'some_dir/container-aarch64.tags', ['1.0']
+        )
+        assert mock_Popen.call_args[0][0][:3] == [
+            'skopeo', '--override-arch', 'aarch64'
+        ]
+        assert mock_Popen.call_args[0][0][-1] == \
+            'oci-archive:some_dir/container-1.0-aarch64.oci.tar:1.0'
+
+    @patch('cgyle.proxy.Path')
+    def test_update_cache_other_shard(self, mock_Path):
+        shard = Mock()
+        shard.tags = False
+        shard.owns.return_value = False
+        self.proxy.update_cache(
+            UpdateOptions(from_registry='some_registry', shard=shard)
+        )
+        shard.owns.assert_called_once_with('container')
+        assert not mock_Path.called
+
+    def test_get_shard_tags(self):
+        shard = Mock()
+        shard.tags = False
+        assert self.proxy._get_shard_tags(shard, ['1', '2'], 'all') == \
+            ['1', '2']
+        shard.tags = True
+        shard.owns.side_effect = lambda key: key == 'container:2:all'
+        assert self.proxy._get_shard_tags(shard, ['1', '2'], 'all') == ['2']
+
+    def test_add_tags(self, tmp_path):
+        tag_log_name = f'{tmp_path}/suse/container-all.tags'
+        self.proxy._add_tags(tag_log_name, ['1.0', 'latest'])
+        self.proxy._add_tags(tag_log_name, ['1.1', '1.0'])
+        with open(tag_log_name) as taglog:
+            assert taglog.read().split() == ['1.0', '1.1']
+
+    @patch('cgyle.proxy.Path')
+    @patch.object(DistributionProxy, 'get_new_tags')
+    @patch.object(DistributionProxy, '_add_tags')
+    @patch.object(DistributionProxy, '_fetch')
+    def test_update_cache_shard_tags(
+        self, mock_fetch, mock_add_tags, mock_get_new_tags, mock_Path
+    ):
+        shard = Mock()
+        shard.tags = True
+        shard.owns.side_effect = lambda key: key == 'container:2:all'
+        mock_get_new_tags.return_value = ('log/container-all.tags', ['1', '2'])
+        mock_fetch.return_value = (0, '')
+        self.proxy.update_cache(
+            UpdateOptions(from_registry='some_registry', shard=shard)
+        )
+        assert not mock_get_new_tags.call_args.kwargs['update_tag_log']
+        mock_add_tags.assert_called_once_with(
+            'log/container-all.tags', ['2']
+        )
+
+    @patch('cgyle.proxy.subprocess.Popen')
+    @patch('os.unlink')
+    @patch('cgyle.proxy.Path')
+    @patch('cgyle.proxy.DistributionProxy')
+    @patch('cgyle.proxy.OCILayout')
+    @patch('cgyle.proxy.TemporaryDirectory')
+    def test_update_cache_oci_layout(
+        self, mock_TemporaryDirectory, mock_OCILayout,
+        mock_DistributionProxy, mock_Path, mock_os_unlink, mock_Popen
+    ):
+        staging = Mock()
+        staging.name = 'some_dir/.staging.XXX'
+        mock_TemporaryDirectory.return_value = staging
+        layout = Mock()
+        layout.has_reference.return_value = False
+        layout.get_staging_options.return_value = [
+            '--dest-shared-blob-dir', 'some_dir/blobs'
+        ]
+        mock_OCILayout.return_value = layout
+        mock_OCILayout.get_reference.return_value = 'container:latest:x86_64'
+        proxy = Mock()
+        proxy.get_tags.return_value = ['latest']
+        mock_DistributionProxy.return_value = proxy
+        skopeo = Mock(stdout=[])
+        skopeo.returncode = 0
+        mock_Popen.return_value = skopeo
+        with patch('builtins.open', create=True) as mock_open:
+            mock_open.return_value = MagicMock(spec=io.IOBase)
+            file_handle = mock_open.return_value.__enter__.return_value
+            self.proxy.update_cache(
+                UpdateOptions(
+                    from_registry='some_registry',
+                    store_oci='some_dir',
+                    use_archs=['x86_64'],
+                    oci_layout=True,
+                    oci_export=True
+                )
+            )
+            mock_OCILayout.assert_called_once_with('some_dir')
+            layout.create.assert_called_once_with()
+            mock_TemporaryDirectory.assert_called_once_with(
+                dir='some_dir', prefix='.staging.'
+            )
+            mock_Popen.assert_called_once_with(
+                [
+                    'skopeo', '--override-arch', 'x86_64',
+                    'copy', '--dest-oci-accept-uncompressed-layers',
+                    '--retry-times', '1',
+                    '--image-parallel-copies', '5',
+                    '--src-tls-verify=true',
+                    '--dest-shared-blob-dir', 'some_dir/blobs',
+                    'docker://server/container:latest',
+                    'oci:some_dir/.staging.XXX:container:latest:x86_64'
+                ], stdout=-1, stderr=-2
+            )
+            layout.add_reference.assert_called_once_with(
+                'container:latest:x86_64', 'some_dir/.staging.XXX'
+            )
+            layout.export.assert_called_once_with(
+                'container:latest:x86_64',
+                'some_dir/container-latest-x86_64.oci.tar', 'latest'
+            )
+            staging.cleanup.assert_called_once_with()
+            mock_os_unlink.assert_called_once_with(
+                'some_dir/container-latest-x86_64.log'
+            )
+
+            # export failed, tag gets dropped
+            mock_os_unlink.reset_mock()
+            layout.export.side_effect = CgyleOCILayoutError('export failed')
+            with patch.object(DistributionProxy, '_drop_tag') as mock_drop_tag:
+                self.proxy.update_cache(
+                    UpdateOptions(
+                        from_registry='some_registry',
+                        store_oci='some_dir',
+                        use_archs=['x86_64'],
+                        oci_layout=True,
+                        oci_export=True
+                    )
+                )
+                mock_drop_tag.assert_called_once_with(
+                    'some_dir/container-x86_64.tags', 'latest'
+                )
+            file_handle.write.assert_called_once_with('export failed\n')
+            assert not mock_os_unlink.called
+
+            # reference already present in layout
+            mock_Popen.reset_mock()
+            layout.has_reference.return_value = True
+            with self._caplog.at_level(logging.INFO):
+                self.proxy.update_cache(
+                    UpdateOptions(
+                        from_registry='some_registry',
+                        store_oci='some_dir',
+                        use_archs=['x86_64'],
+                        oci_layout=True
+                    )
+                )
+            assert not mock_Popen.called
+            assert 'container:latest:x86_64 present in some_dir' in \
+                self._caplog.text
 
     @patch('cgyle.proxy.subprocess.Popen')
     @patch('os.unlink')
@@ -129,34 +326,540 @@ class TestDistributionProxy:
         proxy = Mock()
         proxy.get_tags.return_value = ['latest']
         mock_DistributionProxy.return_value = proxy
-        skopeo = Mock()
+        skopeo = Mock(stdout=[])
         skopeo.returncode = 0
-        skopeo.communicate.return_value = ('stdout', 'stderr')
+        skopeo.stdout = [b'stdout']
         mock_Popen.return_value = skopeo
         with patch('builtins.open', create=True) as mock_open:
             mock_open.return_value = MagicMock(spec=io.IOBase)
-            file_handle = mock_open.return_value.__enter__.return_value
             self.proxy.update_cache(
-                from_registry='some_registry',
-                push_oci='some.dkr.ecr.eu-central-1.amazonaws.com',
-                push_oci_creds='user:pass',
-                use_archs=['x86_64'],
-                remove_signatures=True
+                UpdateOptions(
+                    from_registry='some_registry',
+                    push_oci='some.dkr.ecr.eu-central-1.amazonaws.com',
+                    push_oci_creds='user:pass',
+                    use_archs=['x86_64'],
+                    remove_signatures=True
+                )
             )
             mock_Popen.assert_called_once_with(
                 [
                     'skopeo', '--override-arch', 'x86_64',
                     'copy', '--dest-oci-accept-uncompressed-layers',
-                    '--retry-times', '5',
+                    '--retry-times', '1',
                     '--image-parallel-copies', '5',
                     '--src-tls-verify=true',
                     '--remove-signatures',
-                    '--dest-creds', 'user:pass',
+                    '--dest-authfile', AuthFile.path,
                     'docker://server/container:latest',
                     'docker://some.dkr.ecr.eu-central-1.amazonaws.com/container:latest'
-                ], stdout=file_handle, stderr=file_handle
+                ], stdout=-1, stderr=-2
+            )
+            assert skopeo.wait.called
+
+    @patch('cgyle.proxy.subprocess.Popen')
+    @patch('os.unlink')
+    @patch('cgyle.proxy.Path')
+    @patch('cgyle.proxy.DistributionProxy')
+    def test_update_cache_push_engine(
+        self, mock_DistributionProxy, mock_Path, mock_os_unlink, mock_Popen
+    ):
+        proxy = Mock()
+        proxy.get_tags.return_value = ['latest']
+        mock_DistributionProxy.return_value = proxy
+        skopeo = Mock(stdout=[])
+        skopeo.returncode = 0
+        mock_Popen.return_value = skopeo
+        push_engine = Mock()
+        push_engine.prepare.return_value = (False, ['sha256:a'])
+        with patch('builtins.open', create=True):
+            self.proxy.update_cache(
+                UpdateOptions(
+                    from_registry='some_registry',
+                    push_oci='some.ecr/base',
+                    use_archs=['x86_64'],
+                    push_engine=push_engine
+                )
+            )
+            push_engine.prepare.assert_called_once_with(
+                'container', 'base/container', 'latest', 'x86_64'
+            )
+            push_engine.register_push.assert_called_once_with(
+                'base/container', ['sha256:a']
+            )
+            assert mock_Popen.called
+
+            # tag is up to date in the destination
+            mock_Popen.reset_mock()
+            push_engine.prepare.return_value = (True, [])
+            with self._caplog.at_level(logging.INFO):
+                self.proxy.update_cache(
+                    UpdateOptions(
+                        from_registry='some_registry',
+                        push_oci='some.ecr/base',
+                        use_archs=['x86_64'],
+                        push_engine=push_engine
+                    )
+                )
+            assert 'container:latest up to date in some.ecr/base' in \
+                self._caplog.text
+            assert not mock_Popen.called
+
+            # push preparation failed, push anyway
+            push_engine.prepare.side_effect = CgyleRequestError('issue')
+            with self._caplog.at_level(logging.WARNING):
+                self.proxy.update_cache(
+                    UpdateOptions(
+                        from_registry='some_registry',
+                        push_oci='some.ecr/base',
+                        use_archs=['x86_64'],
+                        push_engine=push_engine
+                    )
+                )
+            assert 'Push preparation failed for container:latest' in \
+                self._caplog.text
+            assert mock_Popen.called
+
+    @patch('cgyle.proxy.yaml.safe_dump')
+    @patch('cgyle.proxy.NamedTemporaryFile')
+    @patch('cgyle.proxy.subprocess.Popen')
+    @patch('cgyle.proxy.Path')
+    @patch('cgyle.proxy.DistributionProxy')
+    def test_update_cache_sync_push(
+        self, mock_DistributionProxy, mock_Path, mock_Popen,
+        mock_NamedTemporaryFile, mock_yaml_safe_dump
+    ):
+        proxy = Mock()
+        proxy.get_tags.return_value = ['1', '2', '3']
+        mock_DistributionProxy.return_value = proxy
+        mock_NamedTemporaryFile.return_value.__enter__.return_value.name = \
+            'spec.yaml'
+        skopeo = Mock(returncode=1)
+        skopeo.stdout = [
+            b'level=info msg="Copying image ref 1/2" '
+            b'from="docker://server/suse/container:1" '
+            b'to="docker://some.ecr/base/container:1"\n',
+            f'Copying blob sha256:{"a" * 64}\n'.encode(),
+            b'Writing manifest to image destination\n',
+            b'level=info msg="Copying image ref 2/2" '
+            b'from="docker://server/suse/container:2" '
+            b'to="docker://some.ecr/base/container:2"\n',
+            b'level=error msg="Error copying ref '
+            b'\\"docker://server/suse/container:2\\": manifest unknown"\n'
+        ]
+        mock_Popen.return_value = skopeo
+        push_engine = Mock()
+        push_engine.prepare.side_effect = lambda container, repo, tag, arch: \
+            (tag == '3', [f'sha256:{tag}'])
+        push_engine.get_blob_sizes.return_value = {f'sha256:{"a" * 64}': 42}
+        self.proxy.container = 'suse/container'
+        TransferReport.reset()
+        state = Mock()
+        state.is_quarantined.return_value = False
+        state.record_failure.return_value = 0
+        with patch('builtins.open', create=True) as mock_open, \
+             patch.object(self.proxy, '_drop_tag') as mock_drop_tag:
+            self.proxy.update_cache(
+                UpdateOptions(
+                    from_registry='some_registry',
+                    push_oci='some.ecr/base',
+                    push_oci_creds='AWS:secret',
+                    use_archs=['x86_64'],
+                    push_engine=push_engine,
+                    sync=True,
+                    state=state
+                )
+            )
+        mock_yaml_safe_dump.assert_called_once_with(
+            {
+                'server': {
+                    'images': {'suse/container': ['1', '2']},
+                    'tls-verify': True
+                }
+            }, mock_NamedTemporaryFile.return_value.__enter__.return_value
+        )
+        mock_Popen.assert_called_once_with(
+            [
+                'skopeo', '--override-arch', 'x86_64',
+                'sync', '--src', 'yaml', '--dest', 'docker',
+                '--keep-going', '--retry-times', '1',
+                '--src-tls-verify=true',
+                '--dest-authfile', AuthFile.path,
+                'spec.yaml', 'some.ecr/base/suse'
+            ], stdout=-1, stderr=-2
+        )
+        mock_drop_tag.assert_called_once_with(
+            '/var/log/cgyle/suse/container-x86_64.tags', '2'
+        )
+        push_engine.register_push.assert_called_once_with(
+            'base/suse/container', ['sha256:1']
+        )
+        mock_open.assert_called_with(
+            '/var/log/cgyle/suse/container-sync-x86_64.log', 'a'
+        )
+        report = TransferReport.get()
+        assert [(entry['tag'], entry['failed']) for entry in report] == [
+            ('1', False), ('2', True)
+        ]
+        assert report[0]['bytes'] == 42
+        # the failed tag records only its own error line
+        state.record_failure.assert_called_once_with(
+            'suse/container', '2', 'x86_64',
+            'level=error msg="Error copying ref '
+            '\\"docker://server/suse/container:2\\": manifest unknown"\n'
+        )
+
+    @patch('cgyle.proxy.TemporaryDirectory')
+    @patch('cgyle.proxy.NamedTemporaryFile')
+    @patch('cgyle.proxy.subprocess.Popen')
+    @patch('cgyle.proxy.Path')
+    @patch('cgyle.proxy.DistributionProxy')
+    def test_update_cache_sync(
+        self, mock_DistributionProxy, mock_Path, mock_Popen,
+        mock_NamedTemporaryFile, mock_TemporaryDirectory
+    ):
+        proxy = Mock()
+        proxy.get_tags.return_value = ['1', '2']
+        mock_DistributionProxy.return_value = proxy
+        mock_NamedTemporaryFile.return_value.__enter__.return_value.name = \
+            'spec.yaml'
+        mock_TemporaryDirectory.return_value.__enter__.return_value = \
+            'sync_dir'
+        skopeo = Mock(returncode=0, stdout=[])
+        mock_Popen.return_value = skopeo
+        with patch('builtins.open', create=True) as mock_open, \
+             patch.object(self.proxy, '_drop_tag') as mock_drop_tag:
+            with self._caplog.at_level(logging.INFO):
+                self.proxy.update_cache(
+                    UpdateOptions(
+                        from_registry='some_registry',
+                        remove_signatures=True,
+                        sync=True
+                    )
+                )
+        assert 'Syncing (2 tags, arch:all): container@server' in \
+            self._caplog.text
+        assert 'synced:2 failed:0' in self._caplog.text
+        mock_Popen.assert_called_once_with(
+            [
+                'skopeo', 'sync', '--src', 'yaml', '--dest', 'dir',
+                '--keep-going', '--retry-times', '1',
+                '--src-tls-verify=true', '--all', '--remove-signatures',
+                'spec.yaml', 'sync_dir'
+            ], stdout=-1, stderr=-2
+        )
+        mock_TemporaryDirectory.assert_called_once_with(
+            dir='/var/tmp', prefix='.sync.'
+        )
+        assert not mock_drop_tag.called
+        assert not mock_open.called
+
+    @patch('cgyle.proxy.subprocess.Popen')
+    @patch('cgyle.proxy.DistributionProxy')
+    def test_update_cache_sync_up_to_date(
+        self, mock_DistributionProxy, mock_Popen
+    ):
+        proxy = Mock()
+        proxy.get_tags.return_value = ['1']
+        mock_DistributionProxy.return_value = proxy
+        push_engine = Mock()
+        push_engine.prepare.return_value = (True, [])
+        with patch('builtins.open', create=True):
+            self.proxy.update_cache(
+                UpdateOptions(
+                    from_registry='some_registry',
+                    push_oci='some.ecr/base',
+                    use_archs=['x86_64'],
+                    push_engine=push_engine,
+                    sync=True
+                )
             )
-            assert skopeo.communicate.called
+        assert not mock_Popen.called
+
+    @patch('cgyle.proxy.Admission')
+    @patch('cgyle.proxy.subprocess.Popen')
+    @patch('os.unlink')
+    @patch('cgyle.proxy.Path')
+    @patch('cgyle.proxy.DistributionProxy')
+    def test_update_cache_deferred(
+        self, mock_DistributionProxy, mock_Path, mock_os_unlink, mock_Popen,
+        mock_Admission
+    ):
+        proxy = Mock()
+        proxy.get_tags.return_value = ['1', '2']
+        mock_DistributionProxy.return_value = proxy
+        skopeo = Mock(returncode=0, stdout=[b'stdout'])
+        mock_Popen.return_value = skopeo
+        mock_Admission.admit.side_effect = [True, False]
+        Metrics.reset()
+        with patch('builtins.open', create=True), \
+             patch.object(self.proxy, '_drop_tag') as mock_drop_tag:
+            with self._caplog.at_level(logging.INFO):
+                self.proxy.update_cache(
+                    UpdateOptions(
+                        from_registry='some_registry', store_oci='some_dir',
+                        use_archs=['x86_64']
+                    )
+                )
+        assert 'Deferring (arch:x86_64): container:2 for lack of disk space' \
+            in self._caplog.text
+        assert mock_Popen.call_count == 1
+        mock_drop_tag.assert_called_once_with(
+            'some_dir/container-x86_64.tags', '2'
+        )
+        mock_Admission.release.assert_called_once_with(
+            'container', '1', 'x86_64'
+        )
+        mock_Admission.defer.assert_called_once_with(
+            'container', '2', 'x86_64'
+        )
+        assert Metrics.get('cgyle_tags_total', state='deferred') == 1
+
+    @patch('cgyle.proxy.Admission')
+    @patch('cgyle.proxy.TemporaryDirectory')
+    @patch('cgyle.proxy.NamedTemporaryFile')
+    @patch('cgyle.proxy.subprocess.Popen')
+    @patch('cgyle.proxy.Path')
+    @patch('cgyle.proxy.DistributionProxy')
+    def test_update_cache_sync_deferred(
+        self, mock_DistributionProxy, mock_Path, mock_Popen,
+        mock_NamedTemporaryFile, mock_TemporaryDirectory, mock_Admission
+    ):
+        proxy = Mock()
+        proxy.get_tags.return_value = ['1', '2']
+        mock_DistributionProxy.return_value = proxy
+        mock_Admission.admit.side_effect = [False, False]
+        with patch('builtins.open', create=True), \
+             patch.object(self.proxy, '_drop_tag') as mock_drop_tag:
+            self.proxy.update_cache(
+                UpdateOptions(
+                    from_registry='some_registry', use_archs=['x86_64'],
+                    sync=True
+                )
+            )
+        assert not mock_Popen.called
+        assert mock_drop_tag.call_count == 2
+        assert mock_Admission.defer.call_args_list == [
+            call('container', '1', 'x86_64'),
+            call('container', '2', 'x86_64')
+        ]
+
+    @patch('cgyle.proxy.subprocess.Popen')
+    @patch('os.unlink')
+    @patch('cgyle.proxy.Path')
+    @patch('cgyle.proxy.DistributionProxy')
+    def test_update_cache_state(
+        self, mock_DistributionProxy, mock_Path, mock_os_unlink, mock_Popen
+    ):
+        proxy = Mock()
+        proxy.get_tags.return_value = ['1', '2', '3']
+        mock_DistributionProxy.return_value = proxy
+        skopeo = Mock(returncode=0)
+        mock_Popen.return_value = skopeo
+        state = Mock()
+        state.is_quarantined.side_effect = \
+            lambda container, tag, arch: tag == '1'
+        state.record_failure.return_value = 21600
+
+        def skopeo_call(call_args, stdout, stderr):
+            skopeo.returncode = 1 if call_args[-1].endswith(':3') else 0
+            skopeo.stdout = [b'manifest unknown'] if skopeo.returncode else []
+            return skopeo
+
+        mock_Popen.side_effect = skopeo_call
+        Metrics.reset()
+        with patch('builtins.open', create=True):
+            with self._caplog.at_level(logging.INFO):
+                self.proxy.update_cache(
+                    UpdateOptions(
+                        from_registry='some_registry', state=state
+                    )
+                )
+        assert 'container:1 in quarantine' in self._caplog.text
+        assert 'container:3 failed repeatedly, quarantined for 6h' in \
+            self._caplog.text
+        assert mock_Popen.call_count == 2
+        state.record_success.assert_called_once_with('container', '2', 'all')
+        state.record_failure.assert_called_once_with(
+            'container', '3', 'all', 'manifest unknown'
+        )
+        for tag_state, tags in [
+            ('planned', 3), ('skipped', 1), ('done', 1), ('failed', 1)
+        ]:
+            assert Metrics.get('cgyle_tags_total', state=tag_state) == tags
+        assert self.proxy.failed_tags == 1
+
+    def test_skip_quarantined(self, tmp_path):
+        tag_log_name = format(tmp_path / 'container-all.tags')
+        with open(tag_log_name, 'w') as tag_log:
+            tag_log.write('1\n2\n')
+        state = Mock()
+        state.is_quarantined.side_effect = \
+            lambda container, tag, arch: tag == '2'
+        assert self.proxy._skip_quarantined(
+            state, ['1', '2'], 'all', tag_log_name
+        ) == ['1']
+        with open(tag_log_name) as tag_log:
+            assert tag_log.read().splitlines() == ['1']
+
+    @patch('cgyle.proxy.TemporaryDirectory')
+    @patch('cgyle.proxy.NamedTemporaryFile')
+    @patch('cgyle.proxy.subprocess.Popen')
+    @patch('cgyle.proxy.Path')
+    @patch('cgyle.proxy.DistributionProxy')
+    def test_update_cache_sync_batches(
+        self, mock_DistributionProxy, mock_Path, mock_Popen,
+        mock_NamedTemporaryFile, mock_TemporaryDirectory
+    ):
+        proxy = Mock()
+        proxy.get_tags.return_value = ['1', '2', '3']
+        mock_DistributionProxy.return_value = proxy
+        skopeo = Mock(returncode=0, stdout=[])
+        mock_Popen.return_value = skopeo
+        self.proxy.max_sync_tags = 2
+        with patch('builtins.open', create=True), \
+             patch.dict('os.environ', {'TMPDIR': '/scratch'}):
+            self.proxy.update_cache(
+                UpdateOptions(
+                    from_registry='some_registry', use_archs=['x86_64'],
+                    sync=True
+                )
+            )
+        assert mock_Popen.call_count == 2
+        assert mock_TemporaryDirectory.call_args_list == [
+            call(dir='/scratch', prefix='.sync.'),
+            call(dir='/scratch', prefix='.sync.')
+        ]
+
+    @patch('cgyle.retry.time.sleep')
+    @patch('cgyle.proxy.yaml.safe_dump')
+    @patch('cgyle.proxy.TemporaryDirectory')
+    @patch('cgyle.proxy.NamedTemporaryFile')
+    @patch('cgyle.proxy.subprocess.Popen')
+    @patch('cgyle.proxy.Path')
+    @patch('cgyle.proxy.DistributionProxy')
+    def test_update_cache_sync_retry(
+        self, mock_DistributionProxy, mock_Path, mock_Popen,
+        mock_NamedTemporaryFile, mock_TemporaryDirectory,
+        mock_yaml_safe_dump, mock_sleep
+    ):
+        proxy = Mock()
+        proxy.get_tags.return_value = ['1', '2']
+        mock_DistributionProxy.return_value = proxy
+        failing = Mock(returncode=1)
+        failing.stdout = [
+            b'level=info msg="Copying image ref 1/2" '
+            b'from="docker://server/container:1"\n',
+            b'level=fatal msg="Error copying ref '
+            b'\\"docker://server/container:2\\": '
+            b'http status 503 service unavailable"\n'
+        ]
+        synced = Mock(returncode=0, stdout=[])
+        mock_Popen.side_effect = [failing, synced]
+        with patch('builtins.open', create=True), \
+             patch.object(self.proxy, '_drop_tag') as mock_drop_tag:
+            self.proxy.update_cache(
+                UpdateOptions(from_registry='some_registry', sync=True)
+            )
+        # the retry only syncs the failed tag
+        assert [
+            dump[0][0]['server']['images']['container']
+            for dump in mock_yaml_safe_dump.call_args_list
+        ] == [['1', '2'], ['2']]
+        assert mock_sleep.called
+        assert not mock_drop_tag.called
+
+    def test_get_sync_errors(self):
+        source = 'docker://server/container'
+        output = (
+            'level=info msg="Copying image ref 1/3" '
+            'from="docker://server/container:1"\n'
+            'level=error msg="Error copying ref '
+            '\\"docker://server/container:1\\": manifest unknown"\n'
+            'level=fatal msg="context canceled"\n'
+        )
+        assert DistributionProxy.get_sync_errors(
+            output, source, ['1', '2']
+        ) == {
+            '1': 'level=error msg="Error copying ref '
+                 '\\"docker://server/container:1\\": manifest unknown"\n',
+            '2': 'level=fatal msg="context canceled"\n'
+        }
+
+    def test_get_failed_sync_tags(self):
+        source = 'docker://server/container'
+        assert DistributionProxy.get_failed_sync_tags(
+            '', 0, source, ['1', '2']
+        ) == []
+        # an error in the name of a tag is no failure
+        assert DistributionProxy.get_failed_sync_tags(
+            f'level=info msg="Copying image ref 1/1" from="{source}:error"',
+            1, source, ['error']
+        ) == []
+        # skopeo stopped before tag 3 was copied
+        assert DistributionProxy.get_failed_sync_tags(
+            f'msg="Copying image ref 1/3" from="{source}:1"\n'
+            f'msg="Copying image ref 2/3" from="{source}:1.1"\n'
+            f'level=fatal msg="Error copying ref \\"{source}:1.1\\": fail"',
+            1, source, ['1', '1.1', '3']
+        ) == ['1.1', '3']
+
+    @patch('cgyle.proxy.subprocess.Popen')
+    @patch('cgyle.proxy.Path')
+    @patch('cgyle.proxy.DistributionProxy')
+    def test_update_cache_fanout(
+        self, mock_DistributionProxy, mock_Path, mock_Popen
+    ):
+        proxy = Mock()
+        proxy.get_tags.return_value = ['latest']
+        mock_DistributionProxy.return_value = proxy
+        fanout = Mock()
+        fanout.destinations = [Mock(), Mock()]
+        fanout.transfer.return_value = True
+        with patch('builtins.open', create=True):
+            with self._caplog.at_level(logging.INFO):
+                self.proxy.update_cache(
+                    UpdateOptions(
+                        from_registry='some_registry',
+                        use_archs=['x86_64'],
+                        fanout=fanout
+                    )
+                )
+            assert 'container:latest@server for 2 destinations' in \
+                self._caplog.text
+            fanout.transfer.assert_called_once_with(
+                [
+                    'skopeo', '--override-arch', 'x86_64',
+                    'copy', '--dest-oci-accept-uncompressed-layers',
+                    '--retry-times', '1',
+                    '--image-parallel-copies', '5',
+                    '--src-tls-verify=true'
+                ],
+                'docker://server/container:latest',
+                'container', 'latest', 'x86_64',
+                '/var/log/cgyle/container-latest-x86_64.log'
+            )
+            assert not mock_Popen.called
+
+            fanout.transfer.return_value = False
+            with patch.object(DistributionProxy, '_drop_tag') as mock_drop_tag, \
+                 patch.object(DistributionProxy, '_read_log') as mock_read_log, \
+                 patch('cgyle.proxy.FailureIndex') as mock_FailureIndex:
+                mock_read_log.return_value = 'manifest unknown'
+                self.proxy.update_cache(
+                    UpdateOptions(
+                        from_registry='some_registry',
+                        use_archs=['x86_64'],
+                        fanout=fanout
+                    )
+                )
+                mock_drop_tag.assert_called_once_with(
+                    '/var/log/cgyle/container-x86_64.tags', 'latest'
+                )
+                mock_FailureIndex.record.assert_called_once_with(
+                    'container', 'latest', 'x86_64',
+                    '/var/log/cgyle/container-latest-x86_64.log',
+                    'manifest unknown'
+                )
 
     @patch('cgyle.proxy.subprocess.Popen')
     @patch('os.unlink')
@@ -168,35 +871,36 @@ class TestDistributionProxy:
         proxy = Mock()
         proxy.get_tags.return_value = ['latest']
         mock_DistributionProxy.return_value = proxy
-        skopeo = Mock()
+        skopeo = Mock(stdout=[])
         skopeo.returncode = 0
-        skopeo.communicate.return_value = ('stdout', 'stderr')
+        skopeo.stdout = [b'stdout']
         mock_Popen.return_value = skopeo
         with patch('builtins.open', create=True) as mock_open:
             mock_open.return_value = MagicMock(spec=io.IOBase)
-            file_handle = mock_open.return_value.__enter__.return_value
             self.proxy.update_cache(
-                from_registry='some_registry',
-                push_oci='some.dkr.ecr.eu-central-1.amazonaws.com',
-                push_oci_creds='user:pass',
-                use_archs=['x86_64'],
-                remove_signatures=True,
-                ecr_alias='custom_alias'
+                UpdateOptions(
+                    from_registry='some_registry',
+                    push_oci='some.dkr.ecr.eu-central-1.amazonaws.com',
+                    push_oci_creds='user:pass',
+                    use_archs=['x86_64'],
+                    remove_signatures=True,
+                    ecr_alias='custom_alias'
+                )
             )
             mock_Popen.assert_called_once_with(
                 [
                     'skopeo', '--override-arch', 'x86_64',
                     'copy', '--dest-oci-accept-uncompressed-layers',
-                    '--retry-times', '5',
+                    '--retry-times', '1',
                     '--image-parallel-copies', '5',
                     '--src-tls-verify=true',
                     '--remove-signatures',
-                    '--dest-creds', 'user:pass',
+                    '--dest-authfile', AuthFile.path,
                     'docker://server/container:latest',
                     'docker://some.dkr.ecr.eu-central-1.amazonaws.com/custom_alias:latest'
-                ], stdout=file_handle, stderr=file_handle
+                ], stdout=-1, stderr=-2
             )
-            assert skopeo.communicate.called
+            assert skopeo.wait.called
 
     @patch('cgyle.proxy.subprocess.Popen')
     @patch('os.unlink')
@@ -211,7 +915,7 @@ class TestDistributionProxy:
         proxy = Mock()
         proxy.get_tags.return_value = ['latest']
         mock_DistributionProxy.return_value = proxy
-        skopeo = Mock()
+        skopeo = Mock(stdout=[b'manifest ', b'unknown\n'])
         skopeo.returncode = 1
         skopeo.pid = 42
         mock_Popen.return_value = skopeo
@@ -236,26 +940,66 @@ class TestDistributionProxy:
             file_handle_tags_write = \
                 mock_open_tags_write.return_value.__enter__.return_value
 
-            self.proxy.update_cache(from_registry='some_registry')
+            self.proxy.update_cache(
+                UpdateOptions(from_registry='some_registry')
+            )
 
             mock_Popen.assert_called_once_with(
                 [
                     'skopeo', 'copy', '--all',
                     '--dest-oci-accept-uncompressed-layers',
-                    '--retry-times', '5',
+                    '--retry-times', '1',
                     '--image-parallel-copies', '5',
                     '--src-tls-verify=true',
                     'docker://server/container:latest',
                     'oci-archive:/dev/null:latest'
-                ], stdout=file_handle_log, stderr=file_handle_log
+                ], stdout=-1, stderr=-2
+            )
+            skopeo.wait.assert_called_once_with()
+            file_handle_log.write.assert_called_once_with(
+                'manifest unknown\n'
             )
-            skopeo.communicate.assert_called_once_with()
             assert '[E] - for details see:' in self._caplog.text
             assert file_handle_tags_write.write.call_args_list == [
                 call('new_tag1\n'),
                 call('new_tag2\n')
             ]
 
+    def test_read_log(self, tmp_path):
+        log_name = format(tmp_path / 'log')
+        assert DistributionProxy._read_log(log_name, 0) == ''
+        DistributionProxy._write_log(log_name, ['attempt 1\n'])
+        DistributionProxy._write_log(log_name, ['attempt 2\n'])
+        assert DistributionProxy._read_log(log_name, 10) == 'attempt 2\n'
+
+    @patch('cgyle.proxy.subprocess.Popen')
+    def test_fetch(self, mock_Popen):
+        results = [0, 1]
+
+        def skopeo(call_args, stdout, stderr):
+            returncode = results.pop()
+            output = [
+                b'Copying blob 1\n', b'connection reset by peer\n'
+            ] if returncode else [b'Copying blob 1\n']
+            return Mock(returncode=returncode, pid=42, stdout=output)
+
+        mock_Popen.side_effect = skopeo
+        capture = deque(maxlen=2)
+        capture.append('former attempt\n')
+        stats = Mock()
+        assert self.proxy._fetch(
+            ['skopeo'], capture, 'latest', '1/1 tags, arch:all', stats
+        ) == (1, 'Copying blob 1\nconnection reset by peer\n')
+        assert self.proxy._fetch(
+            ['skopeo'], capture, 'latest', '1/1 tags, arch:all', stats
+        ) == (0, '')
+        # the ring buffer keeps the last lines of all attempts
+        assert list(capture) == [
+            'connection reset by peer\n', 'Copying blob 1\n'
+        ]
+        assert stats.begin.call_count == 2
+        stats.feed.assert_called_with('Copying blob 1\n')
+
     def test_get_pid(self):
         assert self.proxy.get_pid() == '0'
 
@@ -409,7 +1153,7 @@ class TestDistributionProxy:
 
     @patch('cgyle.proxy.subprocess.Popen')
     def test_get_tags_no_logfile(self, mock_Popen):
-        skopeo = Mock()
+        skopeo = Mock(stdout=[])
         skopeo.returncode = 0
         skopeo.communicate.return_value = ['{"RepoTags": ["name"],"Architecture": "amd64"}', '']
         mock_Popen.return_value = skopeo
@@ -426,13 +1170,81 @@ class TestDistributionProxy:
     @patch('cgyle.proxy.subprocess.Popen')
     @patch('os.unlink')
     def test_get_tags_with_logfile(self, mock_os_unlink, mock_Popen):
-        skopeo = Mock()
+        skopeo = Mock(stdout=[])
         skopeo.returncode = 0
         skopeo.communicate.return_value = ['{"RepoTags": ["name"],"Architecture": "amd64"}', '']
         mock_Popen.return_value = skopeo
         with patch('builtins.open', create=True):
             self.proxy.get_tags(True, 'user:pass', 'amd64', 'some-log-file')
 
+    @patch.object(DistributionProxy, 'get_created')
+    @patch('cgyle.proxy.subprocess.Popen')
+    def test_get_tags_with_selector(self, mock_Popen, mock_get_created):
+        skopeo = Mock(stdout=[])
+        skopeo.returncode = 0
+        skopeo.communicate.return_value = [
+            '{"RepoTags": ["15.4", "15.5", "15.6-beta", "latest"]}', ''
+        ]
+        mock_Popen.return_value = skopeo
+        mock_get_created.return_value = None
+        assert self.proxy.get_tags(
+            tag_selector=TagSelector(tags='15.*', exclude=['*-beta'], keep=1)
+        ) == ['15.5']
+        assert not mock_get_created.called
+        assert self.proxy.get_tags(
+            False, tag_selector=TagSelector(order='created', keep=1)
+        ) == ['latest', '15.6-beta']
+        mock_get_created.assert_called_with('15.6-beta', False, '', '')
+
+    @patch.object(DistributionProxy, 'get_tags')
+    @patch('os.path.exists')
+    def test_get_new_tags_with_delta(self, mock_os_path_exists, mock_get_tags):
+        mock_os_path_exists.return_value = False
+        mock_get_tags.return_value = ['latest', '1.1', '1.0']
+        delta = Mock()
+        delta.get_new_tags.return_value = ['latest', '1.1']
+        assert self.proxy.get_new_tags(
+            'registry', '', 'all', update_tag_log=False, delta=delta
+        ) == ('/var/log/cgyle/container-all.tags', ['latest', '1.1'])
+        delta.get_new_tags.assert_called_once_with(
+            'container', ['latest', '1.1', '1.0']
+        )
+
+    @patch.object(DistributionProxy, '_drop_tag')
+    def test_drop_tags(self, mock_drop_tag):
+        self.proxy.drop_tags('oci', 'x86_64', ['1.0', '2.0'])
+        assert mock_drop_tag.call_args_list == [
+            call('oci/container-x86_64.tags', '1.0'),
+            call('oci/container-x86_64.tags', '2.0')
+        ]
+
+    @patch('cgyle.proxy.subprocess.Popen')
+    def test_get_created(self, mock_Popen):
+        skopeo = Mock()
+        skopeo.returncode = 0
+        skopeo.communicate.return_value = [
+            b'{"Created": "2024-01-01T00:00:00Z"}', b''
+        ]
+        mock_Popen.return_value = skopeo
+        assert self.proxy.get_created(
+            '1.0', False, 'auth.json', 'amd64'
+        ) == 1704067200.0
+        mock_Popen.assert_called_once_with(
+            [
+                'skopeo', '--override-arch', 'amd64', 'inspect',
+                '--authfile', 'auth.json', '--tls-verify=false',
+                'docker://server/container:1.0'
+            ], stdout=-1, stderr=-1
+        )
+        skopeo.returncode = 1
+        skopeo.communicate.return_value = [b'', b'manifest unknown']
+        with self._caplog.at_level(logging.WARNING):
+            assert self.proxy.get_created('1.0') is None
+            assert 'manifest unknown' in self._caplog.text
+        skopeo.returncode = 0
+        skopeo.communicate.return_value = [b'{', b'']
+        assert self.proxy.get_created('1.0') is None
+
     @patch('cgyle.proxy.subprocess.Popen')
     @patch('os.unlink')
     def test_get_tags_podman_search(self, mock_os_unlink, mock_Popen):
@@ -455,13 +1267,13 @@ class TestDistributionProxy:
         with patch('builtins.open', create=True):
             assert self.proxy.get_tags(
                 True, 'user:pass', 'amd64', 'some-log-file', True
-            ) == ['tag1', 'tag2', 'some.att']
+            ) == ['tag2', 'tag1', 'some.att']
             skopeos = [
                 second, first
             ]
             assert self.proxy.get_tags(
                 True, 'user:pass', 'amd64', 'some-log-file', False
-            ) == ['tag1', 'tag2']
+            ) == ['tag2', 'tag1']
 
     @patch('cgyle.proxy.subprocess.Popen')
     @patch('os.unlink')
@@ -502,7 +1314,9 @@ class TestDistributionProxy:
             with DistributionProxy('server', 'container') as proxy:
                 proxy.pid = 1234
                 proxy.shutdown = True
-                proxy.update_cache(from_registry='some_registry')
+                proxy.update_cache(
+                    UpdateOptions(from_registry='some_registry')
+                )
                 raise KeyboardInterrupt
             mock_os_kill.assert_called_once_with()
 
@@ -0,0 +1,84 @@
+from unittest.mock import (
+    Mock, call
+)
+from cgyle.push import PushEngine
+from cgyle.metrics import Metrics
+
+image_amd64 = {
+    'config': {'digest': 'sha256:config-amd64', 'size': 1},
+    'layers': [
+        {'digest': 'sha256:base', 'size': 10},
+        {'digest': 'sha256:amd64', 'size': 100}
+    ]
+}
+image_arm64 = {
+    'config': {'digest': 'sha256:config-arm64'},
+    'layers': [{'digest': 'sha256:base'}, {'digest': 'sha256:arm64'}]
+}
+
+
+class TestPushEngine:
+    def setup(self):
+        Metrics.reset()
+        self.source = Mock()
+        self.destination = Mock()
+        self.engine = PushEngine(self.source, self.destination)
+
+        def resolve(repo, tag, arch):
+            return {
+                'all': ('sha256:index', [image_amd64, image_arm64]),
+                'x86_64': ('sha256:m-amd64', [image_amd64]),
+                'aarch64': ('sha256:m-arm64', [image_arm64])
+            }[arch]
+
+        self.source.resolve.side_effect = resolve
+
+    def setup_method(self, cls):
+        self.setup()
+
+    def test_prepare_up_to_date(self):
+        self.destination.get_manifest_digest.return_value = 'sha256:m-arm64'
+        assert self.engine.prepare('repo', 'dest', 'tag', 'aarch64') == (
+            True, []
+        )
+        self.destination.get_manifest_digest.assert_called_once_with(
+            'dest', 'tag'
+        )
+        assert not self.destination.blob_exists.called
+
+    def test_prepare_mounts_known_blobs(self):
+        self.destination.get_manifest_digest.return_value = ''
+        self.destination.blob_exists.side_effect = \
+            lambda repo, digest: digest == 'sha256:config-amd64'
+        self.destination.mount_blob.side_effect = \
+            lambda repo, digest, from_repo: from_repo == 'other'
+        self.engine.register('dest', ['sha256:amd64'])
+        self.engine.register('other', ['sha256:base'])
+        self.engine.register('unknown', ['sha256:base'])
+        assert self.engine.prepare('repo', 'dest', 'tag', 'x86_64') == (
+            False, ['sha256:config-amd64', 'sha256:base', 'sha256:amd64']
+        )
+        assert self.destination.mount_blob.call_args_list == [
+            call('dest', 'sha256:base', 'other')
+        ]
+        assert self.engine.get_locations('sha256:base') == [
+            'dest', 'other', 'unknown'
+        ]
+        assert self.engine.get_locations('sha256:config-amd64') == ['dest']
+        assert self.engine.get_locations('sha256:amd64') == ['dest']
+        assert Metrics.get('cgyle_bytes_total', kind='deduplicated') == 11
+
+    def test_register_push(self):
+        self.destination.get_manifest_digest.return_value = ''
+        self.destination.blob_exists.side_effect = \
+            lambda repo, digest: digest == 'sha256:config-amd64'
+        self.destination.mount_blob.return_value = False
+        self.engine.prepare('repo', 'dest', 'tag', 'x86_64')
+        assert self.engine.get_blob_sizes(
+            ['sha256:amd64', 'sha256:unknown']
+        ) == {'sha256:amd64': 100, 'sha256:unknown': 0}
+        self.engine.register_push(
+            'dest', ['sha256:config-amd64', 'sha256:base', 'sha256:amd64']
+        )
+        assert Metrics.get('cgyle_bytes_total', kind='transferred') == 110
+        assert self.engine.get_locations('sha256:base') == ['dest']
@@ -0,0 +1,271 @@
+from unittest.mock import (
+    patch, Mock, call
+)
+from pytest import raises
+from cgyle.registry import Registry
+from cgyle.credentials import TokenCache
+from cgyle.retry import CircuitBreaker
+from cgyle.exceptions import CgyleRequestError
+
+
+def response(status_code=200, headers={}, content=b''):
+    return Mock(status_code=status_code, headers=headers, content=content)
+
+
+class TestRegistry:
+    def setup(self):
+        self.registry = Registry('https://server', 'user:pass')
+        TokenCache.tokens = {}
+        CircuitBreaker.breakers = {}
+
+    def setup_method(self, cls):
+        self.setup()
+
+    def test_url(self):
+        assert self.registry.url == 'https://server'
+        assert Registry('http://localhost:7000').url == 'http://localhost:7000'
+        assert Registry('some.ecr').url == 'https://some.ecr'
+
+    @patch('cgyle.registry.requests.request')
+    def test_request_basic_auth(self, mock_request):
+        mock_request.side_effect = [
+            response(401, {'WWW-Authenticate': 'Basic realm="some"'}),
+            response(200),
+            response(200)
+        ]
+        assert self.registry.blob_exists('repo', 'sha256:a')
+        assert mock_request.call_args_list[1] == call(
+            'HEAD', 'https://server/v2/repo/blobs/sha256:a',
+            headers={'Authorization': 'Basic dXNlcjpwYXNz'},
+            verify=True, timeout=60
+        )
+        # authorization is reused for the same scope
+        assert self.registry.blob_exists('repo', 'sha256:b')
+        assert mock_request.call_args_list[2] == call(
+            'HEAD', 'https://server/v2/repo/blobs/sha256:b',
+            headers={'Authorization': 'Basic dXNlcjpwYXNz'},
+            verify=True, timeout=60
+        )
+
+    @patch('cgyle.registry.requests.get')
+    @patch('cgyle.registry.requests.request')
+    def test_request_bearer_auth(self, mock_request, mock_get):
+        mock_request.side_effect = [
+            response(
+                401, {
+                    'WWW-Authenticate':
+                    'Bearer realm="https://auth/token",service="registry"'
+                }
+            ),
+            response(404),
+            response(404)
+        ]
+        mock_get.return_value = response(
+            content=b'{"token": "abc", "expires_in": 300}'
+        )
+        assert not self.registry.blob_exists('repo', 'sha256:a')
+        mock_get.assert_called_once_with(
+            'https://auth/token',
+            params={'service': 'registry', 'scope': ['repository:repo:pull']},
+            auth=('user', 'pass'), verify=True, timeout=60
+        )
+        assert mock_request.call_args_list[1] == call(
+            'HEAD', 'https://server/v2/repo/blobs/sha256:a',
+            headers={'Authorization': 'Bearer abc'},
+            verify=True, timeout=60
+        )
+        # the token is shared with other instances for the same scope
+        other = Registry('https://server', 'user:pass')
+        assert not other.blob_exists('repo', 'sha256:b')
+        assert mock_get.call_count == 1
+        assert mock_request.call_args_list[2] == call(
+            'HEAD', 'https://server/v2/repo/blobs/sha256:b',
+            headers={'Authorization': 'Bearer abc'},
+            verify=True, timeout=60
+        )
+
+    @patch('cgyle.registry.Credentials.read')
+    @patch('cgyle.registry.requests.get')
+    @patch('cgyle.registry.requests.request')
+    def test_request_refreshed_credentials(
+        self, mock_request, mock_get, mock_Credentials_read
+    ):
+        mock_Credentials_read.return_value = ['AWS', 'old']
+        mock_request.side_effect = [
+            response(
+                401, {
+                    'WWW-Authenticate':
+                    'Bearer realm="https://auth/token",service="registry"'
+                }
+            ),
+            response(200),
+            response(
+                401, {
+                    'WWW-Authenticate':
+                    'Bearer realm="https://auth/token",service="registry"'
+                }
+            ),
+            response(200)
+        ]
+        mock_get.side_effect = [
+            response(content=b'{"token": "abc"}'),
+            response(content=b'{"token": "def"}')
+        ]
+        registry = Registry('some.ecr', 'exec:AWS:command')
+        assert registry.blob_exists('repo', 'sha256:a')
+        mock_Credentials_read.return_value = ['AWS', 'new']
+        assert registry.blob_exists('repo', 'sha256:a')
+        # the token of the old credentials is not used anymore
+        assert mock_get.call_count == 2
+        assert mock_get.call_args_list[1][1]['auth'] == ('AWS', 'new')
+        assert mock_request.call_args_list[3][1]['headers'] == {
+            'Authorization': 'Bearer def'
+        }
+
+    @patch('cgyle.registry.requests.get')
+    @patch('cgyle.registry.requests.request')
+    def test_request_bearer_auth_raises(self, mock_request, mock_get):
+        mock_request.return_value = response(
+            401, {'WWW-Authenticate': 'Bearer realm="https://auth/token"'}
+        )
+        mock_get.return_value = response(content=b'{}')
+        with raises(CgyleRequestError):
+            self.registry.blob_exists('repo', 'sha256:a')
+        mock_get.side_effect = Exception
+        with raises(CgyleRequestError):
+            self.registry.blob_exists('repo', 'sha256:a')
+        mock_request.return_value = response(
+            401, {'WWW-Authenticate': 'Digest nonce="xxx"'}
+        )
+        with raises(CgyleRequestError):
+            self.registry.blob_exists('repo', 'sha256:a')
+
+    @patch('time.sleep')
+    @patch('cgyle.registry.requests.request')
+    def test_request_raises(self, mock_request, mock_sleep):
+        mock_request.side_effect = Exception
+        with raises(CgyleRequestError):
+            self.registry.blob_exists('repo', 'sha256:a')
+        # network errors are retried
+        assert mock_request.call_count == 4
+        assert mock_sleep.call_count == 3
+
+    @patch('time.sleep')
+    @patch('cgyle.registry.requests.request')
+    def test_request_retry(self, mock_request, mock_sleep):
+        mock_request.side_effect = [
+            response(429, {'Retry-After': '20'}),
+            response(503),
+            response(200)
+        ]
+        assert self.registry.blob_exists('repo', 'sha256:a')
+        assert mock_sleep.call_args_list[0][0][0] >= 20
+        assert mock_sleep.call_args_list[1][0][0] <= 4
+        mock_request.reset_mock()
+        mock_request.side_effect = None
+        mock_request.return_value = response(502)
+        assert not self.registry.blob_exists('repo', 'sha256:a')
+        assert mock_request.call_count == 4
+
+    @patch('cgyle.registry.requests.request')
+    def test_mount_blob(self, mock_request):
+        mock_request.return_value = response(201)
+        assert self.registry.mount_blob('repo', 'sha256:a', 'other')
+        mock_request.assert_called_once_with(
+            'POST',
+            'https://server/v2/repo/blobs/uploads/?mount=sha256:a&from=other',
+            headers={}, verify=True, timeout=60
+        )
+
+    @patch('cgyle.registry.requests.request')
+    def test_mount_blob_not_mounted(self, mock_request):
+        mock_request.side_effect = [
+            response(202, {'Location': 'https://server/v2/repo/blobs/uploads/id'}),
+            response(204)
+        ]
+        assert not self.registry.mount_blob('repo', 'sha256:a', 'other')
+        assert mock_request.call_args_list[1] == call(
+            'DELETE', 'https://server/v2/repo/blobs/uploads/id',
+            headers={}, verify=True, timeout=60
+        )
+
+    @patch('cgyle.registry.requests.request')
+    def test_get_manifest_digest(self, mock_request):
+        mock_request.return_value = response(
+            200, {'Docker-Content-Digest': 'sha256:m'}
+        )
+        assert self.registry.get_manifest_digest('repo', 'tag') == 'sha256:m'
+        mock_request.return_value = response(404)
+        assert self.registry.get_manifest_digest('repo', 'tag') == ''
+
+    @patch('cgyle.registry.requests.request')
+    def test_get_manifest(self, mock_request):
+        mock_request.return_value = response(
+            200, {'Docker-Content-Digest': 'sha256:m'}, b'{"layers": []}'
+        )
+        assert self.registry.get_manifest('repo', 'tag') == (
+            {'layers': []}, 'sha256:m'
+        )
+        mock_request.return_value = response(200, {}, b'{"layers": []}')
+        assert self.registry.get_manifest('repo', 'sha256:x') == (
+            {'layers': []}, 'sha256:x'
+        )
+
+    @patch('cgyle.registry.requests.request')
+    def test_get_manifest_raises(self, mock_request):
+        mock_request.return_value = response(404)
+        with raises(CgyleRequestError):
+            self.registry.get_manifest('repo', 'tag')
+        mock_request.return_value = response(200, {}, b'{')
+        with raises(CgyleRequestError):
+            self.registry.get_manifest('repo', 'tag')
+
+    def test_resolve(self):
+        image_amd64 = {'layers': [{'digest': 'sha256:amd64'}]}
+        image_arm64 = {'layers': [{'digest': 'sha256:arm64'}]}
+        image_index = {
+            'manifests': [
+                {
+                    'digest': 'sha256:m-amd64',
+                    'platform': {'architecture': 'amd64'}
+                },
+                {
+                    'digest': 'sha256:m-arm64',
+                    'platform': {'architecture': 'arm64'}
+                }
+            ]
+        }
+
+        def get_manifest(repo, reference):
+            return {
+                'tag': (image_index, 'sha256:index'),
+                'sha256:m-amd64': (image_amd64, 'sha256:m-amd64'),
+                'sha256:m-arm64': (image_arm64, 'sha256:m-arm64'),
+                'single': (image_amd64, 'sha256:single')
+            }[reference]
+
+        with patch.object(Registry, 'get_manifest') as mock_get_manifest:
+            mock_get_manifest.side_effect = get_manifest
+            assert self.registry.resolve('repo', 'tag', 'all') == (
+                'sha256:index', [image_amd64, image_arm64]
+            )
+            assert self.registry.resolve('repo', 'tag', 'x86_64') == (
+                'sha256:m-amd64', [image_amd64]
+            )
+            assert self.registry.resolve('repo', 'tag', 's390x') == ('', [])
+            assert self.registry.resolve('repo', 'single', 'x86_64') == (
+                'sha256:single', [image_amd64]
+            )
+
+    def test_get_blobs(self):
+        assert Registry.get_blobs(
+            {
+                'config': {'digest': 'sha256:c'},
+                'layers': [{'digest': 'sha256:l'}]
+            }
+        ) == [{'digest': 'sha256:c'}, {'digest': 'sha256:l'}]
+        assert Registry.get_blobs({}) == []
+
+    def test_is_index(self):
+        assert Registry.is_index({'manifests': []})
+        assert not Registry.is_index({'layers': []})
@@ -0,0 +1,191 @@
+import os
+import json
+from unittest.mock import patch
+from pytest import (
+    raises, fixture
+)
+from cgyle.report import (
+    TransferStats, TransferReport
+)
+from cgyle.metrics import Metrics
+from cgyle.exceptions import CgyleReportError
+
+digest_a = 'a' * 64
+digest_b = 'b' * 64
+digest_c = 'c' * 64
+
+
+class TestTransferStats:
+    def setup(self):
+        Metrics.reset()
+        self.stats = TransferStats(
+            'container', 'latest', 'x86_64', {f'sha256:{digest_a}': 4096}
+        )
+
+    def setup_method(self, cls):
+        self.setup()
+
+    @patch('time.monotonic')
+    def test_feed_without_terminal(self, mock_monotonic):
+        mock_monotonic.side_effect = [10, 10, 11, 12, 13, 15, 17]
+        self.stats.begin()
+        self.stats.feed('Getting image source signatures\n')
+        self.stats.feed(f'Copying blob sha256:{digest_a}\n')
+        self.stats.feed(f'Copying blob sha256:{digest_b}\n')
+        self.stats.feed(f'Copying config sha256:{digest_c}\n')
+        self.stats.feed('Writing manifest to image destination\n')
+        entry = self.stats.finish(False)
+        assert entry == {
+            'container': 'container',
+            'tag': 'latest',
+            'arch': 'x86_64',
+            'failed': False,
+            'attempts': 1,
+            'duration': 7,
+            'bytes': 4096,
+            'blobs': [
+                {
+                    'digest': digest_a, 'kind': 'blob',
+                    'state': 'copied', 'duration': 4, 'bytes': 4096
+                },
+                {
+                    'digest': digest_b, 'kind': 'blob',
+                    'state': 'copied', 'duration': 3, 'bytes': 0
+                },
+                {
+                    'digest': digest_c, 'kind': 'config',
+                    'state': 'copied', 'duration': 2, 'bytes': 0
+                }
+            ]
+        }
+        assert Metrics.get('cgyle_blobs_total', state='copied') == 3
+
+    @patch('time.monotonic')
+    def test_feed_with_progress(self, mock_monotonic):
+        mock_monotonic.side_effect = [100, 101, 102, 103, 104, 105, 106, 109]
+        self.stats.begin()
+        self.stats.feed(f'Copying blob {digest_b[:12]} [====>] 1.0MiB / 2.0MiB\n')
+        self.stats.feed(f'Copying blob {digest_a[:12]} skipped: already exists\n')
+        self.stats.feed(f'Copying blob {digest_b[:12]} done  2.5MiB / 2.5MiB\n')
+        self.stats.feed('some other output\n')
+        # a retry forgets the blobs of the failed attempt
+        self.stats.begin()
+        self.stats.feed(f'Copying blob {digest_a[:12]}\n')
+        self.stats.feed(f'Copying blob {digest_b[:12]} done\n')
+        entry = self.stats.finish(True)
+        assert entry['failed'] is True
+        assert entry['attempts'] == 2
+        assert entry['duration'] == 9
+        assert entry['bytes'] == 4096
+        assert entry['blobs'] == [
+            {
+                'digest': digest_a[:12], 'kind': 'blob',
+                'state': 'copied', 'duration': 4, 'bytes': 4096
+            },
+            {
+                'digest': digest_b[:12], 'kind': 'blob',
+                'state': 'copied', 'duration': 0, 'bytes': 0
+            }
+        ]
+
+    @patch('time.monotonic')
+    def test_feed_progress_sizes(self, mock_monotonic):
+        mock_monotonic.return_value = 1
+        self.stats.begin()
+        self.stats.feed(f'Copying blob {digest_a[:12]} skipped: already exists\n')
+        self.stats.feed(f'Copying blob {digest_b[:12]} done  2.5MiB / 2.5MiB\n')
+        self.stats.feed(f'Copying config {digest_c[:12]} done  1.2kB\n')
+        entry = self.stats.finish(False)
+        assert [blob['state'] for blob in entry['blobs']] == [
+            'skipped', 'copied', 'copied'
+        ]
+        assert entry['bytes'] == 2621440
+        assert Metrics.get('cgyle_blobs_total', state='skipped') == 1
+
+    @patch('time.monotonic')
+    def test_end(self, mock_monotonic):
+        mock_monotonic.side_effect = [10, 11, 14, 20]
+        self.stats.begin()
+        self.stats.feed(f'Copying blob sha256:{digest_a}\n')
+        self.stats.end()
+        entry = self.stats.finish(False)
+        assert entry['duration'] == 4
+        assert entry['blobs'][0]['duration'] == 3
+
+    def test_finish_without_begin(self):
+        assert self.stats.finish(True)['duration'] == 0
+
+
+class TestTransferReport:
+    @fixture(autouse=True)
+    def inject_fixtures(self, tmp_path):
+        self.tmp = format(tmp_path)
+        TransferReport.reset()
+
+    def _add(self, tag, duration, blob_durations, failed=False):
+        TransferReport.add(
+            {
+                'container': 'container',
+                'tag': tag,
+                'arch': 'x86_64',
+                'failed': failed,
+                'attempts': 1,
+                'duration': duration,
+                'bytes': 10 * len(blob_durations),
+                'blobs': [
+                    {
+                        'digest': f'{tag}-{count}', 'kind': 'blob',
+                        'state': 'copied' if blob_duration else 'skipped',
+                        'duration': blob_duration, 'bytes': 10
+                    } for count, blob_duration in enumerate(blob_durations)
+                ]
+            }
+        )
+
+    def test_get_summary(self):
+        TransferReport.top = 2
+        try:
+            self._add('1', 1.5, [1, 0])
+            self._add('2', 4, [3.5, 0.5])
+            self._add('3', 0.5, [], failed=True)
+            summary = TransferReport.get_summary()
+        finally:
+            TransferReport.top = 10
+        assert summary['tags'] == 3
+        assert summary['failed'] == 1
+        assert summary['duration'] == 6
+        assert summary['bytes'] == 40
+        assert summary['blobs_copied'] == 3
+        assert summary['blobs_skipped'] == 1
+        assert summary['slowest_tags'] == [
+            {
+                'container': 'container', 'tag': '2', 'arch': 'x86_64',
+                'duration': 4, 'bytes': 20
+            },
+            {
+                'container': 'container', 'tag': '1', 'arch': 'x86_64',
+                'duration': 1.5, 'bytes': 20
+            }
+        ]
+        assert [blob['digest'] for blob in summary['slowest_blobs']] == [
+            '2-0', '1-0'
+        ]
+        assert summary['slowest_blobs'][0]['tag'] == '2'
+
+    def test_write(self):
+        self._add('1', 1, [1])
+        filename = os.sep.join([self.tmp, 'report.json'])
+        TransferReport.write(filename)
+        with open(filename) as report_file:
+            report = json.load(report_file)
+        assert report['summary']['tags'] == 1
+        assert report['transfers'] == TransferReport.get()
+        assert oct(os.stat(filename).st_mode & 0o777) == '0o644'
+        TransferReport.reset()
+        assert TransferReport.get() == []
+
+    def test_write_raises(self):
+        with raises(CgyleReportError):
+            TransferReport.write(
+                os.sep.join([self.tmp, 'missing', 'report.json'])
+            )
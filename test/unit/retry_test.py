@@ -0,0 +1,179 @@
+import logging
+from unittest.mock import (
+    patch, Mock, MagicMock
+)
+from pytest import fixture
+from cgyle.retry import (
+    RetryPolicy, CircuitBreaker
+)
+
+
+class TestRetryPolicy:
+    @fixture(autouse=True)
+    def inject_fixtures(self, caplog):
+        self._caplog = caplog
+
+    def setup(self):
+        CircuitBreaker.breakers = {}
+
+    def setup_method(self, cls):
+        self.setup()
+
+    def test_classify(self):
+        assert RetryPolicy.classify() == ''
+        assert RetryPolicy.classify(status_code=200) == ''
+        assert RetryPolicy.classify(status_code=401) == 'auth'
+        assert RetryPolicy.classify(status_code=404) == 'not_found'
+        assert RetryPolicy.classify(status_code=429) == 'throttle'
+        assert RetryPolicy.classify(status_code=503) == 'server'
+        assert RetryPolicy.classify(status_code=400) == 'unknown'
+        assert RetryPolicy.classify(
+            'received unexpected HTTP status: 502 Bad Gateway'
+        ) == 'server'
+        assert RetryPolicy.classify(
+            'writing blob: no space left on device'
+        ) == 'disk'
+        assert RetryPolicy.classify(
+            'reading manifest 1 in server/container: manifest unknown'
+        ) == 'not_found'
+        assert RetryPolicy.classify(
+            'toomanyrequests: rate limit exceeded'
+        ) == 'throttle'
+        assert RetryPolicy.classify(
+            'dial tcp: lookup server: no such host'
+        ) == 'network'
+        assert RetryPolicy.classify('something odd') == 'unknown'
+
+    def test_is_retryable(self):
+        assert RetryPolicy.is_retryable('network')
+        assert not RetryPolicy.is_retryable('auth')
+        assert not RetryPolicy.is_retryable('unknown')
+
+    def test_get_delay(self):
+        assert 1 <= RetryPolicy.get_delay(0) <= 2
+        assert 8 <= RetryPolicy.get_delay(3) <= 16
+        assert RetryPolicy.get_delay(100) <= RetryPolicy.max_delay
+        assert RetryPolicy.get_delay(0, retry_after=60) == 60
+
+    @patch('time.time')
+    def test_get_retry_after(self, mock_time):
+        mock_time.return_value = 1445411280
+        assert RetryPolicy.get_retry_after('') == 0
+        assert RetryPolicy.get_retry_after('120') == 120
+        assert RetryPolicy.get_retry_after(
+            'Wed, 21 Oct 2015 07:30:00 GMT'
+        ) == 1320
+        assert RetryPolicy.get_retry_after('bogus') == 0
+
+    @patch('time.sleep')
+    def test_run(self, mock_sleep):
+        call = Mock()
+        call.side_effect = [
+            (1, 'received unexpected HTTP status: 502 Bad Gateway'),
+            (1, 'connection reset by peer'),
+            (0, '')
+        ]
+        with self._caplog.at_level(logging.WARNING):
+            assert RetryPolicy.run('server', call) == (0, '')
+        assert 'server error from server, retry 1/3' in self._caplog.text
+        assert mock_sleep.call_count == 2
+
+        call.reset_mock()
+        call.side_effect = None
+        call.return_value = (1, 'manifest unknown')
+        assert RetryPolicy.run('server', call) == (1, 'manifest unknown')
+        assert call.call_count == 1
+
+        call.reset_mock()
+        call.return_value = (1, 'i/o timeout')
+        assert RetryPolicy.run('server', call) == (1, 'i/o timeout')
+        assert call.call_count == RetryPolicy.max_retries + 1
+
+    @patch('time.sleep')
+    def test_run_destination(self, mock_sleep):
+        call = Mock()
+        call.side_effect = [
+            (1, 'writing blob: Patch "https://some.ecr/v2/a": i/o timeout'),
+            (0, '')
+        ]
+        with self._caplog.at_level(logging.WARNING):
+            assert RetryPolicy.run('server', call, 'some.ecr') == (0, '')
+        assert 'network error from some.ecr, retry 1/3' in self._caplog.text
+        assert set(CircuitBreaker.breakers) == {'server', 'some.ecr'}
+
+    def test_get_failing_host(self):
+        assert RetryPolicy.get_failing_host(
+            'reading docker://server/a: i/o timeout', ['server', 'some.ecr']
+        ) == 'server'
+        assert RetryPolicy.get_failing_host(
+            'copy docker://server/a to docker://some.ecr/a: i/o timeout',
+            ['server', 'some.ecr']
+        ) == 'some.ecr'
+        assert RetryPolicy.get_failing_host(
+            'i/o timeout', ['server', 'some.ecr']
+        ) == 'server'
+
+    def test_get_retry_times(self):
+        assert RetryPolicy.get_retry_times() == '1'
+        with patch.object(RetryPolicy, 'max_retries', 0):
+            assert RetryPolicy.get_retry_times() == '5'
+
+
+class TestCircuitBreaker:
+    @fixture(autouse=True)
+    def inject_fixtures(self, caplog):
+        self._caplog = caplog
+
+    def setup(self):
+        CircuitBreaker.breakers = {}
+        self.breaker = CircuitBreaker.get('server')
+
+    def setup_method(self, cls):
+        self.setup()
+
+    def test_get(self):
+        assert CircuitBreaker.get('server') is self.breaker
+        assert CircuitBreaker.get('other') is not self.breaker
+
+    @patch('time.time')
+    def test_open_and_close(self, mock_time):
+        mock_time.return_value = 1000
+        for failure in range(CircuitBreaker.failure_threshold - 1):
+            self.breaker.record_failure()
+        assert not self.breaker.open_until
+        with self._caplog.at_level(logging.WARNING):
+            self.breaker.record_failure()
+        assert 'Circuit for server open, pausing for 30s' in \
+            self._caplog.text
+        assert self.breaker.open_until == 1030
+
+        # a failed probe doubles the open period
+        self.breaker.record_failure()
+        assert self.breaker.open_until == 1060
+
+        # retry after is used as lower bound
+        self.breaker.record_failure(retry_after=500)
+        assert self.breaker.open_until == 1500
+
+        with self._caplog.at_level(logging.INFO):
+            self.breaker.record_success()
+        assert 'Circuit for server closed' in self._caplog.text
+        assert not self.breaker.open_until
+        assert self.breaker.failures == 0
+
+    @patch('time.time')
+    def test_wait(self, mock_time):
+        mock_time.return_value = 1000
+        # closed circuit does not block
+        self.breaker.wait()
+        self.breaker.open_until = 1010
+        self.breaker.condition = MagicMock()
+
+        def wait(delay):
+            assert delay == 10
+            mock_time.return_value = 1010
+
+        self.breaker.condition.wait.side_effect = wait
+        self.breaker.wait()
+        # the caller probes the host, others wait for the probe
+        assert self.breaker.open_until == 1040
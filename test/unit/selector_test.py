@@ -0,0 +1,123 @@
+from unittest.mock import patch
+from pytest import raises
+from cgyle.selector import TagSelector
+from cgyle.exceptions import CgylePolicyError
+
+
+class TestTagSelector:
+    def setup(self):
+        self.tags = [
+            '15.4', '15.10', '15.9', '15.6-beta1', '16.0', 'latest'
+        ]
+        self.created = {
+            '15.4': 400.0, '15.10': 100.0, '15.9': 300.0,
+            '15.6-beta1': 200.0, '16.0': None
+        }
+
+    def setup_method(self, cls):
+        self.setup()
+
+    def test_init_raises(self):
+        with raises(CgylePolicyError):
+            TagSelector(order='bogus')
+        with raises(CgylePolicyError):
+            TagSelector(keep=-1)
+        with raises(CgylePolicyError):
+            TagSelector(tags_regex='(')
+
+    def test_from_policy(self):
+        assert TagSelector.from_policy({'path': 'bci/**'}) is None
+        assert TagSelector.from_policy(
+            {'path': 'bci/**', 'priority': 10}
+        ) is None
+        selector = TagSelector.from_policy(
+            {
+                'path': 'bci/**', 'tags': 15.4, 'exclude': '*-beta*',
+                'keep': '3', 'order': 'created', 'max_age': 90
+            }
+        )
+        assert selector
+        assert selector.tags == '15.4'
+        assert selector.exclude == ['*-beta*']
+        assert selector.keep == 3
+        assert selector.order == 'created'
+        assert selector.max_age == 90
+        selector = TagSelector.from_policy(
+            {'path': 'bci/**', 'tags_regex': '^15', 'exclude': ['a', 'b']}
+        )
+        assert selector
+        assert selector.tags_regex
+        assert selector.exclude == ['a', 'b']
+
+    def test_from_policy_raises(self):
+        with raises(CgylePolicyError):
+            TagSelector.from_policy({'path': 'bci/**', 'bogus': 1})
+        with raises(CgylePolicyError):
+            TagSelector.from_policy({'tags': '*'})
+        with raises(CgylePolicyError):
+            TagSelector.from_policy({'path': 'bci/**', 'keep': 'all'})
+        with raises(CgylePolicyError):
+            TagSelector.from_policy({'path': 'bci/**', 'exclude': 1})
+
+    def test_needs_created(self):
+        assert not TagSelector(keep=3).needs_created()
+        assert TagSelector(order='created').needs_created()
+        assert TagSelector(max_age=1).needs_created()
+
+    def test_match(self):
+        selector = TagSelector(
+            tags='15.*', tags_regex=r'^15\.\d+$', exclude=['*.4']
+        )
+        assert selector.match('15.10')
+        assert not selector.match('16.0')
+        assert not selector.match('15.6-beta1')
+        assert not selector.match('15.4')
+
+    def test_select_by_version(self):
+        selector = TagSelector(keep=2)
+        assert selector.select(self.tags) == ['latest', '16.0', '15.10']
+        selector = TagSelector(tags='15.*', exclude=['*-beta*'], keep=2)
+        assert selector.select(self.tags) == ['15.10', '15.9']
+
+    def test_select_by_created(self):
+        selector = TagSelector(keep=2, order='created')
+        assert selector.select(
+            self.tags, lambda tag: self.created[tag]
+        ) == ['latest', '15.4', '15.9']
+        # without creation dates the version decides
+        assert selector.select(self.tags) == ['latest', '16.0', '15.10']
+
+    @patch('time.time')
+    def test_select_by_max_age(self, mock_time):
+        mock_time.return_value = 86400 + 250.0
+        selector = TagSelector(max_age=1)
+        assert selector.select(
+            self.tags, lambda tag: self.created[tag]
+        ) == ['latest', '16.0', '15.9', '15.4']
+        assert selector.select(self.tags) == [
+            'latest', '16.0', '15.10', '15.9', '15.6-beta1', '15.4'
+        ]
+
+    def test_order_newest(self):
+        assert TagSelector.order_newest(self.tags) == [
+            'latest', '16.0', '15.10', '15.9', '15.6-beta1', '15.4'
+        ]
+        assert TagSelector.order_newest(self.tags, self.created) == [
+            'latest', '15.4', '15.9', '15.6-beta1', '15.10', '16.0'
+        ]
+
+    def test_get_version_key(self):
+        assert sorted(
+            ['15.9', '15.10', '15.10-1', '1.0'],
+            key=TagSelector.get_version_key
+        ) == ['1.0', '15.9', '15.10', '15.10-1']
+
+    def test_parse_created(self):
+        assert TagSelector.parse_created(
+            '2024-01-01T00:00:00Z'
+        ) == 1704067200.0
+        assert TagSelector.parse_created(
+            '2024-01-01T01:00:00.123456789+01:00'
+        ) == 1704067200.123456
+        assert TagSelector.parse_created('') is None
+        assert TagSelector.parse_created('yesterday') is None
@@ -0,0 +1,169 @@
+import os
+import hashlib
+import multiprocessing
+from unittest.mock import (
+    patch, Mock
+)
+from pytest import (
+    raises, fixture
+)
+from cgyle.shard import (
+    Shard, Coordinator
+)
+from cgyle.exceptions import CgyleShardError
+
+UNITS = [f'suse/container-{count}' for count in range(100)]
+
+
+def claim_units(claim_dir):
+    # runs in a separate process standing in for one node
+    coordinator = Coordinator(claim_dir)
+    return [unit for unit in UNITS if coordinator.owns(unit)]
+
+
+class TestShard:
+    def test_parse(self):
+        shard = Shard.parse('2/3', tags=True)
+        assert shard.index == 2
+        assert shard.count == 3
+        assert shard.tags
+        with raises(CgyleShardError):
+            Shard.parse('2')
+        with raises(CgyleShardError):
+            Shard.parse('a/3')
+        with raises(CgyleShardError):
+            Shard.parse('0/3')
+        with raises(CgyleShardError):
+            Shard.parse('4/3')
+
+    def test_owns(self):
+        shards = [Shard(index, 3) for index in range(1, 4)]
+        owners = [
+            [shard.owns(unit) for shard in shards].count(True)
+            for unit in UNITS
+        ]
+        assert owners == [1] * len(UNITS)
+        for shard in shards:
+            assert 20 < len([unit for unit in UNITS if shard.owns(unit)]) < 50
+        # the partition is stable across processes
+        assert Shard.get_hash('suse/sle15') == 1550949660692930241
+
+
+class TestCoordinator:
+    @fixture(autouse=True)
+    def inject_fixtures(self, tmp_path):
+        self._tmp_path = tmp_path
+        self.claim_dir = f'{tmp_path}/claims'
+        self.coordinator = Coordinator(self.claim_dir, tags=True)
+
+    def test_init_raises(self):
+        (self._tmp_path / 'file').write_text('')
+        with raises(CgyleShardError):
+            Coordinator(f'{self._tmp_path}/file/claims')
+
+    def _get_claim_file(self, key):
+        return os.sep.join(
+            [self.claim_dir, hashlib.sha256(key.encode()).hexdigest()]
+        )
+
+    def _get_node(self, pid):
+        with patch('os.getpid', return_value=pid):
+            return Coordinator(self.claim_dir, tags=True, claim_ttl=60)
+
+    def _age(self, path):
+        os.utime(path, (1000, 1000))
+
+    def test_owns(self):
+        assert self.coordinator.tags
+        assert self.coordinator.owns('suse/sle15:1.0:x86_64')
+        assert not self.coordinator.owns('suse/sle15:1.0:x86_64')
+        with open(self._get_claim_file('suse/sle15:1.0:x86_64')) as claim:
+            assert claim.read().endswith(' suse/sle15:1.0:x86_64\n')
+
+    def test_owns_claims_of_ended_run(self):
+        node_a = self._get_node(1)
+        assert node_a.owns('suse/a')
+        self._age(self._get_claim_file('suse/a'))
+        node_b = self._get_node(2)
+        # claim of a running node is live
+        assert not node_b.owns('suse/a')
+        assert node_a.owns('suse/b')
+        node_a.release()
+        # claim taken before node_b started is taken over
+        assert node_b.owns('suse/a')
+        # claim taken while node_b is running stays live
+        assert not node_b.owns('suse/b')
+        node_b.release()
+        # the next run, e.g. on the same node, processes all units
+        node_c = self._get_node(2)
+        self._age(self._get_claim_file('suse/b'))
+        assert node_c.owns('suse/b')
+        node_c.release()
+        node_c.release()
+
+    @patch('time.time')
+    def test_owns_claims_of_expired_run(self, mock_time):
+        node_a = self._get_node(1)
+        assert node_a.owns('suse/a')
+        self._age(self._get_claim_file('suse/a'))
+        self._age(node_a.run_file)
+        node_b = self._get_node(2)
+        mock_time.return_value = 1030
+        assert not node_b.owns('suse/a')
+        mock_time.return_value = 1070
+        assert node_b.owns('suse/a')
+
+    def test_owns_claim_without_owner(self):
+        claim_file = self._get_claim_file('suse/a')
+        with open(claim_file, 'w') as claim:
+            claim.write('')
+        self._age(claim_file)
+        assert self.coordinator.owns('suse/a')
+
+    def test_owns_take_over_race(self):
+        node_a = self._get_node(1)
+        assert node_a.owns('suse/a')
+        claim_file = self._get_claim_file('suse/a')
+        self._age(claim_file)
+        node_a.release()
+        node_b = self._get_node(2)
+        # another node is taking over the same claim
+        marker = f'{claim_file}.{os.stat(claim_file).st_mtime_ns}.takeover'
+        with open(marker, 'w'):
+            pass
+        assert not node_b.owns('suse/a')
+        os.unlink(marker)
+        # another node took over after the claim was checked
+        mtime = os.stat(claim_file).st_mtime_ns
+        with patch('os.stat') as mock_stat:
+            mock_stat.side_effect = [
+                Mock(st_mtime_ns=mtime), FileNotFoundError,
+                Mock(st_mtime_ns=1)
+            ]
+            assert not node_b.owns('suse/a')
+        with open(claim_file) as claim:
+            assert claim.read().startswith(node_a.owner)
+        assert sorted(os.listdir(self.claim_dir)) == sorted(
+            ['runs', os.path.basename(claim_file)]
+        )
+
+    @patch('os.rename')
+    def test_owns_claim_moved_by_other_node(self, mock_rename):
+        mock_rename.side_effect = FileNotFoundError
+        node_a = self._get_node(1)
+        assert node_a.owns('suse/a')
+        self._age(self._get_claim_file('suse/a'))
+        node_a.release()
+        assert not self._get_node(2).owns('suse/a')
+
+    @patch('os.link')
+    def test_owns_raises(self, mock_link):
+        mock_link.side_effect = PermissionError
+        with raises(CgyleShardError):
+            self.coordinator.owns('suse/sle15')
+
+    def test_owns_multiple_nodes(self):
+        with multiprocessing.Pool(4) as nodes:
+            claims = nodes.map(claim_units, [self.claim_dir] * 4)
+        claimed = [unit for node_claims in claims for unit in node_claims]
+        assert sorted(claimed) == sorted(UNITS)
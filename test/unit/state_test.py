@@ -0,0 +1,66 @@
+from unittest.mock import patch
+from pytest import (
+    raises, fixture
+)
+from cgyle.state import StateStore
+from cgyle.exceptions import CgyleStateError
+
+
+class TestStateStore:
+    @fixture(autouse=True)
+    def inject_fixtures(self, tmp_path):
+        self.tmp = format(tmp_path)
+        self.state = StateStore(f'{self.tmp}/state/state.db')
+
+    def teardown_method(self, cls):
+        self.state.close()
+
+    def test_init_raises(self):
+        with raises(CgyleStateError):
+            StateStore(self.tmp)
+
+    @patch('time.time')
+    def test_quarantine(self, mock_time):
+        mock_time.return_value = 1000
+        # a first failure is retried with the next run
+        assert self.state.record_failure('suse/a', '1', 'all', 'error') == 0
+        assert not self.state.is_quarantined('suse/a', '1', 'all')
+        # cool-off doubles with every further failure
+        assert self.state.record_failure('suse/a', '1', 'all') == \
+            StateStore.base_cooloff
+        assert self.state.is_quarantined('suse/a', '1', 'all')
+        assert not self.state.is_quarantined('suse/a', '1', 'x86_64')
+        assert self.state.record_failure('suse/a', '1', 'all') == \
+            2 * StateStore.base_cooloff
+        for failure in range(10):
+            cooloff = self.state.record_failure(
+                'suse/a', '1', 'all', 'some\nmanifest unknown\n'
+            )
+        assert cooloff == StateStore.max_cooloff
+        quarantined = self.state.get_quarantined()
+        assert len(quarantined) == 1
+        assert quarantined[0]['container'] == 'suse/a'
+        assert quarantined[0]['failures'] == '13'
+        assert quarantined[0]['error'] == 'manifest unknown'
+        # the quarantine is over after the cool-off period
+        mock_time.return_value = 1000 + StateStore.max_cooloff + 1
+        assert not self.state.is_quarantined('suse/a', '1', 'all')
+        assert self.state.get_quarantined() == []
+
+    def test_record_success(self):
+        self.state.record_failure('suse/a', '1', 'all')
+        self.state.record_failure('suse/a', '1', 'all')
+        assert self.state.get_quarantined()[0]['error'] == ''
+        self.state.record_success('suse/a', '1', 'all')
+        assert not self.state.is_quarantined('suse/a', '1', 'all')
+        assert self.state.record_failure('suse/a', '1', 'all') == 0
+
+    def test_record_failure_keeps_last_lines(self):
+        self.state.max_error_lines = 2
+        self.state.record_failure(
+            'suse/a', '1', 'all', 'line 1\nline 2\nline 3\n'
+        )
+        error = self.state.db.execute(
+            'SELECT error FROM failures WHERE container=?', ('suse/a',)
+        ).fetchone()[0]
+        assert error == 'line 2\nline 3\n'
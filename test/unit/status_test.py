@@ -0,0 +1,125 @@
+import os
+import json
+import threading
+import urllib.request
+from unittest.mock import patch
+from pytest import (
+    raises, fixture
+)
+from cgyle.status import (
+    Status, StatusHandler, StatusFile
+)
+from cgyle.metrics import (
+    Metrics, MetricsServer
+)
+from cgyle.report import TransferReport
+from cgyle.exceptions import CgyleStatusError
+
+
+class TestStatus:
+    @fixture(autouse=True)
+    def inject_fixtures(self, tmp_path, caplog):
+        self.tmp = format(tmp_path)
+        self._caplog = caplog
+        Metrics.reset()
+        TransferReport.reset()
+        Status.start_time = 0.0
+        Status.finished = False
+        Status.workers = {}
+
+    def test_get_not_started(self):
+        status = Status.get()
+        assert status['state'] == 'running'
+        assert status['elapsed'] == 0
+        assert status['eta'] is None
+        assert status['rates'] == {
+            'containers_per_minute': 0.0,
+            'tags_per_minute': 0.0,
+            'bytes_per_second': 0.0
+        }
+
+    @patch('cgyle.status.time.time')
+    def test_get(self, mock_time):
+        mock_time.return_value = 1000
+        Status.start()
+        for state in ['planned'] * 4 + ['done', 'failed', 'deferred']:
+            Metrics.inc('cgyle_containers_total', state=state)
+        Metrics.inc('cgyle_tags_total', 5, state='done')
+        Metrics.inc('cgyle_tags_total', 1, state='failed')
+        Metrics.inc('cgyle_tags_total', 2, state='deferred')
+        Metrics.set('cgyle_queue_depth', 1)
+        TransferReport.add({'bytes': 6000, 'duration': 1, 'blobs': []})
+        mock_time.return_value = 1060
+        Status.begin('container')
+        Status.update('latest', '1/2 tags, arch:all')
+        # no worker announced in this thread
+        worker = threading.Thread(
+            target=Status.update, args=['other', '1/1 tags, arch:all']
+        )
+        worker.start()
+        worker.join()
+        mock_time.return_value = 1120
+        status = Status.get()
+        assert status['elapsed'] == 120
+        assert status['eta'] == 40
+        assert status['containers'] == {
+            'planned': 4, 'done': 1, 'failed': 1, 'skipped': 0,
+            'deferred': 1, 'remaining': 1
+        }
+        assert status['tags'] == {
+            'done': 5, 'failed': 1, 'skipped': 0, 'deferred': 2
+        }
+        assert status['bytes'] == 6000
+        assert status['rates'] == {
+            'containers_per_minute': 1.5,
+            'tags_per_minute': 4.0,
+            'bytes_per_second': 50.0
+        }
+        assert status['queue_depth'] == 1
+        assert status['workers'] == {
+            threading.current_thread().name: {
+                'container': 'container',
+                'tag': 'latest',
+                'progress': '1/2 tags, arch:all',
+                'since': 1060,
+                'busy': 60
+            }
+        }
+        Status.end()
+        assert Status.get()['workers'] == {}
+        Status.finish()
+        status = Status.get()
+        assert status['state'] == 'finished'
+        assert status['eta'] == 0
+
+    def test_write(self):
+        filename = os.sep.join([self.tmp, 'status.json'])
+        Status.write(filename)
+        with open(filename) as status_file:
+            assert json.load(status_file)['state'] == 'running'
+        with raises(CgyleStatusError):
+            Status.write(os.sep.join([self.tmp, 'missing', 'status.json']))
+
+    def test_status_file(self):
+        filename = os.sep.join([self.tmp, 'status.json'])
+        with StatusFile(filename, 0.01) as status_file:
+            status_file.stopped.wait(0.05)
+            assert os.path.isfile(filename)
+            Status.finish()
+        with open(filename) as status:
+            assert json.load(status)['state'] == 'finished'
+
+        # errors are logged but do not stop the run
+        with StatusFile(os.sep.join([self.tmp, 'missing', 'status.json']), 10):
+            pass
+        assert 'Failed to write status' in self._caplog.text
+
+    def test_serve(self):
+        Metrics.set('cgyle_queue_depth', 3)
+        with MetricsServer(0, handler=StatusHandler) as server:
+            url = 'http://127.0.0.1:{}'.format(server.server.server_port)
+            with urllib.request.urlopen(f'{url}/status') as response:
+                assert response.status == 200
+                assert json.loads(response.read())['queue_depth'] == 3
+            with urllib.request.urlopen(f'{url}/metrics') as response:
+                assert 'cgyle_queue_depth 3.0' in response.read().decode()
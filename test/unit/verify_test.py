@@ -0,0 +1,295 @@
+import io
+import os
+import json
+import hashlib
+import logging
+import tarfile
+import concurrent.futures
+from unittest.mock import patch
+from pytest import (
+    fixture, raises
+)
+from cgyle.verify import Verifier
+from cgyle.oci_layout import OCILayout
+from cgyle.exceptions import CgyleVerifyError
+
+
+def digest_of(content):
+    return 'sha256:{}'.format(hashlib.sha256(content).hexdigest())
+
+
+def manifest_of(config, layers):
+    return json.dumps(
+        {
+            'config': {'digest': config},
+            'layers': [{'digest': layer} for layer in layers]
+        }
+    ).encode()
+
+
+class TestVerifier:
+    @fixture(autouse=True)
+    def inject_fixtures(self, caplog, tmp_path):
+        self._caplog = caplog
+        self.tmp_path = tmp_path
+
+    def setup(self):
+        self.verifier = Verifier(2)
+        self.pool = patch(
+            'cgyle.verify.concurrent.futures.ProcessPoolExecutor',
+            concurrent.futures.ThreadPoolExecutor
+        )
+        self.pool.start()
+
+    def setup_method(self, cls):
+        self.setup()
+
+    def teardown_method(self, cls):
+        self.pool.stop()
+
+    def add_distribution_blob(self, root, content, digest=''):
+        digest = digest or digest_of(content)
+        blob_dir = root / 'blobs' / 'sha256' / digest[7:9] / digest[7:]
+        blob_dir.mkdir(parents=True)
+        (blob_dir / 'data').write_bytes(content)
+        return digest
+
+    def add_distribution_tag(self, root, container, tag, digest):
+        link_dir = root / 'repositories' / container / '_manifests' / \
+            'tags' / tag / 'current'
+        link_dir.mkdir(parents=True)
+        (link_dir / 'link').write_text(digest)
+
+    def test_verify_distribution(self):
+        root = self.tmp_path / 'docker' / 'registry' / 'v2'
+        config = self.add_distribution_blob(root, b'config')
+        layer = self.add_distribution_blob(root, b'layer')
+        corrupt = self.add_distribution_blob(
+            root, b'truncat', digest_of(b'truncated')
+        )
+        orphan = self.add_distribution_blob(root, b'orphan')
+        manifest = self.add_distribution_blob(
+            root, manifest_of(config, [layer, corrupt])
+        )
+        good_manifest = self.add_distribution_blob(
+            root, manifest_of(config, [layer])
+        )
+        child = self.add_distribution_blob(
+            root, manifest_of(config, [digest_of(b'gone')])
+        )
+        index = self.add_distribution_blob(
+            root, json.dumps(
+                {
+                    'manifests': [
+                        {'digest': child},
+                        {'digest': digest_of(b'other arch')}
+                    ]
+                }
+            ).encode()
+        )
+        self.add_distribution_tag(root, 'suse/base', '1.0', manifest)
+        self.add_distribution_tag(root, 'suse/base', '2.0', index)
+        self.add_distribution_tag(root, 'suse/base', 'broken', '')
+        self.add_distribution_tag(root, 'other', '1.0', good_manifest)
+        result = self.verifier.verify_distribution(format(self.tmp_path))
+        blob_path = '{}/{}/{}/data'
+        assert result['kind'] == 'distribution'
+        assert result['blobs'] == 8
+        assert result['corrupt'] == [
+            blob_path.format(root / 'blobs/sha256', corrupt[7:9], corrupt[7:])
+        ]
+        assert result['missing'] == [digest_of(b'gone'), 'suse/base:broken']
+        assert result['orphaned'] == [
+            blob_path.format(root / 'blobs/sha256', orphan[7:9], orphan[7:])
+        ]
+        assert result['affected'] == [
+            ['suse/base', '1.0', ''],
+            ['suse/base', '2.0', ''],
+            ['suse/base', 'broken', '']
+        ]
+
+    def test_verify_layout(self):
+        blob_dir = self.tmp_path / 'blobs' / 'sha256'
+        blob_dir.mkdir(parents=True)
+        (blob_dir / '.tmp').write_bytes(b'partial')
+
+        def add_blob(content):
+            digest = digest_of(content)
+            (blob_dir / digest[7:]).write_bytes(content)
+            return digest
+        config = add_blob(b'config')
+        manifest = add_blob(manifest_of(config, [digest_of(b'gone')]))
+        good_manifest = add_blob(manifest_of(config, [config]))
+        (self.tmp_path / 'index.json').write_text(
+            json.dumps(
+                {
+                    'manifests': [
+                        {
+                            'digest': manifest, 'annotations': {
+                                'org.opencontainers.image.ref.name':
+                                'suse/base:1.0:x86_64'
+                            }
+                        },
+                        {
+                            'digest': good_manifest, 'annotations': {
+                                'org.opencontainers.image.ref.name':
+                                'suse/base:2.0:x86_64'
+                            }
+                        }
+                    ]
+                }
+            )
+        )
+        result = self.verifier.verify_layout(format(self.tmp_path))
+        assert result['blobs'] == 3
+        assert result['bytes'] > 0
+        assert result['corrupt'] == []
+        assert result['missing'] == [digest_of(b'gone')]
+        assert result['orphaned'] == []
+        assert result['affected'] == [['suse/base', '1.0', 'x86_64']]
+        assert self.verifier.verify_layout(
+            format(self.tmp_path / 'empty')
+        )['blobs'] == 0
+
+    def create_archive(self, name, tag, blobs, corrupt=b''):
+        archive_name = self.tmp_path / name
+        archive_name.parent.mkdir(parents=True, exist_ok=True)
+        with tarfile.open(archive_name, 'w') as archive:
+            def add(path, content):
+                info = tarfile.TarInfo(path)
+                info.size = len(content)
+                archive.addfile(info, io.BytesIO(content))
+            config = digest_of(b'config')
+            manifest = manifest_of(
+                config, [digest_of(blob) for blob in blobs]
+            )
+            add(f'blobs/sha256/{config[7:]}', b'config')
+            add(f'blobs/sha256/{digest_of(manifest)[7:]}', manifest)
+            for blob in blobs:
+                add(
+                    f'blobs/sha256/{digest_of(blob)[7:]}',
+                    corrupt if corrupt and blob == blobs[0] else blob
+                )
+            if tag:
+                add(
+                    'index.json', json.dumps(
+                        {
+                            'manifests': [
+                                {
+                                    'digest': digest_of(manifest),
+                                    'annotations': {
+                                        'org.opencontainers.image.ref.name':
+                                        tag
+                                    }
+                                }
+                            ]
+                        }
+                    ).encode()
+                )
+        return format(archive_name)
+
+    def test_verify_archives(self):
+        self.create_archive('suse/base-1.0-x86_64.oci.tar', '1.0', [b'a'])
+        corrupt = self.create_archive(
+            'suse/base-2.0-x86_64.oci.tar', '2.0', [b'a', b'b'], b'x'
+        )
+        empty = self.create_archive('suse/base-x-x86_64.oci.tar', '', [])
+        truncated = format(self.tmp_path / 'suse/base-3.0-x86_64.oci.tar')
+        with open(truncated, 'wb') as archive:
+            archive.write(b'\0' * 100)
+        with open(self.tmp_path / 'suse/base-x86_64.tags', 'w') as taglog:
+            taglog.write('3.0\n')
+        with self._caplog.at_level(logging.WARNING):
+            result = self.verifier.verify_archives(format(self.tmp_path))
+        assert result['kind'] == 'oci-archive'
+        assert result['blobs'] == 9
+        assert result['corrupt'] == [corrupt, truncated, empty]
+        assert result['affected'] == [
+            ['suse/base', '2.0', 'x86_64'],
+            ['suse/base', '3.0', 'x86_64']
+        ]
+        assert f'No container tag found for {empty}' in self._caplog.text
+        assert 'no image in archive' in self._caplog.text
+
+    def test_verify_archive_in_process(self):
+        self.pool.stop()
+        try:
+            archive = self.create_archive(
+                'suse/base-1.0-all.oci.tar', '1.0', [b'a']
+            )
+            result = self.verifier.verify_archives(format(self.tmp_path))
+            assert result['corrupt'] == []
+            assert result['blobs'] == 3
+            assert Verifier.verify_archive(archive)['tag'] == '1.0'
+        finally:
+            self.pool.start()
+
+    def test_get_archive_unit(self):
+        assert Verifier.get_archive_unit(
+            '/store', '/store/suse/base-1.0-x86_64.oci.tar', '1.1'
+        ) is None
+        assert Verifier.get_archive_unit(
+            '/store', '/store/suse/base-1.0-x86_64.oci.tar', '1.0'
+        ) == ('suse/base', '1.0', 'x86_64')
+
+    def test_hash_file(self):
+        (self.tmp_path / 'blob').write_bytes(b'content')
+        assert Verifier.hash_file(format(self.tmp_path / 'blob')) == (
+            digest_of(b'content'), 7
+        )
+        with self._caplog.at_level(logging.WARNING):
+            assert Verifier.hash_file(format(self.tmp_path / 'gone')) == (
+                '', 0
+            )
+        assert 'Failed to read' in self._caplog.text
+
+    def test_read_manifest(self):
+        assert Verifier.read_manifest(format(self.tmp_path / 'gone')) == {}
+        assert Verifier._load_manifest(io.BytesIO(b'[]')) == {}
+        assert Verifier._load_manifest(io.BytesIO(b'{')) == {}
+
+    @patch.object(OCILayout, 'remove_reference')
+    def test_repair(self, mock_remove_reference):
+        blob = self.tmp_path / 'blob'
+        blob.write_bytes(b'content')
+        result = Verifier._get_result('distribution', format(self.tmp_path))
+        result['corrupt'] = [format(blob), format(self.tmp_path / 'gone')]
+        result['affected'] = [['suse/base', '1.0', '']]
+        Verifier.repair(result)
+        assert not blob.exists()
+        assert not mock_remove_reference.called
+        (self.tmp_path / 'index.json').write_text('{}')
+        result['kind'] = 'oci-layout'
+        result['affected'] = [['suse/base', '1.0', 'x86_64']]
+        Verifier.repair(result)
+        mock_remove_reference.assert_called_once_with(
+            'suse/base:1.0:x86_64'
+        )
+        result['corrupt'] = [format(self.tmp_path / 'index.json')]
+        with patch('os.unlink') as mock_unlink:
+            mock_unlink.side_effect = OSError('busy')
+            with raises(CgyleVerifyError):
+                Verifier.repair(result)
+
+    def test_log(self):
+        result = Verifier._get_result('oci-layout', '/store')
+        result['corrupt'] = ['/store/blobs/sha256/a']
+        result['missing'] = ['sha256:b']
+        result['affected'] = [['suse/base', '1.0', 'x86_64'], ['c', 't', '']]
+        with self._caplog.at_level(logging.INFO):
+            Verifier.log(result)
+        assert 'Corrupt: /store/blobs/sha256/a' in self._caplog.text
+        assert 'Missing: sha256:b' in self._caplog.text
+        assert 'Affected: suse/base:1.0 arch:x86_64' in self._caplog.text
+        assert 'Affected: c:t\n' in self._caplog.text
+        assert 'Verified oci-layout /store: blobs:0 size:0MB corrupt:1 ' \
+            'missing:1 orphaned:0 affected tags:2' in self._caplog.text
+
+    def test_write(self):
+        report = self.tmp_path / 'verify.json'
+        Verifier.write([{'kind': 'oci-layout'}], format(report))
+        with open(report) as report_file:
+            assert json.load(report_file) == [{'kind': 'oci-layout'}]
+        assert oct(os.stat(report).st_mode)[-3:] == '644'
+        with raises(CgyleVerifyError):
+            Verifier.write([], format(self.tmp_path / 'gone' / 'verify.json'))